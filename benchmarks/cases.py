@@ -0,0 +1,368 @@
+import datetime
+import importlib.util
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+from typing import List, Optional
+
+import aind_behavior_services.calibration.load_cells as lcc
+import numpy as np
+from aind_behavior_force_foraging import (
+    dataset,
+    emulator,
+    licks,
+    occupancy,
+    pyramid,
+    replay,
+    serialization,
+    task_logic,
+)
+from aind_behavior_force_foraging.data_mappers import AindSessionDataMapper, coerce_many_to_aind_data_schema
+from aind_behavior_force_foraging.force import apply_load_cells_calibration, parse_force, prepare_lookup_table
+from aind_behavior_force_foraging.harp_io import PayloadType, encode_harp_messages
+from aind_behavior_force_foraging.rig import AindForceForagingRig
+from aind_behavior_force_foraging.task_logic import AindForceForagingTaskLogic
+from aind_behavior_force_foraging.trials import build_trial_table
+from aind_behavior_services.calibration.water_valve import Measurement, WaterValveCalibrationInput
+from aind_behavior_services.data_types import SoftwareEvent
+from pydantic import BaseModel
+
+from benchmarks.harness import benchmark
+from examples.example_roi_trial_type import mock_rig, mock_session, mock_task_logic
+
+REPOSITORY_ROOT = Path(__file__).parents[1].resolve()
+N_LOAD_CELL_SAMPLES = 500_000
+N_LOAD_CELL_CHANNELS = 8
+N_TRIALS = 2_000
+N_CURRICULUM_BLOCKS = 200
+N_COERCED_MODELS = 1_000
+N_LICKS = 1_000_000
+LUT_SHAPE = (256, 256)
+
+_rng = np.random.default_rng(seed=42)
+
+
+def synthetic_load_cell_data(n_samples: int = N_LOAD_CELL_SAMPLES) -> np.ndarray:
+    return _rng.integers(-(2**15), 2**15 - 1, size=(n_samples, N_LOAD_CELL_CHANNELS), dtype=np.int16)
+
+
+def synthetic_load_cells_calibration() -> lcc.LoadCellsCalibrationOutput:
+    return lcc.LoadCellsCalibrationOutput(
+        channels=[
+            lcc.LoadCellCalibrationOutput(channel=channel, offset=0, baseline=100.0 * channel, slope=0.5)
+            for channel in range(N_LOAD_CELL_CHANNELS)
+        ]
+    )
+
+
+def synthetic_force_lookup_table() -> task_logic.ForceOperationControl:
+    return task_logic.ForceOperationControl(
+        press_mode=task_logic.PressMode.SINGLE_LOOKUP_TABLE,
+        left_index=0,
+        right_index=1,
+        force_lookup_table=task_logic.ForceLookUpTable(
+            path="lut.tiff", left_min=-(2**15), left_max=2**15, right_min=-(2**15), right_max=2**15, scale=2, offset=1
+        ),
+    )
+
+
+def synthetic_trial_events(n_trials: int = N_TRIALS) -> List[SoftwareEvent]:
+    trial = mock_task_logic().task_parameters.environment.block_statistics[0].trial_statistics.model_dump()
+    harvest = trial["right_harvest"]
+    events: List[SoftwareEvent] = []
+    for i in range(n_trials):
+        t = 5.0 * i
+        events.extend(
+            [
+                SoftwareEvent(name="Trial", timestamp=t, data=trial),
+                SoftwareEvent(name="QuiescencePeriod", timestamp=t + 0.5, data={}),
+                SoftwareEvent(name="InitiationPeriod", timestamp=t + 1.0, data={}),
+                SoftwareEvent(name="ResponsePeriod", timestamp=t + 1.5, data={}),
+                SoftwareEvent(name="HarvestActionSelected", timestamp=t + 2.0, data=harvest),
+                SoftwareEvent(name="GiveReward", timestamp=t + 2.5, data=harvest["amount"]),
+                SoftwareEvent(
+                    name="TrialOutcome",
+                    timestamp=t + 3.0,
+                    data={"HarvestAction": harvest, "TrialNumber": i, "Reward": harvest["amount"], "IsAborted": False},
+                ),
+                SoftwareEvent(name="TrialNumber", timestamp=t + 3.1, data=i + 1),
+            ]
+        )
+    return events
+
+
+def synthetic_lick_states(n_licks: int = N_LICKS) -> tuple:
+    """Alternating lick onsets and offsets, in bouts of 5 licks at 8 Hz every 2 s."""
+    rng = np.random.default_rng(seed=0)
+    lick = np.arange(n_licks)
+    onset = (lick // 5) * 2.0 + (lick % 5) * 0.125 + rng.uniform(0, 0.01, n_licks)
+    timestamp = np.stack([onset, onset + 0.05], axis=1).reshape(-1)
+    state = np.tile(np.array([1, 0], dtype=np.uint8), n_licks)
+    return timestamp, state
+
+
+def synthetic_curriculum(n_blocks: int = N_CURRICULUM_BLOCKS) -> AindForceForagingTaskLogic:
+    """A task logic with `n_blocks` block generators, as in a long curriculum stage."""
+    model = mock_task_logic()
+    model.task_parameters.environment.block_statistics = model.task_parameters.environment.block_statistics * n_blocks
+    return model
+
+
+@benchmark("models.task_logic.validate_json", number=50)
+def _task_logic_validate():
+    payload = mock_task_logic().model_dump_json()
+    return lambda: AindForceForagingTaskLogic.model_validate_json(payload)
+
+
+@benchmark("models.task_logic.dump_json", number=50)
+def _task_logic_dump():
+    model = mock_task_logic()
+    return lambda: model.model_dump_json()
+
+
+@benchmark("models.rig.validate_json", number=50)
+def _rig_validate():
+    payload = mock_rig().model_dump_json()
+    return lambda: AindForceForagingRig.model_validate_json(payload)
+
+
+@benchmark("models.rig.dump_json", number=50)
+def _rig_dump():
+    model = mock_rig()
+    return lambda: model.model_dump_json()
+
+
+@benchmark("data_mappers.session._map", repeat=3)
+def _session_data_mapper():
+    repository = SimpleNamespace(
+        remote=lambda: SimpleNamespace(url="https://github.com/AllenNeuralDynamics/Aind.Behavior.ForceForaging"),
+        head=SimpleNamespace(commit=SimpleNamespace(hexsha="0" * 40)),
+        working_dir=str(REPOSITORY_ROOT),
+    )
+    session, rig, task = mock_session(), mock_rig(), mock_task_logic()
+    return lambda: AindSessionDataMapper._map(
+        session_model=session,
+        rig_model=rig,
+        task_logic_model=task,
+        repository=repository,
+        script_path=REPOSITORY_ROOT / "src" / "main.bonsai",
+        session_end_time=datetime.datetime.now(tz=datetime.timezone.utc),
+        bonsai_config_path=REPOSITORY_ROOT / "bonsai" / "Bonsai.config",
+    )
+
+
+class _HarpDeviceSummary(BaseModel):
+    who_am_i: int
+    serial_number: Optional[str] = None
+    port_name: str
+
+
+class _RigSummary(BaseModel):
+    rig_name: str
+    computer_name: str
+    harp_behavior: _HarpDeviceSummary
+    harp_load_cells: _HarpDeviceSummary
+
+
+@benchmark("data_mappers.coerce_many_to_aind_data_schema", repeat=3)
+def _coerce_many():
+    rig = mock_rig()
+    rigs = [rig.model_copy(update={"rig_name": f"rig_{i}"}) for i in range(N_COERCED_MODELS)]
+    return lambda: coerce_many_to_aind_data_schema(rigs, _RigSummary)
+
+
+@benchmark("force.apply_load_cells_calibration")
+def _apply_load_cells_calibration():
+    data, calibration = synthetic_load_cell_data(), synthetic_load_cells_calibration()
+    return lambda: apply_load_cells_calibration(data, calibration)
+
+
+@benchmark("force.parse_force.lookup_table")
+def _parse_force_lookup_table():
+    data = apply_load_cells_calibration(synthetic_load_cell_data())
+    settings = synthetic_force_lookup_table()
+    lookup_table = prepare_lookup_table(_rng.random(LUT_SHAPE), settings.force_lookup_table)
+    return lambda: parse_force(data, settings, lookup_table)
+
+
+@benchmark("calibration.water_valve", number=10)
+def _water_valve_calibration():
+    calibration_input = WaterValveCalibrationInput(
+        measurements=[
+            Measurement(valve_open_interval=0.5, valve_open_time=t, water_weight=[t * 2, t * 2.1], repeat_count=100)
+            for t in np.linspace(0.01, 0.2, 10)
+        ]
+    )
+    return lambda: calibration_input.calibrate_output()
+
+
+@benchmark("calibration.load_cells", number=10)
+def _load_cells_calibration():
+    calibration_input = lcc.LoadCellsCalibrationInput(
+        channels=[
+            lcc.LoadCellCalibrationInput(
+                channel=channel,
+                offset_measurement=[lcc.MeasuredOffset(offset=o, baseline=abs(o) * 10.0) for o in range(-10, 11)],
+                weight_measurement=[lcc.MeasuredWeight(weight=w, baseline=w * 3.0 + 5) for w in range(10)],
+            )
+            for channel in range(N_LOAD_CELL_CHANNELS)
+        ]
+    )
+    return lambda: calibration_input.calibrate_output()
+
+
+@benchmark("trials.build_trial_table", repeat=3)
+def _build_trial_table():
+    events = synthetic_trial_events()
+    return lambda: build_trial_table(events)
+
+
+@benchmark("licks.segment_and_collect", repeat=3)
+def _licks():
+    timestamp, state = synthetic_lick_states()
+    events = synthetic_trial_events()
+
+    def run():
+        lick_data = licks.lick_edges(timestamp, state)
+        return licks.build_collection_table(events, lick_data, licks.segment_bouts(lick_data))
+
+    return run
+
+
+@benchmark("occupancy.accumulate", repeat=3)
+def _occupancy_accumulate():
+    """500k samples in chunks of 50k, binned per trial on a 64x64 grid over the look up table."""
+    data = synthetic_load_cell_data().astype(np.float64)
+    timestamp = np.arange(len(data)) * 1e-3
+    starts = np.arange(0, timestamp[-1], 5.0)
+    lut = synthetic_force_lookup_table().force_lookup_table
+
+    def run():
+        accumulator = occupancy.OccupancyAccumulator(lut, LUT_SHAPE, (64, 64), starts)
+        for i in range(0, len(data), 50_000):
+            accumulator.append(timestamp[i : i + 50_000], data[i : i + 50_000, 0], data[i : i + 50_000, 1])
+        return accumulator.result()
+
+    return run
+
+
+@benchmark("pyramid.build", repeat=3)
+def _pyramid_build():
+    data = synthetic_load_cell_data().astype(np.float64)
+    timestamp = np.arange(len(data)) * 1e-3
+    tmp = tempfile.mkdtemp()
+
+    def run():
+        with pyramid.PyramidBuilder(Path(tmp) / "load_cells", N_LOAD_CELL_CHANNELS, t0=0.0, bin_s=0.004) as builder:
+            for i in range(0, len(data), 50_000):
+                builder.append(timestamp[i : i + 50_000], data[i : i + 50_000])
+
+    return run
+
+
+@benchmark("pyramid.query", number=100)
+def _pyramid_query():
+    data = synthetic_load_cell_data().astype(np.float64)
+    path = Path(tempfile.mkdtemp()) / "load_cells"
+    with pyramid.PyramidBuilder(path, N_LOAD_CELL_CHANNELS, t0=0.0, bin_s=0.004) as builder:
+        builder.append(np.arange(len(data)) * 1e-3, data)
+    levels = pyramid.Pyramid(path)
+    return lambda: levels.query(100.0, 400.0, width=2000)
+
+
+@benchmark("replay.replay_trials", repeat=3)
+def _replay_trials():
+    """2000 trials of 5 s, with alternating left and right presses, replayed against a 1 kHz force."""
+    harvest = dict(lower_force_threshold=10000, upper_force_threshold=20000, time_to_collect=task_logic.scalar_value(1))
+    trial = task_logic.Trial(
+        quiescence_period=task_logic.QuiescencePeriod(force_threshold=5000, duration=task_logic.scalar_value(0.2)),
+        initiation_period=task_logic.InitiationPeriod(abort_on_force=True, abort_on_force_threshold=5000),
+        response_period=task_logic.ResponsePeriod(duration=task_logic.scalar_value(2.0)),
+        left_harvest=task_logic.LeftHarvestAction(harvest_mode=task_logic.HarvestMode.ROI, **harvest),
+        right_harvest=task_logic.RightHarvestAction(harvest_mode=task_logic.HarvestMode.ACCUMULATION, **harvest),
+    )
+    time = np.arange(0, 5.0 * N_TRIALS, 1e-3)
+    force = _rng.normal(0, 500, size=(len(time), 2))
+    press = (time % 5.0 >= 1.0) & (time % 5.0 < 2.0)
+    side = (time // 5.0).astype(int) % 2
+    force[press & (side == 0), 0] += 15000
+    force[press & (side == 1), 1] += 15000
+    trace = replay.ForceTrace(time=time, left_force=force[:, 0], right_force=force[:, 1])
+    lick_time = np.arange(0, 5.0 * N_TRIALS, 0.7)
+    trials, start_times = [trial] * N_TRIALS, np.arange(N_TRIALS) * 5.0
+    return lambda: replay.replay_trials(trace, lick_time, trials, start_times)
+
+
+@benchmark("emulator.emulate_session", repeat=3)
+def _emulate_session():
+    """10 minutes of the example task at 10 times the production rates, with its load cells stream."""
+    rig, logic = mock_rig(), mock_task_logic()
+    logic.task_parameters.environment.block_statistics[
+        0
+    ].trial_statistics.response_period.duration = task_logic.scalar_value(2.0)
+
+    def run():
+        emulated = emulator.emulate_session(logic, rig, 600.0, rate_multiplier=10, seed=0)
+        return emulator.device_stream(emulated, replay.LOAD_CELLS_DEVICE)
+
+    return run
+
+
+def _msgpack_cases():
+    for name, build in (
+        ("task_logic", mock_task_logic),
+        ("rig", mock_rig),
+        ("curriculum", synthetic_curriculum),
+    ):
+
+        @benchmark(f"models.{name}.dump_msgpack", number=50 if name != "curriculum" else 5)
+        def _dump(build=build):
+            model = build()
+            return lambda: serialization.dumps(model)
+
+        @benchmark(f"models.{name}.load_msgpack", number=50 if name != "curriculum" else 5)
+        def _load(build=build):
+            model = build()
+            payload = serialization.dumps(model)
+            return lambda: serialization.loads(payload, type(model))
+
+
+@benchmark("models.curriculum.dump_json", number=5)
+def _curriculum_dump():
+    model = synthetic_curriculum()
+    return lambda: model.model_dump_json()
+
+
+@benchmark("models.curriculum.validate_json", number=5)
+def _curriculum_validate():
+    payload = synthetic_curriculum().model_dump_json()
+    return lambda: AindForceForagingTaskLogic.model_validate_json(payload)
+
+
+def _nwb_cases():
+    from aind_behavior_force_foraging import nwb
+
+    @benchmark("nwb.export_session", repeat=3)
+    def _export_session():
+        """500k load cells samples, exported in chunks of 50k."""
+        session = Path(tempfile.mkdtemp()) / "session"
+        logs = session / dataset.BEHAVIOR_DIR / dataset.LOGS_DIR
+        logs.mkdir(parents=True)
+        for filename, model in (
+            (dataset.RIG_INPUT, mock_rig()),
+            (dataset.SESSION_INPUT, mock_session()),
+            (dataset.TASK_LOGIC_INPUT, mock_task_logic()),
+        ):
+            (logs / filename).write_text(model.model_dump_json(), encoding="utf-8")
+        path = dataset.harp_register_file(session, replay.LOAD_CELLS_DEVICE, 33)
+        path.parent.mkdir(parents=True)
+        data = synthetic_load_cell_data()
+        path.write_bytes(encode_harp_messages(33, data, PayloadType.S16, np.arange(len(data)) * 1e-3))
+        return lambda: nwb.export_session(session, session.parent / "session.nwb", chunk_size=50_000)
+
+
+if importlib.util.find_spec("msgpack") is not None:
+    _msgpack_cases()
+
+if importlib.util.find_spec("pynwb") is not None:
+    _nwb_cases()
@@ -0,0 +1,125 @@
+import dataclasses
+import datetime
+import json
+import os
+import platform
+import timeit
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+BASELINE_VERSION = 1
+
+
+@dataclasses.dataclass(frozen=True)
+class BenchmarkCase:
+    """A named benchmark. `setup` builds the synthetic data and returns the callable to be measured."""
+
+    name: str
+    setup: Callable[[], Callable[[], Any]]
+    repeat: int = 5
+    number: int = 1
+
+
+@dataclasses.dataclass(frozen=True)
+class BenchmarkResult:
+    name: str
+    time_s: float
+    peak_memory_bytes: int
+
+
+@dataclasses.dataclass(frozen=True)
+class Regression:
+    name: str
+    metric: str
+    baseline: float
+    current: float
+
+    @property
+    def ratio(self) -> float:
+        return self.current / self.baseline if self.baseline > 0 else float("inf")
+
+    def __str__(self) -> str:
+        return f"{self.name}: {self.metric} {self.baseline:.4g} -> {self.current:.4g} ({self.ratio:.2f}x)"
+
+
+CASES: Dict[str, BenchmarkCase] = {}
+
+
+def benchmark(name: str, repeat: int = 5, number: int = 1) -> Callable:
+    """Registers the decorated setup function as a benchmark case."""
+
+    def decorator(setup: Callable[[], Callable[[], Any]]) -> Callable[[], Callable[[], Any]]:
+        if name in CASES:
+            raise ValueError(f"Benchmark {name} is already registered.")
+        CASES[name] = BenchmarkCase(name=name, setup=setup, repeat=repeat, number=number)
+        return setup
+
+    return decorator
+
+
+def measure(case: BenchmarkCase) -> BenchmarkResult:
+    """Measures the best per-call wall time and, in a separate untimed call, the peak traced memory."""
+    fn = case.setup()
+    fn()  # Warm up caches and lazy imports
+    timings = timeit.Timer(fn).repeat(repeat=case.repeat, number=case.number)
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return BenchmarkResult(name=case.name, time_s=min(timings) / case.number, peak_memory_bytes=peak)
+
+
+def run(pattern: Optional[str] = None) -> List[BenchmarkResult]:
+    return [measure(case) for name, case in CASES.items() if pattern is None or pattern in name]
+
+
+def compare(
+    results: List[BenchmarkResult],
+    baseline: Dict[str, Any],
+    time_threshold: float = 0.25,
+    memory_threshold: float = 0.25,
+) -> List[Regression]:
+    """Returns every metric that is worse than the baseline by more than the relative threshold."""
+    regressions: List[Regression] = []
+    reference = baseline.get("results", {})
+    for result in results:
+        if result.name not in reference:
+            continue
+        for metric, threshold in (("time_s", time_threshold), ("peak_memory_bytes", memory_threshold)):
+            previous = float(reference[result.name][metric])
+            current = float(getattr(result, metric))
+            if current > previous * (1 + threshold):
+                regressions.append(Regression(name=result.name, metric=metric, baseline=previous, current=current))
+    return regressions
+
+
+def load_baseline(path: os.PathLike) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("version") != BASELINE_VERSION:
+        raise ValueError(f"Unsupported baseline version {baseline.get('version')}. Expected {BASELINE_VERSION}.")
+    return baseline
+
+
+def machine_info() -> Dict[str, str]:
+    """Identifies the machine the benchmarks run on. Timings are only comparable on the same machine."""
+    return {"python": platform.python_version(), "platform": platform.platform(), "node": platform.node()}
+
+
+def write_baseline(path: os.PathLike, results: List[BenchmarkResult], previous: Optional[Dict] = None) -> None:
+    """Writes the results as the new baseline. Cases not in `results` are kept from `previous`."""
+    merged = dict(previous.get("results", {})) if previous else {}
+    merged.update({r.name: {"time_s": r.time_s, "peak_memory_bytes": r.peak_memory_bytes} for r in results})
+    baseline = {
+        "version": BASELINE_VERSION,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "machine": machine_info(),
+        "results": dict(sorted(merged.items())),
+    }
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, indent=2)
+        f.write("\n")
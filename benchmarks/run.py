@@ -0,0 +1,60 @@
+"""Runs the offline benchmark suite and compares it against the tracked baseline.
+
+Usage (from the repository root):
+    python -m benchmarks.run                     # Fails if any case regressed beyond the threshold
+    python -m benchmarks.run --update-baseline   # Records the current results as the new baseline
+"""
+
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+from benchmarks import cases  # noqa: F401  # Registers the benchmark cases
+from benchmarks.harness import compare, load_baseline, machine_info, run, write_baseline
+
+DEFAULT_BASELINE = Path(__file__).parent / "baseline.json"
+
+logger = logging.getLogger(__name__)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Force foraging offline benchmarks")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE, help="Path to the baseline json file")
+    parser.add_argument("--update-baseline", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--time-threshold", type=float, default=0.25, help="Allowed relative time regression")
+    parser.add_argument("--memory-threshold", type=float, default=0.25, help="Allowed relative memory regression")
+    parser.add_argument("-k", "--filter", default=None, help="Only run cases whose name contains this string")
+    args = parser.parse_args(argv)
+
+    results = run(args.filter)
+    print(f"{'case':<45}{'time (ms)':>14}{'peak memory (MiB)':>20}")
+    for result in results:
+        print(f"{result.name:<45}{result.time_s * 1e3:>14.3f}{result.peak_memory_bytes / 2**20:>20.2f}")
+
+    previous = load_baseline(args.baseline) if args.baseline.exists() else None
+    if args.update_baseline:
+        write_baseline(args.baseline, results, previous)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    if previous is None:
+        print(f"No baseline found at {args.baseline}. Run with --update-baseline to create one.")
+        return 0
+
+    if previous.get("machine") != machine_info():
+        print(
+            f"Warning: the baseline was recorded on another machine ({previous.get('machine')}). Timings may not be "
+            "comparable. Record a baseline on this machine with --update-baseline and a separate --baseline path."
+        )
+    regressions = compare(results, previous, args.time_threshold, args.memory_threshold)
+    if regressions:
+        print("Performance regressions detected:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print("No regressions detected.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+"""Compares the size and encode/decode time of the JSON and MessagePack serializations of the models.
+
+Usage (from the repository root):
+    python -m benchmarks.serialization
+"""
+
+import sys
+import timeit
+
+from aind_behavior_force_foraging import serialization
+
+from benchmarks.cases import mock_rig, mock_task_logic, synthetic_curriculum
+
+NUMBER = 20
+
+
+def _best_ms(fn) -> float:
+    fn()
+    return min(timeit.Timer(fn).repeat(repeat=5, number=NUMBER)) / NUMBER * 1e3
+
+
+def main() -> int:
+    print(f"{'model':<14}{'codec':<10}{'size (bytes)':>14}{'encode (ms)':>14}{'decode (ms)':>14}")
+    for name, model in (("task_logic", mock_task_logic()), ("rig", mock_rig()), ("curriculum", synthetic_curriculum())):
+        cls = type(model)
+        payload = model.model_dump_json()
+        print(
+            f"{name:<14}{'json':<10}{len(payload.encode('utf-8')):>14}"
+            f"{_best_ms(model.model_dump_json):>14.3f}{_best_ms(lambda: cls.model_validate_json(payload)):>14.3f}"
+        )
+        packed = serialization.dumps(model)
+        print(
+            f"{name:<14}{'msgpack':<10}{len(packed):>14}{_best_ms(lambda: serialization.dumps(model)):>14.3f}"
+            f"{_best_ms(lambda: serialization.loads(packed, cls)):>14.3f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
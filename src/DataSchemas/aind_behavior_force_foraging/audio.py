@@ -0,0 +1,67 @@
+"""Audio cues from the speaker commands logged during a session.
+
+The task plays an audio cue (`AudioControl` in the workflow) by writing its duration to the `PulseDO2`
+register of the Harp behavior board and its frequency to `PwmFrequencyDO2`, followed by a `PwmStart`
+command for `DO2`, which drives the speaker. All commands are logged under `HarpCommands/Behavior`.
+As for the water valve, every cue is paired with the last duration and frequency written before it.
+"""
+
+import logging
+import os
+from typing import NamedTuple
+
+import numpy as np
+
+from aind_behavior_force_foraging import dataset
+from aind_behavior_force_foraging.water import BEHAVIOR_DEVICE, _read_writes
+
+logger = logging.getLogger(__name__)
+
+# Register addresses and bits of the Harp Behavior device.yml
+PULSE_DO2_ADDRESS = 58  # Behavior PulseDO2, in milliseconds
+PWM_FREQUENCY_DO2_ADDRESS = 62  # Behavior PwmFrequencyDO2, in Hz
+PWM_START_ADDRESS = 68  # Behavior PwmStart
+PWM_DO2 = 0x4  # Speaker bit of the Behavior PwmOutputs
+
+
+class AudioCues(NamedTuple):
+    """The audio cues of a session. Settings that were never written are NaN."""
+
+    time: np.ndarray
+    frequency_hz: np.ndarray
+    duration_s: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+
+def _last_written(write_time: np.ndarray, value: np.ndarray, time: np.ndarray) -> np.ndarray:
+    order = np.argsort(write_time, kind="stable")
+    index = np.searchsorted(np.asarray(write_time)[order], time, side="right") - 1
+    return np.append(np.asarray(value, dtype=np.float64)[order], np.nan)[index]  # -1 selects the NaN
+
+
+def read_audio_cues(session_path: os.PathLike) -> AudioCues:
+    """
+    Reads the speaker commands of a session. Returns no cues if the `PwmStart` commands were not logged.
+
+    Args:
+        session_path (os.PathLike): The session directory.
+
+    Returns:
+        AudioCues: The cues, with the frequency and duration in effect when each was played.
+    """
+    start_file = dataset.find_harp_command_file(session_path, BEHAVIOR_DEVICE, PWM_START_ADDRESS)
+    if start_file is None:
+        logger.info("No audio cues found in session %s.", session_path)
+        return AudioCues(time=np.empty(0), frequency_hz=np.empty(0), duration_s=np.empty(0))
+    start_time, start = _read_writes(start_file)
+    time = np.asarray(start_time, dtype=np.float64)[(np.asarray(start) & PWM_DO2) != 0]
+
+    settings = []
+    for address in (PWM_FREQUENCY_DO2_ADDRESS, PULSE_DO2_ADDRESS):
+        path = dataset.find_harp_command_file(session_path, BEHAVIOR_DEVICE, address)
+        write_time, value = _read_writes(path) if path is not None else (np.empty(0), np.empty(0))
+        settings.append(_last_written(write_time, value, time))
+    frequency_hz, duration_ms = settings
+    return AudioCues(time=time, frequency_hz=frequency_hz, duration_s=duration_ms * 1e-3)
@@ -0,0 +1,304 @@
+"""Local cohort store.
+
+Indexes the session metadata and trial tables of many sessions in a single SQLite file, so that
+cohort-level queries run without reopening the raw logs. Sessions are discovered using the layout
+written by the launcher with `group_by_subject_log=True`, i.e. `<root>/<subject>/<session_name>`,
+and only new or modified sessions are (re)ingested.
+
+Example:
+    with CohortStore(r"C:/Data") as store:
+        store.ingest()
+        trials = store.trials(
+            subject="my_mouse",
+            where="right_harvest_mode = ? AND right_upper_force_threshold > ?",
+            params=("RegionOfInterest", 20000),
+        )
+"""
+
+import datetime
+import json
+import logging
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from aind_behavior_force_foraging import dataset
+from aind_behavior_force_foraging.trials import TRIAL_EVENTS, TRIAL_TABLE_COLUMNS, build_trial_table
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_FILENAME = ".cohort.sqlite"
+SCHEMA_VERSION = 1
+
+SESSION_COLUMNS = (
+    "session_id",
+    "subject",
+    "session_name",
+    "date",
+    "experiment",
+    "experiment_version",
+    "rig_name",
+    "task_logic_name",
+    "task_logic_version",
+    "task_logic_stage",
+    "trial_count",
+    "path",
+    "signature",
+    "ingested_at",
+)
+
+
+class CohortStore:
+    """A persistent SQLite index of the sessions found under `root`."""
+
+    def __init__(self, root: os.PathLike, index_path: Optional[os.PathLike] = None):
+        self.root = Path(root)
+        self.index_path = Path(index_path) if index_path is not None else self.root / DEFAULT_INDEX_FILENAME
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(self.index_path)
+        self._create_schema()
+
+    def __enter__(self) -> "CohortStore":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def _create_schema(self) -> None:
+        trial_columns = ", ".join(f'"{c}"' for c in TRIAL_TABLE_COLUMNS)
+        with self._connection:
+            self._connection.executescript(
+                f"""
+                CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT);
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY, subject TEXT, session_name TEXT, date TEXT, experiment TEXT,
+                    experiment_version TEXT, rig_name TEXT, task_logic_name TEXT, task_logic_version TEXT,
+                    task_logic_stage TEXT, trial_count INTEGER, path TEXT, signature TEXT, ingested_at TEXT
+                );
+                CREATE INDEX IF NOT EXISTS sessions_subject ON sessions (subject);
+                CREATE TABLE IF NOT EXISTS trials (session_id TEXT, trial INTEGER, {trial_columns},
+                    PRIMARY KEY (session_id, trial));
+                """
+            )
+            version = self._connection.execute("SELECT value FROM metadata WHERE key = 'schema_version'").fetchone()
+            if version is None:
+                self._connection.execute("INSERT INTO metadata VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),))
+            elif int(version[0]) != SCHEMA_VERSION:
+                raise ValueError(f"Unsupported cohort index version {version[0]}. Expected {SCHEMA_VERSION}.")
+
+    def discover(self) -> List[Path]:
+        """Returns every `<root>/<subject>/<session_name>` directory that contains a behavior session."""
+        return dataset.discover_sessions(self.root)
+
+    def session_id(self, session_path: os.PathLike) -> str:
+        return Path(session_path).resolve().relative_to(self.root.resolve()).as_posix()
+
+    def pending(self) -> List[Path]:
+        """Returns the sessions that are not indexed, or that changed since they were indexed."""
+        return self._pending(self.discover())
+
+    def _pending(self, discovered: Sequence[Path]) -> List[Path]:
+        indexed = dict(self._connection.execute("SELECT session_id, signature FROM sessions").fetchall())
+        return [p for p in discovered if indexed.get(self.session_id(p)) != session_signature(p)]
+
+    def stale(self) -> List[str]:
+        """Returns the ids of the indexed sessions that are no longer found under `root`."""
+        return self._stale(self.discover())
+
+    def _stale(self, discovered: Sequence[Path]) -> List[str]:
+        found = {self.session_id(p) for p in discovered}
+        indexed = [row[0] for row in self._connection.execute("SELECT session_id FROM sessions ORDER BY session_id")]
+        return [session_id for session_id in indexed if session_id not in found]
+
+    def prune(self) -> List[str]:
+        """Removes the indexed sessions that are no longer found under `root`, and returns their ids."""
+        return self._prune(self.discover())
+
+    def _prune(self, discovered: Sequence[Path]) -> List[str]:
+        stale = self._stale(discovered)
+        for session_id in stale:
+            self.remove(session_id)
+        if stale:
+            logger.info("Removed %d sessions no longer found under %s from the index.", len(stale), self.root)
+        return stale
+
+    def ingest(self, max_workers: Optional[int] = None, force: bool = False) -> List[str]:
+        """
+        Ingests new and modified sessions, and removes the indexed sessions that are no longer found.
+        Sessions are read in a process pool, and written to the index, one transaction per session,
+        from the calling process.
+
+        Args:
+            max_workers (Optional[int]): Number of worker processes. If 1, sessions are read serially.
+            force (bool): Re-ingest all sessions. Defaults to False.
+
+        Returns:
+            List[str]: The ids of the ingested sessions.
+        """
+        discovered = self.discover()
+        self._prune(discovered)
+        sessions = discovered if force else self._pending(discovered)
+        if not sessions:
+            return []
+        logger.info("Ingesting %d sessions into %s.", len(sessions), self.index_path)
+        ingested: List[str] = []
+        if max_workers == 1 or len(sessions) == 1:
+            results = map(_read_session_safe, sessions)
+            self._write_all(sessions, results, ingested)
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                self._write_all(sessions, executor.map(_read_session_safe, sessions), ingested)
+        return ingested
+
+    def _write_all(self, sessions: Sequence[Path], results, ingested: List[str]) -> None:
+        for path, result in zip(sessions, results):
+            if isinstance(result, Exception):
+                logger.error("Failed to ingest session %s. %s", path, result)
+                continue
+            session, trials = result
+            session["session_id"] = self.session_id(path)
+            self._write_session(session, trials)
+            ingested.append(session["session_id"])
+
+    def _write_session(self, session: Dict[str, Any], trials: pd.DataFrame) -> None:
+        session_id = session["session_id"]
+        trials = _to_sql_values(trials)
+        trials.insert(0, "trial", np.arange(len(trials)))
+        trials.insert(0, "session_id", session_id)
+        placeholders = ", ".join("?" * len(trials.columns))
+        columns = ", ".join(f'"{c}"' for c in trials.columns)
+        with self._connection:
+            self._connection.execute("DELETE FROM trials WHERE session_id = ?", (session_id,))
+            self._connection.execute(
+                f"INSERT OR REPLACE INTO sessions ({', '.join(SESSION_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(SESSION_COLUMNS))})",
+                [session.get(c) for c in SESSION_COLUMNS],
+            )
+            self._connection.executemany(
+                f"INSERT INTO trials ({columns}) VALUES ({placeholders})", trials.itertuples(index=False, name=None)
+            )
+
+    def remove(self, session_id: str) -> None:
+        with self._connection:
+            self._connection.execute("DELETE FROM trials WHERE session_id = ?", (session_id,))
+            self._connection.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def query(self, sql: str, params: Sequence[Any] = ()) -> pd.DataFrame:
+        """Runs an arbitrary read query against the `sessions` and `trials` tables."""
+        return pd.read_sql_query(sql, self._connection, params=tuple(params))
+
+    def sessions(self, subject: Optional[str] = None) -> pd.DataFrame:
+        if subject is None:
+            return self.query("SELECT * FROM sessions ORDER BY subject, date")
+        return self.query("SELECT * FROM sessions WHERE subject = ? ORDER BY date", (subject,))
+
+    def trials(
+        self,
+        subject: Optional[str] = None,
+        where: Optional[str] = None,
+        params: Sequence[Any] = (),
+    ) -> pd.DataFrame:
+        """
+        Returns the trials, joined with the metadata of their session.
+
+        Args:
+            subject (Optional[str]): Only return trials of this subject.
+            where (Optional[str]): Additional SQL condition over the trial and session columns.
+            params (Sequence[Any]): Parameters of the `where` condition.
+
+        Returns:
+            pd.DataFrame: The trials.
+        """
+        conditions, values = [], []
+        if subject is not None:
+            conditions.append("s.subject = ?")
+            values.append(subject)
+        if where:
+            conditions.append(f"({where})")
+            values.extend(params)
+        sql = (
+            "SELECT s.subject, s.session_name, s.date, s.rig_name, s.task_logic_version, t.* "
+            "FROM trials t JOIN sessions s ON s.session_id = t.session_id"
+        )
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        return self.query(sql + " ORDER BY s.date, t.trial", values)
+
+
+def session_signature(session_path: os.PathLike) -> str:
+    """A cheap fingerprint of the files the store reads from a session, based on their size and mtime."""
+    behavior = Path(session_path) / dataset.BEHAVIOR_DIR
+    files = sorted((behavior / dataset.SOFTWARE_EVENTS_DIR).glob("*.json")) + sorted(
+        (behavior / dataset.LOGS_DIR).glob("*_input.json")
+    )
+    stats = [f.stat() for f in files]
+    return f"{len(stats)}:{sum(s.st_size for s in stats)}:{max((s.st_mtime_ns for s in stats), default=0)}"
+
+
+def read_session(session_path: os.PathLike) -> Tuple[Dict[str, Any], pd.DataFrame]:
+    """
+    Reads the metadata and trial table of a session. Input models are read as plain json, so that
+    sessions acquired with older schema versions can still be indexed.
+    """
+    session_path = Path(session_path)
+    signature = session_signature(session_path)
+    logs = session_path / dataset.BEHAVIOR_DIR / dataset.LOGS_DIR
+    session = _read_json(logs / dataset.SESSION_INPUT)
+    rig = _read_json(logs / dataset.RIG_INPUT)
+    task_logic = _read_json(logs / dataset.TASK_LOGIC_INPUT)
+    events = [e for name in TRIAL_EVENTS for e in dataset.read_software_events(session_path, name)]
+    trials = build_trial_table(events)
+    metadata = {
+        "subject": session.get("subject", session_path.parent.name),
+        "session_name": session.get("session_name", session_path.name),
+        "date": session.get("date"),
+        "experiment": session.get("experiment"),
+        "experiment_version": session.get("experiment_version"),
+        "rig_name": rig.get("rig_name"),
+        "task_logic_name": task_logic.get("name"),
+        "task_logic_version": task_logic.get("version"),
+        "task_logic_stage": task_logic.get("stage_name"),
+        "trial_count": len(trials),
+        "path": str(session_path.resolve()),
+        "signature": signature,
+        "ingested_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+    return metadata, trials
+
+
+def _read_session_safe(session_path: Path):
+    try:
+        return read_session(session_path)
+    except Exception as e:
+        return e
+
+
+def _read_json(path: Path) -> Dict[str, Any]:
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _to_sql_values(table: pd.DataFrame) -> pd.DataFrame:
+    out = pd.DataFrame(index=table.index)
+    for column in table.columns:
+        values = table[column].astype(object)
+        out[column] = values.where(values.notna(), None).map(_to_sql_scalar)
+    return out
+
+
+def _to_sql_scalar(value: Any) -> Any:
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
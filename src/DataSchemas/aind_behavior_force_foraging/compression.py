@@ -0,0 +1,515 @@
+"""Post-session compression stage.
+
+Compresses the Harp binary logs of a session with a fast codec and, optionally, re-encodes its
+videos, before the session directory is handed to the data transfer. The hash of every original
+file is recorded in a manifest at the root of the session. When a data transfer follows, the
+originals are kept next to the session until the compressed files are verified at the destination.
+
+Usage:
+    python -m aind_behavior_force_foraging.compression path/to/session [--reencode-videos]
+"""
+
+import argparse
+import datetime
+import enum
+import gzip
+import itertools
+import logging
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple, Union
+
+import aind_behavior_experiment_launcher.launcher.behavior_launcher as behavior_launcher
+from aind_behavior_experiment_launcher.data_transfer import DataTransfer
+from pydantic import BaseModel, Field
+
+from aind_behavior_force_foraging import dataset
+from aind_behavior_force_foraging.data_transfer import file_hash
+from aind_behavior_force_foraging.harp_io import GZIP_SUFFIX, ZSTD_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = "compression_manifest.json"
+ORIGINALS_DIRNAME = ".compression_originals"
+_COPY_BLOCK_SIZE = 4 * 2**20
+
+
+class HarpCodec(str, enum.Enum):
+    GZIP = "gzip"
+    ZSTD = "zstd"
+
+
+class CompressionSettings(BaseModel):
+    harp_codec: HarpCodec = Field(default=HarpCodec.GZIP, description="Codec used to compress the Harp logs")
+    harp_compression_level: Optional[int] = Field(
+        default=None, description="Codec compression level. Defaults to a fast level of the codec."
+    )
+    reencode_videos: bool = Field(default=False, description="Whether to re-encode the session videos")
+    video_codec: str = Field(default="libx264", description="Codec used to re-encode videos")
+    video_crf: int = Field(default=23, ge=0, le=51, description="Constant rate factor used to re-encode videos")
+    video_preset: str = Field(default="veryfast", description="Encoder preset used to re-encode videos")
+    max_workers: Optional[int] = Field(default=None, description="Number of worker processes")
+
+
+class ManifestEntry(BaseModel):
+    path: str = Field(..., description="Path of the original file, relative to the session directory")
+    size: int = Field(..., description="Size of the original file, in bytes")
+    hash: str = Field(..., description="Hash of the original file")
+    compressed_path: str = Field(..., description="Path of the compressed file, relative to the session directory")
+    compressed_size: int = Field(..., description="Size of the compressed file, in bytes")
+    method: str = Field(..., description="Codec used to compress the file")
+
+
+class CompressionManifest(BaseModel):
+    created: datetime.datetime = Field(default_factory=lambda: datetime.datetime.now(datetime.timezone.utc))
+    hash_algorithm: str = Field(default="sha256", description="Algorithm used to hash the original files")
+    entries: List[ManifestEntry] = Field(default=[], description="Compressed files")
+
+    @property
+    def original_size(self) -> int:
+        return sum(e.size for e in self.entries)
+
+    @property
+    def compressed_size(self) -> int:
+        return sum(e.compressed_size for e in self.entries)
+
+
+def originals_directory(session_path: os.PathLike) -> Path:
+    """Directory where the originals of a session are kept, outside of the session so they are not transferred."""
+    session_path = Path(session_path)
+    return session_path.parent / ORIGINALS_DIRNAME / session_path.name
+
+
+def queued_sessions(data_dir: os.PathLike) -> List[Path]:
+    """
+    Returns the sessions of a data directory, laid out as `<subject>/<session>`, that were queued for the
+    post-session stage and whose originals were not released yet.
+    """
+    return sorted(p.parent.parent / p.name for p in Path(data_dir).glob(f"*/{ORIGINALS_DIRNAME}/*") if p.is_dir())
+
+
+def _release_originals(originals: Path) -> None:
+    shutil.rmtree(originals, ignore_errors=True)
+    try:
+        originals.parent.rmdir()
+    except OSError:
+        pass  # Originals of other sessions are still pending
+
+
+def _retire(path: Path, originals_dir: Optional[Path]) -> None:
+    if originals_dir is None:
+        path.unlink()
+        return
+    originals_dir.mkdir(parents=True, exist_ok=True)
+    os.replace(path, originals_dir / path.name)
+
+
+def compress_harp_file(
+    path: Path,
+    codec: HarpCodec = HarpCodec.GZIP,
+    level: Optional[int] = None,
+    hash_algorithm: str = "sha256",
+    originals_dir: Optional[Path] = None,
+) -> ManifestEntry:
+    """
+    Compresses a file next to the original. Once the compressed file is written, the original is moved
+    to `originals_dir` if provided, or removed otherwise.
+    """
+    match codec:
+        case HarpCodec.GZIP:
+            target = path.with_name(path.name + GZIP_SUFFIX)
+            with open(path, "rb") as fin, gzip.open(target, "wb", compresslevel=level if level is not None else 1) as f:
+                shutil.copyfileobj(fin, f, _COPY_BLOCK_SIZE)
+        case HarpCodec.ZSTD:
+            import zstandard
+
+            target = path.with_name(path.name + ZSTD_SUFFIX)
+            compressor = zstandard.ZstdCompressor(level=level if level is not None else 3)
+            with open(path, "rb") as fin, open(target, "wb") as fout:
+                compressor.copy_stream(fin, fout, read_size=_COPY_BLOCK_SIZE)
+        case _:
+            raise ValueError(f"Unknown codec {codec}.")
+    entry = ManifestEntry(
+        path=path.name,
+        size=path.stat().st_size,
+        hash=file_hash(path, hash_algorithm),
+        compressed_path=target.name,
+        compressed_size=target.stat().st_size,
+        method=codec.value,
+    )
+    _retire(path, originals_dir)
+    return entry
+
+
+def _video_extent(path: Path) -> Tuple[int, float]:
+    """Number of frames of the first video stream of a file, and the time between its first and last frame."""
+    import av
+
+    with av.open(str(path)) as container:
+        stream = container.streams.video[0]
+        pts = [packet.pts for packet in container.demux(stream) if packet.pts is not None]
+        return len(pts), float((max(pts) - min(pts)) * stream.time_base) if pts else 0.0
+
+
+def reencode_video(
+    path: Path, settings: CompressionSettings, hash_algorithm: str = "sha256", originals_dir: Optional[Path] = None
+) -> ManifestEntry:
+    """
+    Re-encodes a video in place, keeping the timestamps of the source frames. The original is only replaced
+    if the re-encoded video has the same number of frames and the same duration, and is moved to
+    `originals_dir` if provided. Video re-encoding is lossy, so the original can not be restored from the manifest.
+    """
+    import av
+
+    tmp = path.with_name(f".{path.stem}.tmp{path.suffix}")
+    with av.open(str(path)) as src, av.open(str(tmp), mode="w") as dst:
+        in_stream = src.streams.video[0]
+        in_stream.thread_type = "AUTO"
+        out_stream = dst.add_stream(
+            settings.video_codec,
+            rate=in_stream.average_rate,
+            options={"crf": str(settings.video_crf), "preset": settings.video_preset},
+        )
+        out_stream.width, out_stream.height = in_stream.width, in_stream.height
+        out_stream.pix_fmt = "yuv420p"
+        rate = in_stream.average_rate
+        # Encode in the time base of the source so its timestamps are kept without rounding
+        out_stream.codec_context.time_base = in_stream.time_base
+        for frame in src.decode(in_stream):
+            frame.time_base = in_stream.time_base
+            for packet in out_stream.encode(frame):
+                dst.mux(packet)
+        for packet in out_stream.encode():
+            dst.mux(packet)
+
+    (n_in, duration_in), (n_out, duration_out) = _video_extent(path), _video_extent(tmp)
+    tolerance = float(1 / rate) if rate else 0.0
+    if n_in != n_out or abs(duration_in - duration_out) > tolerance:
+        tmp.unlink()
+        raise IOError(
+            f"Re-encoding {path} produced {n_out} frames over {duration_out:.3f} s, "
+            f"from {n_in} frames over {duration_in:.3f} s. The original was kept."
+        )
+    entry = ManifestEntry(
+        path=path.name,
+        size=path.stat().st_size,
+        hash=file_hash(path, hash_algorithm),
+        compressed_path=path.name,
+        compressed_size=tmp.stat().st_size,
+        method=settings.video_codec,
+    )
+    if originals_dir is not None:
+        _retire(path, originals_dir)
+    os.replace(tmp, path)
+    return entry
+
+
+def uncompressed_harp_files(session_path: os.PathLike) -> List[Path]:
+    """Returns the Harp register and command files of a session that were not compressed yet."""
+    files = itertools.chain(
+        dataset.iter_harp_register_files(session_path), dataset.iter_harp_command_files(session_path)
+    )
+    return sorted(f.path for f in files if f.path.suffix == ".bin")
+
+
+def _relative_to(entry: ManifestEntry, path: Path, session_path: Path) -> ManifestEntry:
+    directory = path.parent.relative_to(session_path)
+    return entry.model_copy(
+        update={
+            "path": (directory / entry.path).as_posix(),
+            "compressed_path": (directory / entry.compressed_path).as_posix(),
+        }
+    )
+
+
+def compress_session(
+    session_path: os.PathLike,
+    settings: Optional[CompressionSettings] = None,
+    originals_dir: Optional[os.PathLike] = None,
+) -> CompressionManifest:
+    """
+    Compresses the Harp logs, and optionally re-encodes the videos, of a session in a process pool.
+    Files that were already compressed are not touched, so the stage can be safely re-run.
+
+    Args:
+        session_path (os.PathLike): The session directory.
+        settings (Optional[CompressionSettings]): The settings. Defaults to `CompressionSettings()`.
+        originals_dir (Optional[os.PathLike]): Directory where the original files are moved to, keeping
+            their path relative to the session. Defaults to None, which removes the originals.
+
+    Returns:
+        CompressionManifest: The manifest, including the entries of previous runs.
+    """
+    session_path = Path(session_path)
+    settings = settings if settings is not None else CompressionSettings()
+    manifest_path = session_path / MANIFEST_FILENAME
+    manifest = (
+        CompressionManifest.model_validate_json(manifest_path.read_text(encoding="utf-8"))
+        if manifest_path.exists()
+        else CompressionManifest()
+    )
+    done = {e.path for e in manifest.entries}
+
+    harp_files = uncompressed_harp_files(session_path)
+    videos: List[Path] = []
+    if settings.reencode_videos:
+        videos = sorted(
+            p
+            for p in (session_path / dataset.BEHAVIOR_VIDEOS_DIR).rglob("*")
+            if p.suffix in dataset.VIDEO_EXTENSIONS and p.relative_to(session_path).as_posix() not in done
+        )
+
+    def kept_in(path: Path) -> Optional[Path]:
+        return Path(originals_dir) / path.parent.relative_to(session_path) if originals_dir is not None else None
+
+    with ProcessPoolExecutor(max_workers=settings.max_workers) as executor:
+        futures = {
+            executor.submit(
+                compress_harp_file,
+                path,
+                settings.harp_codec,
+                settings.harp_compression_level,
+                manifest.hash_algorithm,
+                kept_in(path),
+            ): path
+            for path in harp_files
+        }
+        futures.update(
+            {
+                executor.submit(reencode_video, path, settings, manifest.hash_algorithm, kept_in(path)): path
+                for path in videos
+            }
+        )
+        for future, path in futures.items():
+            try:
+                manifest.entries.append(_relative_to(future.result(), path, session_path))
+            except Exception as e:
+                logger.error("Failed to compress %s. %s", path, e)
+
+    manifest_path.write_text(manifest.model_dump_json(indent=2), encoding="utf-8")
+    logger.info("Compressed %s from %d to %d bytes.", session_path, manifest.original_size, manifest.compressed_size)
+    return manifest
+
+
+def decompress_session(session_path: os.PathLike, verify: bool = True) -> None:
+    """
+    Restores the Harp logs compressed by `compress_session`. Re-encoded videos can not be restored.
+
+    Args:
+        session_path (os.PathLike): The session directory.
+        verify (bool): Check the restored files against the hashes in the manifest. Defaults to True.
+    """
+    session_path = Path(session_path)
+    manifest_path = session_path / MANIFEST_FILENAME
+    manifest = CompressionManifest.model_validate_json(manifest_path.read_text(encoding="utf-8"))
+    remaining: List[ManifestEntry] = []
+    for entry in manifest.entries:
+        if entry.method not in (HarpCodec.GZIP.value, HarpCodec.ZSTD.value):
+            remaining.append(entry)
+            continue
+        compressed = session_path / entry.compressed_path
+        original = session_path / entry.path
+        if entry.method == HarpCodec.GZIP.value:
+            with gzip.open(compressed, "rb") as fin, open(original, "wb") as fout:
+                shutil.copyfileobj(fin, fout, _COPY_BLOCK_SIZE)
+        else:
+            import zstandard
+
+            with open(compressed, "rb") as fin, open(original, "wb") as fout:
+                zstandard.ZstdDecompressor().copy_stream(fin, fout)
+        if verify and file_hash(original, manifest.hash_algorithm) != entry.hash:
+            original.unlink()
+            raise IOError(f"Restored file {original} does not match its original hash.")
+        compressed.unlink()
+    manifest.entries = remaining
+    manifest_path.write_text(manifest.model_dump_json(indent=2), encoding="utf-8")
+
+
+class PostSessionCompressionService(DataTransfer):
+    """
+    Data transfer that compresses the session before handing it to another data transfer.
+
+    With `background=True`, compression and the wrapped transfer run in a detached process, so the
+    launcher returns, and the next session can start, while they are still running. The wrapped
+    transfer service must be picklable.
+    """
+
+    def __init__(
+        self,
+        session_directory: os.PathLike,
+        data_transfer: Optional[DataTransfer] = None,
+        settings: Optional[CompressionSettings] = None,
+        background: bool = True,
+        log_file: Optional[os.PathLike] = None,
+    ):
+        self.session_directory = Path(session_directory)
+        self.data_transfer = data_transfer
+        self.settings = settings if settings is not None else CompressionSettings()
+        self.background = background
+        self.log_file = Path(log_file) if log_file is not None else None
+        self.process: Optional[subprocess.Popen] = None
+
+    def validate(self) -> bool:
+        if not self.session_directory.is_dir():
+            logger.error("Session directory %s does not exist.", self.session_directory)
+            return False
+        return self.data_transfer.validate() if self.data_transfer is not None else True
+
+    def transfer(self) -> None:
+        # Queues the session, see `queued_sessions`
+        originals_directory(self.session_directory).mkdir(parents=True, exist_ok=True)
+        if not self.background:
+            run_post_session(self.session_directory, self.settings, self.data_transfer)
+            return
+        command = [
+            sys.executable,
+            "-m",
+            __name__,
+            str(self.session_directory),
+            "--settings",
+            self.settings.model_dump_json(),
+        ]
+        if self.data_transfer is not None:
+            with tempfile.NamedTemporaryFile("wb", suffix=".pkl", delete=False) as f:
+                pickle.dump(self.data_transfer, f)
+            command += ["--transfer", f.name]
+        log_file = self.log_file if self.log_file is not None else Path(tempfile.gettempdir()) / "post_session.log"
+        log_file.parent.mkdir(parents=True, exist_ok=True)
+        kwargs = (
+            {"creationflags": subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP}
+            if os.name == "nt"
+            else {"start_new_session": True}
+        )
+        with open(log_file, "ab") as log:
+            self.process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, **kwargs)
+        logger.info(
+            "Post-session compression of %s started in the background (pid %d, log %s).",
+            self.session_directory,
+            self.process.pid,
+            log_file,
+        )
+
+
+def verify_transfer(manifest: CompressionManifest, destination: os.PathLike) -> List[str]:
+    """
+    Checks that the compressed files of a manifest were transferred.
+
+    Args:
+        manifest (CompressionManifest): The manifest of the session.
+        destination (os.PathLike): The session directory at the destination.
+
+    Returns:
+        List[str]: The compressed files that are missing at the destination, or whose size does not match.
+    """
+    destination = Path(destination)
+    return [
+        entry.compressed_path
+        for entry in manifest.entries
+        if not (destination / entry.compressed_path).is_file()
+        or (destination / entry.compressed_path).stat().st_size != entry.compressed_size
+    ]
+
+
+def run_post_session(
+    session_path: os.PathLike, settings: CompressionSettings, data_transfer: Optional[DataTransfer] = None
+) -> CompressionManifest:
+    """
+    Compresses the session and then, if provided, runs the data transfer. The originals are kept in
+    `originals_directory(session_path)` until the compressed files are verified at the destination
+    of the transfer, and are left there if the transfer can not be verified.
+    """
+    originals = originals_directory(session_path)
+    if data_transfer is None:
+        manifest = compress_session(session_path, settings)
+        _release_originals(originals)
+        return manifest
+    manifest = compress_session(session_path, settings, originals)
+    if not data_transfer.validate():
+        raise ValueError(f"Data transfer service failed validation. The originals are kept in {originals}.")
+    data_transfer.transfer()
+
+    destination = getattr(data_transfer, "destination", None)
+    if not isinstance(destination, (str, os.PathLike)):
+        logger.warning("Can not verify the transfer of %s. The originals are kept in %s.", session_path, originals)
+        return manifest
+    missing = verify_transfer(manifest, destination)
+    if missing:
+        raise IOError(
+            f"{len(missing)} compressed files of {session_path} are missing or incomplete at {destination}. "
+            f"The originals are kept in {originals}."
+        )
+    _release_originals(originals)
+    return manifest
+
+
+def post_session_compression_factory(
+    data_transfer_factory: Optional[
+        Union[DataTransfer, Callable[[behavior_launcher.BehaviorLauncher], DataTransfer]]
+    ] = None,
+    settings: Optional[CompressionSettings] = None,
+    background: bool = True,
+) -> Callable[[behavior_launcher.BehaviorLauncher], PostSessionCompressionService]:
+    return partial(
+        _post_session_compression_factory,
+        data_transfer_factory=data_transfer_factory,
+        settings=settings,
+        background=background,
+    )
+
+
+def _post_session_compression_factory(
+    launcher: behavior_launcher.BehaviorLauncher,
+    data_transfer_factory: Optional[
+        Union[DataTransfer, Callable[[behavior_launcher.BehaviorLauncher], DataTransfer]]
+    ] = None,
+    settings: Optional[CompressionSettings] = None,
+    background: bool = True,
+) -> PostSessionCompressionService:
+    data_transfer = data_transfer_factory
+    if data_transfer is not None and not isinstance(data_transfer, DataTransfer):
+        data_transfer = data_transfer(launcher)
+    return PostSessionCompressionService(
+        session_directory=launcher.session_directory,
+        data_transfer=data_transfer,
+        settings=settings,
+        background=background,
+        log_file=Path(launcher.temp_dir).parent / f"post_session_{launcher.session_schema.session_name}.log",
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Post-session compression of a force foraging session")
+    parser.add_argument("session", type=Path, help="Session directory")
+    parser.add_argument("--settings", type=str, default=None, help="CompressionSettings as json")
+    parser.add_argument("--reencode-videos", action="store_true", help="Re-encode the session videos")
+    parser.add_argument("--transfer", type=Path, default=None, help="Pickled data transfer to run afterwards")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    settings = (
+        CompressionSettings.model_validate_json(args.settings) if args.settings is not None else CompressionSettings()
+    )
+    if args.reencode_videos:
+        settings.reencode_videos = True
+    data_transfer = None
+    if args.transfer is not None:
+        with open(args.transfer, "rb") as f:
+            data_transfer = pickle.load(f)
+        args.transfer.unlink()
+    try:
+        run_post_session(args.session, settings, data_transfer)
+    except Exception as e:
+        logger.error("Post-session stage failed for %s. %s", args.session, e)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
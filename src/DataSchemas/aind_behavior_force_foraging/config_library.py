@@ -0,0 +1,251 @@
+"""Local mirror of the network config library.
+
+The launcher reads task logics, rig and subject configs, visualizer layouts and the
+`AindDataSchemaRig` files from the config library on the network share. `ConfigLibraryMirror`
+keeps a local copy of these directories, synced incrementally in a background thread, so that
+session setup reads from the local disk and keeps working while the share is unavailable.
+
+Files are compared by size and mtime first, and only copied when their content hash changed.
+The mirror is read-only: changes made to the local copy are overwritten by the next sync.
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, NamedTuple, Optional, Sequence
+
+from aind_behavior_force_foraging.startup import DEFAULT_CHECK_TIMEOUT_S, run_checks
+
+logger = logging.getLogger(__name__)
+
+STATE_FILENAME = ".mirror_state.json"
+DEFAULT_INCLUDE = ("Rig", "Subjects", "TaskLogic", "AindDataSchemaRig", "VisualizerLayouts")
+DEFAULT_SYNC_INTERVAL_S = 300.0
+DEFAULT_MAX_STALENESS_S = 24 * 3600.0
+
+
+class SyncResult(NamedTuple):
+    copied: int
+    deleted: int
+    unchanged: int
+    duration_s: float
+    error: Optional[str] = None
+
+
+class MirrorStatus(NamedTuple):
+    last_sync: Optional[datetime.datetime]
+    age_s: Optional[float]
+    last_error: Optional[str]
+    is_stale: bool
+
+
+class ConfigLibraryMirror:
+    """
+    Keeps a local copy of the config library.
+
+    Example:
+        mirror = ConfigLibraryMirror(r"\\\\server\\AindForceForaging", r"./local/.config_library")
+        mirror.sync()
+        mirror.start()  # Keep syncing in the background
+        launcher = BehaviorLauncher(config_library_dir=mirror.local, ...)
+    """
+
+    def __init__(
+        self,
+        remote: os.PathLike,
+        local: os.PathLike,
+        include: Optional[Sequence[str]] = DEFAULT_INCLUDE,
+        interval_s: float = DEFAULT_SYNC_INTERVAL_S,
+        max_staleness_s: float = DEFAULT_MAX_STALENESS_S,
+    ):
+        self.remote = Path(remote)
+        self.local = Path(local)
+        self.include = tuple(include) if include is not None else None
+        self.interval_s = interval_s
+        self.max_staleness_s = max_staleness_s
+        self._sync_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._state = self._load_state()
+
+    @property
+    def state_path(self) -> Path:
+        return self.local / STATE_FILENAME
+
+    def _load_state(self) -> Dict[str, Any]:
+        state = {"remote": str(self.remote), "last_sync": None, "last_error": None, "files": {}}
+        if not self.state_path.exists():
+            return state
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable mirror state %s. %s", self.state_path, e)
+            return state
+        if saved.get("remote") != str(self.remote):
+            logger.info("Mirror %s was synced from a different library. Starting over.", self.local)
+            return state
+        return saved
+
+    def _save_state(self) -> None:
+        self.local.mkdir(parents=True, exist_ok=True)
+        tmp = self.state_path.with_name(STATE_FILENAME + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._state, f, indent=1)
+        os.replace(tmp, self.state_path)
+
+    def _iter_remote_files(self):
+        roots = [self.remote / name for name in self.include] if self.include is not None else [self.remote]
+        if not self.remote.is_dir():
+            raise FileNotFoundError(f"Config library {self.remote} is not reachable.")
+
+        def raise_error(e: OSError):
+            raise e
+
+        for root in roots:
+            if not root.is_dir():
+                continue
+            for directory, _, files in os.walk(root, onerror=raise_error):
+                for name in files:
+                    path = Path(directory) / name
+                    yield path.relative_to(self.remote).as_posix(), path
+
+    def sync(self) -> SyncResult:
+        """
+        Brings the local copy up to date. If the share fails mid-sync, files already synced are
+        kept, nothing is deleted, and the error is recorded in the mirror status.
+        If a sync is already running, e.g. in the background thread, waits for it instead.
+        """
+        with self._sync_lock:
+            return self._sync()
+
+    def _sync(self) -> SyncResult:
+        start = time.perf_counter()
+        files: Dict[str, Dict[str, Any]] = self._state["files"]
+        copied, unchanged = 0, 0
+        seen = set()
+        try:
+            for relative_path, src in self._iter_remote_files():
+                seen.add(relative_path)
+                stat = src.stat()
+                entry = files.get(relative_path)
+                dst = self.local / relative_path
+                if (
+                    entry is not None
+                    and entry["size"] == stat.st_size
+                    and entry["mtime_ns"] == stat.st_mtime_ns
+                    and dst.exists()
+                ):
+                    unchanged += 1
+                    continue
+                content = src.read_bytes()
+                digest = hashlib.sha256(content).hexdigest()
+                if entry is None or entry["hash"] != digest or not dst.exists():
+                    dst.parent.mkdir(parents=True, exist_ok=True)
+                    tmp = dst.with_name(dst.name + ".tmp")
+                    tmp.write_bytes(content)
+                    os.utime(tmp, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+                    os.replace(tmp, dst)
+                    copied += 1
+                else:
+                    unchanged += 1
+                files[relative_path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": digest}
+        except OSError as e:
+            self._state["last_error"] = f"{type(e).__name__}: {e}"
+            self._save_state()
+            logger.warning("Config library sync from %s failed. Using the local copy. %s", self.remote, e)
+            return SyncResult(copied, 0, unchanged, time.perf_counter() - start, self._state["last_error"])
+
+        deleted = 0
+        for relative_path in set(files) - seen:
+            (self.local / relative_path).unlink(missing_ok=True)
+            del files[relative_path]
+            deleted += 1
+        self._state["last_sync"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        self._state["last_error"] = None
+        self._save_state()
+        result = SyncResult(copied, deleted, unchanged, time.perf_counter() - start)
+        logger.info(
+            "Synced config library: %d copied, %d deleted, %d unchanged in %.2f s.",
+            result.copied,
+            result.deleted,
+            result.unchanged,
+            result.duration_s,
+        )
+        return result
+
+    def status(self) -> MirrorStatus:
+        last_sync = self._state["last_sync"]
+        if last_sync is None:
+            return MirrorStatus(None, None, self._state["last_error"], True)
+        last_sync = datetime.datetime.fromisoformat(last_sync)
+        age_s = (datetime.datetime.now(datetime.timezone.utc) - last_sync).total_seconds()
+        return MirrorStatus(last_sync, age_s, self._state["last_error"], age_s > self.max_staleness_s)
+
+    def start(self) -> None:
+        """Starts syncing every `interval_s` in a background thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ConfigLibraryMirror", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error("Config library background sync failed. %s", e)
+
+
+def mirrored_config_library(
+    remote: os.PathLike,
+    local: os.PathLike,
+    timeout_s: float = DEFAULT_CHECK_TIMEOUT_S,
+    background: bool = True,
+    **kwargs,
+) -> Path:
+    """
+    Syncs the local mirror of a config library, waiting at most `timeout_s`, and returns the
+    directory the launcher should read from: the mirror if it was ever synced, the remote library otherwise.
+
+    Args:
+        remote (os.PathLike): The config library on the network share.
+        local (os.PathLike): The local mirror.
+        timeout_s (float): Maximum time to wait for the initial sync. A slower sync continues in the background.
+        background (bool): Keep syncing in the background. Defaults to True.
+        **kwargs: Additional arguments passed to `ConfigLibraryMirror`.
+
+    Returns:
+        Path: The config library directory.
+    """
+    mirror = ConfigLibraryMirror(remote, local, **kwargs)
+    result = run_checks({"config_library_sync": mirror.sync}, timeout_s=timeout_s)["config_library_sync"]
+    if result.timed_out:
+        logger.warning("Config library sync is taking longer than %.1f s. Continuing in the background.", timeout_s)
+    if background:
+        mirror.start()
+    status = mirror.status()
+    if status.last_sync is None:
+        logger.warning("Config library mirror %s was never synced. Reading from %s.", mirror.local, mirror.remote)
+        return mirror.remote
+    if status.is_stale:
+        logger.warning(
+            "Config library mirror is stale: last synced %s (%.1f h ago). Last error: %s",
+            status.last_sync.isoformat(),
+            status.age_s / 3600,
+            status.last_error,
+        )
+    return mirror.local
@@ -1,8 +1,25 @@
 import datetime
+import functools
 import logging
 import os
 from pathlib import Path
-from typing import Callable, Dict, List, Optional, Self, Tuple, Type, TypeVar, Union
+from types import UnionType
+from typing import (
+    Annotated,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Self,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+    get_args,
+    get_origin,
+)
 
 import aind_behavior_services.rig as AbsRig
 import aind_data_schema
@@ -26,6 +43,7 @@ from pydantic import BaseModel
 
 from aind_behavior_force_foraging.rig import AindForceForagingRig
 from aind_behavior_force_foraging.task_logic import AindForceForagingTaskLogic
+from aind_behavior_force_foraging.water import session_water_log
 
 TFrom = TypeVar("TFrom", bound=Union[BaseModel, dict])
 TTo = TypeVar("TTo", bound=BaseModel)
@@ -34,12 +52,12 @@ T = TypeVar("T")
 
 logger = logging.getLogger(__name__)
 
-_DATABASE_DIR = "AindDataSchemaRig"
+DATABASE_DIR = "AindDataSchemaRig"
 
 
 class AindRigDataMapper(ads.AindDataSchemaRigDataMapper):
     """Outputs a data mapper for aind-data-schema Rig. By default, it will go in
-    the directory `{db_root}/{_DATABASE_DIR}/{computer_name}/{rig_schema_file_name}.json`"""
+    the directory `{db_root}/{DATABASE_DIR}/{computer_name}/{rig_schema_file_name}.json`"""
 
     def __init__(
         self,
@@ -51,7 +69,7 @@ class AindRigDataMapper(ads.AindDataSchemaRigDataMapper):
         super().__init__()
         self.filename = rig_schema_filename
         self.db_root = db_root
-        self.db_dir = db_suffix if db_suffix else f"{_DATABASE_DIR}/{os.environ['COMPUTERNAME']}"
+        self.db_dir = db_suffix if db_suffix else f"{DATABASE_DIR}/{os.environ['COMPUTERNAME']}"
         self.target_file = Path(self.db_root) / self.db_dir / self.filename
         self._mapped: Optional[aind_data_schema.core.rig.Rig] = None
 
@@ -269,7 +287,8 @@ class AindSessionDataMapper(ads.AindDataSchemaSessionDataMapper):
                             name="Bonsai",
                             version=f"{repository_remote_url}/blob/{repository_sha}/bonsai/Bonsai.config",
                             url=f"{repository_remote_url}/blob/{repository_sha}/bonsai",
-                            parameters=data_mapper_helpers.snapshot_bonsai_environment(
+                            parameters=kwargs.get("bonsai_environment")
+                            or data_mapper_helpers.snapshot_bonsai_environment(
                                 config_file=kwargs.get("bonsai_config_path", Path("./bonsai/bonsai.config"))
                             ),
                         ),
@@ -277,7 +296,8 @@ class AindSessionDataMapper(ads.AindDataSchemaSessionDataMapper):
                             name="Python",
                             version=f"{repository_remote_url}/blob/{repository_sha}/pyproject.toml",
                             url=f"{repository_remote_url}/blob/{repository_sha}",
-                            parameters=data_mapper_helpers.snapshot_python_environment(),
+                            parameters=kwargs.get("python_environment")
+                            or data_mapper_helpers.snapshot_python_environment(),
                         ),
                     ],
                     script=aind_data_schema.core.session.Software(
@@ -308,16 +328,101 @@ class AindSessionDataMapper(ads.AindDataSchemaSessionDataMapper):
 
 
 def coerce_to_aind_data_schema(value: TFrom, target_type: Type[TTo]) -> TTo:
-    _normalized_input: dict
-    if isinstance(value, BaseModel):
-        _normalized_input = value.model_dump()
-    elif isinstance(value, dict):
-        _normalized_input = value
-    else:
+    """
+    Builds a `target_type` from the fields of `value` that `target_type` also defines.
+
+    Models are dumped with an `include` mask of the fields shared with the target, nested models
+    included, so that fields the target would discard are never serialized. The mask of each
+    (source type, target type) pair is resolved once and cached.
+
+    Args:
+        value (TFrom): The source model, or a dict.
+        target_type (Type[TTo]): The target model, e.g. an aind-data-schema component.
+
+    Returns:
+        TTo: The validated target.
+    """
+    return target_type.model_validate(_dump_for(value, target_type))
+
+
+def coerce_many_to_aind_data_schema(values: Iterable[TFrom], target_type: Type[TTo]) -> List[TTo]:
+    """Coerces many values to `target_type`, validated in a single call. See `coerce_to_aind_data_schema`."""
+    return _list_adapter(target_type).validate_python([_dump_for(value, target_type) for value in values])
+
+
+_IncludeMask = Union[bool, Dict[Any, Any]]
+
+
+def _dump_for(value: TFrom, target_type: Type[BaseModel]) -> dict:
+    if isinstance(value, dict):
+        target_fields = target_type.model_fields
+        return {k: v for k, v in value.items() if k in target_fields}
+    if not isinstance(value, BaseModel):
         raise ValueError(f"Expected value to be a BaseModel or a dict, got {type(value)}")
+    mask = _include_mask(type(value), target_type)
+    if mask is True:
+        return value.model_dump()
+    if value.__pydantic_extra__:
+        mask = {**mask, **{k: True for k in value.__pydantic_extra__ if k in target_type.model_fields}}
+    return value.model_dump(include=mask)
+
+
+@functools.lru_cache(maxsize=None)
+def _include_mask(source_type: Type[BaseModel], target_type: Type[BaseModel]) -> _IncludeMask:
+    """
+    The fields of the source, nested fields included, that the target also defines.
+    True if the target defines every field of the source, since dumping without a mask is faster.
+    """
     target_fields = target_type.model_fields
-    _normalized_input = {k: v for k, v in _normalized_input.items() if k in target_fields}
-    return target_type(**_normalized_input)
+    source_fields = [name for name, field in source_type.model_fields.items() if not field.exclude]
+    mask: Dict[str, _IncludeMask] = {}
+    for name in source_fields:
+        if name in target_fields:
+            mask[name] = _field_mask(source_type.model_fields[name].annotation, target_fields[name].annotation)
+    for name in source_type.model_computed_fields:
+        if name in target_fields:
+            mask[name] = True
+    is_complete = len(mask) == len(source_fields) + len(source_type.model_computed_fields)
+    if is_complete and all(m is True for m in mask.values()) and source_type.model_config.get("extra") != "allow":
+        return True
+    return mask
+
+
+def _field_mask(source: Any, target: Any) -> _IncludeMask:
+    """Masks a nested model field when both annotations have the same shape, e.g. `List[Model]`."""
+    source, target = _unwrap_optional(source), _unwrap_optional(target)
+    if _is_model(source) and _is_model(target):
+        return _include_mask(source, target)
+    source_origin, target_origin = get_origin(source), get_origin(target)
+    if source_origin is None or source_origin is not target_origin:
+        return True
+    source_args, target_args = get_args(source), get_args(target)
+    if source_origin is list and len(source_args) == len(target_args) == 1:
+        inner = _field_mask(source_args[0], target_args[0])
+    elif source_origin is dict and len(source_args) == len(target_args) == 2:
+        inner = _field_mask(source_args[1], target_args[1])
+    else:
+        return True
+    return True if inner is True else {"__all__": inner}
+
+
+def _unwrap_optional(annotation: Any) -> Any:
+    if get_origin(annotation) is Annotated:
+        return _unwrap_optional(get_args(annotation)[0])
+    if get_origin(annotation) in (Union, UnionType):
+        args = [arg for arg in get_args(annotation) if arg is not type(None)]
+        if len(args) == 1:
+            return _unwrap_optional(args[0])
+    return annotation
+
+
+def _is_model(annotation: Any) -> bool:
+    return isinstance(annotation, type) and issubclass(annotation, BaseModel)
+
+
+@functools.lru_cache(maxsize=None)
+def _list_adapter(target_type: Type[TTo]) -> pydantic.TypeAdapter[List[TTo]]:
+    return pydantic.TypeAdapter(List[target_type])
 
 
 def aind_session_data_mapper_factory(launcher: BehaviorLauncher) -> AindSessionDataMapper:
@@ -329,6 +434,7 @@ def aind_session_data_mapper_factory(launcher: BehaviorLauncher) -> AindSessionD
         repository=launcher.repository,
         script_path=launcher.services_factory_manager.bonsai_app.workflow,
         session_end_time=now,
+        subject_info=session_water_log(launcher.session_directory, launcher.rig_schema.calibration.water_valve),
     )
 
 
@@ -338,7 +444,7 @@ def aind_rig_data_mapper_factory(
     rig_schema: AindForceForagingRig = launcher.rig_schema
     return AindRigDataMapper(
         rig_schema_filename=f"{rig_schema.rig_name}.json",
-        db_suffix=f"{_DATABASE_DIR}/{launcher.computer_name}",
+        db_suffix=f"{DATABASE_DIR}/{launcher.computer_name}",
         db_root=launcher.config_library_dir,
     )
 
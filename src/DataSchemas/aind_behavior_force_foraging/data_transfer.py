@@ -0,0 +1,307 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+import aind_behavior_experiment_launcher.launcher.behavior_launcher as behavior_launcher
+from aind_behavior_experiment_launcher.data_transfer import DataTransfer
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = ".transfer_manifest.json"
+MANIFEST_VERSION = 2
+PARTIAL_SUFFIX = ".partial"
+DEFAULT_CHUNK_SIZE = 64 * 2**20
+DEFAULT_HASH_ALGORITHM = "sha256"
+_READ_BLOCK_SIZE = 4 * 2**20
+_MANIFEST_SAVE_INTERVAL_S = 1.0
+
+
+def file_hash(path: os.PathLike, algorithm: str = DEFAULT_HASH_ALGORITHM, block_size: int = _READ_BLOCK_SIZE) -> str:
+    """Computes the hash of a file, reading it in blocks so memory use does not depend on the file size."""
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _hash_chunks(path: os.PathLike, algorithm: str, chunk_size: int) -> Tuple[str, List[str]]:
+    """Computes, in a single pass, the hash of a file and the hash of each of its chunks."""
+    digest = hashlib.new(algorithm)
+    chunk_hashes: List[str] = []
+    with open(path, "rb") as f:
+        while True:
+            chunk_digest = hashlib.new(algorithm)
+            remaining = chunk_size
+            while remaining > 0 and (block := f.read(min(_READ_BLOCK_SIZE, remaining))):
+                digest.update(block)
+                chunk_digest.update(block)
+                remaining -= len(block)
+            if remaining == chunk_size and chunk_hashes:
+                break
+            chunk_hashes.append(chunk_digest.hexdigest())
+            if remaining > 0:
+                break
+    return digest.hexdigest(), chunk_hashes
+
+
+class TransferManifest:
+    """
+    Records, for each file of a transfer, the hashes of the source and of its chunks, and the hash of
+    every chunk that was already copied.
+    The manifest is written atomically next to the destination so a transfer can resume from it, and
+    deleted once the transfer completes, so it never ends up in the archived session.
+    """
+
+    def __init__(self, path: os.PathLike, algorithm: str, chunk_size: int):
+        self.path = Path(path)
+        self.algorithm = algorithm
+        self.chunk_size = chunk_size
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._last_save = 0.0
+
+    @classmethod
+    def load_or_create(cls, path: os.PathLike, algorithm: str, chunk_size: int) -> "TransferManifest":
+        manifest = cls(path, algorithm, chunk_size)
+        if not manifest.path.exists():
+            return manifest
+        try:
+            with open(manifest.path, "r", encoding="utf-8") as f:
+                content = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable transfer manifest %s. %s", manifest.path, e)
+            return manifest
+        if (
+            content.get("version") == MANIFEST_VERSION
+            and content.get("algorithm") == algorithm
+            and content.get("chunk_size") == chunk_size
+        ):
+            manifest.files = content.get("files", {})
+        else:
+            logger.info("Transfer manifest %s was written with different settings. Starting over.", manifest.path)
+        return manifest
+
+    def save(self, force: bool = True) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_save < _MANIFEST_SAVE_INTERVAL_S:
+                return
+            self._last_save = now
+            content = {
+                "version": MANIFEST_VERSION,
+                "algorithm": self.algorithm,
+                "chunk_size": self.chunk_size,
+                "files": self.files,
+            }
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(content, f, indent=1)
+            os.replace(tmp, self.path)
+
+    def mark_chunk_done(self, relative_path: str, chunk: int, chunk_hash: str) -> None:
+        with self._lock:
+            self.files[relative_path]["chunks_done"][str(chunk)] = chunk_hash
+        self.save(force=False)
+
+
+class ResumableTransferService(DataTransfer):
+    """
+    Copies a directory in parallel fixed-size chunks.
+
+    Progress is recorded in a manifest at the destination, so an interrupted transfer resumes
+    where it stopped. Every chunk is hashed as it is copied, and a file is moved into place once the
+    hashes of all its chunks match those of its source, so it is never read back. Chunks that do not
+    match are copied again on the next transfer. Files already present at the destination with the same
+    hash are skipped, and partial files whose source is gone are deleted. The manifest is removed when
+    every file has been verified.
+    """
+
+    def __init__(
+        self,
+        source: os.PathLike,
+        destination: os.PathLike,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        max_workers: int = 4,
+        hash_algorithm: str = DEFAULT_HASH_ALGORITHM,
+        delete_src: bool = False,
+    ):
+        if chunk_size <= 0:
+            raise ValueError("Chunk size must be positive.")
+        self.source = Path(source)
+        self.destination = Path(destination)
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.hash_algorithm = hash_algorithm
+        self.delete_src = delete_src
+        self.manifest: Optional[TransferManifest] = None
+
+    def validate(self) -> bool:
+        if not self.source.is_dir():
+            logger.error("Source directory %s does not exist.", self.source)
+            return False
+        try:
+            hashlib.new(self.hash_algorithm)
+        except ValueError:
+            logger.error("Unsupported hash algorithm %s.", self.hash_algorithm)
+            return False
+        anchor = next((p for p in (self.destination, *self.destination.parents) if p.exists()), None)
+        if anchor is None or not os.access(anchor, os.W_OK):
+            logger.error("Destination %s is not writable.", self.destination)
+            return False
+        return True
+
+    def transfer(self) -> None:
+        logger.info("Starting resumable transfer from %s to %s.", self.source, self.destination)
+        self.destination.mkdir(parents=True, exist_ok=True)
+        self.manifest = TransferManifest.load_or_create(
+            self.destination / MANIFEST_FILENAME, self.hash_algorithm, self.chunk_size
+        )
+        pending: List[Tuple[str, Path]] = []
+        skipped = 0
+        sources = set()
+        for relative_path, src in self._iter_source_files():
+            sources.add(relative_path)
+            if self._prepare(relative_path, src):
+                pending.append((relative_path, src))
+            else:
+                skipped += 1
+        self._remove_orphans(sources)
+        self.manifest.save()
+        logger.info("%d files to copy, %d files already at the destination.", len(pending), skipped)
+
+        chunks = [
+            (relative_path, src, chunk)
+            for relative_path, src in pending
+            for chunk in self._missing_chunks(relative_path)
+        ]
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                list(executor.map(lambda args: self._copy_chunk(*args), chunks))
+        finally:
+            self.manifest.save()
+
+        failed = [relative_path for relative_path, src in pending if not self._finalize(relative_path, src)]
+        self.manifest.save()
+        if failed:
+            raise IOError(f"Hash verification failed for {len(failed)} files: {failed}. Re-run to retry.")
+        self.manifest.path.unlink(missing_ok=True)
+        if self.delete_src:
+            for relative_path, src in self._iter_source_files():
+                src.unlink()
+        logger.info("Transfer from %s to %s completed.", self.source, self.destination)
+
+    def _iter_source_files(self) -> Iterator[Tuple[str, Path]]:
+        for root, _, files in os.walk(self.source):
+            for name in sorted(files):
+                path = Path(root) / name
+                yield path.relative_to(self.source).as_posix(), path
+
+    def _prepare(self, relative_path: str, src: Path) -> bool:
+        """Updates the manifest entry of a file. Returns False if the file does not need to be copied."""
+        stat = src.stat()
+        entry = self.manifest.files.get(relative_path)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+            source_hash, chunk_hashes = _hash_chunks(src, self.hash_algorithm, self.chunk_size)
+            entry = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "hash": source_hash,
+                "chunk_hashes": chunk_hashes,
+                "chunks_done": {},
+                "complete": False,
+            }
+            self.manifest.files[relative_path] = entry
+
+        dst = self.destination / relative_path
+        dst_stat = dst.stat() if dst.exists() else None
+        if dst_stat is not None and dst_stat.st_size == entry["size"]:
+            # Files verified by a previous run are only trusted if they were not touched since
+            unchanged = entry["complete"] and entry.get("dst_mtime_ns") == dst_stat.st_mtime_ns
+            if unchanged or file_hash(dst, self.hash_algorithm) == entry["hash"]:
+                entry["complete"] = True
+                entry["dst_mtime_ns"] = dst_stat.st_mtime_ns
+                return False
+        entry["complete"] = False
+        partial_file = dst.with_name(dst.name + PARTIAL_SUFFIX)
+        if not partial_file.exists() or partial_file.stat().st_size != entry["size"]:
+            entry["chunks_done"] = {}
+            partial_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(partial_file, "wb") as f:
+                f.truncate(entry["size"])
+        return True
+
+    def _remove_orphans(self, sources: Set[str]) -> None:
+        """Deletes the partial files, and forgets the manifest entries, of files no longer in the source."""
+        for partial_file in self.destination.rglob(f"*{PARTIAL_SUFFIX}"):
+            relative_path = partial_file.relative_to(self.destination).as_posix()[: -len(PARTIAL_SUFFIX)]
+            if relative_path not in sources:
+                logger.info("Deleting %s, whose source no longer exists.", partial_file)
+                partial_file.unlink()
+        for relative_path in set(self.manifest.files) - sources:
+            del self.manifest.files[relative_path]
+
+    def _missing_chunks(self, relative_path: str) -> List[int]:
+        entry = self.manifest.files[relative_path]
+        done = entry["chunks_done"]
+        return [chunk for chunk in range(len(entry["chunk_hashes"])) if str(chunk) not in done]
+
+    def _copy_chunk(self, relative_path: str, src: Path, chunk: int) -> None:
+        dst = self.destination / relative_path
+        offset = chunk * self.chunk_size
+        digest = hashlib.new(self.hash_algorithm)
+        with open(src, "rb") as fin, open(dst.with_name(dst.name + PARTIAL_SUFFIX), "r+b") as fout:
+            fin.seek(offset)
+            fout.seek(offset)
+            remaining = self.chunk_size
+            while remaining > 0 and (block := fin.read(min(_READ_BLOCK_SIZE, remaining))):
+                fout.write(block)
+                digest.update(block)
+                remaining -= len(block)
+        self.manifest.mark_chunk_done(relative_path, chunk, digest.hexdigest())
+
+    def _finalize(self, relative_path: str, src: Path) -> bool:
+        entry = self.manifest.files[relative_path]
+        dst = self.destination / relative_path
+        partial_file = dst.with_name(dst.name + PARTIAL_SUFFIX)
+        mismatched = [
+            chunk
+            for chunk, chunk_hash in enumerate(entry["chunk_hashes"])
+            if entry["chunks_done"][str(chunk)] != chunk_hash
+        ]
+        if mismatched:
+            logger.error(
+                "Hash mismatch for %d chunks of %s. They will be copied again on the next transfer.",
+                len(mismatched),
+                relative_path,
+            )
+            for chunk in mismatched:
+                del entry["chunks_done"][str(chunk)]
+            return False
+        os.replace(partial_file, dst)
+        entry["complete"] = True
+        entry["dst_mtime_ns"] = dst.stat().st_mtime_ns
+        return True
+
+
+def resumable_data_transfer_factory(
+    destination: os.PathLike, **kwargs
+) -> Callable[[behavior_launcher.BehaviorLauncher], ResumableTransferService]:
+    return partial(_resumable_data_transfer_factory, destination=destination, **kwargs)
+
+
+def _resumable_data_transfer_factory(
+    launcher: behavior_launcher.BehaviorLauncher, destination: os.PathLike, **kwargs
+) -> ResumableTransferService:
+    if launcher.group_by_subject_log:
+        dst = Path(destination) / launcher.session_schema.subject / launcher.session_schema.session_name
+    else:
+        dst = Path(destination) / launcher.session_schema.session_name
+    return ResumableTransferService(source=launcher.session_directory, destination=dst, **kwargs)
@@ -0,0 +1,178 @@
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional, Type, TypeVar
+
+from aind_behavior_services.data_types import SoftwareEvent
+from aind_behavior_services.session import AindBehaviorSessionModel
+from aind_behavior_services.utils import model_from_json_file
+from pydantic import BaseModel
+
+from aind_behavior_force_foraging.harp_io import COMPRESSED_SUFFIXES
+from aind_behavior_force_foraging.rig import AindForceForagingRig
+from aind_behavior_force_foraging.task_logic import AindForceForagingTaskLogic
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T", bound=BaseModel)
+
+BEHAVIOR_DIR = "Behavior"
+BEHAVIOR_VIDEOS_DIR = "BehaviorVideos"
+SOFTWARE_EVENTS_DIR = "SoftwareEvents"
+LOGS_DIR = "Logs"
+HARP_COMMANDS_DIR = "HarpCommands"
+
+RIG_INPUT = "rig_input.json"
+SESSION_INPUT = "session_input.json"
+TASK_LOGIC_INPUT = "tasklogic_input.json"
+INPUT_FILES = (SESSION_INPUT, RIG_INPUT, TASK_LOGIC_INPUT)
+TELEMETRY_FILE = "telemetry.bin"
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mkv", ".mov")
+
+CAMERA_TRIGGER_DEVICE = "Behavior"
+CAMERA_TRIGGER_ADDRESS = 92  # Behavior Camera0Frame
+
+_HARP_FILE_PATTERN = re.compile(
+    r"^(?P<device>.+)_(?P<address>\d+)\.bin(" + "|".join(re.escape(s) for s in COMPRESSED_SUFFIXES) + ")?$"
+)
+
+
+class HarpRegisterFile(NamedTuple):
+    device: str
+    address: int
+    path: Path
+
+
+def discover_sessions(root: os.PathLike) -> List[Path]:
+    """Returns every `<root>/<subject>/<session_name>` directory that contains a behavior session."""
+    return sorted(p.parent for p in Path(root).glob(f"*/*/{BEHAVIOR_DIR}") if p.is_dir())
+
+
+def harp_device_dir(session_path: os.PathLike, device: str) -> Path:
+    """Returns the directory where the events of a Harp device are logged."""
+    return Path(session_path) / BEHAVIOR_DIR / f"{device}.harp"
+
+
+def harp_register_file(
+    session_path: os.PathLike, device: str, address: int, harp_device_name: Optional[str] = None
+) -> Path:
+    """
+    Returns the path of the binary file of a Harp device register.
+
+    Args:
+        session_path (os.PathLike): The session directory.
+        device (str): The name the device is logged under, e.g. `Lickometer`.
+        address (int): The register address.
+        harp_device_name (Optional[str]): The Harp device name that prefixes the register files,
+            e.g. `LicketySplit`. Defaults to `device`.
+
+    Returns:
+        Path: The register file.
+    """
+    return harp_device_dir(session_path, device) / f"{harp_device_name or device}_{address}.bin"
+
+
+def find_harp_register_file(
+    session_path: os.PathLike, device: str, address: int, harp_device_name: Optional[str] = None
+) -> Optional[Path]:
+    """Returns the binary file of a Harp device register, or its compressed counterpart, if either exists."""
+    return _find_possibly_compressed(harp_register_file(session_path, device, address, harp_device_name))
+
+
+def harp_command_file(session_path: os.PathLike, device: str, address: int) -> Path:
+    """Returns the path of the binary file of the commands sent to a Harp device register."""
+    return Path(session_path) / BEHAVIOR_DIR / HARP_COMMANDS_DIR / f"{device}.harp" / f"{device}_{address}.bin"
+
+
+def find_harp_command_file(session_path: os.PathLike, device: str, address: int) -> Optional[Path]:
+    """Returns the binary file of the commands sent to a Harp device register, or its compressed counterpart."""
+    return _find_possibly_compressed(harp_command_file(session_path, device, address))
+
+
+def _find_possibly_compressed(path: Path) -> Optional[Path]:
+    for candidate in (path, *(path.with_name(path.name + suffix) for suffix in COMPRESSED_SUFFIXES)):
+        if candidate.exists():
+            return candidate
+    return None
+
+
+def iter_harp_register_files(session_path: os.PathLike) -> Iterator[HarpRegisterFile]:
+    """Iterates over all Harp register files logged in a session, excluding the command logs."""
+    return _iter_harp_files(Path(session_path) / BEHAVIOR_DIR)
+
+
+def iter_harp_command_files(session_path: os.PathLike) -> Iterator[HarpRegisterFile]:
+    """Iterates over all Harp command files logged in a session."""
+    return _iter_harp_files(Path(session_path) / BEHAVIOR_DIR / HARP_COMMANDS_DIR)
+
+
+def _iter_harp_files(directory: Path) -> Iterator[HarpRegisterFile]:
+    for device_dir in sorted(directory.glob("*.harp")):
+        for path in sorted(device_dir.glob("*.bin*")):
+            match = _HARP_FILE_PATTERN.match(path.name)
+            if match is None:
+                logger.debug("Skipping file %s that does not follow the Harp register naming convention.", path)
+                continue
+            yield HarpRegisterFile(device=match.group("device"), address=int(match.group("address")), path=path)
+
+
+def read_software_events(session_path: os.PathLike, name: Optional[str] = None) -> List[SoftwareEvent]:
+    """
+    Reads the software events logged in a session.
+
+    Args:
+        session_path (os.PathLike): The session directory.
+        name (Optional[str]): The event name. If None, all software event files are read.
+
+    Returns:
+        List[SoftwareEvent]: The events, in file order.
+    """
+    directory = Path(session_path) / BEHAVIOR_DIR / SOFTWARE_EVENTS_DIR
+    files = [directory / f"{name}.json"] if name is not None else sorted(directory.glob("*.json"))
+    events: List[SoftwareEvent] = []
+    for file in files:
+        if not file.exists():
+            continue
+        with open(file, "r", encoding="utf-8") as f:
+            events.extend(SoftwareEvent.model_validate_json(line) for line in f if line.strip())
+    return events
+
+
+def _read_input_model(session_path: os.PathLike, filename: str, model: Type[T]) -> Optional[T]:
+    path = Path(session_path) / BEHAVIOR_DIR / LOGS_DIR / filename
+    if not path.exists():
+        return None
+    return model_from_json_file(path, model)
+
+
+def read_rig(session_path: os.PathLike) -> Optional[AindForceForagingRig]:
+    return _read_input_model(session_path, RIG_INPUT, AindForceForagingRig)
+
+
+def read_session(session_path: os.PathLike) -> Optional[AindBehaviorSessionModel]:
+    return _read_input_model(session_path, SESSION_INPUT, AindBehaviorSessionModel)
+
+
+def read_task_logic(session_path: os.PathLike) -> Optional[AindForceForagingTaskLogic]:
+    return _read_input_model(session_path, TASK_LOGIC_INPUT, AindForceForagingTaskLogic)
+
+
+def video_metadata_file(session_path: os.PathLike, camera: str) -> Optional[Path]:
+    """
+    Returns the frame metadata file of a camera, if it exists. Both the `<camera>/metadata.csv`
+    layout and the older flat `<camera>.csv` layout are supported.
+    """
+    root = Path(session_path) / BEHAVIOR_VIDEOS_DIR
+    for candidate in (root / camera / "metadata.csv", root / f"{camera}.csv"):
+        if candidate.exists():
+            return candidate
+    return None
+
+
+def video_file(session_path: os.PathLike, camera: str) -> Optional[Path]:
+    """Returns the video file of a camera, if it exists, for either of the supported layouts."""
+    root = Path(session_path) / BEHAVIOR_VIDEOS_DIR
+    candidates = sorted((root / camera).glob("video.*")) + sorted(root.glob(f"{camera}.*"))
+    return next((c for c in candidates if c.suffix in VIDEO_EXTENSIONS), None)
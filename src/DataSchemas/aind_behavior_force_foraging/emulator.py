@@ -0,0 +1,931 @@
+"""Software-in-the-loop emulation of the Harp devices of an `AindForceForagingRig`.
+
+The emulator runs a task logic against a simple `Agent` and produces the messages the rig would:
+
+- the `LoadCellData` of the load cells,
+- the `LickState` of the lickometer,
+- the camera triggers and the water valve commands of the behavior board,
+- the heartbeat and the register dump of every device,
+- and the software events of the task.
+
+Trials are resolved by the state machine of `replay`, run on the emulated force, so that the
+events are the ones the workflow logs for the same force and licks. Distributions are sampled
+here, and every `Trial` event logs the sampled values as `Scalar`s, so that emulated sessions can
+themselves be replayed. Since the outcomes come from `replay`, emulated sessions exercise the
+acquisition and analysis paths, not the replay itself. Numerical and action updaters are not applied.
+
+The load cells and the camera triggers run at `rate_multiplier` times their production rate, to
+stress the live processing paths. An emulated session is either written to disk, with the layout of
+an acquired session (`write_session`), or streamed in real time, one byte stream per device as on its
+serial port, to a pty (`open_pty`), a TCP connection or any other writer (`stream_device`). A pty can
+also answer the READ requests of a host from the register dump (`serve_read_requests`), for instance to
+stand in for a device during the pre-flight probe of `preflight`.
+
+Usage:
+    emulate-rig --rig rig.json --task-logic task_logic.json --duration 600 --rate-multiplier 5 --output session
+    emulate-rig --rig rig.json --task-logic task_logic.json --duration 600 --pty
+"""
+
+import argparse
+import functools
+import itertools
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from aind_behavior_services.calibration.load_cells import LoadCellsCalibrationOutput
+from aind_behavior_services.data_types import SoftwareEvent
+from aind_behavior_services.session import AindBehaviorSessionModel
+from aind_behavior_services.task_logic.distributions import DistributionFamily
+from pydantic import BaseModel
+
+from aind_behavior_force_foraging import dataset, licks, replay, water
+from aind_behavior_force_foraging.force import apply_load_cells_calibration, parse_force
+from aind_behavior_force_foraging.harp_io import (
+    ERROR_FLAG,
+    FIRMWARE_VERSION_HIGH_ADDRESS,
+    FIRMWARE_VERSION_LOW_ADDRESS,
+    HAS_TIMESTAMP,
+    SECONDS_PER_TICK,
+    TIMESTAMP_SECONDS_ADDRESS,
+    WHO_AM_I_ADDRESS,
+    MessageType,
+    PayloadType,
+    encode_harp_messages,
+    split_harp_stream,
+)
+from aind_behavior_force_foraging.load_cells_calibration import LOAD_CELL_DATA_ADDRESS, N_CHANNELS
+from aind_behavior_force_foraging.replay import ForceTrace, ReplayedTrial, replay_trial, scalar_or_nan
+from aind_behavior_force_foraging.rig import AindForceForagingRig
+from aind_behavior_force_foraging.task_logic import (
+    AindForceForagingTaskLogic,
+    BlockGenerator,
+    BlockStatistics,
+    Environment,
+    ForceOperationControl,
+    HarvestAction,
+    HarvestActionLabel,
+    HarvestMode,
+    PressMode,
+    Trial,
+    scalar_value,
+)
+from aind_behavior_force_foraging.trials import (
+    GIVE_REWARD_EVENT,
+    HARVEST_ACTION_SELECTED_EVENT,
+    INITIATION_PERIOD_EVENT,
+    QUIESCENCE_PERIOD_EVENT,
+    RESPONSE_PERIOD_EVENT,
+    TRIAL_EVENT,
+    TRIAL_OUTCOME_EVENT,
+)
+
+logger = logging.getLogger(__name__)
+
+LOAD_CELLS_RATE_HZ = 1000.0  # LoadCellData events in production
+HEARTBEAT_PERIOD_S = 1.0
+CLOCK_GENERATOR_DEVICE = "ClockGenerator"
+CLOCK_GENERATOR_HARP_DEVICE = "TimestampGeneratorGen3"
+DEFAULT_FIRMWARE_VERSION = (1, 0)
+DEFAULT_CHUNK_S = 0.01
+
+_TRUNCATION_DRAWS = 1000
+_ROWS_PER_CHUNK = 1 << 20
+
+# The actions the workflow selects when the response period times out, or the initiation period is aborted
+TIMEOUT_ACTION = HarvestAction(
+    harvest_mode=HarvestMode.ROI,
+    probability=0,
+    amount=0,
+    force_duration=0,
+    upper_force_threshold=32768,
+    lower_force_threshold=5000,
+    is_operant=False,
+)
+ABORT_ACTION = HarvestAction(
+    harvest_mode=HarvestMode.ROI,
+    probability=0,
+    amount=1,
+    force_duration=0,
+    upper_force_threshold=0,
+    lower_force_threshold=0,
+    is_operant=True,
+)
+
+_SAMPLERS: Dict[DistributionFamily, Callable[[Any, np.random.Generator, int], np.ndarray]] = {
+    DistributionFamily.UNIFORM: lambda p, rng, n: rng.uniform(p.min, p.max, n),
+    DistributionFamily.NORMAL: lambda p, rng, n: rng.normal(p.mean, p.std, n),
+    DistributionFamily.LOGNORMAL: lambda p, rng, n: rng.lognormal(p.mean, p.std, n),
+    DistributionFamily.EXPONENTIAL: lambda p, rng, n: rng.exponential(1.0 / p.rate, n),
+    DistributionFamily.GAMMA: lambda p, rng, n: rng.gamma(p.shape, 1.0 / p.rate, n),
+    DistributionFamily.BETA: lambda p, rng, n: rng.beta(p.alpha, p.beta, n),
+    DistributionFamily.POISSON: lambda p, rng, n: rng.poisson(p.rate, n).astype(np.float64),
+    DistributionFamily.BINOMIAL: lambda p, rng, n: rng.binomial(p.n, p.p, n).astype(np.float64),
+    DistributionFamily.PDF: lambda p, rng, n: rng.choice(np.asarray(p.index), n, p=np.asarray(p.pdf) / np.sum(p.pdf)),
+}
+
+
+class EmulatedDevice(NamedTuple):
+    """A Harp device of the rig, by the name it is logged under."""
+
+    device: str
+    harp_device_name: str
+    who_am_i: int
+
+
+class RegisterStream(NamedTuple):
+    """The messages of a single register of an emulated device."""
+
+    device: str
+    address: int
+    payload_type: PayloadType
+    timestamp: np.ndarray
+    payload: np.ndarray
+    message_type: MessageType = MessageType.EVENT
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+    def encode(self, start: int = 0, stop: Optional[int] = None) -> bytes:
+        """Encodes the messages `[start, stop)`."""
+        return encode_harp_messages(
+            self.address,
+            self.payload[start:stop],
+            self.payload_type,
+            self.timestamp[start:stop],
+            message_type=self.message_type,
+        )
+
+
+class EmulatedSession(NamedTuple):
+    """The messages and software events of an emulated session."""
+
+    devices: List[EmulatedDevice]
+    registers: List[RegisterStream]
+    commands: List[RegisterStream]
+    events: List[SoftwareEvent]
+    trials: pd.DataFrame
+
+
+class Press(NamedTuple):
+    """A constant force applied on the side of a harvest action, in the units seen by the task."""
+
+    action: HarvestActionLabel
+    start: float
+    stop: float
+    value: float
+
+
+class Agent(NamedTuple):
+    """
+    A simple subject. In every trial, it stays still until the response period, then, with probability
+    `press_probability`, presses to select one of the harvest actions at random, and licks after every
+    selected action.
+    """
+
+    press_probability: float = 0.9
+    reaction_time_s: float = 0.2
+    hold_factor: float = 1.5
+    accumulation_time_s: float = 0.5
+    lick_latency_s: float = 0.15
+    lick_count: int = 4
+    inter_lick_interval_s: float = 0.12
+    lick_duration_s: float = 0.04
+    noise_sd: float = 0.0
+
+    def press(self, trial: Trial, response_start: float, rng: np.random.Generator) -> Optional[Press]:
+        """The press of a trial whose response period starts at `response_start`, if any."""
+        harvests = [h for h in (trial.left_harvest, trial.right_harvest) if h is not None]
+        if not harvests or not rng.random() < self.press_probability:
+            return None
+        harvest = harvests[int(rng.integers(len(harvests)))]
+        start = response_start + self.reaction_time_s
+        hold = harvest.force_duration * self.hold_factor
+        if harvest.harvest_mode == HarvestMode.ROI:
+            value = 0.5 * (harvest.lower_force_threshold + harvest.upper_force_threshold)
+            return Press(harvest.action, start, start + hold, value)
+        value = max(harvest.upper_force_threshold - harvest.lower_force_threshold, 0) / self.accumulation_time_s
+        return Press(harvest.action, start, start + self.accumulation_time_s + hold, value)
+
+    def licks(self, harvest_time: float) -> np.ndarray:
+        """The lick onsets that follow a harvest action selected at `harvest_time`."""
+        return harvest_time + self.lick_latency_s + self.inter_lick_interval_s * np.arange(self.lick_count)
+
+
+class StreamStatistics(NamedTuple):
+    """The outcome of streaming a device."""
+
+    message_count: int
+    byte_count: int
+    elapsed_s: float
+    max_lag_s: float
+
+
+class DeviceStream(NamedTuple):
+    """The messages a device sends on its serial port, in time order."""
+
+    timestamp: np.ndarray
+    data: np.ndarray
+    offset: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+
+def sample_distribution(distribution: Any, rng: np.random.Generator) -> float:
+    """
+    Draws a value from a distribution, with its scaling and truncation, as `SampleDistribution.cs` does.
+
+    Args:
+        distribution (Any): The distribution.
+        rng (np.random.Generator): The random number generator.
+
+    Raises:
+        ValueError: If the distribution family is not supported.
+
+    Returns:
+        float: The value. Truncated values are drawn again, and clipped if no draw is in range.
+    """
+    parameters = distribution.distribution_parameters
+    if parameters.family == DistributionFamily.SCALAR:
+        return float(parameters.value)
+    if parameters.family not in _SAMPLERS:
+        raise ValueError(f"Sampling from {parameters.family} distributions is not supported.")
+    truncation = distribution.truncation_parameters
+    is_truncated = truncation is not None and truncation.is_truncated
+    samples = _SAMPLERS[parameters.family](parameters, rng, _TRUNCATION_DRAWS if is_truncated else 1)
+    scaling = distribution.scaling_parameters
+    if scaling is not None:
+        samples = samples * scaling.scale + scaling.offset
+    if is_truncated:
+        inside = samples[(samples >= truncation.min) & (samples <= truncation.max)]
+        return float(inside[0]) if len(inside) else float(np.clip(samples[0], truncation.min, truncation.max))
+    return float(samples[0])
+
+
+def sample_trial(trial: Trial, rng: np.random.Generator) -> Trial:
+    """Returns a copy of a trial with every distribution replaced by a `Scalar` of a value drawn from it."""
+    trial = trial.model_copy(deep=True)
+    trial.inter_trial_interval = scalar_value(sample_distribution(trial.inter_trial_interval, rng))
+    for period in (trial.quiescence_period, trial.initiation_period, trial.response_period):
+        if period is not None:
+            period.duration = scalar_value(sample_distribution(period.duration, rng))
+    for harvest in (trial.left_harvest, trial.right_harvest):
+        if harvest is not None and harvest.time_to_collect is not None:
+            harvest.time_to_collect = scalar_value(sample_distribution(harvest.time_to_collect, rng))
+    return trial
+
+
+def iter_trials(environment: Environment, rng: np.random.Generator) -> Iterator[Trial]:
+    """
+    Yields the trials of an environment in order, block after block, with the shuffling and repetitions
+    of the environment and its blocks. Environments and blocks with a null `repeat_count` repeat forever.
+    """
+    for _ in _repetitions(environment.repeat_count):
+        blocks = list(environment.block_statistics)
+        if environment.shuffle:
+            blocks = [blocks[i] for i in rng.permutation(len(blocks))]
+        n_trials = 0
+        for block in blocks:
+            for trial in _iter_block(block, rng):
+                n_trials += 1
+                yield trial
+        if n_trials == 0:
+            return
+
+
+def _iter_block(block: BlockStatistics, rng: np.random.Generator) -> Iterator[Trial]:
+    if isinstance(block, BlockGenerator):
+        block_size = max(int(round(sample_distribution(block.block_size, rng))), 0)
+        yield from itertools.repeat(block.trial_statistics, block_size)
+        return
+    if not block.trials:
+        return
+    for _ in _repetitions(block.repeat_count):
+        order = rng.permutation(len(block.trials)) if block.shuffle else range(len(block.trials))
+        yield from (block.trials[i] for i in order)
+
+
+def _repetitions(repeat_count: Optional[int]) -> Iterator[int]:
+    return itertools.count() if repeat_count is None else iter(range(repeat_count + 1))
+
+
+def sample_times(duration_s: float, rate_hz: float) -> np.ndarray:
+    """Timestamps at a fixed rate from zero, rounded to the resolution of the Harp clock."""
+    return np.round(np.arange(0.0, duration_s, 1.0 / rate_hz) / SECONDS_PER_TICK) * SECONDS_PER_TICK
+
+
+def rig_devices(rig: AindForceForagingRig) -> List[EmulatedDevice]:
+    """The emulated devices of a rig."""
+    return [
+        EmulatedDevice(water.BEHAVIOR_DEVICE, water.BEHAVIOR_DEVICE, rig.harp_behavior.who_am_i),
+        EmulatedDevice(replay.LOAD_CELLS_DEVICE, replay.LOAD_CELLS_DEVICE, rig.harp_load_cells.who_am_i),
+        EmulatedDevice(licks.LICKOMETER_DEVICE, licks.LICKOMETER_HARP_DEVICE, rig.harp_lickometer.who_am_i),
+        EmulatedDevice(CLOCK_GENERATOR_DEVICE, CLOCK_GENERATOR_HARP_DEVICE, rig.harp_clock_generator.who_am_i),
+    ]
+
+
+class _SessionEmulator:
+    """Runs the trials of a session, one after the other, on the load cell data they leave behind."""
+
+    def __init__(
+        self,
+        task_logic: AindForceForagingTaskLogic,
+        rig: AindForceForagingRig,
+        time: np.ndarray,
+        agent: Agent,
+        rng: np.random.Generator,
+    ) -> None:
+        self.control: ForceOperationControl = task_logic.task_parameters.operation_control.force
+        if self.control.press_mode == PressMode.SINGLE_LOOKUP_TABLE:
+            raise ValueError("The force of the SingleLookupTable press mode can not be emulated.")
+        calibration = rig.harp_load_cells.calibration
+        self.calibration = calibration.output if calibration is not None else None
+        self.baseline, self.slope = _channel_calibration(self.calibration)
+        self.time = time
+        self.agent = agent
+        self.rng = rng
+        self.raw = _noisy_baseline(len(time), self.baseline, agent.noise_sd, rng)
+        self.lick_onsets: List[float] = []
+        self.rewards: List[Tuple[float, float]] = []
+        self.events: List[SoftwareEvent] = []
+        self.trials: List[ReplayedTrial] = []
+
+    @property
+    def end(self) -> float:
+        return float(self.time[-1]) if len(self.time) else 0.0
+
+    def run(self, trials: Iterator[Trial]) -> None:
+        i = 0
+        for number, template in enumerate(trials):
+            if i >= len(self.time):
+                break
+            outcome = self.run_trial(number, sample_trial(template, self.rng), float(self.time[i]))
+            if outcome is None:
+                break
+            # Software events take the timestamp of the last Harp message, so the next trial starts
+            # with the first sample after the outcome
+            i = int(np.searchsorted(self.time, outcome, side="right"))
+
+    def run_trial(self, number: int, trial: Trial, start: float) -> Optional[float]:
+        """Runs a trial. Returns the time of its outcome, or None if the session ends first."""
+        response_start = start + scalar_or_nan(trial.initiation_period.duration)
+        if trial.quiescence_period is not None:
+            response_start += scalar_or_nan(trial.quiescence_period.duration)
+        press = self.agent.press(trial, response_start, self.rng)
+        if press is not None:
+            self._apply_press(press)
+        replayed = self._replay(trial, start)
+        if replayed.selected_action not in (None, HarvestActionLabel.NONE.value):
+            onsets = _to_ticks(self.agent.licks(replayed.harvest_action_selected_time))
+            self.lick_onsets.extend(onsets[onsets <= self.end].tolist())
+            replayed = self._replay(trial, start)
+        self._log(number, trial, replayed)
+        return replayed.outcome_time if replayed.is_replayed else None
+
+    def _apply_press(self, press: Press) -> None:
+        i0, i1 = np.searchsorted(self.time, (press.start, press.stop))
+        for channel in _press_channels(self.control, press.action):
+            value = self.raw[i0:i1, channel].astype(np.int32) + int(round(press.value / self.slope[channel]))
+            self.raw[i0:i1, channel] = np.clip(value, np.iinfo(np.int16).min, np.iinfo(np.int16).max)
+
+    def _force(self, i0: int, i1: int) -> ForceTrace:
+        force = parse_force(apply_load_cells_calibration(self.raw[i0:i1], self.calibration), self.control)
+        return ForceTrace(time=self.time[i0:i1], left_force=force.left_force, right_force=force.right_force)
+
+    def _replay(self, trial: Trial, start: float) -> ReplayedTrial:
+        """Replays a trial on a window of the force, doubled until the trial ends in it or the session ends."""
+        lick_time = np.sort(np.asarray(self.lick_onsets, dtype=np.float64))
+        i0 = int(np.searchsorted(self.time, start))
+        span = _nominal_duration(trial) + self.agent.reaction_time_s + 1.0
+        while True:
+            i1 = int(np.searchsorted(self.time, start + span, side="right"))
+            replayed = replay_trial(self._force(i0, i1), lick_time, trial, start)
+            if replayed.is_replayed or i1 >= len(self.time):
+                return replayed
+            span *= 2
+
+    def _log(self, number: int, trial: Trial, replayed: ReplayedTrial) -> None:
+        selected = {h.action.value: h for h in (trial.left_harvest, trial.right_harvest) if h is not None}.get(
+            replayed.selected_action
+        )
+        is_timeout = selected is None and not np.isnan(replayed.response_period_start_time)
+        outcome_action = selected or (TIMEOUT_ACTION if is_timeout else ABORT_ACTION)
+        events = [(TRIAL_EVENT, replayed.start_time, trial.model_dump(mode="json"))]
+        if trial.quiescence_period is not None:
+            events.append(
+                (QUIESCENCE_PERIOD_EVENT, replayed.start_time, trial.quiescence_period.model_dump(mode="json"))
+            )
+        events += [
+            (
+                INITIATION_PERIOD_EVENT,
+                replayed.initiation_period_start_time,
+                trial.initiation_period.model_dump(mode="json"),
+            ),
+            (RESPONSE_PERIOD_EVENT, replayed.response_period_start_time, trial.response_period.model_dump(mode="json")),
+            (
+                HARVEST_ACTION_SELECTED_EVENT,
+                replayed.harvest_action_selected_time,
+                outcome_action.model_dump(mode="json"),
+            ),
+        ]
+        reward = np.nan
+        if selected is not None and not np.isnan(replayed.reward_time):
+            reward = selected.amount if self.rng.random() < selected.probability else np.nan
+            events.append((GIVE_REWARD_EVENT, replayed.reward_time, reward))
+            self.rewards.append((replayed.reward_time, reward))
+        outcome = {
+            "HarvestAction": outcome_action.model_dump(mode="json"),
+            "TrialNumber": number,
+            "Reward": None if np.isnan(reward) else reward,
+            "IsAborted": replayed.is_aborted,
+        }
+        events.append((TRIAL_OUTCOME_EVENT, replayed.outcome_time, outcome))
+        self.events += [SoftwareEvent(name=n, timestamp=t, data=d) for n, t, d in events if t <= self.end]
+        self.trials.append(replayed)
+
+
+def emulate_session(
+    task_logic: AindForceForagingTaskLogic,
+    rig: AindForceForagingRig,
+    duration_s: float,
+    agent: Agent = Agent(),
+    rate_multiplier: float = 1.0,
+    seed: Optional[int] = None,
+    firmware_version: Tuple[int, int] = DEFAULT_FIRMWARE_VERSION,
+) -> EmulatedSession:
+    """
+    Emulates a session of a task logic on a rig.
+
+    Args:
+        task_logic (AindForceForagingTaskLogic): The task logic. Its trials are run in the order of its environment.
+        rig (AindForceForagingRig): The rig, whose load cells calibration and water valve calibration are applied.
+        duration_s (float): The duration of the session, in seconds.
+        agent (Agent): The subject.
+        rate_multiplier (float): The factor applied to the production rate of the load cells and camera triggers.
+        seed (Optional[int]): The seed of the random number generator.
+        firmware_version (Tuple[int, int]): The firmware version reported by every device.
+
+    Raises:
+        ValueError: If the press mode is `SingleLookupTable`, or a distribution can not be sampled.
+
+    Returns:
+        EmulatedSession: The emulated session.
+    """
+    rng = np.random.default_rng(seed)
+    emulator = _SessionEmulator(
+        task_logic, rig, sample_times(duration_s, LOAD_CELLS_RATE_HZ * rate_multiplier), agent, rng
+    )
+    emulator.run(iter_trials(task_logic.task_parameters.environment, rng))
+    logger.info("Emulated %d trials in %.1f s of session.", len(emulator.trials), duration_s)
+
+    devices = rig_devices(rig)
+    registers = [r for device in devices for r in _device_registers(device, duration_s, firmware_version)]
+    registers.append(
+        RegisterStream(replay.LOAD_CELLS_DEVICE, LOAD_CELL_DATA_ADDRESS, PayloadType.S16, emulator.time, emulator.raw)
+    )
+    frame_rate = rig.triggered_camera_controller.frame_rate
+    if frame_rate:
+        triggers = sample_times(duration_s, frame_rate * rate_multiplier)
+        registers.append(
+            RegisterStream(
+                dataset.CAMERA_TRIGGER_DEVICE,
+                dataset.CAMERA_TRIGGER_ADDRESS,
+                PayloadType.U8,
+                triggers,
+                np.ones(len(triggers), dtype=np.uint8),
+            )
+        )
+    registers.append(_lick_state(np.asarray(emulator.lick_onsets), agent.lick_duration_s))
+    return EmulatedSession(
+        devices=devices,
+        registers=registers,
+        commands=_valve_commands(emulator.rewards, rig),
+        events=sorted(emulator.events, key=_timestamp),
+        trials=pd.DataFrame(
+            emulator.trials,
+            columns=replay.REPLAY_TABLE_COLUMNS,
+            index=pd.RangeIndex(len(emulator.trials), name="trial"),
+        ),
+    )
+
+
+def _device_registers(
+    device: EmulatedDevice, duration_s: float, firmware_version: Tuple[int, int]
+) -> List[RegisterStream]:
+    """The register dump, read when the device is opened, and the heartbeat of a device."""
+    zero = np.zeros(1)
+    heartbeat = sample_times(duration_s, 1.0 / HEARTBEAT_PERIOD_S)
+    return [
+        RegisterStream(
+            device.device, WHO_AM_I_ADDRESS, PayloadType.U16, zero, np.array([device.who_am_i]), MessageType.READ
+        ),
+        RegisterStream(
+            device.device,
+            FIRMWARE_VERSION_HIGH_ADDRESS,
+            PayloadType.U8,
+            zero,
+            np.array([firmware_version[0]]),
+            MessageType.READ,
+        ),
+        RegisterStream(
+            device.device,
+            FIRMWARE_VERSION_LOW_ADDRESS,
+            PayloadType.U8,
+            zero,
+            np.array([firmware_version[1]]),
+            MessageType.READ,
+        ),
+        RegisterStream(
+            device.device, TIMESTAMP_SECONDS_ADDRESS, PayloadType.U32, heartbeat, np.round(heartbeat).astype(np.uint32)
+        ),
+    ]
+
+
+def _lick_state(onset: np.ndarray, lick_duration_s: float) -> RegisterStream:
+    """The `LickState` events of licks on channel 0. A lick ends at the latest when the next one starts."""
+    onset = np.unique(onset)
+    offset = _to_ticks(np.minimum(onset + lick_duration_s, np.append(onset[1:], np.inf)))
+    timestamp = np.column_stack((onset, offset)).reshape(-1)
+    state = np.tile(np.array([1, 0], dtype=np.uint8), len(onset))
+    return RegisterStream(licks.LICKOMETER_DEVICE, licks.LICK_STATE_ADDRESS, PayloadType.U8, timestamp, state)
+
+
+def _valve_commands(rewards: Sequence[Tuple[float, float]], rig: AindForceForagingRig) -> List[RegisterStream]:
+    """The `PulseSupplyPort0` and `OutputSet` writes that open the water valve for every reward given."""
+    calibration = rig.calibration.water_valve if rig.calibration is not None else None
+    if calibration is None or calibration.output is None:
+        logger.warning("The rig has no water valve calibration. Valve commands are not emulated.")
+        return []
+    reward = np.array([r for r in rewards if not np.isnan(r[1])], dtype=np.float64).reshape(-1, 2)
+    time = _to_ticks(reward[:, 0])
+    open_time_ms = np.round((reward[:, 1] - calibration.output.offset) / calibration.output.slope * 1e3)
+    return [
+        RegisterStream(
+            water.BEHAVIOR_DEVICE,
+            water.PULSE_SUPPLY_PORT0_ADDRESS,
+            PayloadType.U16,
+            time,
+            np.clip(open_time_ms, 0, np.iinfo(np.uint16).max).astype(np.uint16),
+            MessageType.WRITE,
+        ),
+        RegisterStream(
+            water.BEHAVIOR_DEVICE,
+            water.OUTPUT_SET_ADDRESS,
+            PayloadType.U16,
+            time,
+            np.full(len(time), water.SUPPLY_PORT0, dtype=np.uint16),
+            MessageType.WRITE,
+        ),
+    ]
+
+
+def write_session(
+    emulated: EmulatedSession,
+    session_path: os.PathLike,
+    inputs: Sequence[BaseModel] = (),
+) -> Path:
+    """
+    Writes an emulated session with the layout of an acquired session. As on the rig, registers without
+    messages have no file.
+
+    Args:
+        emulated (EmulatedSession): The emulated session.
+        session_path (os.PathLike): The session directory.
+        inputs (Sequence[BaseModel]): The rig, session and task logic the session was emulated with, saved
+            as the input files of the session.
+
+    Returns:
+        Path: The session directory.
+    """
+    session_path = Path(session_path)
+    harp_device_names = {d.device: d.harp_device_name for d in emulated.devices}
+    for register in (r for r in emulated.registers if len(r)):
+        path = dataset.harp_register_file(
+            session_path, register.device, register.address, harp_device_names[register.device]
+        )
+        _write_register(path, register)
+    for command in (c for c in emulated.commands if len(c)):
+        _write_register(dataset.harp_command_file(session_path, command.device, command.address), command)
+
+    filenames = {
+        AindForceForagingRig: dataset.RIG_INPUT,
+        AindBehaviorSessionModel: dataset.SESSION_INPUT,
+        AindForceForagingTaskLogic: dataset.TASK_LOGIC_INPUT,
+    }
+    logs = session_path / dataset.BEHAVIOR_DIR / dataset.LOGS_DIR
+    logs.mkdir(parents=True, exist_ok=True)
+    for model in inputs:
+        (logs / filenames[type(model)]).write_text(model.model_dump_json(indent=2), encoding="utf-8")
+
+    events_dir = session_path / dataset.BEHAVIOR_DIR / dataset.SOFTWARE_EVENTS_DIR
+    events_dir.mkdir(parents=True, exist_ok=True)
+    by_name: Dict[str, List[SoftwareEvent]] = {}
+    for event in emulated.events:
+        by_name.setdefault(event.name, []).append(event)
+    for name, events in by_name.items():
+        with open(events_dir / f"{name}.json", "w", encoding="utf-8") as f:
+            f.writelines(event.model_dump_json(by_alias=True) + "\n" for event in events)
+    return session_path
+
+
+def _write_register(path: Path, register: RegisterStream) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        for start in range(0, len(register), _ROWS_PER_CHUNK):
+            f.write(register.encode(start, start + _ROWS_PER_CHUNK))
+
+
+def device_stream(emulated: EmulatedSession, device: str) -> DeviceStream:
+    """
+    Interleaves the messages of every register of a device in time order, as the device sends them.
+    The register dump comes first.
+    """
+    registers = [r for r in emulated.registers if r.device == device and len(r)]
+    if not registers:
+        return DeviceStream(timestamp=np.empty(0), data=np.empty(0, dtype=np.uint8), offset=np.zeros(1, dtype=np.int64))
+    buffers = [np.frombuffer(r.encode(), dtype=np.uint8) for r in registers]
+    strides = [len(b) // len(r) for r, b in zip(registers, buffers)]
+    register = np.concatenate([np.full(len(r), k) for k, r in enumerate(registers)])
+    message = np.concatenate([np.arange(len(r)) for r in registers])
+    timestamp = np.concatenate([r.timestamp for r in registers])
+    order = np.argsort(timestamp, kind="stable")
+    register, message = register[order], message[order]
+    offset = np.concatenate(([0], np.cumsum(np.asarray(strides)[register])))
+    # Copied run by run: a dense register, such as the load cells, is only broken up by the sparse ones
+    breaks = np.flatnonzero((register[1:] != register[:-1]) | (message[1:] != message[:-1] + 1)) + 1
+    data = np.empty(offset[-1], dtype=np.uint8)
+    for start, end in zip(np.append(0, breaks).tolist(), np.append(breaks, len(order)).tolist()):
+        k, stride = register[start], strides[register[start]]
+        data[offset[start] : offset[end]] = buffers[k][message[start] * stride : (message[end - 1] + 1) * stride]
+    return DeviceStream(timestamp=timestamp[order], data=data, offset=offset)
+
+
+def stream_device(
+    stream: DeviceStream,
+    write: Callable[[memoryview], Any],
+    speed: float = 1.0,
+    chunk_s: float = DEFAULT_CHUNK_S,
+    stop: Optional[threading.Event] = None,
+    clock: Callable[[], float] = time.monotonic,
+    sleep: Callable[[float], None] = time.sleep,
+) -> StreamStatistics:
+    """
+    Writes the messages of a device on schedule, in chunks of `chunk_s` seconds of session time.
+
+    Args:
+        stream (DeviceStream): The messages of the device.
+        write (Callable[[memoryview], Any]): Writes bytes to the consumer, e.g. `socket.sendall`.
+        speed (float): The speed of the session time relative to the wall clock. `inf` writes
+            as fast as the consumer reads.
+        chunk_s (float): The session time sent in every write.
+        stop (Optional[threading.Event]): Stops streaming once set.
+        clock (Callable[[], float]): The wall clock.
+        sleep (Callable[[float], None]): Waits for a number of seconds.
+
+    Returns:
+        StreamStatistics: The messages and bytes written, and the largest delay of a write past its
+            schedule, which grows when the consumer does not keep up.
+    """
+    if not len(stream):
+        return StreamStatistics(message_count=0, byte_count=0, elapsed_s=0.0, max_lag_s=0.0)
+    first = float(stream.timestamp[0])
+    ends = np.searchsorted(stream.timestamp, np.arange(first, float(stream.timestamp[-1]), chunk_s) + chunk_s, "right")
+    ends = np.unique(np.append(ends, len(stream)))
+    ends = ends[ends > 0]
+    origin = clock()
+    start, max_lag = 0, 0.0
+    for end in ends.tolist():
+        if stop is not None and stop.is_set():
+            break
+        lag = clock() - origin - (float(stream.timestamp[end - 1]) - first) / speed
+        if lag < 0:
+            sleep(-lag)
+        elif np.isfinite(speed):
+            max_lag = max(max_lag, lag)
+        write(memoryview(stream.data[stream.offset[start] : stream.offset[end]]))
+        start = end
+    return StreamStatistics(
+        message_count=start, byte_count=int(stream.offset[start]), elapsed_s=clock() - origin, max_lag_s=max_lag
+    )
+
+
+def open_pty() -> Tuple[int, int, str]:
+    """
+    Opens a pseudo terminal in raw mode, the stand-in for the serial port of a device. POSIX only.
+
+    Returns:
+        Tuple[int, int, str]: The file descriptor the emulator writes to, the file descriptor of the port,
+            which must be kept open while streaming, and the path consumers open as the port name.
+    """
+    import tty
+
+    controller, port = os.openpty()
+    tty.setraw(port)
+    return controller, port, os.ttyname(port)
+
+
+def fd_writer(fd: int) -> Callable[[memoryview], None]:
+    """A writer for `stream_device` that writes to a file descriptor, such as a pty."""
+
+    def write(data: memoryview) -> None:
+        while len(data):
+            data = data[os.write(fd, data) :]
+
+    return write
+
+
+def serve_tcp(
+    stream: DeviceStream, server: socket.socket, speed: float = 1.0, stop: Optional[threading.Event] = None
+) -> StreamStatistics:
+    """Streams a device to the first client that connects to a listening socket."""
+    connection, address = server.accept()
+    logger.info("Streaming to %s.", address)
+    with connection:
+        return stream_device(stream, connection.sendall, speed=speed, stop=stop)
+
+
+def serve_read_requests(
+    emulated: EmulatedSession, device: str, fd: int, stop: threading.Event, poll_s: float = 0.05
+) -> int:
+    """
+    Replies to the READ requests a host writes to a pty with the register dump of a device, as the stand-in
+    for the device when its identity is probed. Requests for other registers are replied with an error.
+    Runs until `stop` is set, or the port is closed.
+
+    Returns:
+        int: The number of requests replied.
+    """
+    import select
+
+    dump = {r.address: r for r in emulated.registers if r.device == device and r.message_type == MessageType.READ}
+    buffer = b""
+    replied = 0
+    while not stop.is_set():
+        if not select.select([fd], [], [], poll_s)[0]:
+            continue
+        try:
+            buffer += os.read(fd, 1 << 12)
+        except OSError:  # The port is closed
+            break
+        registers, trailing_bytes = split_harp_stream(buffer)
+        buffer = buffer[len(buffer) - trailing_bytes :]
+        for address, messages in registers.items():
+            offset = 0
+            while offset < len(messages):
+                if messages[offset] == MessageType.READ:
+                    fd_writer(fd)(memoryview(_read_reply(dump, address, messages[offset + 4])))
+                    replied += 1
+                offset += messages[offset + 1] + 2
+    return replied
+
+
+def _read_reply(dump: Dict[int, RegisterStream], address: int, payload_type: int) -> bytes:
+    if address in dump:
+        return dump[address].encode()
+    payload_type = PayloadType(payload_type & ~HAS_TIMESTAMP)
+    return encode_harp_messages(address, [0], payload_type, np.zeros(1), MessageType.READ | ERROR_FLAG)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Emulate the Harp devices of a rig running a task logic")
+    parser.add_argument("--rig", type=Path, required=True, help="Path to the rig json")
+    parser.add_argument("--task-logic", type=Path, required=True, help="Path to the task logic json")
+    parser.add_argument("--session", type=Path, default=None, help="Optional path to the session json")
+    parser.add_argument("--duration", type=float, default=600.0, help="Session duration, in seconds")
+    parser.add_argument("--rate-multiplier", type=float, default=1.0, help="Factor on the production sample rates")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed")
+    parser.add_argument("--speed", type=float, default=1.0, help="Streaming speed relative to real time")
+    parser.add_argument("--delay", type=float, default=5.0, help="Seconds to wait for consumers before streaming")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--output", type=Path, help="Write the session to this directory")
+    mode.add_argument("--pty", action="store_true", help="Stream every device to its own pty")
+    mode.add_argument("--tcp", type=int, metavar="PORT", help="Stream every device to a TCP port, from PORT up")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    rig = AindForceForagingRig.model_validate_json(args.rig.read_text(encoding="utf-8"))
+    task_logic = AindForceForagingTaskLogic.model_validate_json(args.task_logic.read_text(encoding="utf-8"))
+    emulated = emulate_session(task_logic, rig, args.duration, rate_multiplier=args.rate_multiplier, seed=args.seed)
+    if args.output is not None:
+        inputs: List[BaseModel] = [rig, task_logic]
+        if args.session is not None:
+            inputs.append(AindBehaviorSessionModel.model_validate_json(args.session.read_text(encoding="utf-8")))
+        write_session(emulated, args.output, inputs)
+        print(f"Wrote {len(emulated.trials)} trials to {args.output}")
+        return 0
+    return _stream_devices(emulated, args)
+
+
+def _stream_devices(emulated: EmulatedSession, args: argparse.Namespace) -> int:
+    """Streams every device in its own thread, to a pty or a TCP port."""
+    stop = threading.Event()
+    results: Dict[str, StreamStatistics] = {}
+    descriptors: List[int] = []
+    servers: List[socket.socket] = []
+    threads: List[threading.Thread] = []
+    for i, device in enumerate(emulated.devices):
+        stream = device_stream(emulated, device.device)
+        if args.pty:
+            controller, port, name = open_pty()
+            descriptors += [controller, port]
+            print(f"{device.device}: {name}")
+            target = functools.partial(_stream_after, args.delay, stream, fd_writer(controller), args.speed, stop)
+        else:
+            servers.append(socket.create_server(("127.0.0.1", args.tcp + i)))
+            print(f"{device.device}: 127.0.0.1:{args.tcp + i}")
+            target = functools.partial(serve_tcp, stream, servers[-1], args.speed, stop)
+        threads.append(threading.Thread(target=_store, args=(results, device.device, target), daemon=True))
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
+    except KeyboardInterrupt:
+        stop.set()
+    finally:
+        for server in servers:
+            server.close()
+        for fd in descriptors:
+            os.close(fd)
+    for device, result in results.items():
+        print(
+            f"{device}: {result.message_count} messages, {result.byte_count} bytes in {result.elapsed_s:.1f} s, "
+            f"max lag {result.max_lag_s * 1e3:.1f} ms"
+        )
+    return 0
+
+
+def _stream_after(
+    delay_s: float, stream: DeviceStream, write: Callable[[memoryview], Any], speed: float, stop: threading.Event
+) -> StreamStatistics:
+    if not stop.wait(delay_s):
+        return stream_device(stream, write, speed=speed, stop=stop)
+    return StreamStatistics(message_count=0, byte_count=0, elapsed_s=0.0, max_lag_s=0.0)
+
+
+def _store(results: Dict[str, StreamStatistics], key: str, target: Callable[[], StreamStatistics]) -> None:
+    results[key] = target()
+
+
+def _press_channels(control: ForceOperationControl, action: HarvestActionLabel) -> List[int]:
+    """The load cell channels to press on so that the task sees the force on the side of `action`."""
+    match control.press_mode:
+        case PressMode.DOUBLE:
+            return [control.left_index if action == HarvestActionLabel.LEFT else control.right_index]
+        case PressMode.SINGLE_LEFT:
+            return [control.left_index]
+        case PressMode.SINGLE_RIGHT:
+            return [control.right_index]
+        case _:
+            return [control.left_index, control.right_index]
+
+
+def _channel_calibration(calibration: Optional[LoadCellsCalibrationOutput]) -> Tuple[np.ndarray, np.ndarray]:
+    """The baseline and slope of every channel, as applied by `apply_load_cells_calibration`."""
+    baseline, slope = np.zeros(N_CHANNELS), np.ones(N_CHANNELS)
+    for channel in calibration.channels if calibration is not None else []:
+        baseline[channel.channel] = int(channel.baseline) if channel.baseline is not None else 0
+        slope[channel.channel] = channel.slope if channel.slope is not None else 1
+    return baseline, slope
+
+
+def _noisy_baseline(n_samples: int, baseline: np.ndarray, noise_sd: float, rng: np.random.Generator) -> np.ndarray:
+    raw = np.empty((n_samples, len(baseline)), dtype=np.int16)
+    for start in range(0, n_samples, _ROWS_PER_CHUNK):
+        chunk = raw[start : start + _ROWS_PER_CHUNK]
+        noise = rng.normal(0.0, noise_sd, chunk.shape) if noise_sd > 0 else 0.0
+        chunk[:] = np.clip(np.round(baseline + noise), np.iinfo(np.int16).min, np.iinfo(np.int16).max)
+    return raw
+
+
+def _nominal_duration(trial: Trial) -> float:
+    """The duration of a trial if the subject acts at once, ignoring the quiescence restarts."""
+    durations = [trial.initiation_period.duration, trial.response_period.duration]
+    if trial.quiescence_period is not None:
+        durations.append(trial.quiescence_period.duration)
+    for harvest in (trial.left_harvest, trial.right_harvest):
+        if harvest is not None and harvest.time_to_collect is not None:
+            durations.append(harvest.time_to_collect)
+    delays = [h.delay for h in (trial.left_harvest, trial.right_harvest) if h is not None]
+    return float(np.nansum([scalar_or_nan(d) for d in durations]) + max(delays, default=0.0))
+
+
+def _to_ticks(time: np.ndarray) -> np.ndarray:
+    return np.round(np.asarray(time, dtype=np.float64) / SECONDS_PER_TICK) * SECONDS_PER_TICK
+
+
+def _timestamp(event: SoftwareEvent) -> float:
+    return event.timestamp
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+import logging
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+from aind_behavior_services.calibration.load_cells import LoadCellsCalibrationOutput
+
+from aind_behavior_force_foraging.task_logic import ForceLookUpTable, ForceOperationControl, PressMode
+
+logger = logging.getLogger(__name__)
+
+
+class ForceDiagnosis(NamedTuple):
+    """Vectorized counterpart of the `ForceDiagnosis` emitted by `ParseForce.cs`"""
+
+    raw_left_force: np.ndarray
+    raw_right_force: np.ndarray
+    lookup_index_left_force: np.ndarray
+    lookup_index_right_force: np.ndarray
+
+
+class Force(NamedTuple):
+    """Vectorized counterpart of the `Force` emitted by `ParseForce.cs`"""
+
+    left_force: np.ndarray
+    right_force: np.ndarray
+    diagnosis: Optional[ForceDiagnosis] = None
+
+
+def apply_load_cells_calibration(
+    data: np.ndarray, calibration: Optional[LoadCellsCalibrationOutput] = None
+) -> np.ndarray:
+    """
+    Applies a load cells calibration to raw load cell data, mirroring `ApplyLoadCellsCalibration.cs`.
+
+    Args:
+        data (np.ndarray): Raw load cell data with shape (n_samples, n_channels).
+        calibration (Optional[LoadCellsCalibrationOutput]): The calibration to apply. If None,
+            the data is only converted to float.
+
+    Returns:
+        np.ndarray: The calibrated data, `(raw - baseline) * slope` for each calibrated channel.
+    """
+    data = np.array(data, dtype=np.float64, ndmin=2)
+    if calibration is None or len(calibration.channels) == 0:
+        return data
+    baseline = np.zeros(data.shape[1])
+    slope = np.ones(data.shape[1])
+    for channel in calibration.channels:
+        if channel.channel >= data.shape[1]:
+            raise ValueError(f"Calibration channel {channel.channel} is out of range for {data.shape[1]} channels.")
+        # The Bonsai side stores the baseline as an integer
+        baseline[channel.channel] = int(channel.baseline) if channel.baseline is not None else 0
+        slope[channel.channel] = channel.slope if channel.slope is not None else 1
+    data -= baseline
+    data *= slope
+    return data
+
+
+def prepare_lookup_table(image: np.ndarray, force_lookup_table: ForceLookUpTable) -> np.ndarray:
+    """
+    Scales and offsets a look up table image the same way the Bonsai workflow does before handing it to `ParseForce`.
+
+    Args:
+        image (np.ndarray): Single channel look up table image. Value = LUT[Left, Right].
+        force_lookup_table (ForceLookUpTable): The look up table settings.
+
+    Returns:
+        np.ndarray: The look up table as a float array.
+    """
+    image = np.asarray(image)
+    if image.ndim != 2:
+        raise ValueError("Look up table must have a single channel.")
+    if image.shape[0] < 2 or image.shape[1] < 2:
+        raise ValueError("Look up table must be at least 2x2.")
+    return image.astype(np.float64) * force_lookup_table.scale + force_lookup_table.offset
+
+
+def lookup_table_indices(
+    left_force: np.ndarray, right_force: np.ndarray, force_lookup_table: ForceLookUpTable, shape: Tuple[int, int]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Rescales left and right forces to the sub-pixel coordinates of a look up table, clamped to its bounds.
+    These are the `LookUpIndexLeftForce` and `LookUpIndexRightForce` of the `ForceDiagnosis` in `ParseForce.cs`.
+
+    Args:
+        left_force (np.ndarray): Left force samples.
+        right_force (np.ndarray): Right force samples.
+        force_lookup_table (ForceLookUpTable): The look up table bounds.
+        shape (Tuple[int, int]): The (height, width) of the look up table. Left force indexes rows.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The left and right coordinates, in [0, height] and [0, width].
+    """
+    if force_lookup_table.left_min >= force_lookup_table.left_max:
+        raise ValueError("Minimum must be strictly lower than maximum.")
+    if force_lookup_table.right_min >= force_lookup_table.right_max:
+        raise ValueError("Minimum must be strictly lower than maximum.")
+    height, width = shape
+    lut = force_lookup_table
+    left = _rescale(np.asarray(left_force, dtype=np.float64), lut.left_min, lut.left_max, 0, height)
+    right = _rescale(np.asarray(right_force, dtype=np.float64), lut.right_min, lut.right_max, 0, width)
+    return np.clip(left, 0, height), np.clip(right, 0, width)
+
+
+def lookup_table_force(
+    left_force: np.ndarray,
+    right_force: np.ndarray,
+    force_lookup_table: ForceLookUpTable,
+    lookup_table: np.ndarray,
+) -> Force:
+    """
+    Projects left and right forces through a look up table using sub-pixel bilinear interpolation.
+    This is a vectorized port of `SubPixelBilinearInterpolator.LookUp` in `ParseForce.cs`.
+
+    Args:
+        left_force (np.ndarray): Left force samples.
+        right_force (np.ndarray): Right force samples.
+        force_lookup_table (ForceLookUpTable): The look up table bounds.
+        lookup_table (np.ndarray): The prepared look up table (see `prepare_lookup_table`).
+
+    Returns:
+        Force: The projected force, repeated on both sides, and the diagnosis.
+    """
+    left_force = np.asarray(left_force, dtype=np.float64)
+    right_force = np.asarray(right_force, dtype=np.float64)
+    height, width = lookup_table.shape
+    index_left, index_right = lookup_table_indices(left_force, right_force, force_lookup_table, (height, width))
+
+    idx_left = index_left.astype(np.intp)
+    idx_right = index_right.astype(np.intp)
+    d_left = index_left - idx_left
+    d_right = index_right - idx_right
+    idx_left = np.minimum(idx_left, height - 2)
+    idx_right = np.minimum(idx_right, width - 2)
+
+    p00 = lookup_table[idx_left, idx_right]
+    p01 = lookup_table[idx_left, idx_right + 1]
+    p10 = lookup_table[idx_left + 1, idx_right]
+    p11 = lookup_table[idx_left + 1, idx_right + 1]
+    force = (
+        p00 * (1 - d_right) * (1 - d_left)
+        + p01 * d_right * (1 - d_left)
+        + p10 * (1 - d_right) * d_left
+        + p11 * d_right * d_left
+    )
+    diagnosis = ForceDiagnosis(
+        raw_left_force=left_force,
+        raw_right_force=right_force,
+        lookup_index_left_force=index_left,
+        lookup_index_right_force=index_right,
+    )
+    return Force(left_force=force, right_force=force.copy(), diagnosis=diagnosis)
+
+
+def parse_force(
+    data: np.ndarray,
+    force_operation_control: ForceOperationControl,
+    lookup_table: Optional[np.ndarray] = None,
+) -> Force:
+    """
+    Solves the press mode of calibrated load cell data, mirroring `ParseForce.cs`.
+
+    Args:
+        data (np.ndarray): Calibrated load cell data with shape (n_samples, n_channels).
+        force_operation_control (ForceOperationControl): The force operation control settings.
+        lookup_table (Optional[np.ndarray]): The prepared look up table. Required in `SingleLookupTable` mode.
+
+    Returns:
+        Force: The left and right force after applying the press mode.
+    """
+    data = np.asarray(data, dtype=np.float64)
+    left = data[:, force_operation_control.left_index]
+    right = data[:, force_operation_control.right_index]
+    match force_operation_control.press_mode:
+        case PressMode.DOUBLE:
+            return Force(left_force=left.copy(), right_force=right.copy())
+        case PressMode.SINGLE_LEFT:
+            return Force(left_force=left.copy(), right_force=left.copy())
+        case PressMode.SINGLE_RIGHT:
+            return Force(left_force=right.copy(), right_force=right.copy())
+        case PressMode.SINGLE_AVERAGE:
+            value = (left + right) / 2
+        case PressMode.SINGLE_MAX:
+            value = np.maximum(left, right)
+        case PressMode.SINGLE_MIN:
+            value = np.minimum(left, right)
+        case PressMode.SINGLE_LOOKUP_TABLE:
+            if lookup_table is None or force_operation_control.force_lookup_table is None:
+                raise ValueError("Look-up table must be specified for SingleLookupTable mode.")
+            return lookup_table_force(left, right, force_operation_control.force_lookup_table, lookup_table)
+        case _:
+            raise ValueError(f"Unknown press mode {force_operation_control.press_mode}.")
+    return Force(left_force=value, right_force=value.copy())
+
+
+def _rescale(value: np.ndarray, min_from: float, max_from: float, min_to: float, max_to: float) -> np.ndarray:
+    return (value - min_from) / (max_from - min_from) * (max_to - min_to) + min_to
@@ -0,0 +1,271 @@
+import enum
+import logging
+import os
+import struct
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from aind_behavior_force_foraging import dataset
+from aind_behavior_force_foraging.harp_io import read_harp_messages
+from aind_behavior_force_foraging.rig import AindForceForagingRig
+
+logger = logging.getLogger(__name__)
+
+FRAME_INDEX_MAGIC = b"FFFRMIDX"
+FRAME_INDEX_VERSION = 1
+FRAME_INDEX_SUFFIX = ".frame_index.bin"
+
+_HEADER = struct.Struct("<8sHxxQQd")  # magic, version, n_frames, n_triggers, frame_rate
+_HEADER_SIZE = 64
+
+FRAME_DTYPE = np.dtype(
+    [("harp_time", "<f8"), ("trigger_index", "<i8"), ("camera_frame_number", "<i8"), ("flags", "u1")]
+)
+
+_METADATA_COLUMNS = ("ReferenceTime", "CameraFrameNumber")
+
+
+class FrameFlags(enum.IntFlag):
+    NONE = 0
+    DROPPED_BEFORE = 1
+    """One or more camera frames were dropped between the previous frame and this one"""
+    DUPLICATE = 2
+    """The frame repeats the camera frame, or the trigger, of the previous frame"""
+    NO_TRIGGER = 4
+    """No Harp trigger could be matched to the frame"""
+
+
+class FrameIndex:
+    """
+    Maps each video frame to its Harp timestamp and camera trigger. Frame `i` of the video is
+    row `i` of `frames`, and trigger `j` logged by the Harp behavior board is
+    video frame `trigger_frame[j]` (-1 if the frame was dropped).
+    """
+
+    def __init__(self, frames: np.ndarray, trigger_frame: np.ndarray, frame_rate: Optional[float] = None):
+        self.frames = frames
+        self.trigger_frame = trigger_frame
+        self.frame_rate = frame_rate
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    @property
+    def harp_time(self) -> np.ndarray:
+        return self.frames["harp_time"]
+
+    @property
+    def dropped_frame_count(self) -> int:
+        """Number of triggers without a matching video frame."""
+        return int(np.count_nonzero(self.trigger_frame < 0))
+
+    @property
+    def duplicate_frame_count(self) -> int:
+        return int(np.count_nonzero(self.frames["flags"] & FrameFlags.DUPLICATE))
+
+    def frame_at(self, time: float) -> int:
+        """Returns the last frame acquired at, or before, `time`. -1 if `time` precedes the first frame."""
+        return int(np.searchsorted(self.harp_time, time, side="right")) - 1
+
+    def frames_between(self, start: float, stop: float) -> slice:
+        """Returns the slice of video frames acquired in the half-open interval [`start`, `stop`)."""
+        harp_time = self.harp_time
+        return slice(int(np.searchsorted(harp_time, start)), int(np.searchsorted(harp_time, stop)))
+
+    def frame_for_trigger(self, trigger_index: int) -> int:
+        return int(self.trigger_frame[trigger_index])
+
+    def save(self, path: os.PathLike) -> None:
+        """Writes the index as a binary sidecar file."""
+        header = _HEADER.pack(
+            FRAME_INDEX_MAGIC,
+            FRAME_INDEX_VERSION,
+            len(self.frames),
+            len(self.trigger_frame),
+            self.frame_rate if self.frame_rate is not None else np.nan,
+        )
+        with open(path, "wb") as f:
+            f.write(header.ljust(_HEADER_SIZE, b"\x00"))
+            f.write(np.ascontiguousarray(self.frames, dtype=FRAME_DTYPE).tobytes())
+            f.write(np.ascontiguousarray(self.trigger_frame, dtype="<i8").tobytes())
+
+    @classmethod
+    def load(cls, path: os.PathLike, mmap: bool = True) -> "FrameIndex":
+        """
+        Reads a binary sidecar file.
+
+        Args:
+            path (os.PathLike): The sidecar file.
+            mmap (bool): If True, the frames are memory mapped instead of read, so opening an index
+                is constant time regardless of the video length. Defaults to True.
+
+        Returns:
+            FrameIndex: The index.
+        """
+        with open(path, "rb") as f:
+            magic, version, n_frames, n_triggers, frame_rate = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != FRAME_INDEX_MAGIC:
+            raise ValueError(f"{path} is not a frame index file.")
+        if version != FRAME_INDEX_VERSION:
+            raise ValueError(f"Unsupported frame index version {version}. Expected {FRAME_INDEX_VERSION}.")
+        trigger_offset = _HEADER_SIZE + n_frames * FRAME_DTYPE.itemsize
+        if mmap:
+            frames = np.memmap(path, dtype=FRAME_DTYPE, mode="r", offset=_HEADER_SIZE, shape=(n_frames,))
+            trigger_frame = np.memmap(path, dtype="<i8", mode="r", offset=trigger_offset, shape=(n_triggers,))
+        else:
+            frames = np.fromfile(path, dtype=FRAME_DTYPE, count=n_frames, offset=_HEADER_SIZE)
+            trigger_frame = np.fromfile(path, dtype="<i8", count=n_triggers, offset=trigger_offset)
+        return cls(frames, trigger_frame, None if np.isnan(frame_rate) else frame_rate)
+
+
+def build_frame_index(
+    metadata: pd.DataFrame,
+    triggers: np.ndarray,
+    frame_rate: Optional[float] = None,
+    tolerance: Optional[float] = None,
+) -> FrameIndex:
+    """
+    Reconciles the frames written by a video writer with the triggers logged by the Harp behavior board.
+
+    Args:
+        metadata (pd.DataFrame): The video frame metadata, one row per written frame, with at least the
+            `ReferenceTime` (Harp time) and `CameraFrameNumber` columns.
+        triggers (np.ndarray): The Harp timestamps of the camera triggers.
+        frame_rate (Optional[float]): The trigger frame rate. Only used to default the `tolerance`.
+        tolerance (Optional[float]): Maximum distance, in seconds, between a frame and its trigger.
+            Defaults to half a trigger period.
+
+    Returns:
+        FrameIndex: The frame index.
+    """
+    missing = [c for c in _METADATA_COLUMNS if c not in metadata.columns]
+    if missing:
+        raise ValueError(f"Frame metadata is missing columns {missing}.")
+    triggers = np.sort(np.asarray(triggers, dtype=np.float64))
+    harp_time = metadata["ReferenceTime"].to_numpy(dtype=np.float64)
+    camera_frame_number = metadata["CameraFrameNumber"].to_numpy(dtype=np.int64)
+    if tolerance is None:
+        if frame_rate:
+            tolerance = 0.5 / frame_rate
+        elif len(triggers) > 1:
+            tolerance = 0.5 * float(np.median(np.diff(triggers)))
+        else:
+            tolerance = np.inf
+
+    frames = np.zeros(len(harp_time), dtype=FRAME_DTYPE)
+    frames["harp_time"] = harp_time
+    frames["camera_frame_number"] = camera_frame_number
+    trigger_index = _nearest(triggers, harp_time, tolerance)
+    frames["trigger_index"] = trigger_index
+
+    flags = np.zeros(len(harp_time), dtype=np.uint8)
+    flags[trigger_index < 0] |= np.uint8(FrameFlags.NO_TRIGGER)
+    step = np.diff(camera_frame_number)
+    flags[1:][step > 1] |= np.uint8(FrameFlags.DROPPED_BEFORE)
+    same_trigger = (np.diff(trigger_index) == 0) & (trigger_index[1:] >= 0)
+    flags[1:][(step == 0) | same_trigger] |= np.uint8(FrameFlags.DUPLICATE)
+    frames["flags"] = flags
+
+    trigger_frame = np.full(len(triggers), -1, dtype=np.int64)
+    first = ~(flags & FrameFlags.DUPLICATE).astype(bool) & (trigger_index >= 0)
+    trigger_frame[trigger_index[first]] = np.flatnonzero(first)
+    return FrameIndex(frames, trigger_frame, frame_rate)
+
+
+def _nearest(reference: np.ndarray, values: np.ndarray, tolerance: float) -> np.ndarray:
+    if len(reference) == 0:
+        return np.full(len(values), -1, dtype=np.int64)
+    right = np.searchsorted(reference, values).clip(0, len(reference) - 1)
+    left = (right - 1).clip(0)
+    nearest = np.where(np.abs(values - reference[left]) <= np.abs(reference[right] - values), left, right)
+    return np.where(np.abs(values - reference[nearest]) <= tolerance, nearest, -1).astype(np.int64)
+
+
+def frame_index_file(metadata_file: os.PathLike) -> Path:
+    """Returns the path of the sidecar that indexes the video described by `metadata_file`."""
+    metadata_file = Path(metadata_file)
+    if metadata_file.name == "metadata.csv":
+        return metadata_file.parent / f"video{FRAME_INDEX_SUFFIX}"
+    return metadata_file.with_suffix(FRAME_INDEX_SUFFIX)
+
+
+def _is_stale(sidecar: Path, metadata_file: Path) -> bool:
+    return not sidecar.exists() or sidecar.stat().st_mtime < metadata_file.stat().st_mtime
+
+
+def read_camera_triggers(session_path: os.PathLike) -> np.ndarray:
+    """Reads the timestamps of the camera triggers logged by the Harp behavior board."""
+    path = dataset.find_harp_register_file(session_path, dataset.CAMERA_TRIGGER_DEVICE, dataset.CAMERA_TRIGGER_ADDRESS)
+    if path is None:
+        raise FileNotFoundError(f"No camera trigger file found in {session_path}.")
+    messages = read_harp_messages(path)
+    return messages.timestamp[messages.is_event & messages.checksum_ok]
+
+
+def load_frame_index(session_path: os.PathLike, camera: str, build_if_stale: bool = True) -> FrameIndex:
+    """
+    Loads the frame index of a camera. If the sidecar does not exist, or is older than the frame
+    metadata, it is (re)built first.
+
+    Args:
+        session_path (os.PathLike): The session directory.
+        camera (str): The camera name, as in `triggered_camera_controller.cameras`.
+        build_if_stale (bool): Whether to (re)build a missing or stale sidecar. Defaults to True.
+
+    Returns:
+        FrameIndex: The memory mapped index.
+    """
+    metadata = dataset.video_metadata_file(session_path, camera)
+    if metadata is None:
+        raise FileNotFoundError(f"No frame metadata found for camera {camera} in {session_path}.")
+    sidecar = frame_index_file(metadata)
+    if _is_stale(sidecar, metadata):
+        if not build_if_stale:
+            raise FileNotFoundError(f"Frame index {sidecar} is missing or out of date.")
+        rig = dataset.read_rig(session_path)
+        frame_rate = rig.triggered_camera_controller.frame_rate if rig is not None else None
+        build_frame_index(pd.read_csv(metadata), read_camera_triggers(session_path), frame_rate).save(sidecar)
+    return FrameIndex.load(sidecar)
+
+
+def build_session_frame_indices(
+    session_path: os.PathLike, rig: Optional[AindForceForagingRig] = None, overwrite: bool = False
+) -> Dict[str, Path]:
+    """
+    Writes the frame index sidecar of every triggered camera of a session.
+
+    Args:
+        session_path (os.PathLike): The session directory.
+        rig (Optional[AindForceForagingRig]): The rig. Defaults to the rig logged in the session.
+        overwrite (bool): Rebuild existing sidecars even if they are up to date. Defaults to False.
+
+    Returns:
+        Dict[str, Path]: The sidecar path of each camera with frame metadata.
+    """
+    rig = rig if rig is not None else dataset.read_rig(session_path)
+    if rig is None:
+        raise FileNotFoundError(f"No rig configuration found in {session_path}.")
+    triggers: Optional[np.ndarray] = None
+    sidecars: Dict[str, Path] = {}
+    for camera in rig.triggered_camera_controller.cameras:
+        metadata = dataset.video_metadata_file(session_path, camera)
+        if metadata is None:
+            logger.warning("No frame metadata found for camera %s in %s.", camera, session_path)
+            continue
+        sidecar = frame_index_file(metadata)
+        if overwrite or _is_stale(sidecar, metadata):
+            triggers = triggers if triggers is not None else read_camera_triggers(session_path)
+            index = build_frame_index(pd.read_csv(metadata), triggers, rig.triggered_camera_controller.frame_rate)
+            index.save(sidecar)
+            logger.info(
+                "Frame index for %s: %d frames, %d dropped, %d duplicated.",
+                camera,
+                len(index),
+                index.dropped_frame_count,
+                index.duplicate_frame_count,
+            )
+        sidecars[camera] = sidecar
+    return sidecars
@@ -0,0 +1,317 @@
+import enum
+import gzip
+import logging
+import os
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_TICK = 32e-6
+HAS_TIMESTAMP = 0x10
+ERROR_FLAG = 0x08
+
+# Core registers, common to every Harp device
+WHO_AM_I_ADDRESS = 0
+FIRMWARE_VERSION_HIGH_ADDRESS = 6
+FIRMWARE_VERSION_LOW_ADDRESS = 7
+TIMESTAMP_SECONDS_ADDRESS = 8  # Also sent as an event every second, the heartbeat of the device
+
+GZIP_SUFFIX = ".gz"
+ZSTD_SUFFIX = ".zst"
+
+_HEADER_SIZE = 5  # MessageType, Length, Address, Port, PayloadType
+_TIMESTAMP_SIZE = 6  # Seconds (U32), Ticks (U16)
+
+
+class MessageType(enum.IntEnum):
+    READ = 1
+    WRITE = 2
+    EVENT = 3
+
+
+class PayloadType(enum.IntEnum):
+    U8 = 0x01
+    S8 = 0x81
+    U16 = 0x02
+    S16 = 0x82
+    U32 = 0x04
+    S32 = 0x84
+    U64 = 0x08
+    S64 = 0x88
+    FLOAT = 0x44
+
+
+_PAYLOAD_DTYPES = {
+    PayloadType.U8: np.dtype(np.uint8),
+    PayloadType.S8: np.dtype(np.int8),
+    PayloadType.U16: np.dtype(np.uint16),
+    PayloadType.S16: np.dtype(np.int16),
+    PayloadType.U32: np.dtype(np.uint32),
+    PayloadType.S32: np.dtype(np.int32),
+    PayloadType.U64: np.dtype(np.uint64),
+    PayloadType.S64: np.dtype(np.int64),
+    PayloadType.FLOAT: np.dtype(np.float32),
+}
+
+
+class HarpMessages(NamedTuple):
+    """Column-wise view of the messages in a single-register Harp binary file."""
+
+    message_type: np.ndarray
+    address: np.ndarray
+    port: np.ndarray
+    payload_type: np.ndarray
+    timestamp: Optional[np.ndarray]
+    payload: np.ndarray
+    checksum_ok: np.ndarray
+    trailing_bytes: int = 0
+
+    def __len__(self) -> int:
+        return len(self.message_type)
+
+    @property
+    def is_event(self) -> np.ndarray:
+        return (self.message_type & ~np.uint8(ERROR_FLAG)) == MessageType.EVENT
+
+    @property
+    def is_error(self) -> np.ndarray:
+        return (self.message_type & ERROR_FLAG) != 0
+
+
+def payload_dtype(payload_type: int) -> np.dtype:
+    """Returns the numpy dtype of a Harp payload type, ignoring the timestamp flag."""
+    try:
+        return _PAYLOAD_DTYPES[PayloadType(payload_type & ~HAS_TIMESTAMP)]
+    except ValueError as e:
+        raise ValueError(f"Unknown payload type {payload_type:#04x}.") from e
+
+
+def parse_harp_messages(buffer: Union[bytes, np.ndarray]) -> HarpMessages:
+    """
+    Parses a buffer of Harp messages that share the same register and payload layout.
+
+    The message stride is inferred from the first message. Messages are not copied, and
+    the checksum of every message is validated, so that a corrupted or misaligned
+    stream can be detected without raising.
+
+    Args:
+        buffer (Union[bytes, np.ndarray]): The raw bytes.
+
+    Returns:
+        HarpMessages: The parsed messages.
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8) if isinstance(buffer, (bytes, bytearray)) else buffer
+    if len(data) < _HEADER_SIZE:
+        empty = np.empty(0, dtype=np.uint8)
+        return HarpMessages(
+            message_type=empty,
+            address=empty,
+            port=empty,
+            payload_type=empty,
+            timestamp=np.empty(0),
+            payload=np.empty((0, 0), dtype=np.uint8),
+            checksum_ok=np.empty(0, dtype=bool),
+            trailing_bytes=len(data),
+        )
+
+    stride = int(data[1]) + 2
+    n_rows = len(data) // stride
+    trailing_bytes = len(data) - n_rows * stride
+    rows = data[: n_rows * stride].reshape(n_rows, stride)
+
+    checksum_ok = (rows[:, :-1].sum(axis=1, dtype=np.uint64) & 0xFF).astype(np.uint8) == rows[:, -1]
+    payload_type = int(data[4])
+    offset = _HEADER_SIZE
+    timestamp = None
+    if payload_type & HAS_TIMESTAMP:
+        seconds = np.ndarray(n_rows, dtype=np.uint32, buffer=rows, offset=offset, strides=stride)
+        ticks = np.ndarray(n_rows, dtype=np.uint16, buffer=rows, offset=offset + 4, strides=stride)
+        timestamp = seconds + ticks * SECONDS_PER_TICK
+        offset += _TIMESTAMP_SIZE
+
+    dtype = payload_dtype(payload_type)
+    payload_size = stride - offset - 1
+    payload = np.ndarray(
+        (n_rows, payload_size // dtype.itemsize),
+        dtype=dtype,
+        buffer=rows,
+        offset=offset,
+        strides=(stride, dtype.itemsize),
+    )
+    return HarpMessages(
+        message_type=rows[:, 0],
+        address=rows[:, 2],
+        port=rows[:, 3],
+        payload_type=rows[:, 4],
+        timestamp=timestamp,
+        payload=payload,
+        checksum_ok=checksum_ok,
+        trailing_bytes=trailing_bytes,
+    )
+
+
+def split_harp_stream(buffer: Union[bytes, bytearray, memoryview]) -> Tuple[Dict[int, bytes], int]:
+    """
+    Splits the messages sent by a device on its serial port, interleaving every register, by register.
+    The messages of every register can then be parsed at once with `parse_harp_messages`.
+
+    Args:
+        buffer (Union[bytes, bytearray, memoryview]): The raw bytes, starting at a message boundary.
+
+    Returns:
+        Tuple[Dict[int, bytes], int]: The messages of every register address, and the number of trailing
+            bytes of an incomplete message, to be prepended to the next buffer. Splitting stops at the
+            first message too short to be valid, which is left in the trailing bytes.
+    """
+    view = memoryview(buffer)
+    messages: Dict[int, List[memoryview]] = {}
+    offset = 0
+    while offset + 2 <= len(view):
+        end = offset + view[offset + 1] + 2
+        if end > len(view) or end < offset + _HEADER_SIZE + 1:
+            break
+        messages.setdefault(view[offset + 2], []).append(view[offset:end])
+        offset = end
+    return {address: b"".join(chunks) for address, chunks in messages.items()}, len(view) - offset
+
+
+def _read_zstd(path: os.PathLike) -> bytes:
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError(f"Reading {path} requires the 'zstandard' package.") from e
+    with open(path, "rb") as f:
+        return zstandard.ZstdDecompressor().stream_reader(f).readall()
+
+
+def _read_gzip(path: os.PathLike) -> bytes:
+    with gzip.open(path, "rb") as f:
+        return f.read()
+
+
+_DECOMPRESSORS: Dict[str, Callable[[os.PathLike], bytes]] = {GZIP_SUFFIX: _read_gzip, ZSTD_SUFFIX: _read_zstd}
+COMPRESSED_SUFFIXES = tuple(_DECOMPRESSORS.keys())
+
+
+def read_harp_messages(file: Union[os.PathLike, str, BinaryIO]) -> HarpMessages:
+    """
+    Reads all messages from a single-register Harp binary file. See `parse_harp_messages`.
+    Files compressed by the post-session compression stage (`.gz` or `.zst`) are decompressed in memory.
+
+    Args:
+        file (Union[os.PathLike, str, BinaryIO]): The file path or open binary file.
+
+    Returns:
+        HarpMessages: The parsed messages.
+    """
+    if isinstance(file, (str, os.PathLike)) and Path(file).suffix in _DECOMPRESSORS:
+        return parse_harp_messages(np.frombuffer(_DECOMPRESSORS[Path(file).suffix](file), dtype=np.uint8))
+    return parse_harp_messages(np.fromfile(file, dtype=np.uint8))
+
+
+def map_harp_file(file: Union[os.PathLike, str]) -> np.ndarray:
+    """
+    Returns the raw bytes of a single-register Harp binary file, memory mapped, so that ranges of messages
+    can be parsed with `parse_harp_messages` without reading the whole file. Compressed files are
+    decompressed in memory.
+    """
+    path = Path(file)
+    if path.suffix in _DECOMPRESSORS:
+        return np.frombuffer(_DECOMPRESSORS[path.suffix](path), dtype=np.uint8)
+    if path.stat().st_size == 0:
+        return np.empty(0, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode="r")
+
+
+class HarpRegisterReader:
+    """
+    Random access to the valid events of a single-register Harp binary file. The file is memory mapped
+    (see `map_harp_file`) and scanned once, chunk by chunk, for events with a valid checksum, so that any
+    range of events is then parsed on its own, and memory is bounded by the size of the range.
+
+    Args:
+        file (Union[os.PathLike, str]): The file path.
+        address (Optional[int]): If given, only events of this register are kept.
+        chunk_size (int): The number of messages scanned at a time.
+    """
+
+    def __init__(self, file: Union[os.PathLike, str], address: Optional[int] = None, chunk_size: int = 1_000_000):
+        self._data = map_harp_file(file)
+        self.stride = int(self._data[1]) + 2 if len(self._data) >= 2 else 1
+        rows: List[np.ndarray] = []
+        for start in range(0, len(self._data) // self.stride, chunk_size):
+            messages = self._parse(start, start + chunk_size)
+            valid = messages.is_event & messages.checksum_ok
+            if address is not None:
+                valid &= messages.address == address
+            rows.append(np.flatnonzero(valid) + start)
+        self._rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def read(self, start: int = 0, stop: Optional[int] = None) -> HarpMessages:
+        """Parses the valid events `[start, stop)`."""
+        rows = self._rows[start:stop]
+        if len(rows) == 0:
+            return parse_harp_messages(self._data[:0])
+        messages = self._parse(int(rows[0]), int(rows[-1]) + 1)
+        index = rows - rows[0]
+        return HarpMessages(*(None if field is None else field[index] for field in messages[:-1]), trailing_bytes=0)
+
+    def _parse(self, start: int, stop: int) -> HarpMessages:
+        return parse_harp_messages(self._data[start * self.stride : stop * self.stride])
+
+
+def encode_harp_messages(
+    address: int,
+    payload: Any,
+    payload_type: PayloadType,
+    timestamp: Optional[Any] = None,
+    message_type: MessageType = MessageType.EVENT,
+    port: int = 255,
+) -> bytes:
+    """
+    Encodes one Harp message per row of `payload` into a single buffer.
+
+    Args:
+        address (int): The register address.
+        payload (Any): The payload, with shape (n_messages,) or (n_messages, payload_length).
+        payload_type (PayloadType): The payload type, without the timestamp flag.
+        timestamp (Optional[Any]): Optional timestamps, in seconds, one per message.
+        message_type (MessageType): The message type. Defaults to `MessageType.EVENT`.
+        port (int): The port. Defaults to 255.
+
+    Returns:
+        bytes: The encoded messages.
+    """
+    dtype = payload_dtype(payload_type).newbyteorder("<")
+    payload = np.asarray(payload, dtype=dtype)
+    payload = payload.reshape(len(payload), -1) if payload.ndim > 0 else payload.reshape(1, 1)
+    n_rows = payload.shape[0]
+    fields = [("header", np.uint8, (_HEADER_SIZE,))]
+    if timestamp is not None:
+        fields += [("seconds", "<u4"), ("ticks", "<u2")]
+    fields += [("payload", dtype, (payload.shape[1],)), ("checksum", np.uint8)]
+    messages = np.zeros(n_rows, dtype=np.dtype(fields))
+    messages["header"][:] = [
+        message_type,
+        messages.dtype.itemsize - 2,
+        address,
+        port,
+        payload_type | (HAS_TIMESTAMP if timestamp is not None else 0),
+    ]
+    if timestamp is not None:
+        timestamp = np.asarray(timestamp, dtype=np.float64)
+        seconds = np.floor(timestamp)
+        ticks = np.round((timestamp - seconds) / SECONDS_PER_TICK)
+        overflow = ticks >= 1 / SECONDS_PER_TICK
+        messages["seconds"] = seconds + overflow
+        messages["ticks"] = np.where(overflow, 0, ticks)
+    messages["payload"] = payload
+    raw = messages.view(np.uint8).reshape(n_rows, -1)
+    raw[:, -1] = raw[:, :-1].sum(axis=1, dtype=np.uint64) & 0xFF
+    return raw.tobytes()
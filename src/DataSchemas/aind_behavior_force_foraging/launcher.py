@@ -1,24 +1,141 @@
 import datetime
+import logging
 import os
 from functools import partial
 from pathlib import Path
-from typing import Callable, Optional
+from typing import Callable, Optional, Self
 
 import aind_behavior_experiment_launcher.launcher.behavior_launcher as behavior_launcher
-from aind_behavior_experiment_launcher import resource_monitor
 from aind_behavior_experiment_launcher.apps import BonsaiApp
 from aind_behavior_experiment_launcher.data_transfer import aind_watchdog
 from aind_behavior_services.session import AindBehaviorSessionModel
 
+from aind_behavior_force_foraging.compression import CompressionSettings, post_session_compression_factory
+from aind_behavior_force_foraging.config_library import mirrored_config_library
 from aind_behavior_force_foraging.data_mappers import AindDataMapperWrapper
+from aind_behavior_force_foraging.data_transfer import resumable_data_transfer_factory
+from aind_behavior_force_foraging.preflight import DEFAULT_PROBE_TIMEOUT_S, validate_rig_hardware
 from aind_behavior_force_foraging.rig import AindForceForagingRig
+from aind_behavior_force_foraging.startup import (
+    DEFAULT_CHECK_TIMEOUT_S,
+    STARTUP_PROFILE_FILENAME,
+    StartupProfiler,
+    list_directories,
+    run_checks,
+)
+from aind_behavior_force_foraging.storage import resource_monitor_factory
 from aind_behavior_force_foraging.task_logic import AindForceForagingTaskLogic
+from aind_behavior_force_foraging.telemetry import TelemetrySampler, telemetry_sampler_factory
+
+logger = logging.getLogger(__name__)
+
+
+class ForceForagingLauncher(behavior_launcher.BehaviorLauncher):
+    """
+    Behavior launcher that profiles its startup and runs the independent startup checks concurrently,
+    evaluates the resource monitor again once the rig is selected, probes the Harp devices of the rig
+    concurrently unless hardware validation is skipped, and records resource telemetry while the session runs.
+    """
+
+    def __init__(
+        self,
+        *args,
+        telemetry_sampler_factory: Optional[Callable[[behavior_launcher.BehaviorLauncher], TelemetrySampler]] = None,
+        startup_check_timeout_s: float = DEFAULT_CHECK_TIMEOUT_S,
+        hardware_probe_timeout_s: float = DEFAULT_PROBE_TIMEOUT_S,
+        **kwargs,
+    ) -> None:
+        self.telemetry_sampler_factory = telemetry_sampler_factory
+        self.startup_check_timeout_s = startup_check_timeout_s
+        self.hardware_probe_timeout_s = hardware_probe_timeout_s
+        self.startup_profiler = StartupProfiler()
+        with self.startup_profiler.phase("init"):
+            super().__init__(*args, **kwargs)
+        logger.info(self.startup_profiler.report())
+        self.startup_profiler.save(self.temp_dir / STARTUP_PROFILE_FILENAME)
+
+    def _solve_schema_instances(self, *args, **kwargs) -> None:
+        with self.startup_profiler.phase("schema_validation"):
+            super()._solve_schema_instances(*args, **kwargs)
+
+    def _post_init(self, validate: bool = True) -> None:
+        with self.startup_profiler.phase("post_init"):
+            super()._post_init(validate=validate)
+
+    def validate(self) -> None:
+        """Lists the config library concurrently, with a deadline, before running the checks of the base launcher.
+
+        The listing bounds how long an unresponsive share can stall startup, and warms up the
+        directories that the base launcher checks next.
+        """
+        with self.startup_profiler.phase("validate"):
+            results = run_checks(
+                {
+                    f"config_listing:{name}": partial(list_directories, path)
+                    for name, path in (
+                        ("rig", self._rig_dir),
+                        ("subject", self._subject_dir),
+                        ("task_logic", self._task_logic_dir),
+                    )
+                },
+                timeout_s=self.startup_check_timeout_s,
+            )
+            for result in results.values():
+                self.startup_profiler.record(f"check:{result.name}", result.duration_s, result.error)
+            try:
+                for result in results.values():
+                    if result.timed_out:
+                        raise TimeoutError(
+                            f"Startup check {result.name} timed out after {self.startup_check_timeout_s} s."
+                        )
+                    if result.error is not None:
+                        raise RuntimeError(f"Startup check {result.name} failed. {result.error}")
+            except Exception as e:
+                logger.error("Failed to validate dependencies. %s", e)
+                self._exit(-1)
+                raise e
+            with self.startup_profiler.phase("base_checks"):
+                super().validate()
+
+    def _pre_run_hook(self, *args, **kwargs) -> Self:
+        super()._pre_run_hook(*args, **kwargs)
+        if not self.skip_hardware_validation:
+            try:
+                with self.startup_profiler.phase("hardware_validation"):
+                    validate_rig_hardware(self.rig_schema, self.hardware_probe_timeout_s)
+            except RuntimeError as e:
+                logger.error("%s The session will not start.", e)
+                self._exit(-1)
+        monitor = self.services_factory_manager.resource_monitor
+        if monitor is not None and not monitor.evaluate_constraints():
+            logger.error("Resource monitor constraints failed. The session will not start.")
+            self._exit(-1)
+        return self
+
+    def _run_hook(self, *args, **kwargs) -> Self:
+        if self.telemetry_sampler_factory is None:
+            return super()._run_hook(*args, **kwargs)
+        with self.telemetry_sampler_factory(self) as sampler:
+            super()._run_hook(*args, **kwargs)
+        if sampler.alerts:
+            logger.warning("%d resource alerts were raised during the session.", len(sampler.alerts))
+        return self
 
 
 def make_launcher() -> behavior_launcher.BehaviorLauncher:
     use_watchdog = False
+    use_resumable_transfer = False  # Robocopy by default, rigs opt in to the resumable transfer
+    use_compression = False  # Rigs opt in; the originals are kept until the transfer is verified
+    use_config_library_mirror = False
+    # Relative to the working directory, like the other local paths. Resolved now, as the launcher
+    # may change the working directory once it is created.
+    config_library_mirror_dir = Path(r"./local/.config_library").resolve()
+    compression_settings = CompressionSettings()
     data_dir = r"C:/Data"
     remote_dir = Path(r"\\allen\aind\scratch\force-foraging\data")
+    config_library_dir = r"\\allen\aind\scratch\AindBehavior.db\AindForceForaging"
+    if use_config_library_mirror:
+        config_library_dir = mirrored_config_library(config_library_dir, config_library_mirror_dir)
     srv = behavior_launcher.BehaviorServicesFactoryManager()
     srv.attach_bonsai_app(BonsaiApp(r"./src/main.bonsai"))
 
@@ -28,23 +145,26 @@ def make_launcher() -> behavior_launcher.BehaviorLauncher:
             watchdog_data_transfer_factory(remote_dir, project_name="Cognitive flexibility in patch foraging")
         )
     else:
-        srv.attach_data_transfer(behavior_launcher.robocopy_data_transfer_factory(Path(remote_dir)))
+        if use_resumable_transfer:
+            data_transfer_factory = resumable_data_transfer_factory(Path(remote_dir))
+        else:
+            data_transfer_factory = behavior_launcher.robocopy_data_transfer_factory(Path(remote_dir))
+        if use_compression:
+            data_transfer_factory = post_session_compression_factory(data_transfer_factory, compression_settings)
+        srv.attach_data_transfer(data_transfer_factory)
 
     srv.attach_resource_monitor(
-        resource_monitor.ResourceMonitor(
-            constrains=[
-                resource_monitor.available_storage_constraint_factory(data_dir, 2e11),
-                resource_monitor.remote_dir_exists_constraint_factory(Path(remote_dir)),
-            ]
+        resource_monitor_factory(
+            data_dir, Path(remote_dir), duration_s=2 * 3600, compression_settings=compression_settings
         )
     )
 
-    return behavior_launcher.BehaviorLauncher(
+    return ForceForagingLauncher(
         rig_schema_model=AindForceForagingRig,
         session_schema_model=AindBehaviorSessionModel,
         task_logic_schema_model=AindForceForagingTaskLogic,
         data_dir=data_dir,
-        config_library_dir=r"\\allen\aind\scratch\AindBehavior.db\AindForceForaging",
+        config_library_dir=config_library_dir,
         temp_dir=r"./local/.temp",
         allow_dirty=False,
         skip_hardware_validation=False,
@@ -52,6 +172,7 @@ def make_launcher() -> behavior_launcher.BehaviorLauncher:
         group_by_subject_log=True,
         services=srv,
         validate_init=True,
+        telemetry_sampler_factory=telemetry_sampler_factory(data_dir, Path(remote_dir)),
     )
 
 
@@ -0,0 +1,319 @@
+"""Lick bout segmentation and reward collection analysis.
+
+Licks are read from the `LickState` register of the Harp lickometer. A selected harvest action makes
+its reward available `HarvestAction.delay` after the selection. Operant rewards (`HarvestAction.is_operant`)
+are then only given if the subject licks within `HarvestAction.time_to_collect`, so `GiveReward` is logged
+at the collecting lick, and not at all when the reward is missed. Every selection is matched to the first
+lick onset after its reward became available with a single sorted search, so sessions with millions of
+licks are analysed without Python loops.
+"""
+
+import logging
+import os
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+from aind_behavior_services.data_types import SoftwareEvent
+
+from aind_behavior_force_foraging import dataset
+from aind_behavior_force_foraging.harp_io import read_harp_messages
+from aind_behavior_force_foraging.trials import (
+    GIVE_REWARD_EVENT,
+    HARVEST_ACTION_SELECTED_EVENT,
+    TRIAL_EVENT,
+    TRIAL_EVENTS,
+    _get,
+    _to_float,
+)
+
+logger = logging.getLogger(__name__)
+
+LICKOMETER_DEVICE = "Lickometer"
+LICKOMETER_HARP_DEVICE = "LicketySplit"
+LICK_STATE_ADDRESS = 32  # Lickometer LickState, one bit per channel
+
+DEFAULT_MAX_INTER_LICK_INTERVAL = 0.5  # seconds
+SELECTABLE_ACTIONS = ("Left", "Right")  # Timeouts and aborts select the None action
+
+COLLECTION_TABLE_COLUMNS = (
+    "trial",
+    "selection_time",
+    "available_time",
+    "reward_time",
+    "reward_amount",
+    "is_operant",
+    "time_to_collect",
+    "collection_deadline",
+    "collection_time",
+    "collection_latency",
+    "collection_bout",
+    "is_collected",
+    "is_missed",
+)
+
+
+class Licks(NamedTuple):
+    """Lick onset and offset times. Licks that never end have a NaN offset."""
+
+    onset: np.ndarray
+    offset: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.onset)
+
+    @property
+    def duration(self) -> np.ndarray:
+        return self.offset - self.onset
+
+
+class LickBouts(NamedTuple):
+    """Lick bouts, as indices into the `Licks` they were segmented from."""
+
+    start: np.ndarray
+    end: np.ndarray
+    first_lick: np.ndarray
+    lick_count: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+
+def lick_edges(timestamp: np.ndarray, state: np.ndarray, channel: int = 0) -> Licks:
+    """
+    Extracts lick onsets and offsets from the timestamped states of the lickometer.
+
+    Args:
+        timestamp (np.ndarray): The timestamp of each state, in seconds.
+        state (np.ndarray): The `LickState` bitmask.
+        channel (int): The lickometer channel.
+
+    Returns:
+        Licks: The licks of the channel.
+    """
+    is_licking = ((np.asarray(state).astype(np.uint32) >> channel) & 1).astype(bool)
+    was_licking = np.concatenate(([False], is_licking[:-1]))
+    timestamp = np.asarray(timestamp, dtype=np.float64)
+    onset = timestamp[is_licking & ~was_licking]
+    offset = np.full(len(onset), np.nan)
+    # Every offset follows an onset, so only the last lick may be left unpaired
+    ends = timestamp[~is_licking & was_licking]
+    offset[: len(ends)] = ends
+    return Licks(onset=onset, offset=offset)
+
+
+def read_licks(session_path: os.PathLike, channel: int = 0) -> Licks:
+    """Reads the licks logged by the lickometer in a session. Returns no licks if the register was not logged."""
+    path = dataset.find_harp_register_file(session_path, LICKOMETER_DEVICE, LICK_STATE_ADDRESS, LICKOMETER_HARP_DEVICE)
+    if path is None:
+        logger.info("No lickometer events found in session %s.", session_path)
+        return Licks(onset=np.empty(0), offset=np.empty(0))
+    messages = read_harp_messages(path)
+    valid = messages.is_event & messages.checksum_ok
+    return lick_edges(messages.timestamp[valid], messages.payload[valid].reshape(-1), channel)
+
+
+def segment_bouts(licks: Licks, max_inter_lick_interval: float = DEFAULT_MAX_INTER_LICK_INTERVAL) -> LickBouts:
+    """
+    Groups licks into bouts. A new bout starts whenever the interval between consecutive
+    lick onsets exceeds `max_inter_lick_interval`.
+
+    Args:
+        licks (Licks): The licks, sorted by onset.
+        max_inter_lick_interval (float): The longest interval between licks of the same bout, in seconds.
+
+    Returns:
+        LickBouts: The bouts. A bout ends at the offset of its last lick, or at its onset if the lick never ended.
+    """
+    n = len(licks)
+    if n == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return LickBouts(start=np.empty(0), end=np.empty(0), first_lick=empty, lick_count=empty)
+    breaks = np.flatnonzero(np.diff(licks.onset) > max_inter_lick_interval) + 1
+    first = np.concatenate(([0], breaks))
+    last = np.concatenate((breaks, [n])) - 1
+    end = licks.offset[last]
+    return LickBouts(
+        start=licks.onset[first],
+        end=np.where(np.isnan(end), licks.onset[last], end),
+        first_lick=first,
+        lick_count=last - first + 1,
+    )
+
+
+def build_collection_table(
+    events: Iterable[SoftwareEvent], licks: Licks, bouts: Optional[LickBouts] = None
+) -> pd.DataFrame:
+    """
+    Matches every selected harvest action to the lick that collected its reward.
+
+    The reward of a selection becomes available `delay` after the `HarvestActionSelected` event, and is
+    collected by the first lick onset after it, provided the lick comes before the collection deadline:
+    the earliest of `time_to_collect` after the reward is available and the start of the next trial.
+    A `time_to_collect` that is not a scalar distribution is not logged with its sampled value, so only
+    the next trial bounds the window. An operant selection without a `GiveReward` before the deadline
+    is missed. Selections of the `None` action, logged for timeouts and aborts, are ignored.
+
+    Args:
+        events (Iterable[SoftwareEvent]): The trial software events of the session. See `trials.build_trial_table`.
+        licks (Licks): The licks, sorted by onset.
+        bouts (Optional[LickBouts]): The bouts of `licks`. If given, the bout of each collecting lick is reported.
+
+    Returns:
+        pd.DataFrame: The collection table, with one row per selected harvest action, in trial order.
+    """
+    names: List[str] = []
+    timestamps: List[float] = []
+    data: List[Any] = []
+    for event in events:
+        if (
+            event.name in (TRIAL_EVENT, HARVEST_ACTION_SELECTED_EVENT, GIVE_REWARD_EVENT)
+            and event.timestamp is not None
+        ):
+            names.append(event.name)
+            timestamps.append(event.timestamp)
+            data.append(event.data)
+    _names = np.asarray(names, dtype=object)
+    _timestamps = np.asarray(timestamps, dtype=np.float64)
+    order = np.argsort(_timestamps, kind="stable")
+    _names, _timestamps = _names[order], _timestamps[order]
+    data = [data[i] for i in order]
+
+    trial_starts = _timestamps[_names == TRIAL_EVENT]
+    trial_index = np.searchsorted(trial_starts, _timestamps, side="right") - 1
+    selection = _last_per_trial(
+        np.flatnonzero((_names == HARVEST_ACTION_SELECTED_EVENT) & (trial_index >= 0)), trial_index
+    )
+    selection = selection[np.array([_get(data[i], "action") in SELECTABLE_ACTIONS for i in selection], dtype=bool)]
+    selection_trial = trial_index[selection]
+    selection_time = _timestamps[selection]
+    selected = [data[i] for i in selection]
+    is_operant = np.array([_get(d, "is_operant") is not False for d in selected], dtype=bool)
+    delay = np.nan_to_num(np.array([_to_float(_get(d, "delay")) for d in selected], dtype=np.float64))
+    time_to_collect = np.array([_time_to_collect(_get(d, "time_to_collect")) for d in selected], dtype=np.float64)
+    available_time = selection_time + delay
+
+    reward_of_trial = np.full(len(trial_starts), -1)
+    reward = _last_per_trial(np.flatnonzero((_names == GIVE_REWARD_EVENT) & (trial_index >= 0)), trial_index)
+    reward_of_trial[trial_index[reward]] = reward
+    reward = reward_of_trial[selection_trial]
+    is_logged = reward >= 0
+    reward_time = np.where(is_logged, _timestamps[reward], np.nan)
+    reward_amount = np.full(len(reward), np.nan)
+    reward_amount[is_logged] = [_to_float(data[i]) for i in reward[is_logged]]
+
+    next_trial_start = np.append(trial_starts, np.inf)[selection_trial + 1]
+    window = np.where(np.isnan(time_to_collect), np.inf, time_to_collect)
+    deadline = np.minimum(available_time + window, next_trial_start)
+
+    first_lick = np.searchsorted(licks.onset, available_time, side="right")
+    collection_time = np.append(licks.onset, np.inf)[first_lick]
+    is_collected = np.isfinite(collection_time) & (collection_time < deadline)
+    collection_time = np.where(is_collected, collection_time, np.nan)
+    is_rewarded = reward_time < deadline
+
+    table = pd.DataFrame(
+        {
+            "trial": selection_trial,
+            "selection_time": selection_time,
+            "available_time": available_time,
+            "reward_time": reward_time,
+            "reward_amount": reward_amount,
+            "is_operant": is_operant,
+            "time_to_collect": time_to_collect,
+            "collection_deadline": deadline,
+            "collection_time": collection_time,
+            "collection_latency": collection_time - available_time,
+            "collection_bout": pd.array([pd.NA] * len(selection_time), dtype="Int64"),
+            "is_collected": is_collected,
+            "is_missed": is_operant & ~is_rewarded,
+        },
+        columns=COLLECTION_TABLE_COLUMNS,
+    )
+    if bouts is not None:
+        table.loc[is_collected, "collection_bout"] = (
+            np.searchsorted(bouts.start, collection_time[is_collected], side="right") - 1
+        )
+    return table
+
+
+def _last_per_trial(indices: np.ndarray, trial_index: np.ndarray) -> np.ndarray:
+    """Keeps the last of `indices`, sorted by time, in every trial."""
+    trial = trial_index[indices]
+    return indices[np.append(trial[1:] != trial[:-1], True)] if len(indices) else indices
+
+
+def collection_by_trial(collection: pd.DataFrame, n_trials: Optional[int] = None) -> pd.DataFrame:
+    """
+    Aggregates a collection table per trial.
+
+    Args:
+        collection (pd.DataFrame): See `build_collection_table`.
+        n_trials (Optional[int]): The number of trials in the session, so that trials without rewards
+            are included. Defaults to the last rewarded trial.
+
+    Returns:
+        pd.DataFrame: Selection, reward, collected and missed counts, and the latency of the first collection,
+            indexed by trial.
+    """
+    if n_trials is None:
+        n_trials = int(collection["trial"].max()) + 1 if len(collection) else 0
+    trial = collection["trial"].to_numpy()
+    latency = collection["collection_latency"].to_numpy()
+    first_latency = np.full(n_trials, np.nan)
+    collected = ~np.isnan(latency)
+    trials, first = np.unique(trial[collected], return_index=True)
+    first_latency[trials] = latency[collected][first]
+    return pd.DataFrame(
+        {
+            "selection_count": np.bincount(trial, minlength=n_trials),
+            "reward_count": np.bincount(
+                trial, weights=collection["reward_time"].notna().to_numpy(), minlength=n_trials
+            ).astype(np.int64),
+            "collected_count": np.bincount(trial, weights=collected, minlength=n_trials).astype(np.int64),
+            "missed_count": np.bincount(trial, weights=collection["is_missed"].to_numpy(), minlength=n_trials).astype(
+                np.int64
+            ),
+            "collection_latency": first_latency,
+        },
+        index=pd.RangeIndex(n_trials, name="trial"),
+    )
+
+
+def summarize_collection(licks: Licks, bouts: LickBouts, collection: pd.DataFrame) -> Dict[str, Any]:
+    """Summarizes the licks and reward collection of a session."""
+    operant = collection["is_operant"].to_numpy(dtype=bool)
+    missed = int(collection["is_missed"].sum())
+    latency = collection["collection_latency"].to_numpy()
+    return {
+        "lick_count": len(licks),
+        "lick_bout_count": len(bouts),
+        "median_licks_per_bout": float(np.median(bouts.lick_count)) if len(bouts) else np.nan,
+        "operant_selection_count": int(operant.sum()),
+        "collected_reward_count": int(collection["is_collected"].sum()),
+        "missed_collection_count": missed,
+        "missed_collection_rate": missed / operant.sum() if operant.any() else np.nan,
+        "median_collection_latency_s": float(np.nanmedian(latency)) if (~np.isnan(latency)).any() else np.nan,
+    }
+
+
+def analyze_session(
+    session_path: os.PathLike,
+    max_inter_lick_interval: float = DEFAULT_MAX_INTER_LICK_INTERVAL,
+    channel: int = 0,
+) -> Dict[str, Any]:
+    """Reads the licks and trial events of a session and summarizes its reward collection."""
+    licks = read_licks(session_path, channel)
+    bouts = segment_bouts(licks, max_inter_lick_interval)
+    events = [e for name in TRIAL_EVENTS for e in dataset.read_software_events(session_path, name)]
+    return summarize_collection(licks, bouts, build_collection_table(events, licks, bouts))
+
+
+def _time_to_collect(distribution: Optional[Dict[str, Any]]) -> float:
+    """Returns the time to collect of a harvest action. Infinite if the reward is available indefinitely,
+    NaN if it was sampled from a distribution."""
+    if distribution is None:
+        return np.inf
+    if _get(distribution, "family") == "Scalar":
+        return _to_float(_get(_get(distribution, "distribution_parameters"), "value"))
+    return np.nan
@@ -0,0 +1,263 @@
+"""Robust fitting of the load cells calibration from reference weight recordings.
+
+Each recording is a `LoadCellData` register file of the Harp load cells, logged while a known
+reference weight rests on one or more channels, after the offsets were set by `calibrateoffset.bonsai`.
+Every channel is fitted with a Huber regression of its median reading against the applied weight,
+solved by iteratively reweighted least squares for all channels at once.
+
+The fitted values follow `ApplyLoadCellsCalibration.cs`, `force = (raw - baseline) * slope`:
+the baseline is the reading at zero weight, in ADC units, and the slope is in grams per ADC unit.
+
+Usage:
+    calibrate-load-cells manifest.csv --output calibration.json [--previous rig_input.json]
+
+The manifest has one row per recording, with the columns `path`, `weight_g` and, optionally,
+`channel`. Rows without a channel apply the weight to every channel.
+"""
+
+import argparse
+import logging
+import os
+import sys
+from pathlib import Path
+from typing import NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from aind_behavior_services.calibration.load_cells import (
+    LoadCellCalibrationOutput,
+    LoadCellsCalibrationOutput,
+    MeasuredWeight,
+)
+
+from aind_behavior_force_foraging.harp_io import read_harp_messages
+from aind_behavior_force_foraging.rig import AindForceForagingRig
+
+logger = logging.getLogger(__name__)
+
+LOAD_CELL_DATA_ADDRESS = 33  # LoadCells LoadCellData, one S16 per channel
+N_CHANNELS = 8
+
+HUBER_K = 1.345  # 95% efficiency for normally distributed residuals
+_MAD_TO_SIGMA = 1.4826
+
+
+class LoadCellsFit(NamedTuple):
+    """The fitted calibration of every channel, with the data it was fitted on."""
+
+    channel: np.ndarray
+    baseline: np.ndarray
+    slope: np.ndarray
+    weight_g: np.ndarray
+    reading: np.ndarray
+    residual_g: np.ndarray
+    robust_weight: np.ndarray
+
+    @property
+    def rmse_g(self) -> np.ndarray:
+        return np.sqrt(np.nanmean(self.residual_g**2, axis=0))
+
+    @property
+    def max_abs_residual_g(self) -> np.ndarray:
+        return np.nanmax(np.abs(self.residual_g), axis=0)
+
+
+def read_recording(path: os.PathLike) -> np.ndarray:
+    """Reads the raw load cell data of a recording, with shape (n_samples, n_channels)."""
+    messages = read_harp_messages(path)
+    valid = messages.is_event & messages.checksum_ok & (messages.address == LOAD_CELL_DATA_ADDRESS)
+    return messages.payload[valid].reshape(int(valid.sum()), -1)
+
+
+def summarize_recording(data: np.ndarray) -> np.ndarray:
+    """The reading of every channel in a recording: the median, robust to transients while the weight settles."""
+    return np.median(np.asarray(data, dtype=np.float64), axis=0)
+
+
+def fit_load_cells(
+    weight_g: np.ndarray,
+    reading: np.ndarray,
+    channel: Optional[Sequence[int]] = None,
+    k: float = HUBER_K,
+    max_iterations: int = 50,
+    tolerance: float = 1e-9,
+) -> LoadCellsFit:
+    """
+    Fits the baseline and slope of every channel with a Huber regression of the reading against the weight.
+
+    Args:
+        weight_g (np.ndarray): The applied weight, in grams, with shape (n_recordings, n_channels).
+            NaN marks the channels a recording does not calibrate.
+        reading (np.ndarray): The reading of every channel, in ADC units, with the same shape.
+        channel (Optional[Sequence[int]]): The channel number of every column. Defaults to the column index.
+        k (float): The Huber threshold, in robust standard deviations of the residuals.
+        max_iterations (int): The maximum number of reweighting iterations.
+        tolerance (float): Iterations stop once no coefficient changes by more than this.
+
+    Raises:
+        ValueError: If a channel has fewer than two distinct weights.
+
+    Returns:
+        LoadCellsFit: The fit.
+    """
+    x = np.asarray(weight_g, dtype=np.float64)
+    y = np.asarray(reading, dtype=np.float64)
+    if x.shape != y.shape or x.ndim != 2:
+        raise ValueError(f"Weights {x.shape} and readings {y.shape} must have the same (n_recordings, n_channels).")
+    channel = np.arange(x.shape[1]) if channel is None else np.asarray(channel)
+    valid = ~np.isnan(x) & ~np.isnan(y)
+    distinct = np.array([len(np.unique(x[valid[:, i], i])) for i in range(x.shape[1])])
+    if (distinct < 2).any():
+        raise ValueError(f"Channels {channel[distinct < 2].tolist()} need at least two distinct reference weights.")
+    x, y = np.where(valid, x, 0.0), np.where(valid, y, 0.0)
+
+    w = valid.astype(np.float64)
+    intercept, coef = _weighted_line(x, y, w)
+    for _ in range(max_iterations):
+        residual = np.where(valid, y - (intercept + coef * x), np.nan)
+        scale = _MAD_TO_SIGMA * np.nanmedian(np.abs(residual), axis=0)
+        threshold = k * np.where(scale > 0, scale, np.inf)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            w = np.where(valid, np.minimum(1.0, threshold / np.abs(residual)), 0.0)
+        new_intercept, new_coef = _weighted_line(x, y, w)
+        converged = np.allclose(new_intercept, intercept, rtol=0, atol=tolerance) and np.allclose(
+            new_coef, coef, rtol=0, atol=tolerance
+        )
+        intercept, coef = new_intercept, new_coef
+        if converged:
+            break
+
+    slope = 1.0 / coef
+    residual_g = np.where(valid, (y - intercept) * slope - x, np.nan)
+    return LoadCellsFit(
+        channel=channel,
+        baseline=intercept,
+        slope=slope,
+        weight_g=np.where(valid, x, np.nan),
+        reading=np.where(valid, y, np.nan),
+        residual_g=residual_g,
+        robust_weight=w,
+    )
+
+
+def to_calibration_output(
+    fit: LoadCellsFit, previous: Optional[LoadCellsCalibrationOutput] = None
+) -> LoadCellsCalibrationOutput:
+    """
+    Builds a `LoadCellsCalibrationOutput` from a fit. The offsets, set by `calibrateoffset.bonsai`, are
+    kept from the previous calibration, as are the channels that were not fitted.
+    """
+    channels = {c.channel: c for c in previous.channels} if previous is not None else {}
+    for i, channel in enumerate(fit.channel.tolist()):
+        valid = ~np.isnan(fit.weight_g[:, i])
+        channels[channel] = LoadCellCalibrationOutput(
+            channel=channel,
+            offset=channels[channel].offset if channel in channels else None,
+            baseline=float(fit.baseline[i]),
+            slope=float(fit.slope[i]),
+            weight_lookup=[
+                MeasuredWeight(weight=float(w), baseline=float(r))
+                for w, r in zip(fit.weight_g[valid, i], fit.reading[valid, i])
+            ],
+        )
+    return LoadCellsCalibrationOutput(channels=[channels[c] for c in sorted(channels)])
+
+
+def calibration_report(fit: LoadCellsFit, previous: Optional[LoadCellsCalibrationOutput] = None) -> pd.DataFrame:
+    """
+    Reports the quality of a fit and its drift from the previous calibration.
+
+    Args:
+        fit (LoadCellsFit): The fit.
+        previous (Optional[LoadCellsCalibrationOutput]): The previous calibration of the rig.
+
+    Returns:
+        pd.DataFrame: One row per channel, with the residuals in grams, the number of recordings
+            down-weighted as outliers, and the baseline and relative slope drift.
+    """
+    previous_channels = {c.channel: c for c in previous.channels} if previous is not None else {}
+    previous_baseline = np.array(
+        [_or_nan(getattr(previous_channels.get(c), "baseline", None)) for c in fit.channel.tolist()]
+    )
+    previous_slope = np.array([_or_nan(getattr(previous_channels.get(c), "slope", None)) for c in fit.channel.tolist()])
+    return pd.DataFrame(
+        {
+            "channel": fit.channel,
+            "n_recordings": (~np.isnan(fit.weight_g)).sum(axis=0),
+            "n_outliers": ((fit.robust_weight < 1.0) & ~np.isnan(fit.weight_g)).sum(axis=0),
+            "baseline": fit.baseline,
+            "slope": fit.slope,
+            "rmse_g": fit.rmse_g,
+            "max_abs_residual_g": fit.max_abs_residual_g,
+            "previous_baseline": previous_baseline,
+            "previous_slope": previous_slope,
+            "baseline_drift": fit.baseline - previous_baseline,
+            "slope_drift": (fit.slope - previous_slope) / previous_slope,
+        }
+    )
+
+
+def fit_manifest(manifest: pd.DataFrame, n_channels: int = N_CHANNELS) -> LoadCellsFit:
+    """
+    Fits the recordings listed in a manifest. See the module documentation for its columns.
+
+    Channels with fewer than two distinct reference weights are left out of the fit.
+    """
+    weight_g = np.full((len(manifest), n_channels), np.nan)
+    reading = np.full((len(manifest), n_channels), np.nan)
+    channels = manifest["channel"] if "channel" in manifest else pd.Series([np.nan] * len(manifest))
+    for i, (path, weight, channel) in enumerate(zip(manifest["path"], manifest["weight_g"], channels)):
+        reading[i] = summarize_recording(read_recording(path))[:n_channels]
+        if pd.isna(channel):
+            weight_g[i] = weight
+        else:
+            weight_g[i, int(channel)] = weight
+    distinct = np.array([len(np.unique(column[~np.isnan(column)])) for column in weight_g.T])
+    if ((distinct > 0) & (distinct < 2)).any():
+        logger.warning("Channels %s have a single reference weight and are not fitted.", np.flatnonzero(distinct == 1))
+    fitted = distinct >= 2
+    return fit_load_cells(weight_g[:, fitted], reading[:, fitted], channel=np.flatnonzero(fitted))
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Fit the load cells calibration from reference weight recordings")
+    parser.add_argument("manifest", type=Path, help="csv with the columns path, weight_g and, optionally, channel")
+    parser.add_argument("--output", type=Path, required=True, help="Path to save the LoadCellsCalibrationOutput")
+    parser.add_argument("--previous", type=Path, default=None, help="Rig config with the previous calibration")
+    parser.add_argument("--report", type=Path, default=None, help="Optional path to save the report as csv")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    manifest = pd.read_csv(args.manifest)
+    manifest["path"] = [p if Path(p).is_absolute() else args.manifest.parent / p for p in manifest["path"]]
+    previous: Optional[LoadCellsCalibrationOutput] = None
+    if args.previous is not None:
+        rig = AindForceForagingRig.model_validate_json(args.previous.read_text(encoding="utf-8"))
+        if rig.harp_load_cells.calibration is not None:
+            previous = rig.harp_load_cells.calibration.output
+    fit = fit_manifest(manifest)
+    report = calibration_report(fit, previous)
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(to_calibration_output(fit, previous).model_dump_json(indent=2), encoding="utf-8")
+    if args.report is not None:
+        report.to_csv(args.report, index=False)
+    with pd.option_context("display.max_columns", None, "display.width", None):
+        print(report.to_string(index=False))
+    return 0
+
+
+def _weighted_line(x: np.ndarray, y: np.ndarray, w: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Weighted least squares of `y = intercept + coef * x`, solved independently for every column."""
+    sw = w.sum(axis=0)
+    mx = (w * x).sum(axis=0) / sw
+    my = (w * y).sum(axis=0) / sw
+    coef = (w * (x - mx) * (y - my)).sum(axis=0) / (w * (x - mx) ** 2).sum(axis=0)
+    return my - coef * mx, coef
+
+
+def _or_nan(value: Optional[float]) -> float:
+    return np.nan if value is None else float(value)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
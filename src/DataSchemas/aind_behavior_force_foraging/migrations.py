@@ -0,0 +1,382 @@
+"""Schema-version migrations of task logic and rig documents.
+
+The `version` field of `AindForceForagingTaskLogic` and `AindForceForagingRig` is a `Literal`,
+so documents written with an older schema fail validation as soon as the version moves.
+Every schema bump that changes the serialized form registers a migration that upgrades the
+raw document by one version:
+
+    @TASK_LOGIC_MIGRATIONS.register("0.1.0", "0.2.0")
+    def _rename_spout_settings(document):
+        parameters = document["task_parameters"]
+        parameters["spout"] = parameters.pop("spout_settings")
+        return document
+
+Migrations are chained from the version of the document up to the current version, and
+operate on plain dicts, so they never depend on the models of older schemas.
+`migrate_tree` applies them to every document under a directory, e.g. the archived sessions
+or the config library, in a process pool. The documents of acquired sessions are only rewritten
+in place when asked to, otherwise they are migrated to a separate output directory. The workers receive a copy of `REGISTRIES` when the
+pool starts, and migration functions are sent by reference, so migrations must be module-level
+functions registered when their module is imported.
+"""
+
+import argparse
+import copy
+import json
+import logging
+import multiprocessing.context
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Type
+
+import pandas as pd
+from aind_behavior_services import __version__ as aind_behavior_services_version
+from pydantic import BaseModel
+
+from aind_behavior_force_foraging import dataset, rig, task_logic
+
+logger = logging.getLogger(__name__)
+
+Document = Dict[str, Any]
+MigrationFunction = Callable[[Document], Document]
+
+MIGRATION_REPORT = "migration_report.csv"
+BACKUP_SUFFIX = ".bak"
+# The session inputs, and the task logic and rig directories of the launcher's config library
+DEFAULT_PATTERNS = (dataset.TASK_LOGIC_INPUT, dataset.RIG_INPUT, "TaskLogic/*.json", "Rig/*/*.json")
+
+
+class MigrationError(ValueError):
+    pass
+
+
+class Migration(NamedTuple):
+    from_version: str
+    to_version: str
+    function: MigrationFunction
+
+
+class MigrationResult(NamedTuple):
+    path: str
+    kind: Optional[str]
+    from_version: Optional[str]
+    to_version: Optional[str]
+    status: str
+    error: Optional[str] = None
+
+
+def _version_key(version: str) -> Tuple[int, ...]:
+    try:
+        return tuple(int(part) for part in version.split("."))
+    except (AttributeError, ValueError) as e:
+        raise MigrationError(f"Invalid schema version {version!r}.") from e
+
+
+class MigrationRegistry:
+    """The migrations of a single schema, up to its current version."""
+
+    def __init__(
+        self,
+        kind: str,
+        current_version: str,
+        model: Type[BaseModel],
+        defaults: Optional[Document] = None,
+    ):
+        """
+        Args:
+            kind (str): Name of the schema, e.g. "task_logic".
+            current_version (str): The version of the schema in this package.
+            model (Type[BaseModel]): The model of the current schema.
+            defaults (Optional[Document]): Fields stamped on every migrated document,
+                e.g. the version of a dependency that is a `Literal` in the model.
+        """
+        self.kind = kind
+        self.current_version = current_version
+        self.model = model
+        self.defaults = dict(defaults or {})
+        self._migrations: Dict[str, Migration] = {}
+
+    def register(self, from_version: str, to_version: str) -> Callable[[MigrationFunction], MigrationFunction]:
+        """Registers a function that upgrades a document from `from_version` to `to_version`."""
+        if _version_key(to_version) <= _version_key(from_version):
+            raise MigrationError(f"Migration {from_version} -> {to_version} does not upgrade the {self.kind} schema.")
+        if _version_key(to_version) > _version_key(self.current_version):
+            raise MigrationError(
+                f"Migration {from_version} -> {to_version} is past the current {self.kind} "
+                f"schema {self.current_version}."
+            )
+
+        def decorator(function: MigrationFunction) -> MigrationFunction:
+            if from_version in self._migrations:
+                raise MigrationError(f"A {self.kind} migration from {from_version} is already registered.")
+            self._migrations[from_version] = Migration(from_version, to_version, function)
+            return function
+
+        return decorator
+
+    @property
+    def migrations(self) -> List[Migration]:
+        return sorted(self._migrations.values(), key=lambda m: _version_key(m.from_version))
+
+    def path(self, from_version: str) -> List[Migration]:
+        """Returns the chain of migrations from `from_version` to the current version."""
+        if _version_key(from_version) > _version_key(self.current_version):
+            raise MigrationError(
+                f"{self.kind} schema {from_version} is newer than the current {self.current_version}. "
+                "Update aind_behavior_force_foraging."
+            )
+        chain: List[Migration] = []
+        version = from_version
+        while version != self.current_version:
+            migration = self._migrations.get(version)
+            if migration is None:
+                raise MigrationError(f"No {self.kind} migration from {version} to {self.current_version}.")
+            chain.append(migration)
+            version = migration.to_version
+        return chain
+
+    def migrate(self, document: Document) -> Document:
+        """
+        Upgrades a raw document to the current version. The input is not modified.
+
+        Args:
+            document (Document): The deserialized document.
+
+        Returns:
+            Document: The upgraded document. Documents at the current version are returned as a copy.
+        """
+        if "version" not in document:
+            raise MigrationError(f"The {self.kind} document has no version field.")
+        chain = self.path(document["version"])
+        document = copy.deepcopy(document)
+        for migration in chain:
+            document = migration.function(document)
+            document["version"] = migration.to_version
+        if chain:
+            document.update(self.defaults)
+        return document
+
+    def migrate_and_validate(self, document: Document) -> BaseModel:
+        # Validated from JSON, as when loading a file. Enums are only coerced from strings in JSON mode.
+        return self.model.model_validate_json(json.dumps(self.migrate(document)))
+
+
+TASK_LOGIC_MIGRATIONS = MigrationRegistry("task_logic", task_logic.__version__, task_logic.AindForceForagingTaskLogic)
+RIG_MIGRATIONS = MigrationRegistry(
+    "rig",
+    rig.__version__,
+    rig.AindForceForagingRig,
+    defaults={"aind_behavior_services_pkg_version": aind_behavior_services_version},
+)
+REGISTRIES: Dict[str, MigrationRegistry] = {
+    TASK_LOGIC_MIGRATIONS.kind: TASK_LOGIC_MIGRATIONS,
+    RIG_MIGRATIONS.kind: RIG_MIGRATIONS,
+}
+_FILENAME_KINDS = {dataset.TASK_LOGIC_INPUT: TASK_LOGIC_MIGRATIONS.kind, dataset.RIG_INPUT: RIG_MIGRATIONS.kind}
+
+
+def _init_worker(registries: Dict[str, MigrationRegistry]) -> None:
+    REGISTRIES.clear()
+    REGISTRIES.update(registries)
+
+
+def detect_kind(path: os.PathLike, document: Any) -> Optional[str]:
+    """Returns the schema of a document from its file name, or from its fields. None if it is neither."""
+    kind = _FILENAME_KINDS.get(Path(path).name)
+    if kind is not None or not isinstance(document, dict):
+        return kind
+    if "task_parameters" in document:
+        return TASK_LOGIC_MIGRATIONS.kind
+    if "rig_name" in document:
+        return RIG_MIGRATIONS.kind
+    return None
+
+
+def migrate_file(
+    path: os.PathLike,
+    output_path: Optional[os.PathLike] = None,
+    validate: bool = True,
+    dry_run: bool = False,
+) -> MigrationResult:
+    """
+    Upgrades a task logic or rig file to the current schema. Failures are reported in the result.
+
+    Args:
+        path (os.PathLike): The document.
+        output_path (Optional[os.PathLike]): Where the upgraded document is written. If None, the
+            file is rewritten in place and the original is kept with a `.bak` suffix.
+        validate (bool): Validate the upgraded document against the current model before writing it.
+        dry_run (bool): Only report what would be migrated.
+
+    Returns:
+        MigrationResult: The result. `status` is one of "migrated", "current", "skipped" or "failed".
+    """
+    path = Path(path)
+    kind, from_version = None, None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            document = json.load(f)
+        kind = detect_kind(path, document)
+        if kind is None:
+            return MigrationResult(str(path), None, None, None, "skipped")
+        registry = REGISTRIES[kind]
+        from_version = document.get("version")
+        if registry.path(from_version) == [] and output_path is None:
+            return MigrationResult(str(path), kind, from_version, from_version, "current")
+        if validate:
+            content = registry.migrate_and_validate(document).model_dump_json(indent=2)
+        else:
+            content = json.dumps(registry.migrate(document), indent=2)
+        if not dry_run:
+            destination = Path(output_path) if output_path is not None else path
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            tmp = destination.with_name(f".{destination.name}.tmp")
+            tmp.write_text(content, encoding="utf-8")
+            if output_path is None:
+                os.replace(path, path.with_name(f"{path.name}.{from_version}{BACKUP_SUFFIX}"))
+            os.replace(tmp, destination)
+        status = "current" if from_version == registry.current_version else "migrated"
+        return MigrationResult(str(path), kind, from_version, registry.current_version, status)
+    except Exception as e:
+        logger.error("Failed to migrate %s. %s", path, e)
+        return MigrationResult(str(path), kind, from_version, None, "failed", f"{type(e).__name__}: {e}")
+
+
+def is_acquired(path: os.PathLike) -> bool:
+    """Whether a document was logged by an acquired session, under `Behavior/Logs`."""
+    path = Path(path)
+    return path.parent.name == dataset.LOGS_DIR and path.parent.parent.name == dataset.BEHAVIOR_DIR
+
+
+def iter_documents(root: os.PathLike, patterns: Sequence[str] = DEFAULT_PATTERNS) -> Iterator[Path]:
+    """Lazily walks `root` for the files matching any of `patterns`."""
+    for directory, _, files in os.walk(root):
+        for name in sorted(files):
+            path = Path(directory) / name
+            if any(path.match(pattern) for pattern in patterns):
+                yield path
+
+
+_ACQUIRED_SKIPPED = "Acquired data is only migrated in place when in_place is set."
+
+
+def _skip_acquired(documents: Iterator[Path], results: List[MigrationResult]) -> Iterator[Path]:
+    for path in documents:
+        if is_acquired(path):
+            results.append(MigrationResult(str(path), None, None, None, "skipped", _ACQUIRED_SKIPPED))
+        else:
+            yield path
+
+
+def migrate_tree(
+    root: os.PathLike,
+    output_dir: Optional[os.PathLike] = None,
+    patterns: Sequence[str] = DEFAULT_PATTERNS,
+    validate: bool = True,
+    dry_run: bool = False,
+    in_place: bool = False,
+    max_workers: Optional[int] = None,
+    mp_context: Optional[multiprocessing.context.BaseContext] = None,
+) -> pd.DataFrame:
+    """
+    Upgrades every task logic and rig document under `root` to the current schema, in a process pool.
+
+    Files are streamed from the directory walk into the pool, with a bounded number of pending
+    files, so the whole tree is never listed up front.
+
+    Args:
+        root (os.PathLike): The directory, e.g. the data directory or the config library.
+        output_dir (Optional[os.PathLike]): If given, every document is written under `output_dir`
+            with the same relative path, and `root` is left untouched. Otherwise files are migrated in place.
+        patterns (Sequence[str]): Glob patterns of the files to consider. Other files are never opened.
+            Defaults to the session inputs and the config library documents.
+        validate (bool): Validate the upgraded documents against the current models.
+        dry_run (bool): Only report what would be migrated.
+        in_place (bool): Allow rewriting the documents of acquired sessions in place. Without an
+            `output_dir`, these documents are otherwise skipped without being read.
+        max_workers (Optional[int]): Number of worker processes. If 1, files are migrated serially.
+        mp_context (Optional[multiprocessing.context.BaseContext]): Context of the worker processes.
+            Defaults to the default context of the platform.
+
+    Returns:
+        pd.DataFrame: One row per file, also saved as `migration_report.csv` in `output_dir`, if given.
+    """
+    root = Path(root)
+
+    def arguments(path: Path) -> Tuple[Path, Optional[Path], bool, bool]:
+        output_path = Path(output_dir) / path.relative_to(root) if output_dir is not None else None
+        return path, output_path, validate, dry_run
+
+    results: List[MigrationResult] = []
+    documents = iter_documents(root, patterns)
+    if output_dir is None and not in_place:
+        documents = _skip_acquired(documents, results)
+    if max_workers == 1:
+        results.extend(migrate_file(*arguments(path)) for path in documents)
+    else:
+        max_pending = 4 * (max_workers or os.cpu_count() or 1)
+        with ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=mp_context, initializer=_init_worker, initargs=(dict(REGISTRIES),)
+        ) as executor:
+            pending = set()
+            for path in documents:
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    results.extend(f.result() for f in done)
+                pending.add(executor.submit(migrate_file, *arguments(path)))
+            results.extend(f.result() for f in pending)
+
+    report = pd.DataFrame(results, columns=MigrationResult._fields).sort_values("path", ignore_index=True)
+    n_acquired = int((report["error"] == _ACQUIRED_SKIPPED).sum())
+    if n_acquired > 0:
+        logger.warning("Skipped %d documents of acquired sessions. Use in_place to migrate them.", n_acquired)
+    if output_dir is not None and not dry_run:
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+        report.to_csv(Path(output_dir) / MIGRATION_REPORT, index=False)
+    counts = report["status"].value_counts().to_dict()
+    logger.info("Migrated documents under %s: %s", root, counts)
+    return report
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Upgrade task logic and rig documents to the current schema")
+    parser.add_argument("root", type=Path, help="Directory with the documents, e.g. the data directory")
+    parser.add_argument("--output", type=Path, default=None, help="Write upgraded copies here instead of in place")
+    parser.add_argument(
+        "--pattern",
+        action="append",
+        default=None,
+        help=f"Glob pattern of the files to migrate. Defaults to {', '.join(DEFAULT_PATTERNS)}",
+    )
+    parser.add_argument(
+        "--in-place",
+        action="store_true",
+        help="Rewrite the documents of acquired sessions in place, keeping the originals as backups",
+    )
+    parser.add_argument("--no-validate", action="store_true", help="Do not validate the upgraded documents")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be migrated")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    report = migrate_tree(
+        args.root,
+        output_dir=args.output,
+        patterns=args.pattern or DEFAULT_PATTERNS,
+        validate=not args.no_validate,
+        dry_run=args.dry_run,
+        in_place=args.in_place,
+        max_workers=args.workers,
+    )
+    failed = report[report["status"] == "failed"]
+    with pd.option_context("display.max_columns", None, "display.width", None, "display.max_colwidth", None):
+        print(report["status"].value_counts().to_string())
+        if len(failed) > 0:
+            print(failed[["path", "error"]].to_string(index=False))
+    return 1 if len(failed) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,412 @@
+"""Export of acquired sessions to NWB.
+
+A session is written as a single NWB file, with every dataset chunked and gzip compressed. The load
+cells, by far the largest stream, are never loaded whole: the Harp file is memory mapped
+(`HarpRegisterReader`) and calibrated and written one chunk at a time by a `GenericDataChunkIterator`,
+so memory is bounded by the chunk size regardless of the session length. All times are Harp times,
+in seconds, as logged.
+
+The task logic and rig are stored as their JSON dump in the `protocol` and `data_collection` fields of
+the file, and the full `HarvestAction` of every trial as JSON in the trial table, next to the scalar
+parameters already in the trial table.
+"""
+
+import argparse
+import functools
+import json
+import logging
+import os
+import sys
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from hdmf.backends.hdf5 import H5DataIO
+from hdmf.common import ElementIdentifiers, VectorData
+from hdmf.data_utils import GenericDataChunkIterator
+from pynwb import NWBHDF5IO, NWBFile, TimeSeries
+from pynwb.epoch import TimeIntervals
+from pynwb.file import Subject
+from pynwb.image import ImageSeries
+
+from aind_behavior_force_foraging import dataset
+from aind_behavior_force_foraging.audio import read_audio_cues
+from aind_behavior_force_foraging.force import apply_load_cells_calibration
+from aind_behavior_force_foraging.frame_index import load_frame_index
+from aind_behavior_force_foraging.harp_io import HarpMessages, HarpRegisterReader
+from aind_behavior_force_foraging.licks import read_licks
+from aind_behavior_force_foraging.load_cells_calibration import LOAD_CELL_DATA_ADDRESS
+from aind_behavior_force_foraging.replay import LOAD_CELLS_DEVICE
+from aind_behavior_force_foraging.rig import AindForceForagingRig
+from aind_behavior_force_foraging.trials import _PERIOD_COLUMNS, TRIAL_EVENT, TRIAL_EVENTS, build_trial_table
+from aind_behavior_force_foraging.water import read_water_deliveries
+
+logger = logging.getLogger(__name__)
+
+NWB_SUFFIX = ".nwb"
+DEFAULT_CHUNK_SIZE = 100_000  # samples
+DEFAULT_COMPRESSION_OPTS = 4  # gzip level
+
+
+class HarpRegisterChunkIterator(GenericDataChunkIterator):
+    """
+    Streams a column of the events of a Harp register to an NWB dataset, one chunk of events at a time.
+
+    Args:
+        reader (HarpRegisterReader): The register.
+        transform (Callable[[HarpMessages], np.ndarray]): Maps a range of events to the rows of the
+            dataset, e.g. `harp_timestamps`.
+        chunk_size (int): The number of events read, and written as an HDF5 chunk, at a time.
+    """
+
+    def __init__(
+        self,
+        reader: HarpRegisterReader,
+        transform: Callable[[HarpMessages], np.ndarray],
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ):
+        if len(reader) == 0:
+            raise ValueError("Can not stream a register without events.")
+        self._reader = reader
+        self._transform = transform
+        sample = transform(reader.read(0, 1))
+        self._sample_shape, self._sample_dtype = sample.shape[1:], sample.dtype
+        shape = (min(chunk_size, len(reader)), *self._sample_shape)
+        super().__init__(buffer_shape=shape, chunk_shape=shape)
+
+    def _get_data(self, selection: Tuple[slice, ...]) -> np.ndarray:
+        rows = selection[0]
+        return self._transform(self._reader.read(rows.start, rows.stop))[(slice(None), *selection[1:])]
+
+    def _get_maxshape(self) -> Tuple[int, ...]:
+        return (len(self._reader), *self._sample_shape)
+
+    def _get_dtype(self) -> np.dtype:
+        return self._sample_dtype
+
+
+def harp_timestamps(messages: HarpMessages) -> np.ndarray:
+    return messages.timestamp
+
+
+def calibrated_load_cells(calibration: Any, messages: HarpMessages) -> np.ndarray:
+    return apply_load_cells_calibration(messages.payload.reshape(len(messages), -1), calibration)
+
+
+def _compressed(data: Any, compression_opts: int) -> Any:
+    if not isinstance(data, GenericDataChunkIterator) and len(data) == 0:
+        return data  # HDF5 can not chunk an empty dataset
+    return H5DataIO(data, compression="gzip", compression_opts=compression_opts)
+
+
+def _nwb_column(values: pd.Series) -> np.ndarray:
+    """Converts a trial table column to an HDF5 compatible array. Missing values are NaN, or empty strings."""
+    if values.dtype != object:
+        return values.astype("Float64").to_numpy(dtype=np.float64, na_value=np.nan)
+    present = values.dropna()
+    if present.map(lambda v: isinstance(v, (int, float, np.number))).all():
+        return pd.to_numeric(values, errors="coerce").to_numpy(dtype=np.float64)
+    return np.array(["" if pd.isna(v) else str(v) for v in values], dtype=str)
+
+
+def _harvest_actions(events: Sequence[Any], side: str) -> np.ndarray:
+    trials = sorted((e for e in events if e.name == TRIAL_EVENT and e.timestamp is not None), key=lambda e: e.timestamp)
+    data = [e.data.get(f"{side}_harvest") if isinstance(e.data, dict) else None for e in trials]
+    return np.array(["" if harvest is None else json.dumps(harvest) for harvest in data], dtype=str)
+
+
+def build_trials(events: Sequence[Any], compression_opts: int = DEFAULT_COMPRESSION_OPTS) -> TimeIntervals:
+    """
+    Builds the NWB trial table, a trial ending when the next one starts. The last trial ends at its last
+    logged period, or outcome.
+
+    Args:
+        events (Sequence[Any]): The trial software events of the session.
+        compression_opts (int): The gzip compression level.
+
+    Returns:
+        TimeIntervals: The trials, with every column of `build_trial_table` and the full `HarvestAction` of
+            each side, as JSON.
+    """
+    table = build_trial_table(events)
+    start_time = table["start_time"].to_numpy(dtype=np.float64)
+    stop_time = np.empty(0)
+    if len(table) > 0:
+        last = np.nanmax(table.iloc[-1][["start_time", *_PERIOD_COLUMNS.values()]].to_numpy(dtype=np.float64))
+        stop_time = np.append(start_time[1:], last)
+    columns = {column: _nwb_column(table[column]) for column in table.columns if column != "start_time"}
+    for side in ("left", "right"):
+        columns[f"{side}_harvest_action"] = _harvest_actions(events, side)
+    return _intervals("trials", "Force foraging trials", start_time, stop_time, compression_opts, **columns)
+
+
+def _intervals(
+    name: str,
+    description: str,
+    start_time: np.ndarray,
+    stop_time: np.ndarray,
+    compression_opts: int = DEFAULT_COMPRESSION_OPTS,
+    **columns: np.ndarray,
+) -> TimeIntervals:
+    """Builds a table of intervals column-wise, with every column compressed."""
+    columns = {"start_time": start_time, "stop_time": stop_time, **columns}
+    return TimeIntervals(
+        name=name,
+        description=description,
+        columns=[
+            VectorData(name=column, description=column.replace("_", " "), data=_compressed(data, compression_opts))
+            for column, data in columns.items()
+        ],
+        id=ElementIdentifiers(name="id", data=np.arange(len(start_time))),
+    )
+
+
+def add_load_cells(
+    nwbfile: NWBFile,
+    session_path: os.PathLike,
+    rig: AindForceForagingRig,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    compression_opts: int = DEFAULT_COMPRESSION_OPTS,
+) -> None:
+    """
+    Adds the load cells, streamed chunk by chunk, to the acquisition of `nwbfile`. Channels are calibrated
+    with the load cells calibration of the rig, if any, and are otherwise exported as raw ADC counts.
+    """
+    path = dataset.find_harp_register_file(session_path, LOAD_CELLS_DEVICE, LOAD_CELL_DATA_ADDRESS)
+    if path is None:
+        logger.warning("No load cells data found in session %s.", session_path)
+        return
+    reader = HarpRegisterReader(path, LOAD_CELL_DATA_ADDRESS)
+    calibration = rig.harp_load_cells.calibration
+    output = calibration.output if calibration is not None else None
+    transform = functools.partial(calibrated_load_cells, output)
+    calibrated = sorted(c.channel for c in output.channels) if output is not None else []
+    if calibrated:
+        description = (
+            f"Load cell channels. Channels {calibrated} are calibrated as (raw - baseline) * slope with the "
+            "load cells calibration of the rig, other channels are raw ADC counts."
+        )
+        unit = "a.u."
+    else:
+        description = "Raw load cell channels. The rig has no load cells calibration."
+        unit = "ADC counts"
+    if len(reader) == 0:
+        data, timestamps = np.empty((0, 0)), np.empty(0)
+    else:
+        data = HarpRegisterChunkIterator(reader, transform, chunk_size)
+        timestamps = HarpRegisterChunkIterator(reader, harp_timestamps, chunk_size)
+    nwbfile.add_acquisition(
+        TimeSeries(
+            name="load_cells",
+            description=description,
+            data=_compressed(data, compression_opts),
+            timestamps=_compressed(timestamps, compression_opts),
+            unit=unit,
+        )
+    )
+
+
+def add_events(
+    nwbfile: NWBFile,
+    session_path: os.PathLike,
+    rig: AindForceForagingRig,
+    compression_opts: int = DEFAULT_COMPRESSION_OPTS,
+) -> None:
+    """Adds the licks, water valve openings and audio cues of a session as intervals of `nwbfile`."""
+    licks = read_licks(session_path)
+    nwbfile.add_time_intervals(_intervals("licks", "Lickometer licks", licks.onset, licks.offset, compression_opts))
+    try:
+        water = read_water_deliveries(session_path, rig.calibration.water_valve)
+    except FileNotFoundError as e:
+        logger.warning("No water valve openings exported for session %s. %s", session_path, e)
+    else:
+        nwbfile.add_time_intervals(
+            _intervals(
+                "water_valve",
+                "Water valve openings, and the volume delivered from the water valve calibration",
+                water.time,
+                water.time + np.nan_to_num(water.open_time_s),
+                compression_opts,
+                volume_ml=water.volume_ml,
+            )
+        )
+    cues = read_audio_cues(session_path)
+    nwbfile.add_time_intervals(
+        _intervals(
+            "audio_cues",
+            "Audio cues played by the speaker",
+            cues.time,
+            cues.time + np.nan_to_num(cues.duration_s),
+            compression_opts,
+            frequency_hz=cues.frequency_hz,
+        )
+    )
+
+
+def add_cameras(
+    nwbfile: NWBFile,
+    session_path: os.PathLike,
+    rig: AindForceForagingRig,
+    output_path: Path,
+    compression_opts: int = DEFAULT_COMPRESSION_OPTS,
+) -> None:
+    """
+    Adds the frame timestamps of every triggered camera to the acquisition of `nwbfile`, as an `ImageSeries`
+    referencing the video file, relative to `output_path`, if it exists, else as the camera frame numbers.
+    """
+    for camera in rig.triggered_camera_controller.cameras:
+        try:
+            frame_index = load_frame_index(session_path, camera)
+        except FileNotFoundError as e:
+            logger.warning("No frames exported for camera %s of session %s. %s", camera, session_path, e)
+            continue
+        timestamps = _compressed(np.array(frame_index.harp_time, dtype=np.float64), compression_opts)
+        video = dataset.video_file(session_path, camera)
+        if video is not None:
+            series = ImageSeries(
+                name=camera,
+                description=f"Video frames of camera {camera}",
+                external_file=[os.path.relpath(video, output_path.parent)],
+                starting_frame=[0],
+                format="external",
+                timestamps=timestamps,
+                unit="n.a.",
+            )
+        else:
+            series = TimeSeries(
+                name=camera,
+                description=f"Camera frame numbers of camera {camera}",
+                data=_compressed(np.array(frame_index.frames["camera_frame_number"]), compression_opts),
+                timestamps=timestamps,
+                unit="frame",
+            )
+        nwbfile.add_acquisition(series)
+
+
+def export_session(
+    session_path: os.PathLike,
+    output_path: os.PathLike,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    compression_opts: int = DEFAULT_COMPRESSION_OPTS,
+) -> Path:
+    """
+    Writes a session as an NWB file.
+
+    Args:
+        session_path (os.PathLike): The session directory.
+        output_path (os.PathLike): The NWB file. Overwritten if it exists.
+        chunk_size (int): The number of load cells samples read, and written as an HDF5 chunk, at a time.
+        compression_opts (int): The gzip compression level.
+
+    Raises:
+        FileNotFoundError: If the session, rig or task logic were not logged.
+
+    Returns:
+        Path: The NWB file.
+    """
+    session = dataset.read_session(session_path)
+    rig = dataset.read_rig(session_path)
+    task_logic = dataset.read_task_logic(session_path)
+    if session is None or rig is None or task_logic is None:
+        raise FileNotFoundError(f"Session {session_path} is missing the session, rig or task logic.")
+    output_path = Path(output_path)
+    nwbfile = NWBFile(
+        session_description=session.notes or session.experiment,
+        identifier=str(uuid.uuid4()),
+        session_id=session.session_name,
+        session_start_time=session.date,
+        experimenter=list(session.experimenter),
+        experiment_description=f"{task_logic.name} {task_logic.version}, stage {task_logic.stage_name}",
+        protocol=task_logic.model_dump_json(),
+        data_collection=rig.model_dump_json(),
+        subject=Subject(subject_id=session.subject),
+    )
+    add_load_cells(nwbfile, session_path, rig, chunk_size, compression_opts)
+    add_events(nwbfile, session_path, rig, compression_opts)
+    add_cameras(nwbfile, session_path, rig, output_path, compression_opts)
+    events = [e for e in dataset.read_software_events(session_path) if e.name in TRIAL_EVENTS]
+    nwbfile.trials = build_trials(events, compression_opts)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with NWBHDF5IO(output_path, mode="w") as io:
+        io.write(nwbfile)
+    return output_path
+
+
+def nwb_filename(session_path: os.PathLike) -> str:
+    """
+    Returns the name of the NWB file of a session, `<subject>_<session directory name>.nwb`. The subject
+    is not repeated if the directory name already starts with it, as default session names do.
+    """
+    session = dataset.read_session(session_path)
+    name = Path(session_path).name
+    if session is None or name.startswith(f"{session.subject}_"):
+        return f"{name}{NWB_SUFFIX}"
+    return f"{session.subject}_{name}{NWB_SUFFIX}"
+
+
+def _export(
+    session_path: os.PathLike, output_dir: os.PathLike, kwargs: Dict[str, Any]
+) -> Tuple[Optional[str], Optional[str]]:
+    try:
+        return str(export_session(session_path, Path(output_dir) / nwb_filename(session_path), **kwargs)), None
+    except Exception as e:
+        logger.error("NWB export failed for session %s. %s", session_path, e)
+        return None, f"{type(e).__name__}: {e}"
+
+
+def export_sessions(
+    session_paths: Sequence[os.PathLike], output_dir: os.PathLike, max_workers: Optional[int] = None, **kwargs
+) -> pd.DataFrame:
+    """
+    Exports many sessions, in a process pool, to `output_dir`, one file per session named by `nwb_filename`.
+    Failures are reported in the `error` column of the summary instead of raised.
+
+    Args:
+        session_paths (Sequence[os.PathLike]): The session directories.
+        output_dir (os.PathLike): The output directory.
+        max_workers (Optional[int]): Number of worker processes. Defaults to the number of processors.
+            If 1, sessions are exported serially in the calling process.
+        **kwargs: Passed to `export_session`.
+
+    Returns:
+        pd.DataFrame: One row per session, in the order of `session_paths`, with the NWB file and error.
+    """
+    if max_workers == 1 or len(session_paths) <= 1:
+        results = [_export(path, output_dir, kwargs) for path in session_paths]
+    else:
+        n = len(session_paths)
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_export, session_paths, [output_dir] * n, [kwargs] * n))
+    return pd.DataFrame(
+        [(str(path), output, error) for path, (output, error) in zip(session_paths, results)],
+        columns=["session", "output", "error"],
+    )
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Export force foraging sessions to NWB")
+    parser.add_argument("sessions", nargs="+", type=Path, help="Session directories")
+    parser.add_argument("--output-dir", type=Path, required=True, help="Directory of the NWB files")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Load cells samples per chunk")
+    parser.add_argument("--compression", type=int, default=DEFAULT_COMPRESSION_OPTS, help="gzip compression level")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    summary = export_sessions(
+        args.sessions,
+        args.output_dir,
+        max_workers=args.workers,
+        chunk_size=args.chunk_size,
+        compression_opts=args.compression,
+    )
+    with pd.option_context("display.max_columns", None, "display.width", None):
+        print(summary.to_string(index=False))
+    return 1 if summary["error"].notna().any() else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
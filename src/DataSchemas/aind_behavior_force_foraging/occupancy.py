@@ -0,0 +1,334 @@
+"""Occupancy and dwell time maps of the force in look up table coordinates.
+
+In `SingleLookupTable` mode, `ParseForce` rescales the left and right forces to coordinates of the look up
+table, reported in its `ForceDiagnosis`. The diagnosis is not logged, so the coordinates are recomputed from
+the logged load cells, with the calibration of the rig and the bounds of the task logic. The load cells file
+is memory mapped (`HarpRegisterReader`) and read chunk by chunk, so memory does not grow with the session.
+Other bounds can be passed instead, to evaluate them on sessions acquired with any press mode.
+
+Every sample is binned on a grid over the look up table, left force on rows and right force on columns,
+and counted (occupancy) and weighted by the interval to the next sample (dwell time). Maps are built for
+the session, and, as a long table of the occupied cells, for every trial. Cohort maps sum session maps,
+which are computed in a process pool and merged as they complete.
+
+Usage:
+    lut-occupancy C:/Data/*/* --lut-shape 256 256 --bins 64 64 --output cohort_occupancy.npz
+"""
+
+import argparse
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from aind_behavior_force_foraging import dataset
+from aind_behavior_force_foraging.force import apply_load_cells_calibration, lookup_table_indices
+from aind_behavior_force_foraging.harp_io import HarpRegisterReader
+from aind_behavior_force_foraging.load_cells_calibration import LOAD_CELL_DATA_ADDRESS
+from aind_behavior_force_foraging.replay import LOAD_CELLS_DEVICE
+from aind_behavior_force_foraging.task_logic import ForceLookUpTable
+from aind_behavior_force_foraging.trials import TRIAL_EVENT, build_trial_table
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1_000_000
+DEFAULT_MAX_DWELL_S = 0.01  # Longer intervals between samples are gaps in the log, not time spent in a cell
+
+OCCUPANCY_TABLE_COLUMNS = ("trial", "left_bin", "right_bin", "sample_count", "dwell_s")
+
+
+class OccupancyMap(NamedTuple):
+    """Sample count and dwell time of every cell of a grid over the look up table, left force on rows."""
+
+    sample_count: np.ndarray
+    dwell_s: np.ndarray
+    clipped_count: int = 0  # Samples clamped to the bounds of the look up table on either side
+
+    @classmethod
+    def empty(cls, bins: Tuple[int, int]) -> "OccupancyMap":
+        return cls(sample_count=np.zeros(bins, dtype=np.int64), dwell_s=np.zeros(bins))
+
+    def merge(self, other: "OccupancyMap") -> "OccupancyMap":
+        if self.sample_count.shape != other.sample_count.shape:
+            raise ValueError(f"Cannot merge maps of {self.sample_count.shape} and {other.sample_count.shape} bins.")
+        return OccupancyMap(
+            sample_count=self.sample_count + other.sample_count,
+            dwell_s=self.dwell_s + other.dwell_s,
+            clipped_count=self.clipped_count + other.clipped_count,
+        )
+
+    @property
+    def clipped_fraction(self) -> float:
+        total = int(self.sample_count.sum())
+        return self.clipped_count / total if total else np.nan
+
+
+class SessionOccupancy(NamedTuple):
+    session: OccupancyMap
+    trials: pd.DataFrame  # OCCUPANCY_TABLE_COLUMNS, one row per occupied cell of every trial
+
+    def trial_map(self, trial: int) -> OccupancyMap:
+        """The dense map of a single trial. Clipped samples are only counted in the session map."""
+        occupancy = OccupancyMap.empty(self.session.sample_count.shape)
+        rows = self.trials[self.trials["trial"] == trial]
+        cells = (rows["left_bin"].to_numpy(), rows["right_bin"].to_numpy())
+        occupancy.sample_count[cells] = rows["sample_count"].to_numpy()
+        occupancy.dwell_s[cells] = rows["dwell_s"].to_numpy()
+        return occupancy
+
+
+class OccupancyAccumulator:
+    """
+    Accumulates the occupancy of force samples fed in chunks, in time order.
+
+    Args:
+        force_lookup_table (ForceLookUpTable): The look up table bounds.
+        lut_shape (Tuple[int, int]): The (height, width) of the look up table image.
+        bins (Optional[Tuple[int, int]]): The grid, in (left, right) cells. Defaults to one cell per pixel.
+        trial_start_times (Optional[np.ndarray]): The sorted start time of every trial. Samples before the
+            first trial are only counted in the session map.
+        max_dwell_s (float): The interval between samples above which the dwell time of a sample is capped.
+    """
+
+    def __init__(
+        self,
+        force_lookup_table: ForceLookUpTable,
+        lut_shape: Tuple[int, int],
+        bins: Optional[Tuple[int, int]] = None,
+        trial_start_times: Optional[np.ndarray] = None,
+        max_dwell_s: float = DEFAULT_MAX_DWELL_S,
+    ) -> None:
+        self.force_lookup_table = force_lookup_table
+        self.lut_shape = (int(lut_shape[0]), int(lut_shape[1]))
+        self.bins = (int(bins[0]), int(bins[1])) if bins is not None else self.lut_shape
+        self.trial_start_times = np.asarray(trial_start_times if trial_start_times is not None else [], dtype=float)
+        self.max_dwell_s = max_dwell_s
+        self._n_cells = self.bins[0] * self.bins[1]
+        self._sample_count = np.zeros(self._n_cells, dtype=np.int64)
+        self._dwell_s = np.zeros(self._n_cells)
+        self._clipped_count = 0
+        self._trial_cells: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        # The last sample of a chunk waits for the next chunk, which starts its interval
+        self._pending: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+
+    def cells(self, left_force: np.ndarray, right_force: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """The flat cell index of every sample, and whether it was clamped to the look up table bounds."""
+        index_left, index_right = lookup_table_indices(left_force, right_force, self.force_lookup_table, self.lut_shape)
+        (height, width), (n_left, n_right) = self.lut_shape, self.bins
+        lut = self.force_lookup_table
+        clipped = (left_force < lut.left_min) | (left_force > lut.left_max)
+        clipped |= (right_force < lut.right_min) | (right_force > lut.right_max)
+        left_bin = np.minimum((index_left * (n_left / height)).astype(np.intp), n_left - 1)
+        right_bin = np.minimum((index_right * (n_right / width)).astype(np.intp), n_right - 1)
+        return left_bin * n_right + right_bin, clipped
+
+    def append(self, time: np.ndarray, left_force: np.ndarray, right_force: np.ndarray) -> None:
+        """Adds a chunk of samples, in force units. Chunks must follow each other in time."""
+        time = np.asarray(time, dtype=np.float64)
+        left_force = np.asarray(left_force, dtype=np.float64)
+        right_force = np.asarray(right_force, dtype=np.float64)
+        if len(time) == 0:
+            return
+        if self._pending is not None:
+            time, left_force, right_force = (
+                np.concatenate(pair) for pair in zip(self._pending, (time, left_force, right_force))
+            )
+        self._pending = (time[-1:], left_force[-1:], right_force[-1:])
+        self._add(time[:-1], left_force[:-1], right_force[:-1], np.diff(time))
+
+    def result(self) -> SessionOccupancy:
+        """The occupancy of every sample appended so far. The dwell time of the last sample is unknown, and zero."""
+        if self._pending is not None:
+            self._add(*self._pending, np.zeros(1))
+            self._pending = None
+        chunks = self._trial_cells or [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0))]
+        keys, sample_count, dwell_s = _sum_by_key(*(np.concatenate(c) for c in zip(*chunks)))
+        self._trial_cells = [(keys, sample_count, dwell_s)]
+        trial, cell = np.divmod(keys, self._n_cells)
+        left_bin, right_bin = np.divmod(cell, self.bins[1])
+        trials = pd.DataFrame(
+            dict(zip(OCCUPANCY_TABLE_COLUMNS, (trial, left_bin, right_bin, sample_count, dwell_s))),
+            columns=list(OCCUPANCY_TABLE_COLUMNS),
+        )
+        session = OccupancyMap(
+            sample_count=self._sample_count.reshape(self.bins).copy(),
+            dwell_s=self._dwell_s.reshape(self.bins).copy(),
+            clipped_count=self._clipped_count,
+        )
+        return SessionOccupancy(session=session, trials=trials)
+
+    def _add(self, time: np.ndarray, left_force: np.ndarray, right_force: np.ndarray, interval: np.ndarray) -> None:
+        dwell = np.clip(interval, 0.0, self.max_dwell_s)
+        cell, clipped = self.cells(left_force, right_force)
+        self._sample_count += np.bincount(cell, minlength=self._n_cells)
+        self._dwell_s += np.bincount(cell, weights=dwell, minlength=self._n_cells)
+        self._clipped_count += int(clipped.sum())
+        trial = np.searchsorted(self.trial_start_times, time, side="right") - 1
+        in_trial = trial >= 0
+        keys = trial[in_trial].astype(np.int64) * self._n_cells + cell[in_trial]
+        self._trial_cells.append(_sum_by_key(keys, np.ones(len(keys), dtype=np.int64), dwell[in_trial]))
+
+
+def _sum_by_key(
+    keys: np.ndarray, sample_count: np.ndarray, dwell_s: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return (
+        unique,
+        np.bincount(inverse, weights=sample_count, minlength=len(unique)).astype(np.int64),
+        np.bincount(inverse, weights=dwell_s, minlength=len(unique)),
+    )
+
+
+def read_lookup_table_shape(path: os.PathLike) -> Tuple[int, int]:
+    """The (height, width) of a look up table image."""
+    try:
+        import cv2
+    except ImportError as e:
+        raise ImportError(f"Reading {path} requires the 'opencv-python' package. Pass the shape instead.") from e
+    image = cv2.imread(str(path), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise FileNotFoundError(f"Look up table image {path} not found.")
+    return image.shape[0], image.shape[1]
+
+
+def session_occupancy(
+    session_path: os.PathLike,
+    lut_shape: Optional[Tuple[int, int]] = None,
+    bins: Optional[Tuple[int, int]] = None,
+    force_lookup_table: Optional[ForceLookUpTable] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    max_dwell_s: float = DEFAULT_MAX_DWELL_S,
+) -> SessionOccupancy:
+    """
+    Computes the look up table occupancy of a session, from its load cells, chunk by chunk.
+
+    Args:
+        session_path (os.PathLike): The session directory.
+        lut_shape (Optional[Tuple[int, int]]): The (height, width) of the look up table. Defaults to the
+            shape of the image referenced by the look up table settings.
+        bins (Optional[Tuple[int, int]]): The grid, in (left, right) cells. Defaults to one cell per pixel.
+        force_lookup_table (Optional[ForceLookUpTable]): The bounds. Defaults to those of the task logic.
+        chunk_size (int): The number of samples processed at a time.
+        max_dwell_s (float): See `OccupancyAccumulator`.
+
+    Raises:
+        FileNotFoundError: If the load cells, rig or task logic were not logged.
+        ValueError: If no look up table bounds are given, or set in the task logic.
+
+    Returns:
+        SessionOccupancy: The session map, and the occupied cells of every trial, by row of the trial table.
+    """
+    path = dataset.find_harp_register_file(session_path, LOAD_CELLS_DEVICE, LOAD_CELL_DATA_ADDRESS)
+    rig = dataset.read_rig(session_path)
+    task_logic = dataset.read_task_logic(session_path)
+    if path is None or rig is None or task_logic is None:
+        raise FileNotFoundError(f"Session {session_path} is missing the load cells data, rig or task logic.")
+    control = task_logic.task_parameters.operation_control.force
+    force_lookup_table = force_lookup_table if force_lookup_table is not None else control.force_lookup_table
+    if force_lookup_table is None:
+        raise ValueError(f"Session {session_path} has no look up table settings.")
+    lut_shape = lut_shape if lut_shape is not None else read_lookup_table_shape(force_lookup_table.path)
+
+    trials = build_trial_table(dataset.read_software_events(session_path, TRIAL_EVENT))
+    accumulator = OccupancyAccumulator(
+        force_lookup_table, lut_shape, bins, trials["start_time"].to_numpy(dtype=np.float64), max_dwell_s
+    )
+    reader = HarpRegisterReader(path, LOAD_CELL_DATA_ADDRESS)
+    calibration = rig.harp_load_cells.calibration
+    calibration = calibration.output if calibration is not None else None
+    for i in range(0, len(reader), chunk_size):
+        messages = reader.read(i, i + chunk_size)
+        chunk = apply_load_cells_calibration(messages.payload.reshape(len(messages), -1), calibration)
+        accumulator.append(messages.timestamp, chunk[:, control.left_index], chunk[:, control.right_index])
+    return accumulator.result()
+
+
+def _session_map(session_path: os.PathLike, kwargs: Dict[str, Any]) -> Tuple[Optional[OccupancyMap], Optional[str]]:
+    try:
+        return session_occupancy(session_path, **kwargs).session, None
+    except Exception as e:
+        logger.error("Occupancy failed for session %s. %s", session_path, e)
+        return None, f"{type(e).__name__}: {e}"
+
+
+def cohort_occupancy(
+    session_paths: Sequence[os.PathLike], max_workers: Optional[int] = None, **kwargs
+) -> Tuple[Optional[OccupancyMap], pd.DataFrame]:
+    """
+    Sums the session maps of many sessions, computed in a process pool. Failures are reported in the
+    `error` column of the summary instead of raised, so that a single broken session does not stop a cohort.
+
+    Args:
+        session_paths (Sequence[os.PathLike]): The session directories.
+        max_workers (Optional[int]): Number of worker processes. Defaults to the number of processors.
+            If 1, sessions are processed serially in the calling process.
+        **kwargs: Passed to `session_occupancy`. Every session must share the same grid.
+
+    Returns:
+        Tuple[Optional[OccupancyMap], pd.DataFrame]: The cohort map, or None if no session succeeded, and a
+            summary table, one row per session, in the order of `session_paths`.
+    """
+    if max_workers == 1 or len(session_paths) <= 1:
+        results = (_session_map(path, kwargs) for path in session_paths)
+        return _merge_sessions(session_paths, results)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return _merge_sessions(session_paths, executor.map(_session_map, session_paths, [kwargs] * len(session_paths)))
+
+
+def _merge_sessions(session_paths: Sequence[os.PathLike], results) -> Tuple[Optional[OccupancyMap], pd.DataFrame]:
+    cohort: Optional[OccupancyMap] = None
+    rows = []
+    for path, (occupancy, error) in zip(session_paths, results):
+        row = {"session": str(path), "sample_count": 0, "dwell_s": 0.0, "clipped_fraction": np.nan, "error": error}
+        if occupancy is not None:
+            cohort = occupancy if cohort is None else cohort.merge(occupancy)
+            row.update(
+                sample_count=int(occupancy.sample_count.sum()),
+                dwell_s=float(occupancy.dwell_s.sum()),
+                clipped_fraction=occupancy.clipped_fraction,
+            )
+        rows.append(row)
+    return cohort, pd.DataFrame(rows, columns=["session", "sample_count", "dwell_s", "clipped_fraction", "error"])
+
+
+def save_occupancy(path: os.PathLike, occupancy: OccupancyMap) -> None:
+    np.savez_compressed(path, **occupancy._asdict())
+
+
+def load_occupancy(path: os.PathLike) -> OccupancyMap:
+    with np.load(path) as f:
+        return OccupancyMap(sample_count=f["sample_count"], dwell_s=f["dwell_s"], clipped_count=int(f["clipped_count"]))
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Look up table occupancy of force foraging sessions")
+    parser.add_argument("sessions", nargs="+", type=Path, help="Session directories")
+    parser.add_argument("--lut-shape", type=int, nargs=2, default=None, help="Height and width of the look up table")
+    parser.add_argument("--bins", type=int, nargs=2, default=None, help="Left and right cells of the grid")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--output", type=Path, default=None, help="Optional path to save the cohort map as npz")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    cohort, summary = cohort_occupancy(
+        args.sessions,
+        max_workers=args.workers,
+        lut_shape=tuple(args.lut_shape) if args.lut_shape else None,
+        bins=tuple(args.bins) if args.bins else None,
+    )
+    with pd.option_context("display.max_columns", None, "display.width", None):
+        print(summary.to_string(index=False))
+    if args.output is not None and cohort is not None:
+        save_occupancy(args.output, cohort)
+        logger.info("Cohort map saved to %s", args.output)
+    return 1 if summary["error"].notna().any() else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
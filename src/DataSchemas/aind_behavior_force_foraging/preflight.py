@@ -0,0 +1,304 @@
+"""Concurrent pre-flight probing of the Harp devices of a rig.
+
+Every device is probed on its own thread, reading its WhoAmI and firmware version with a per-device timeout,
+so that an unplugged or unresponsive device costs one timeout instead of delaying the probe of every other device.
+
+Usage:
+    probe-harp --rig local/rig.json --timeout 2
+"""
+
+import argparse
+import importlib.util
+import logging
+import os
+import select
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import aind_behavior_services.rig as rig
+import numpy as np
+
+from aind_behavior_force_foraging.harp_io import (
+    ERROR_FLAG,
+    FIRMWARE_VERSION_HIGH_ADDRESS,
+    FIRMWARE_VERSION_LOW_ADDRESS,
+    WHO_AM_I_ADDRESS,
+    MessageType,
+    PayloadType,
+    parse_harp_messages,
+    split_harp_stream,
+)
+from aind_behavior_force_foraging.rig import AindForceForagingRig
+from aind_behavior_force_foraging.startup import run_checks
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROBE_TIMEOUT_S = 2.0
+HARP_BAUD_RATE = 1_000_000
+# Opening and writing to a port are not covered by the per-device timeout, only by the deadline of the probe
+OPEN_TIMEOUT_S = 5.0
+
+IDENTITY_REGISTERS: Dict[int, PayloadType] = {
+    WHO_AM_I_ADDRESS: PayloadType.U16,
+    FIRMWARE_VERSION_HIGH_ADDRESS: PayloadType.U8,
+    FIRMWARE_VERSION_LOW_ADDRESS: PayloadType.U8,
+}
+
+
+class DeviceIdentity(NamedTuple):
+    who_am_i: int
+    firmware_version: Tuple[int, int]
+
+
+class DeviceProbe(NamedTuple):
+    name: str
+    port_name: str
+    expected_who_am_i: Optional[int]
+    identity: Optional[DeviceIdentity]
+    duration_s: float
+    error: Optional[str] = None
+    timed_out: bool = False
+
+    @property
+    def ok(self) -> bool:
+        """Whether the device replied, with the WhoAmI of the rig model when it specifies one."""
+        if self.error is not None or self.timed_out or self.identity is None:
+            return False
+        return self.expected_who_am_i is None or self.identity.who_am_i == self.expected_who_am_i
+
+    def describe(self) -> str:
+        if self.timed_out:
+            return f"{self.name} ({self.port_name}): no reply before the probe deadline."
+        if self.error is not None:
+            return f"{self.name} ({self.port_name}): {self.error}"
+        high, low = self.identity.firmware_version
+        status = "ok" if self.ok else f"expected WhoAmI {self.expected_who_am_i}"
+        return f"{self.name} ({self.port_name}): WhoAmI {self.identity.who_am_i}, firmware {high}.{low}, {status}."
+
+
+def read_request(address: int, payload_type: PayloadType) -> bytes:
+    """Encodes a Harp READ request, a message without payload."""
+    message = bytes([MessageType.READ, 4, address, 255, payload_type])
+    return message + bytes([sum(message) & 0xFF])
+
+
+class HarpPort:
+    """
+    The serial port of a Harp device, opened with pyserial when installed, or as a raw POSIX terminal,
+    which also opens pseudo terminals standing in for a device.
+
+    Args:
+        port_name (str): The port name, e.g. "COM3" or "/dev/ttyUSB0".
+    """
+
+    def __init__(self, port_name: str) -> None:
+        self.port_name = port_name
+        self._serial = None
+        self._fd: Optional[int] = None
+        try:
+            import serial
+        except ImportError:
+            serial = None
+        if serial is not None:
+            self._serial = serial.Serial(port_name, HARP_BAUD_RATE, timeout=0)
+            self._serial.reset_input_buffer()
+        elif os.name == "posix":
+            self._fd = _open_raw_terminal(port_name)
+        else:
+            raise ImportError(f"Opening {port_name} requires the 'pyserial' package.")
+
+    def write(self, data: bytes) -> None:
+        if self._serial is not None:
+            self._serial.write(data)
+            return
+        while data:
+            ready = select.select([], [self._fd], [], OPEN_TIMEOUT_S)[1]
+            if not ready:
+                raise TimeoutError(f"Writing to {self.port_name} timed out.")
+            data = data[os.write(self._fd, data) :]
+
+    def read(self, timeout_s: float) -> bytes:
+        """Reads the available bytes, waiting up to `timeout_s` for at least one."""
+        if self._serial is not None:
+            self._serial.timeout = timeout_s
+            return self._serial.read(max(1, self._serial.in_waiting))
+        if not select.select([self._fd], [], [], timeout_s)[0]:
+            return b""
+        return os.read(self._fd, 1 << 12)
+
+    def close(self) -> None:
+        if self._serial is not None:
+            self._serial.close()
+        elif self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self) -> "HarpPort":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def _open_raw_terminal(port_name: str) -> int:
+    import termios
+    import tty
+
+    fd = os.open(port_name, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    try:
+        tty.setraw(fd)
+        if hasattr(termios, "B1000000"):
+            attributes = termios.tcgetattr(fd)
+            attributes[4] = attributes[5] = termios.B1000000
+            termios.tcsetattr(fd, termios.TCSANOW, attributes)
+        termios.tcflush(fd, termios.TCIFLUSH)
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+
+def read_identity(
+    port: HarpPort, timeout_s: float = DEFAULT_PROBE_TIMEOUT_S, clock: Callable[[], float] = time.monotonic
+) -> DeviceIdentity:
+    """
+    Requests the WhoAmI and firmware version of a device, and waits for the replies.
+    Other messages sent by the device meanwhile, such as its heartbeat, are ignored.
+
+    Args:
+        port (HarpPort): The open port of the device.
+        timeout_s (float): How long to wait for every reply, in seconds.
+        clock (Callable[[], float]): The clock, in seconds.
+
+    Returns:
+        DeviceIdentity: The identity of the device.
+
+    Raises:
+        TimeoutError: If a register is not replied within `timeout_s`.
+        RuntimeError: If the device replies to a request with an error.
+    """
+    port.write(b"".join(read_request(address, payload_type) for address, payload_type in IDENTITY_REGISTERS.items()))
+    deadline = clock() + timeout_s
+    values: Dict[int, int] = {}
+    buffer = b""
+    while len(values) < len(IDENTITY_REGISTERS):
+        remaining = deadline - clock()
+        if remaining <= 0:
+            missing = sorted(set(IDENTITY_REGISTERS) - set(values))
+            raise TimeoutError(f"No reply to registers {missing} within {timeout_s} s.")
+        buffer += port.read(remaining)
+        registers, trailing_bytes = split_harp_stream(buffer)
+        buffer = buffer[len(buffer) - trailing_bytes :]
+        for address in IDENTITY_REGISTERS.keys() & registers.keys():
+            replies = parse_harp_messages(registers[address])
+            is_reply = replies.checksum_ok & ((replies.message_type & ~np.uint8(ERROR_FLAG)) == MessageType.READ)
+            if (replies.is_error & is_reply).any():
+                raise RuntimeError(f"The device replied with an error to register {address}.")
+            if is_reply.any():
+                values[address] = int(replies.payload[is_reply][0, 0])
+    return DeviceIdentity(
+        who_am_i=values[WHO_AM_I_ADDRESS],
+        firmware_version=(values[FIRMWARE_VERSION_HIGH_ADDRESS], values[FIRMWARE_VERSION_LOW_ADDRESS]),
+    )
+
+
+def probe_device(port_name: str, timeout_s: float = DEFAULT_PROBE_TIMEOUT_S) -> DeviceIdentity:
+    """Opens the port of a device and reads its identity. See `read_identity`."""
+    with HarpPort(port_name) as port:
+        return read_identity(port, timeout_s)
+
+
+def rig_harp_devices(rig_model: AindForceForagingRig) -> Dict[str, rig.HarpDeviceGeneric]:
+    """The Harp devices configured in a rig, by field name."""
+    devices = {name: getattr(rig_model, name) for name in type(rig_model).model_fields}
+    return {name: device for name, device in devices.items() if isinstance(device, rig.HarpDeviceGeneric)}
+
+
+def probe_rig(
+    rig_model: AindForceForagingRig,
+    timeout_s: float = DEFAULT_PROBE_TIMEOUT_S,
+    probe: Callable[[str, float], DeviceIdentity] = probe_device,
+) -> Dict[str, DeviceProbe]:
+    """
+    Probes every Harp device of a rig concurrently.
+
+    Args:
+        rig_model (AindForceForagingRig): The rig.
+        timeout_s (float): How long to wait for the replies of each device, in seconds.
+        probe (Callable[[str, float], DeviceIdentity]): Reads the identity of the device on a port.
+
+    Returns:
+        Dict[str, DeviceProbe]: The probes, by rig field name.
+    """
+    devices = rig_harp_devices(rig_model)
+    results = run_checks(
+        {name: _bind(probe, device.port_name, timeout_s) for name, device in devices.items()},
+        timeout_s=timeout_s + OPEN_TIMEOUT_S,
+    )
+    return {
+        name: DeviceProbe(
+            name=name,
+            port_name=device.port_name,
+            expected_who_am_i=device.who_am_i,
+            identity=results[name].value,
+            duration_s=results[name].duration_s,
+            error=results[name].error,
+            timed_out=results[name].timed_out,
+        )
+        for name, device in devices.items()
+    }
+
+
+def _bind(
+    probe: Callable[[str, float], DeviceIdentity], port_name: str, timeout_s: float
+) -> Callable[[], DeviceIdentity]:
+    return lambda: probe(port_name, timeout_s)
+
+
+def has_serial_backend() -> bool:
+    """Whether serial ports can be opened, either with pyserial or as raw POSIX terminals."""
+    return importlib.util.find_spec("serial") is not None or os.name == "posix"
+
+
+def validate_rig_hardware(
+    rig_model: AindForceForagingRig, timeout_s: float = DEFAULT_PROBE_TIMEOUT_S
+) -> Dict[str, DeviceProbe]:
+    """
+    Probes every Harp device of a rig, and checks their WhoAmI against the rig model.
+
+    Validation is skipped, with a warning, when no serial backend is available.
+
+    Raises:
+        RuntimeError: If a device does not reply, or is not the device the rig expects.
+    """
+    if not has_serial_backend():
+        logger.warning("Skipping hardware validation. Opening the serial ports requires the 'pyserial' package.")
+        return {}
+    probes = probe_rig(rig_model, timeout_s)
+    failed: List[DeviceProbe] = []
+    for result in probes.values():
+        if result.ok:
+            logger.info(result.describe())
+        else:
+            logger.error(result.describe())
+            failed.append(result)
+    if failed:
+        raise RuntimeError(f"Hardware validation failed for {', '.join(p.name for p in failed)}.")
+    return probes
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Probe the Harp devices of a rig")
+    parser.add_argument("--rig", type=Path, required=True, help="Path to the rig json")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_PROBE_TIMEOUT_S, help="Per-device timeout, in seconds")
+    args = parser.parse_args(argv)
+
+    probes = probe_rig(AindForceForagingRig.model_validate_json(args.rig.read_text(encoding="utf-8")), args.timeout)
+    for result in probes.values():
+        print(f"{result.describe()} ({result.duration_s * 1000:.0f} ms)")
+    return 0 if all(p.ok for p in probes.values()) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
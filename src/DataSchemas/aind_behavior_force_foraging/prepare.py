@@ -0,0 +1,221 @@
+"""Batch session preparation from the subject database.
+
+For the subjects scheduled on a rig, resolves each subject's task logic through the subject
+database, validates it together with the rig, and writes the validated inputs ahead of time:
+
+    <output>/<subject>/rig_input.json
+    <output>/<subject>/tasklogic_input.json
+    <output>/<subject>/session_input.json    # Template. Experimenter, notes and date are set at run time.
+
+Subjects are prepared in a process pool. Running a prepared subject only loads validated files:
+
+    clabe --subject <subject> --rig-path <output>/<subject>/rig_input.json \
+        --task-logic-path <output>/<subject>/tasklogic_input.json
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import pandas as pd
+from aind_behavior_services.db_utils import SubjectDataBase
+from aind_behavior_services.session import AindBehaviorSessionModel
+from aind_behavior_services.utils import model_from_json_file
+
+from aind_behavior_force_foraging import dataset
+from aind_behavior_force_foraging.rig import AindForceForagingRig
+from aind_behavior_force_foraging.task_logic import AindForceForagingTaskLogic
+
+logger = logging.getLogger(__name__)
+
+RIG_DIR = "Rig"
+SUBJECT_DIR = "Subjects"
+TASK_LOGIC_DIR = "TaskLogic"
+PREPARED_MANIFEST = "prepared_sessions.csv"
+
+
+class PreparedSession(NamedTuple):
+    subject: str
+    task_logic_target: Optional[str]
+    directory: Optional[str]
+    error: Optional[str] = None
+
+
+def load_subject_database(path: os.PathLike) -> SubjectDataBase:
+    with open(path, "r", encoding="utf-8") as f:
+        return SubjectDataBase.model_validate_json(f.read())
+
+
+def resolve_rig_file(config_library_dir: os.PathLike, computer_name: Optional[str] = None) -> Path:
+    """Returns the single rig config of a computer in the config library."""
+    computer_name = computer_name if computer_name is not None else os.environ["COMPUTERNAME"]
+    rig_dir = Path(config_library_dir) / RIG_DIR / computer_name
+    available = sorted(rig_dir.glob("*.json"))
+    if len(available) != 1:
+        raise ValueError(f"Expected a single rig config in {rig_dir}, found {len(available)}. Pass the rig explicitly.")
+    return available[0]
+
+
+def prepare_subject(
+    subject: str,
+    task_logic_target: Optional[str],
+    task_logic_dir: os.PathLike,
+    rig_json: str,
+    output_dir: os.PathLike,
+    data_dir: os.PathLike,
+    group_by_subject_log: bool = True,
+) -> PreparedSession:
+    """
+    Validates and writes the inputs of a single subject. Failures are reported in the `error` field.
+
+    Args:
+        subject (str): The subject.
+        task_logic_target (Optional[str]): Name of the task logic file, without extension, from the subject database.
+        task_logic_dir (os.PathLike): The task logic directory of the config library.
+        rig_json (str): The validated rig, serialized.
+        output_dir (os.PathLike): Where the inputs are written, in a directory per subject.
+        data_dir (os.PathLike): The launcher data directory, used for the session root path.
+        group_by_subject_log (bool): Whether sessions are grouped by subject in `data_dir`. Defaults to True.
+
+    Returns:
+        PreparedSession: The result.
+    """
+    try:
+        if task_logic_target is None:
+            raise ValueError(f"Subject {subject} has no task logic target in the subject database.")
+        task_logic_path = Path(task_logic_dir) / f"{task_logic_target}.json"
+        if not task_logic_path.is_file():
+            raise FileNotFoundError(f"Task logic {task_logic_path} not found.")
+        task_logic = model_from_json_file(task_logic_path, AindForceForagingTaskLogic)
+        rig = AindForceForagingRig.model_validate_json(rig_json)
+        root_path = Path(data_dir).resolve()
+        session = AindBehaviorSessionModel(
+            experiment=task_logic.name,
+            experiment_version=task_logic.version,
+            date=datetime.datetime.now(datetime.timezone.utc),
+            root_path=str(root_path / subject if group_by_subject_log else root_path),
+            subject=subject,
+        )
+        directory = Path(output_dir) / subject
+        directory.mkdir(parents=True, exist_ok=True)
+        for name, model in (
+            (dataset.RIG_INPUT, rig),
+            (dataset.TASK_LOGIC_INPUT, task_logic),
+            (dataset.SESSION_INPUT, session),
+        ):
+            tmp = directory / f".{name}.tmp"
+            tmp.write_text(model.model_dump_json(indent=2), encoding="utf-8")
+            os.replace(tmp, directory / name)
+        return PreparedSession(subject, task_logic_target, str(directory))
+    except Exception as e:
+        logger.error("Failed to prepare subject %s. %s", subject, e)
+        return PreparedSession(subject, task_logic_target, None, f"{type(e).__name__}: {e}")
+
+
+def prepare_sessions(
+    config_library_dir: os.PathLike,
+    subject_database: os.PathLike,
+    output_dir: os.PathLike,
+    data_dir: os.PathLike,
+    subjects: Optional[Sequence[str]] = None,
+    rig_path: Optional[os.PathLike] = None,
+    max_workers: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Prepares the inputs of the scheduled subjects in a process pool.
+
+    The rig is validated once, in the calling process, and shared by all subjects.
+
+    Args:
+        config_library_dir (os.PathLike): The config library, or its local mirror.
+        subject_database (os.PathLike): The subject database file. Relative paths are resolved
+            against the `Subjects` directory of the config library.
+        output_dir (os.PathLike): Where the inputs are written.
+        data_dir (os.PathLike): The launcher data directory.
+        subjects (Optional[Sequence[str]]): The subjects scheduled for the day. Defaults to all subjects in the database.
+        rig_path (Optional[os.PathLike]): The rig config. Defaults to the single rig config of this computer.
+        max_workers (Optional[int]): Number of worker processes. If 1, subjects are prepared serially.
+
+    Returns:
+        pd.DataFrame: One row per subject, also saved as `prepared_sessions.csv` in `output_dir`.
+    """
+    config_library_dir = Path(config_library_dir)
+    subject_database = Path(subject_database)
+    if not subject_database.is_absolute() and not subject_database.exists():
+        subject_database = config_library_dir / SUBJECT_DIR / subject_database
+    database = load_subject_database(subject_database)
+    subjects = list(subjects) if subjects is not None else list(database.subjects)
+    unknown = [s for s in subjects if s not in database.subjects]
+    if unknown:
+        raise ValueError(f"Subjects {unknown} are not in the subject database {subject_database}.")
+
+    rig_path = Path(rig_path) if rig_path is not None else resolve_rig_file(config_library_dir)
+    rig_json = model_from_json_file(rig_path, AindForceForagingRig).model_dump_json()
+    targets = [database.subjects[s].task_logic_target if database.subjects[s] is not None else None for s in subjects]
+    task_logic_dir = config_library_dir / TASK_LOGIC_DIR
+    args = [(s, t, task_logic_dir, rig_json, output_dir, data_dir) for s, t in zip(subjects, targets)]
+    if max_workers == 1 or len(args) <= 1:
+        results = [prepare_subject(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(prepare_subject, *zip(*args)))
+
+    summary = pd.DataFrame(results, columns=PreparedSession._fields)
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    summary.to_csv(Path(output_dir) / PREPARED_MANIFEST, index=False)
+    return summary
+
+
+def launch_arguments(prepared: PreparedSession) -> List[str]:
+    """Returns the launcher arguments that run a prepared subject without prompting for the rig and task logic."""
+    if prepared.directory is None:
+        raise ValueError(f"Subject {prepared.subject} was not prepared. {prepared.error}")
+    directory = Path(prepared.directory)
+    return [
+        "--subject",
+        prepared.subject,
+        "--rig-path",
+        str(directory / dataset.RIG_INPUT),
+        "--task-logic-path",
+        str(directory / dataset.TASK_LOGIC_INPUT),
+    ]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Prepare the sessions of the subjects scheduled on this rig")
+    parser.add_argument("subject_database", type=Path, help="Subject database file")
+    parser.add_argument("--config-library", type=Path, required=True, help="Config library directory")
+    parser.add_argument("--output", type=Path, default=Path("./local/prepared"), help="Output directory")
+    parser.add_argument("--data-dir", type=Path, default=Path("C:/Data"), help="Launcher data directory")
+    parser.add_argument("--subjects", nargs="+", default=None, help="Subjects scheduled for the day")
+    parser.add_argument("--rig", type=Path, default=None, help="Rig config. Defaults to the rig of this computer")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    summary = prepare_sessions(
+        args.config_library,
+        args.subject_database,
+        args.output,
+        args.data_dir,
+        subjects=args.subjects,
+        rig_path=args.rig,
+        max_workers=args.workers,
+    )
+    commands: Dict[str, str] = {
+        row.subject: " ".join(launch_arguments(row)) for row in summary.itertuples(index=False) if row.error is None
+    }
+    with pd.option_context("display.max_columns", None, "display.width", None):
+        print(summary.to_string(index=False))
+    print(json.dumps(commands, indent=2))
+    return 1 if summary["error"].notna().any() else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
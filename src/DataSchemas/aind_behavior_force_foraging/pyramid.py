@@ -0,0 +1,354 @@
+"""Multi-resolution min/max/mean pyramids of long multichannel traces, e.g. load cell forces and analog inputs.
+
+Level `l` of a pyramid splits time into bins of `bin_s * factor ** l` seconds, starting at `t0`, and stores
+the minimum, maximum and mean of every channel, and the sample count, of every bin. Each level is an
+append-only file, one fixed size record per bin, so bin `k` of a level is record `k`. Bins without
+samples are NaN. A window of any length and pixel width is served by a single slice of a memory
+mapped level, chosen arithmetically, in constant time.
+
+Pyramids are built incrementally: `PyramidBuilder.append` takes samples chunk by chunk, in time order,
+and a `Pyramid` opened on the same files sees every completed bin. The pyramids of a session are built
+after acquisition by `build_session_pyramids`, which streams the memory mapped Harp files.
+
+    <session>/Behavior/Pyramids/<name>.pyramid/level_<l>.bin
+"""
+
+import logging
+import math
+import os
+import struct
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from aind_behavior_force_foraging import dataset
+from aind_behavior_force_foraging.force import apply_load_cells_calibration
+from aind_behavior_force_foraging.harp_io import HarpRegisterReader
+from aind_behavior_force_foraging.rig import AindForceForagingRig
+
+logger = logging.getLogger(__name__)
+
+PYRAMID_MAGIC = b"FFPYRAMD"
+PYRAMID_VERSION = 1
+PYRAMID_SUFFIX = ".pyramid"
+PYRAMIDS_DIR = "Pyramids"
+
+_HEADER = struct.Struct("<8sHHIIdd")  # magic, version, level, n_channels, factor, t0, bin_s
+_HEADER_SIZE = 64
+
+DEFAULT_BIN_S = 0.004
+DEFAULT_FACTOR = 4
+DEFAULT_N_LEVELS = 10
+
+
+class PyramidSource(NamedTuple):
+    """A Harp register to build a pyramid from."""
+
+    device: str
+    address: int
+    harp_device_name: Optional[str] = None
+
+
+PYRAMID_SOURCES: Dict[str, PyramidSource] = {
+    "load_cells": PyramidSource("LoadCells", 33),  # LoadCellData
+    "analog_input": PyramidSource("AnalogInput", 44),  # AnalogData
+}
+
+
+class PyramidWindow(NamedTuple):
+    """The bins of a pyramid level that cover a time window."""
+
+    level: int
+    time: np.ndarray
+    min: np.ndarray
+    max: np.ndarray
+    mean: np.ndarray
+    count: np.ndarray
+
+
+def record_dtype(n_channels: int) -> np.dtype:
+    return np.dtype(
+        [("min", "<f4", (n_channels,)), ("max", "<f4", (n_channels,)), ("mean", "<f4", (n_channels,)), ("count", "<u4")]
+    )
+
+
+def _open_bin_dtype(n_channels: int) -> np.dtype:
+    return np.dtype(
+        [("min", "<f8", (n_channels,)), ("max", "<f8", (n_channels,)), ("sum", "<f8", (n_channels,)), ("count", "<u8")]
+    )
+
+
+def level_file(path: os.PathLike, level: int) -> Path:
+    return Path(path) / f"level_{level}.bin"
+
+
+class _Level:
+    """Aggregates the bins of the level below into the bins of one level. Only the last bin is kept open."""
+
+    def __init__(self, path: Path, level: int, n_channels: int, factor: int, t0: float, bin_s: float):
+        self.path = path
+        self.dtype = record_dtype(n_channels)
+        self.n_channels = n_channels
+        self.written = 0
+        self.open_index = -1
+        self.open = np.zeros(1, dtype=_open_bin_dtype(n_channels))
+        header = _HEADER.pack(PYRAMID_MAGIC, PYRAMID_VERSION, level, n_channels, factor, t0, bin_s)
+        with open(path, "wb") as f:
+            f.write(header.ljust(_HEADER_SIZE, b"\x00"))
+
+    def push(
+        self, index: np.ndarray, vmin: np.ndarray, vmax: np.ndarray, vsum: np.ndarray, count: np.ndarray
+    ) -> Optional[Tuple[np.ndarray, ...]]:
+        """
+        Adds sub-bins, sorted by the index of the bin of this level they fall in. Returns the completed
+        bins, in the same form, so they can be pushed to the level above.
+        """
+        if len(index) == 0:
+            return None
+        if index[0] < self.open_index:
+            raise ValueError("Samples must be appended in time order.")
+        # Merge the open bin in front of the new sub-bins
+        if self.open_index >= 0:
+            index = np.concatenate(([self.open_index], index))
+            vmin = np.concatenate((self.open["min"], vmin))
+            vmax = np.concatenate((self.open["max"], vmax))
+            vsum = np.concatenate((self.open["sum"], vsum))
+            count = np.concatenate((self.open["count"], count))
+        starts = np.flatnonzero(np.concatenate(([True], np.diff(index) > 0)))
+        bins = index[starts]
+        bmin = np.fmin.reduceat(vmin, starts, axis=0)
+        bmax = np.fmax.reduceat(vmax, starts, axis=0)
+        bsum = np.add.reduceat(vsum, starts, axis=0)
+        bcount = np.add.reduceat(count, starts)
+        # The last bin may still receive samples
+        self.open_index = int(bins[-1])
+        self.open["min"], self.open["max"], self.open["sum"], self.open["count"] = (
+            bmin[-1],
+            bmax[-1],
+            bsum[-1],
+            bcount[-1],
+        )
+        completed = (bins[:-1], bmin[:-1], bmax[:-1], bsum[:-1], bcount[:-1])
+        self._write(*completed, until=self.open_index)
+        return completed
+
+    def flush(self) -> Optional[Tuple[np.ndarray, ...]]:
+        """Completes the open bin."""
+        if self.open_index < 0:
+            return None
+        completed = (
+            np.array([self.open_index]),
+            self.open["min"],
+            self.open["max"],
+            self.open["sum"],
+            self.open["count"],
+        )
+        self._write(*completed, until=self.open_index + 1)
+        self.open_index = -1
+        return completed
+
+    def _write(self, bins, bmin, bmax, bsum, bcount, until: int) -> None:
+        """Writes every bin up to `until`, exclusive. Bins without samples are NaN."""
+        n = until - self.written
+        if n <= 0:
+            return
+        records = np.zeros(n, dtype=self.dtype)
+        records["min"] = records["max"] = records["mean"] = np.nan
+        position = np.asarray(bins, dtype=np.int64) - self.written
+        records["min"][position] = bmin
+        records["max"][position] = bmax
+        with np.errstate(invalid="ignore"):
+            records["mean"][position] = bsum / np.asarray(bcount)[:, None]
+        records["count"][position] = bcount
+        with open(self.path, "ab") as f:
+            f.write(records.tobytes())
+        self.written = until
+
+
+class PyramidBuilder:
+    """
+    Builds a pyramid incrementally. Samples must be appended in time order.
+
+    Example:
+        with PyramidBuilder("session/Behavior/Pyramids/load_cells.pyramid", n_channels=8, t0=t0) as builder:
+            for timestamp, data in chunks:
+                builder.append(timestamp, data)
+    """
+
+    def __init__(
+        self,
+        path: os.PathLike,
+        n_channels: int,
+        t0: float,
+        bin_s: float = DEFAULT_BIN_S,
+        factor: int = DEFAULT_FACTOR,
+        n_levels: int = DEFAULT_N_LEVELS,
+    ):
+        if factor < 2:
+            raise ValueError("The decimation factor must be at least 2.")
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.t0 = t0
+        self.bin_s = bin_s
+        self.factor = factor
+        self._levels = [
+            _Level(level_file(self.path, level), level, n_channels, factor, t0, bin_s) for level in range(n_levels)
+        ]
+
+    def __enter__(self) -> "PyramidBuilder":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def append(self, timestamp: np.ndarray, data: np.ndarray) -> None:
+        """
+        Appends samples.
+
+        Args:
+            timestamp (np.ndarray): The sample times, in seconds, with shape (n_samples,). Samples before `t0` are dropped.
+            data (np.ndarray): The samples, with shape (n_samples, n_channels).
+        """
+        timestamp = np.asarray(timestamp, dtype=np.float64)
+        data = np.asarray(data, dtype=np.float64).reshape(len(timestamp), -1)
+        keep = timestamp >= self.t0
+        timestamp, data = timestamp[keep], data[keep]
+        index = np.floor((timestamp - self.t0) / self.bin_s).astype(np.int64)
+        if len(index) > 1 and (np.diff(index) < 0).any():
+            raise ValueError("Samples must be appended in time order.")
+        completed = self._levels[0].push(index, data, data, data, np.ones(len(index), dtype=np.uint64))
+        self._propagate(completed, start=1)
+
+    def close(self) -> None:
+        """Completes the last bin of every level. Nothing can be appended afterwards."""
+        for level in range(len(self._levels)):
+            self._propagate(self._levels[level].flush(), start=level + 1)
+
+    def _propagate(self, completed: Optional[Tuple[np.ndarray, ...]], start: int) -> None:
+        for level in self._levels[start:]:
+            if completed is None or len(completed[0]) == 0:
+                return
+            bins, bmin, bmax, bsum, bcount = completed
+            completed = level.push(bins // self.factor, bmin, bmax, bsum, bcount)
+
+
+class Pyramid:
+    """A read-only view of a pyramid. Bins completed after it was opened are visible to later queries."""
+
+    def __init__(self, path: os.PathLike):
+        self.path = Path(path)
+        self.n_levels = 0
+        while level_file(self.path, self.n_levels).exists():
+            self.n_levels += 1
+        if self.n_levels == 0:
+            raise FileNotFoundError(f"{path} is not a pyramid.")
+        with open(level_file(self.path, 0), "rb") as f:
+            magic, version, _, self.n_channels, self.factor, self.t0, self.bin_s = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != PYRAMID_MAGIC:
+            raise ValueError(f"{path} is not a pyramid.")
+        if version != PYRAMID_VERSION:
+            raise ValueError(f"Unsupported pyramid version {version}. Expected {PYRAMID_VERSION}.")
+        self.dtype = record_dtype(self.n_channels)
+        self._maps: List[Optional[np.memmap]] = [None] * self.n_levels
+
+    def bin_s_of(self, level: int) -> float:
+        return self.bin_s * self.factor**level
+
+    def level(self, level: int) -> np.ndarray:
+        """The completed bins of a level, memory mapped. The map is only renewed once the file has grown."""
+        path = level_file(self.path, level)
+        n_records = (path.stat().st_size - _HEADER_SIZE) // self.dtype.itemsize
+        current = self._maps[level]
+        if current is None or len(current) != n_records:
+            if n_records == 0:
+                return np.zeros(0, dtype=self.dtype)
+            current = np.memmap(path, dtype=self.dtype, mode="r", offset=_HEADER_SIZE, shape=(n_records,))
+            self._maps[level] = current
+        return current
+
+    def select_level(self, start: float, stop: float, width: int) -> int:
+        """The finest level with at most `width` bins between `start` and `stop`."""
+        bins = (stop - start) / (self.bin_s * max(width, 1))
+        if bins <= 1:
+            return 0
+        return min(self.n_levels - 1, math.ceil(math.log(bins, self.factor) - 1e-9))
+
+    def query(self, start: float, stop: float, width: int) -> PyramidWindow:
+        """
+        Returns the bins that cover a time window at a resolution of about `width` bins.
+
+        Args:
+            start (float): The window start, in seconds.
+            stop (float): The window end, in seconds.
+            width (int): The number of bins wanted, e.g. the width of the plot in pixels.
+
+        Returns:
+            PyramidWindow: The bins of the selected level. At most `width` bins, unless the window is
+                longer than `width` bins of the coarsest level.
+        """
+        level = self.select_level(start, stop, width)
+        bin_s = self.bin_s_of(level)
+        records = self.level(level)
+        first = max(0, math.floor((start - self.t0) / bin_s))
+        last = min(len(records), max(first, math.ceil((stop - self.t0) / bin_s)))
+        window = records[first:last]
+        return PyramidWindow(
+            level=level,
+            time=self.t0 + np.arange(first, last) * bin_s,
+            min=window["min"],
+            max=window["max"],
+            mean=window["mean"],
+            count=window["count"],
+        )
+
+
+def pyramid_dir(session_path: os.PathLike, name: str) -> Path:
+    return Path(session_path) / dataset.BEHAVIOR_DIR / PYRAMIDS_DIR / f"{name}{PYRAMID_SUFFIX}"
+
+
+def build_session_pyramids(
+    session_path: os.PathLike,
+    rig: Optional[AindForceForagingRig] = None,
+    sources: Optional[Dict[str, PyramidSource]] = None,
+    chunk_size: int = 1_000_000,
+    **kwargs,
+) -> Dict[str, Path]:
+    """
+    Builds the pyramid of every source logged in a session, reading its memory mapped file chunk by chunk.
+    Load cells are calibrated with the rig calibration, so the pyramid is in force units.
+
+    Args:
+        session_path (os.PathLike): The session directory.
+        rig (Optional[AindForceForagingRig]): The rig. Defaults to the rig logged in the session.
+        sources (Optional[Dict[str, PyramidSource]]): The registers to build pyramids of. Defaults to `PYRAMID_SOURCES`.
+        chunk_size (int): The number of samples appended at a time.
+        **kwargs: Passed to `PyramidBuilder`.
+
+    Returns:
+        Dict[str, Path]: The pyramid directory of every source that was logged.
+    """
+    rig = rig if rig is not None else dataset.read_rig(session_path)
+    calibration = rig.harp_load_cells.calibration if rig is not None else None
+    pyramids: Dict[str, Path] = {}
+    for name, source in (sources if sources is not None else PYRAMID_SOURCES).items():
+        path = dataset.find_harp_register_file(session_path, source.device, source.address, source.harp_device_name)
+        if path is None:
+            logger.debug("No %s data found in session %s.", name, session_path)
+            continue
+        reader = HarpRegisterReader(path, source.address)
+        if len(reader) == 0:
+            continue
+        first = reader.read(0, 1)
+        n_channels = first.payload.reshape(1, -1).shape[1]
+        with PyramidBuilder(
+            pyramid_dir(session_path, name), n_channels, float(first.timestamp[0]), **kwargs
+        ) as builder:
+            for i in range(0, len(reader), chunk_size):
+                messages = reader.read(i, i + chunk_size)
+                chunk = messages.payload.reshape(len(messages), -1)
+                if name == "load_cells" and calibration is not None:
+                    chunk = apply_load_cells_calibration(chunk, calibration.output)
+                builder.append(messages.timestamp, chunk)
+        pyramids[name] = pyramid_dir(session_path, name)
+    return pyramids
@@ -0,0 +1,280 @@
+"""Batch quality control of force foraging sessions.
+
+Every session is checked in its own worker process and the results are collected
+into a single summary table, with one row per session.
+
+Usage:
+    qc path/to/session1 path/to/session2 ... [--workers 8] [--output summary.csv] [--replay] [--licks]
+"""
+
+import argparse
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from aind_behavior_force_foraging import dataset, licks, replay
+from aind_behavior_force_foraging.harp_io import read_harp_messages
+from aind_behavior_force_foraging.rig import AindForceForagingRig
+from aind_behavior_force_foraging.trials import TRIAL_EVENTS, build_trial_table
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_ADDRESS = 8  # Core register TimestampSeconds, emitted once per second by every device
+
+DEFAULT_GAP_THRESHOLD_S = 1.5
+
+
+class HarpFileQc(NamedTuple):
+    device: str
+    address: int
+    message_count: int
+    corrupted_count: int
+    trailing_bytes: int
+    clock_discontinuities: int
+    max_gap_s: float
+    dropped_heartbeats: int
+
+
+def check_harp_file(
+    path: os.PathLike, device: str, address: int, gap_threshold_s: float = DEFAULT_GAP_THRESHOLD_S
+) -> HarpFileQc:
+    """
+    Checks the integrity of a single Harp register file.
+
+    Args:
+        path (os.PathLike): The register file.
+        device (str): The device name.
+        address (int): The register address.
+        gap_threshold_s (float): Heartbeat intervals longer than this are counted as dropped messages.
+
+    Returns:
+        HarpFileQc: Message and corrupted message counts, number of bytes left over after the
+            last complete message, number of times the device clock went backwards, the longest
+            interval between events and, for the heartbeat register, the number of missing heartbeats.
+    """
+    messages = read_harp_messages(path)
+    max_gap_s = np.nan
+    clock_discontinuities = 0
+    dropped_heartbeats = 0
+    if messages.timestamp is not None:
+        timestamps = messages.timestamp[messages.is_event & messages.checksum_ok]
+        intervals = np.diff(timestamps)
+        if len(intervals) > 0:
+            clock_discontinuities = int(np.count_nonzero(intervals < 0))
+            max_gap_s = float(intervals.max())
+        if address == HEARTBEAT_ADDRESS:
+            late = intervals[intervals > gap_threshold_s]
+            dropped_heartbeats = int(np.sum(np.round(late) - 1))
+    return HarpFileQc(
+        device=device,
+        address=address,
+        message_count=len(messages),
+        corrupted_count=int(np.count_nonzero(~messages.checksum_ok)),
+        trailing_bytes=messages.trailing_bytes,
+        clock_discontinuities=clock_discontinuities,
+        max_gap_s=max_gap_s,
+        dropped_heartbeats=dropped_heartbeats,
+    )
+
+
+def check_harp_logs(session_path: os.PathLike, gap_threshold_s: float = DEFAULT_GAP_THRESHOLD_S) -> Dict[str, Any]:
+    """Aggregates `check_harp_file` over all Harp register files of a session."""
+    files = [
+        check_harp_file(f.path, f.device, f.address, gap_threshold_s)
+        for f in dataset.iter_harp_register_files(session_path)
+    ]
+    gaps = [f.max_gap_s for f in files if f.address == HEARTBEAT_ADDRESS and not np.isnan(f.max_gap_s)]
+    return {
+        "harp_devices": len({f.device for f in files}),
+        "harp_files": len(files),
+        "harp_messages": sum(f.message_count for f in files),
+        "harp_corrupted_messages": sum(f.corrupted_count for f in files),
+        "harp_truncated_files": sum(f.trailing_bytes > 0 for f in files),
+        "harp_clock_discontinuities": sum(f.clock_discontinuities for f in files),
+        "harp_dropped_heartbeats": sum(f.dropped_heartbeats for f in files),
+        "harp_max_heartbeat_gap_s": max(gaps) if gaps else np.nan,
+    }
+
+
+def check_cameras(session_path: os.PathLike, rig: Optional[AindForceForagingRig]) -> Dict[str, Any]:
+    """
+    Compares the frames logged by each triggered camera against the triggers logged by the
+    Harp behavior board, and the triggers against the count expected from the
+    `triggered_camera_controller.frame_rate`.
+    """
+    result: Dict[str, Any] = {}
+    trigger_file = dataset.find_harp_register_file(
+        session_path, dataset.CAMERA_TRIGGER_DEVICE, dataset.CAMERA_TRIGGER_ADDRESS
+    )
+    trigger_count: Optional[int] = None
+    if trigger_file is not None:
+        messages = read_harp_messages(trigger_file)
+        triggers = messages.timestamp[messages.is_event & messages.checksum_ok]
+        trigger_count = len(triggers)
+        result["camera_trigger_count"] = trigger_count
+        frame_rate = rig.triggered_camera_controller.frame_rate if rig is not None else None
+        if frame_rate and trigger_count > 1:
+            expected = int(np.round((triggers[-1] - triggers[0]) * frame_rate)) + 1
+            result["camera_expected_trigger_count"] = expected
+            result["camera_missing_triggers"] = expected - trigger_count
+
+    if rig is None:
+        return result
+    for camera in rig.triggered_camera_controller.cameras:
+        metadata = dataset.video_metadata_file(session_path, camera)
+        frame_count = len(pd.read_csv(metadata)) if metadata is not None else 0
+        result[f"{camera}_frame_count"] = frame_count
+        if trigger_count is not None:
+            result[f"{camera}_missing_frames"] = trigger_count - frame_count
+    return result
+
+
+def check_trials(session_path: os.PathLike) -> Dict[str, Any]:
+    """Counts trials and totals the rewards delivered in a session."""
+    events = [e for name in TRIAL_EVENTS for e in dataset.read_software_events(session_path, name)]
+    trials = build_trial_table(events)
+    return {
+        "trial_count": len(trials),
+        "aborted_trial_count": int(trials["is_aborted"].sum()) if len(trials) else 0,
+        "rewarded_trial_count": int((trials["reward_count"] > 0).sum()) if len(trials) else 0,
+        "reward_count": int(trials["reward_count"].sum()) if len(trials) else 0,
+        "total_reward": float(trials["reward_amount"].sum()) if len(trials) else 0.0,
+    }
+
+
+def check_licks(session_path: os.PathLike) -> Dict[str, Any]:
+    """Summarizes the licks and reward collection of a session, if the lickometer was logged."""
+    path = dataset.find_harp_register_file(
+        session_path, licks.LICKOMETER_DEVICE, licks.LICK_STATE_ADDRESS, licks.LICKOMETER_HARP_DEVICE
+    )
+    if path is None:
+        return {}
+    return licks.analyze_session(session_path)
+
+
+def check_replay(session_path: os.PathLike) -> Dict[str, Any]:
+    """Replays the trials of a session from the recorded force and counts those that diverge from the logs."""
+    try:
+        return replay.replay_session(session_path)
+    except (FileNotFoundError, ValueError) as e:
+        logger.info("Trials of session %s were not replayed. %s", session_path, e)
+        return {}
+
+
+def qc_session(
+    session_path: os.PathLike,
+    gap_threshold_s: float = DEFAULT_GAP_THRESHOLD_S,
+    with_replay: bool = False,
+    with_licks: bool = False,
+) -> Dict[str, Any]:
+    """
+    Runs all checks on a single session. Failures are reported in the `error` field instead of raised,
+    so that a single broken session does not stop a batch.
+
+    Args:
+        session_path (os.PathLike): The session directory.
+        gap_threshold_s (float): See `check_harp_file`.
+        with_replay (bool): Also replay the trials of the session, see `check_replay`. Reads the whole
+            force stream, so it is off by default.
+        with_licks (bool): Also summarize the licks and reward collection, see `check_licks`.
+
+    Returns:
+        Dict[str, Any]: A summary row.
+    """
+    row: Dict[str, Any] = {"session": str(session_path), "error": None}
+    try:
+        if not (Path(session_path) / dataset.BEHAVIOR_DIR).exists():
+            raise FileNotFoundError(f"{session_path} is not a session directory.")
+        rig = dataset.read_rig(session_path)
+        session = dataset.read_session(session_path)
+        if session is not None:
+            row["subject"] = session.subject
+            row["session_date"] = session.date
+        row["rig_name"] = rig.rig_name if rig is not None else None
+        row.update(check_harp_logs(session_path, gap_threshold_s))
+        row.update(check_cameras(session_path, rig))
+        row.update(check_trials(session_path))
+        if with_licks:
+            row.update(check_licks(session_path))
+        if with_replay:
+            row.update(check_replay(session_path))
+    except Exception as e:
+        logger.error("QC failed for session %s. %s", session_path, e)
+        row["error"] = f"{type(e).__name__}: {e}"
+    return row
+
+
+def run_qc(
+    session_paths: Sequence[os.PathLike],
+    max_workers: Optional[int] = None,
+    gap_threshold_s: float = DEFAULT_GAP_THRESHOLD_S,
+    with_replay: bool = False,
+    with_licks: bool = False,
+) -> pd.DataFrame:
+    """
+    Runs `qc_session` on every session in a process pool.
+
+    Args:
+        session_paths (Sequence[os.PathLike]): The session directories.
+        max_workers (Optional[int]): Number of worker processes. Defaults to the number of processors.
+            If 1, sessions are processed serially in the calling process.
+        gap_threshold_s (float): See `check_harp_file`.
+        with_replay (bool): See `qc_session`.
+        with_licks (bool): See `qc_session`.
+
+    Returns:
+        pd.DataFrame: The summary table, one row per session, in the order of `session_paths`.
+    """
+    check = partial(qc_session, gap_threshold_s=gap_threshold_s, with_replay=with_replay, with_licks=with_licks)
+    if max_workers == 1 or len(session_paths) <= 1:
+        rows = [check(path) for path in session_paths]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            rows = list(executor.map(check, session_paths))
+    columns: List[str] = ["session", "error"]
+    for row in rows:
+        columns.extend(key for key in row if key not in columns)
+    columns.append(columns.pop(columns.index("error")))
+    return pd.DataFrame(rows, columns=columns)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Batch quality control of force foraging sessions")
+    parser.add_argument("sessions", nargs="+", type=Path, help="Session directories")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--output", type=Path, default=None, help="Optional path to save the summary as csv")
+    parser.add_argument(
+        "--gap-threshold",
+        type=float,
+        default=DEFAULT_GAP_THRESHOLD_S,
+        help="Heartbeat interval (s) above which messages are counted as dropped",
+    )
+    parser.add_argument("--replay", action="store_true", help="Also replay the trials from the recorded force")
+    parser.add_argument("--licks", action="store_true", help="Also summarize the licks and reward collection")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    summary = run_qc(
+        args.sessions,
+        max_workers=args.workers,
+        gap_threshold_s=args.gap_threshold,
+        with_replay=args.replay,
+        with_licks=args.licks,
+    )
+    with pd.option_context("display.max_columns", None, "display.width", None):
+        print(summary.to_string(index=False))
+    if args.output is not None:
+        summary.to_csv(args.output, index=False)
+        logger.info("Summary saved to %s", args.output)
+    return 1 if summary["error"].notna().any() else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,320 @@
+"""Batch re-mapping of archived sessions to aind-data-schema metadata.
+
+Rebuilds `session.json` and `rig.json` of archived sessions from the input files the launcher
+stored in `Behavior/Logs`, without a launcher. Inputs written with older schemas are upgraded
+with `migrations` first. Sessions are mapped in a process pool. Each worker parses the
+aind-data-schema rig of a rig once, and the software environment snapshot is taken once for
+the whole batch.
+
+Fields that can not be rebuilt from the inputs (the session end time, the animal weight and
+water, the output parameters and the software environment that acquired the session) are
+carried over from the `session.json` being replaced, if any. Likewise, a session keeps its own
+`rig.json`, and only sessions without one take their rig from the config library.
+
+Example:
+    remap_sessions(dataset.discover_sessions(r"C:/Data"), config_library_dir=r"\\\\server\\AindForceForaging")
+"""
+
+import argparse
+import datetime
+import functools
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+import aind_data_schema.core.rig
+import aind_data_schema.core.session
+import git
+import pandas as pd
+from aind_behavior_experiment_launcher.data_mapper import helpers as data_mapper_helpers
+from aind_behavior_services.session import AindBehaviorSessionModel
+
+from aind_behavior_force_foraging import dataset
+from aind_behavior_force_foraging.data_mappers import DATABASE_DIR, AindSessionDataMapper
+from aind_behavior_force_foraging.migrations import RIG_MIGRATIONS, TASK_LOGIC_MIGRATIONS
+from aind_behavior_force_foraging.water import session_water_log
+
+logger = logging.getLogger(__name__)
+
+SESSION_FILENAME = "session.json"
+RIG_FILENAME = "rig.json"
+REMAP_REPORT = "remap_report.csv"
+DEFAULT_SCRIPT_PATH = Path("./src/main.bonsai")
+DEFAULT_BONSAI_CONFIG_PATH = Path("./bonsai/Bonsai.config")
+
+_environment: Optional["EnvironmentSnapshot"] = None
+
+
+class RepositorySnapshot(NamedTuple):
+    """The parts of a `git.Repo` used by the session mapper, so that it can be sent to worker processes."""
+
+    url: str
+    sha: str
+    working_dir: str
+
+    @classmethod
+    def from_repository(cls, path: os.PathLike = ".") -> "RepositorySnapshot":
+        repository = git.Repo(Path(path), search_parent_directories=True)
+        return cls(repository.remote().url, repository.head.commit.hexsha, str(repository.working_dir))
+
+    def remote(self) -> SimpleNamespace:
+        return SimpleNamespace(url=self.url)
+
+    @property
+    def head(self) -> SimpleNamespace:
+        return SimpleNamespace(commit=SimpleNamespace(hexsha=self.sha))
+
+
+class EnvironmentSnapshot(NamedTuple):
+    python: Dict[str, str]
+    bonsai: Dict[str, str]
+
+    @classmethod
+    def take(cls, bonsai_config_path: os.PathLike = DEFAULT_BONSAI_CONFIG_PATH) -> "EnvironmentSnapshot":
+        return cls(
+            python=data_mapper_helpers.snapshot_python_environment(),
+            bonsai=data_mapper_helpers.snapshot_bonsai_environment(config_file=bonsai_config_path),
+        )
+
+
+class RemapResult(NamedTuple):
+    session: str
+    rig_id: Optional[str]
+    rig_source: Optional[str]
+    error: Optional[str] = None
+    warning: Optional[str] = None
+
+
+def _init_worker(environment: "EnvironmentSnapshot") -> None:
+    global _environment
+    _environment = environment
+
+
+def _read_json(path: Path) -> Optional[Dict[str, Any]]:
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+@functools.lru_cache(maxsize=32)
+def _load_aind_rig(path: str, mtime_ns: int) -> aind_data_schema.core.rig.Rig:
+    """Parses an aind-data-schema rig once per worker. `mtime_ns` invalidates the cache if the file changes."""
+    with open(path, "r", encoding="utf-8") as f:
+        return aind_data_schema.core.rig.Rig.model_validate_json(f.read())
+
+
+def resolve_aind_rig(
+    session_path: os.PathLike, computer_name: str, rig_name: str, config_library_dir: Optional[os.PathLike] = None
+) -> Optional[Path]:
+    """
+    Returns the aind-data-schema rig of a session: its own `rig.json`, as acquired, or, if it is missing,
+    the one in the config library, which may have been edited since the session.
+    """
+    candidates = [Path(session_path) / RIG_FILENAME]
+    if config_library_dir is not None:
+        candidates.append(Path(config_library_dir) / DATABASE_DIR / computer_name / f"{rig_name}.json")
+    return next((p for p in candidates if p.exists()), None)
+
+
+def _previous_session_fields(previous: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """The fields of a previous `session.json` that can not be rebuilt from the input files."""
+    if previous is None:
+        return {}
+    fields: Dict[str, Any] = {
+        "session_end_time": previous.get("session_end_time"),
+        "animal_weight_post": previous.get("animal_weight_post"),
+        "reward_consumed_total": previous.get("reward_consumed_total"),
+    }
+    epochs = previous.get("stimulus_epochs") or []
+    if epochs:
+        fields["output_parameters"] = epochs[0].get("output_parameters") or None
+        fields["reward_consumed_during_epoch"] = epochs[0].get("reward_consumed_during_epoch")
+        software = {s.get("name"): s.get("parameters") for s in epochs[0].get("software") or []}
+        fields["python_environment"] = software.get("Python")
+        fields["bonsai_environment"] = software.get("Bonsai")
+    return fields
+
+
+def _last_modified(session_path: Path) -> datetime.datetime:
+    """The latest modification time of the behavior files, a fallback for the session end time."""
+    mtime = max((p.stat().st_mtime for p in (session_path / dataset.BEHAVIOR_DIR).rglob("*") if p.is_file()))
+    return datetime.datetime.fromtimestamp(mtime, tz=datetime.timezone.utc)
+
+
+def remap_session(
+    session_path: os.PathLike,
+    repository: RepositorySnapshot,
+    config_library_dir: Optional[os.PathLike] = None,
+    script_path: os.PathLike = DEFAULT_SCRIPT_PATH,
+    output_dir: Optional[os.PathLike] = None,
+    environment: Optional[EnvironmentSnapshot] = None,
+) -> RemapResult:
+    """
+    Rebuilds the aind-data-schema `session.json` and `rig.json` of a session. Failures are reported in the result.
+
+    Args:
+        session_path (os.PathLike): The session directory.
+        repository (RepositorySnapshot): The task repository. The session's commit, if recorded, is used for URLs.
+        config_library_dir (Optional[os.PathLike]): The config library with the `AindDataSchemaRig` files,
+            used for sessions without their own `rig.json`.
+        script_path (os.PathLike): The Bonsai workflow, inside the repository.
+        output_dir (Optional[os.PathLike]): Where the metadata is written. Defaults to the session directory.
+        environment (Optional[EnvironmentSnapshot]): The environment snapshot for sessions without a
+            previous `session.json`. Defaults to the worker's snapshot, or a new one.
+
+    Returns:
+        RemapResult: The result.
+    """
+    session_path = Path(session_path)
+    try:
+        logs = session_path / dataset.BEHAVIOR_DIR / dataset.LOGS_DIR
+        inputs = {name: _read_json(logs / name) for name in dataset.INPUT_FILES}
+        missing = [name for name, document in inputs.items() if document is None]
+        if missing:
+            raise FileNotFoundError(f"Missing input files {missing} in {logs}.")
+        session_model = AindBehaviorSessionModel.model_validate_json(json.dumps(inputs[dataset.SESSION_INPUT]))
+        rig_model = RIG_MIGRATIONS.migrate_and_validate(inputs[dataset.RIG_INPUT])
+        task_logic_model = TASK_LOGIC_MIGRATIONS.migrate_and_validate(inputs[dataset.TASK_LOGIC_INPUT])
+
+        rig_path = resolve_aind_rig(session_path, rig_model.computer_name, rig_model.rig_name, config_library_dir)
+        if rig_path is None:
+            raise FileNotFoundError(f"No aind-data-schema rig found for {rig_model.rig_name}.")
+        aind_rig = _load_aind_rig(str(rig_path), rig_path.stat().st_mtime_ns)
+
+        previous = _previous_session_fields(_read_json(session_path / SESSION_FILENAME))
+        environment = environment or _environment or EnvironmentSnapshot.take()
+        session_end_time = previous.get("session_end_time") or _last_modified(session_path)
+        if isinstance(session_end_time, str):
+            session_end_time = datetime.datetime.fromisoformat(session_end_time)
+        if session_model.commit_hash:
+            repository = repository._replace(sha=session_model.commit_hash)
+
+        # Sessions mapped before the water was computed from the valve commands keep their logged values
+        water_log, warning = None, None
+        if previous.get("reward_consumed_total") is None:
+            water_log = session_water_log(session_path, rig_model.calibration.water_valve)
+            if water_log is None:
+                warning = "Could not compute the water delivered from the valve commands. The water fields are empty."
+
+        session = AindSessionDataMapper._map(
+            session_model=session_model,
+            rig_model=rig_model,
+            task_logic_model=task_logic_model,
+            repository=repository,
+            script_path=Path(repository.working_dir) / script_path,
+            session_end_time=session_end_time,
+            output_parameters=previous.get("output_parameters"),
+            python_environment=previous.get("python_environment") or environment.python,
+            bonsai_environment=previous.get("bonsai_environment") or environment.bonsai,
+            subject_info=water_log,
+        )
+        if previous:
+            session.animal_weight_post = previous.get("animal_weight_post")
+            if water_log is None:
+                session.reward_consumed_total = previous.get("reward_consumed_total")
+                session.stimulus_epochs[0].reward_consumed_during_epoch = previous.get("reward_consumed_during_epoch")
+        session.rig_id = aind_rig.rig_id
+
+        output_dir = Path(output_dir) if output_dir is not None else session_path
+        output_dir.mkdir(parents=True, exist_ok=True)
+        session.write_standard_file(output_dir)
+        aind_rig.write_standard_file(output_dir)
+        return RemapResult(str(session_path), aind_rig.rig_id, str(rig_path), warning=warning)
+    except Exception as e:
+        logger.error("Failed to re-map session %s. %s", session_path, e)
+        return RemapResult(str(session_path), None, None, f"{type(e).__name__}: {e}")
+
+
+def _rig_key(session_path: Path) -> str:
+    rig = _read_json(session_path / dataset.BEHAVIOR_DIR / dataset.LOGS_DIR / dataset.RIG_INPUT) or {}
+    return f"{rig.get('computer_name')}/{rig.get('rig_name')}"
+
+
+def remap_sessions(
+    sessions: Sequence[os.PathLike],
+    config_library_dir: Optional[os.PathLike] = None,
+    repository: Optional[RepositorySnapshot] = None,
+    script_path: os.PathLike = DEFAULT_SCRIPT_PATH,
+    bonsai_config_path: os.PathLike = DEFAULT_BONSAI_CONFIG_PATH,
+    output_root: Optional[os.PathLike] = None,
+    max_workers: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Rebuilds the aind-data-schema metadata of many sessions in a process pool.
+
+    Sessions are ordered by rig, so that the sessions of a rig are mostly mapped by the same worker
+    and its aind-data-schema rig is only parsed once.
+
+    Args:
+        sessions (Sequence[os.PathLike]): The session directories, e.g. from `dataset.discover_sessions`.
+        config_library_dir (Optional[os.PathLike]): The config library with the `AindDataSchemaRig` files.
+        repository (Optional[RepositorySnapshot]): The task repository. Defaults to the repository of
+            the current directory.
+        script_path (os.PathLike): The Bonsai workflow, relative to the repository.
+        bonsai_config_path (os.PathLike): The Bonsai config of the environment snapshot.
+        output_root (Optional[os.PathLike]): If given, the metadata of each session is written to
+            `<output_root>/<subject>/<session name>` instead of the session directory.
+        max_workers (Optional[int]): Number of worker processes. If 1, sessions are mapped serially.
+
+    Returns:
+        pd.DataFrame: One row per session, also saved as `remap_report.csv` in `output_root`, if given.
+    """
+    repository = repository or RepositorySnapshot.from_repository()
+    environment = EnvironmentSnapshot.take(bonsai_config_path)
+    sessions = sorted((Path(s) for s in sessions), key=lambda s: (_rig_key(s), str(s)))
+    outputs = [Path(output_root) / s.parent.name / s.name if output_root is not None else None for s in sessions]
+    args = [(s, repository, config_library_dir, script_path, o, environment) for s, o in zip(sessions, outputs)]
+
+    if max_workers == 1 or len(args) <= 1:
+        results = [remap_session(*a) for a in args]
+    else:
+        max_workers = max_workers or os.cpu_count() or 1
+        chunksize = max(1, len(args) // (4 * max_workers))
+        with ProcessPoolExecutor(
+            max_workers=max_workers, initializer=_init_worker, initargs=(environment,)
+        ) as executor:
+            results = list(executor.map(remap_session, *zip(*[a[:-1] for a in args]), chunksize=chunksize))
+
+    report = pd.DataFrame(results, columns=RemapResult._fields)
+    if output_root is not None:
+        Path(output_root).mkdir(parents=True, exist_ok=True)
+        report.to_csv(Path(output_root) / REMAP_REPORT, index=False)
+    logger.info("Re-mapped %d of %d sessions.", report["error"].isna().sum(), len(report))
+    return report
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Rebuild the aind-data-schema metadata of archived sessions")
+    parser.add_argument("root", type=Path, help="Data directory, with sessions in <root>/<subject>/<session>")
+    parser.add_argument("--config-library", type=Path, default=None, help="Config library directory")
+    parser.add_argument("--output", type=Path, default=None, help="Write the metadata here instead")
+    parser.add_argument("--subject", nargs="+", default=None, help="Only re-map these subjects")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    sessions: List[Path] = dataset.discover_sessions(args.root)
+    if args.subject is not None:
+        sessions = [s for s in sessions if s.parent.name in args.subject]
+    report = remap_sessions(
+        sessions, config_library_dir=args.config_library, output_root=args.output, max_workers=args.workers
+    )
+    failed = report[report["error"].notna()]
+    warned = report[report["warning"].notna()]
+    with pd.option_context("display.max_columns", None, "display.width", None, "display.max_colwidth", None):
+        print(f"Re-mapped {len(report) - len(failed)} of {len(report)} sessions.")
+        if len(warned) > 0:
+            print(warned[["session", "warning"]].to_string(index=False))
+        if len(failed) > 0:
+            print(failed[["session", "error"]].to_string(index=False))
+    return 1 if len(failed) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,416 @@
+"""Offline replay of the trial state machine, driven by the force recorded in a session.
+
+The replay mirrors `CreateTrial.bonsai`. A trial runs, in order:
+
+1. The `QuiescencePeriod`, if any. It ends once neither force has been above `force_threshold`
+   for the period duration. As in the workflow, the timer restarts every time the state changes.
+2. The `InitiationPeriod`. It ends after its duration, or aborts the trial if `abort_on_force`
+   is set and either force goes above `abort_on_force_threshold`.
+3. The `ResponsePeriod`. Every harvest action is observed according to its `HarvestMode`
+   (`ObserveRoiAction.bonsai` and `ObserveAccumulationAction.bonsai`), and the first one held
+   for its `force_duration` is selected. If none is, the trial ends without an action.
+4. The reward. After the harvest action `delay`, open loop rewards are given at once, and operant
+   rewards at the first lick, unless `time_to_collect` runs out first.
+5. The inter-trial interval, after which the `TrialOutcome` is logged.
+
+Every trial is replayed independently, from its logged start to the start of the next trial, with
+the parameters logged in its `Trial` event, so that a single divergence does not spread to the
+following trials. Periods sampled from distributions other than `Scalar` can not be replayed, since
+the sampled value is not logged.
+"""
+
+import logging
+import os
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from aind_behavior_force_foraging import dataset, licks
+from aind_behavior_force_foraging.force import apply_load_cells_calibration, parse_force
+from aind_behavior_force_foraging.harp_io import HarpRegisterReader
+from aind_behavior_force_foraging.load_cells_calibration import LOAD_CELL_DATA_ADDRESS
+from aind_behavior_force_foraging.task_logic import (
+    HarvestAction,
+    HarvestActionLabel,
+    HarvestMode,
+    QuiescencePeriod,
+    Trial,
+)
+from aind_behavior_force_foraging.trials import TRIAL_EVENT, TRIAL_EVENTS, build_trial_table
+
+logger = logging.getLogger(__name__)
+
+LOAD_CELLS_DEVICE = "LoadCells"
+DEFAULT_TOLERANCE_S = 0.05
+DEFAULT_CHUNK_SIZE = 1_000_000  # load cells samples
+
+REPLAY_TABLE_COLUMNS = (
+    "start_time",
+    "initiation_period_start_time",
+    "response_period_start_time",
+    "harvest_action_selected_time",
+    "reward_time",
+    "end_time",
+    "outcome_time",
+    "selected_action",
+    "is_aborted",
+    "is_replayed",
+)
+
+_COMPARED_TIMES = (
+    "initiation_period_start_time",
+    "response_period_start_time",
+    "harvest_action_selected_time",
+    "outcome_time",
+)
+
+
+class ForceTrace(NamedTuple):
+    """The left and right force of a session, as seen by the task."""
+
+    time: np.ndarray
+    left_force: np.ndarray
+    right_force: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    def side(self, action: HarvestActionLabel) -> np.ndarray:
+        return self.left_force if action == HarvestActionLabel.LEFT else self.right_force
+
+
+class ReplayedTrial(NamedTuple):
+    """The replayed timeline of a single trial. Times that were not reached are NaN."""
+
+    start_time: float
+    initiation_period_start_time: float
+    response_period_start_time: float
+    harvest_action_selected_time: float
+    reward_time: float
+    end_time: float
+    outcome_time: float
+    selected_action: Optional[str]
+    is_aborted: bool
+    is_replayed: bool
+
+
+def scalar_or_nan(distribution: Any) -> float:
+    """The value of a `Scalar` distribution. NaN for any other distribution, since its sampled value is not logged."""
+    parameters = getattr(distribution, "distribution_parameters", None)
+    if getattr(parameters, "family", None) == "Scalar":
+        return float(parameters.value)
+    return np.nan
+
+
+def first_held(time: np.ndarray, state: np.ndarray, target: bool, duration: float, start: float, stop: float) -> float:
+    """
+    Finds when `state` has first held `target` for `duration` seconds, within `[start, stop)`.
+
+    This is the `DistinctUntilChanged` followed by a timer, restarted on every change, used by the
+    workflow to debounce force conditions.
+
+    Args:
+        time (np.ndarray): The sample timestamps, sorted.
+        state (np.ndarray): The condition at every sample.
+        target (bool): The value the condition must hold.
+        duration (float): The time the condition must hold, in seconds.
+        start (float): The time the condition starts being observed.
+        stop (float): The time the observation ends.
+
+    Returns:
+        float: The time the timer fires, or NaN if it does not before `stop`.
+    """
+    i0, i1 = np.searchsorted(time, (start, stop))
+    if i1 <= i0:
+        return np.nan
+    t, s = time[i0:i1], state[i0:i1]
+    change = np.flatnonzero(s[1:] != s[:-1]) + 1
+    run_start = np.concatenate(([0], change))
+    run_end = np.append(t[change], stop)
+    held = (s[run_start] == target) & (run_end - t[run_start] >= duration)
+    k = int(np.argmax(held))
+    return float(t[run_start[k]] + duration) if held[k] else np.nan
+
+
+def accumulated_force(time: np.ndarray, force: np.ndarray, lower_bound: float) -> np.ndarray:
+    """
+    Integrates the force with the trapezoidal rule, never letting the total drop below `lower_bound`,
+    as `ObserveAccumulationAction.bonsai` does. The result is timestamped by `time[1:]`.
+
+    The bounded running sum `acc[k] = max(acc[k - 1] + step[k], lower_bound)` is computed in closed form
+    from the unbounded sum and its running minimum.
+    """
+    total = lower_bound + np.cumsum(0.5 * (force[1:] + force[:-1]) * np.diff(time))
+    return total - np.minimum(np.minimum.accumulate(total - lower_bound), 0.0)
+
+
+def harvest_time(force: ForceTrace, harvest: HarvestAction, start: float, stop: float) -> float:
+    """The time a harvest action is selected, if it is before `stop`, or NaN."""
+    i0, i1 = np.searchsorted(force.time, (start, stop))
+    time, value = force.time[i0:i1], force.side(harvest.action)[i0:i1]
+    match harvest.harvest_mode:
+        case HarvestMode.ROI:
+            inside = (value >= harvest.lower_force_threshold) & (value <= harvest.upper_force_threshold)
+            return first_held(time, inside, True, harvest.force_duration, start, stop)
+        case HarvestMode.ACCUMULATION:
+            if len(time) < 2:
+                return np.nan
+            total = accumulated_force(time, value, harvest.lower_force_threshold)
+            return first_held(
+                time[1:], total >= harvest.upper_force_threshold, True, harvest.force_duration, start, stop
+            )
+    return np.nan
+
+
+def replay_trial(
+    force: ForceTrace, lick_time: np.ndarray, trial: Trial, start: float, stop: float = np.inf
+) -> ReplayedTrial:
+    """
+    Replays a single trial.
+
+    Args:
+        force (ForceTrace): The force of the session.
+        lick_time (np.ndarray): The lick onsets of the session, sorted.
+        trial (Trial): The trial parameters, as logged in its `Trial` event.
+        start (float): The time the trial started.
+        stop (float): The time the next trial started. Events after it are not considered.
+
+    Returns:
+        ReplayedTrial: The replayed trial. `is_replayed` is False if the trial did not end before
+            `stop`, or depended on a period that was sampled from a distribution.
+    """
+    stop = min(stop, float(force.time[-1])) if len(force) else start
+    nan = np.nan
+    initiation_start = start
+    if trial.quiescence_period is not None:
+        initiation_start = _quiescence_end(force, trial.quiescence_period, start, stop)
+    initiation_end = initiation_start + scalar_or_nan(trial.initiation_period.duration)
+    if not initiation_end < stop:
+        return _finish(trial, start, initiation_start, nan, nan, nan, nan, None, stop)
+    if trial.initiation_period.abort_on_force:
+        aborted_at = _first_above(
+            force, trial.initiation_period.abort_on_force_threshold, initiation_start, initiation_end
+        )
+        if not np.isnan(aborted_at):
+            return _finish(trial, start, initiation_start, nan, nan, nan, aborted_at, None, stop)
+
+    response_start = initiation_end
+    selected, harvest_at = _select_harvest(force, trial, response_start, stop)
+    if selected is None:
+        return _finish(trial, start, initiation_start, response_start, harvest_at, nan, harvest_at, None, stop)
+    reward_at, end = _reward(lick_time, selected, harvest_at, stop)
+    return _finish(trial, start, initiation_start, response_start, harvest_at, reward_at, end, selected, stop)
+
+
+def _select_harvest(
+    force: ForceTrace, trial: Trial, response_start: float, stop: float
+) -> Tuple[Optional[HarvestAction], float]:
+    """
+    The first harvest action held during the response period, and the time it is selected. Without one,
+    the time the response period times out, or NaN if it does not before `stop`. An action selected before
+    `stop` is replayed even if the timeout comes after it.
+    """
+    timeout = response_start + scalar_or_nan(trial.response_period.duration)
+    if np.isnan(timeout):
+        return None, np.nan
+    selected: Optional[HarvestAction] = None
+    harvest_at = min(timeout, stop)
+    for harvest in (trial.left_harvest, trial.right_harvest):
+        if harvest is not None:
+            at = harvest_time(force, harvest, response_start, harvest_at)
+            if at < harvest_at:
+                selected, harvest_at = harvest, at
+    if selected is None:
+        return None, timeout if timeout < stop else np.nan
+    return selected, harvest_at
+
+
+def _quiescence_end(force: ForceTrace, quiescence: QuiescencePeriod, start: float, stop: float) -> float:
+    i0, i1 = np.searchsorted(force.time, (start, stop))
+    threshold = quiescence.force_threshold
+    above = (force.left_force[i0:i1] > threshold) | (force.right_force[i0:i1] > threshold)
+    return first_held(force.time[i0:i1], above, False, scalar_or_nan(quiescence.duration), start, stop)
+
+
+def _first_above(force: ForceTrace, threshold: float, start: float, stop: float) -> float:
+    i0, i1 = np.searchsorted(force.time, (start, stop))
+    above = np.flatnonzero((force.left_force[i0:i1] > threshold) | (force.right_force[i0:i1] > threshold))
+    return float(force.time[i0 + above[0]]) if len(above) else np.nan
+
+
+def _reward(lick_time: np.ndarray, harvest: HarvestAction, harvest_at: float, stop: float) -> Tuple[float, float]:
+    """The time the reward is given, NaN if it is not, and the time the reward period ends."""
+    available = harvest_at + harvest.delay
+    if not harvest.is_operant:
+        return available, available
+    time_to_collect = np.inf if harvest.time_to_collect is None else scalar_or_nan(harvest.time_to_collect)
+    k = np.searchsorted(lick_time, available, side="right")
+    lick = float(lick_time[k]) if k < len(lick_time) and lick_time[k] < stop else np.inf
+    deadline = available + time_to_collect
+    if lick < deadline:
+        return lick, lick
+    return np.nan, deadline if np.isfinite(deadline) else np.nan
+
+
+def _finish(
+    trial: Trial,
+    start: float,
+    initiation_start: float,
+    response_start: float,
+    harvest_at: float,
+    reward_at: float,
+    end: float,
+    selected: Optional[HarvestAction],
+    stop: float,
+) -> ReplayedTrial:
+    is_replayed = bool(end <= stop)
+    return ReplayedTrial(
+        start_time=start,
+        initiation_period_start_time=initiation_start,
+        response_period_start_time=response_start,
+        harvest_action_selected_time=harvest_at,
+        reward_time=reward_at,
+        end_time=end,
+        outcome_time=end + scalar_or_nan(trial.inter_trial_interval),
+        selected_action=(selected.action.value if selected is not None else HarvestActionLabel.NONE.value)
+        if is_replayed
+        else None,
+        is_aborted=is_replayed and selected is None,
+        is_replayed=is_replayed,
+    )
+
+
+def replay_trials(
+    force: ForceTrace, lick_time: np.ndarray, trials: Sequence[Trial], start_times: Sequence[float]
+) -> pd.DataFrame:
+    """
+    Replays every trial of a session, each one up to the start of the next.
+
+    Args:
+        force (ForceTrace): The force of the session.
+        lick_time (np.ndarray): The lick onsets of the session, sorted.
+        trials (Sequence[Trial]): The parameters of every trial.
+        start_times (Sequence[float]): The logged start time of every trial, sorted.
+
+    Returns:
+        pd.DataFrame: The replayed trials, indexed by trial. See `REPLAY_TABLE_COLUMNS`.
+    """
+    start_times = np.asarray(start_times, dtype=np.float64)
+    stop_times = np.append(start_times[1:], np.inf)
+    lick_time = np.asarray(lick_time, dtype=np.float64)
+    rows = [replay_trial(force, lick_time, *args) for args in zip(trials, start_times, stop_times)]
+    return pd.DataFrame(rows, columns=REPLAY_TABLE_COLUMNS, index=pd.RangeIndex(len(rows), name="trial"))
+
+
+def compare_replay(
+    replayed: pd.DataFrame, logged: pd.DataFrame, tolerance_s: float = DEFAULT_TOLERANCE_S
+) -> pd.DataFrame:
+    """
+    Compares the replayed trials with the trials logged by the task.
+
+    Args:
+        replayed (pd.DataFrame): See `replay_trials`.
+        logged (pd.DataFrame): The trial table of the session. See `trials.build_trial_table`.
+        tolerance_s (float): The largest timing error, in seconds, for a logged event to match its replay.
+
+    Returns:
+        pd.DataFrame: For every replayed trial, whether the selected action, the abort and the reward
+            match the logs, the timing error of every period, and whether the whole trial matches.
+    """
+    replayed = replayed[replayed["is_replayed"]]
+    logged = logged.loc[replayed.index]
+    comparison = pd.DataFrame(index=replayed.index)
+    comparison["action_matches"] = replayed["selected_action"].to_numpy() == logged["selected_action"].fillna(
+        HarvestActionLabel.NONE.value
+    ).to_numpy(dtype=object)
+    comparison["is_aborted_matches"] = replayed["is_aborted"].to_numpy() == logged["is_aborted"].fillna(False).to_numpy(
+        dtype=bool
+    )
+    comparison["reward_matches"] = np.isfinite(replayed["reward_time"].to_numpy(dtype=np.float64)) == (
+        logged["reward_count"].fillna(0).to_numpy() > 0
+    )
+    matches = comparison[["action_matches", "is_aborted_matches", "reward_matches"]].all(axis=1).to_numpy()
+    for column in _COMPARED_TIMES:
+        replayed_time = replayed[column].to_numpy(dtype=np.float64)
+        logged_time = logged[column].to_numpy(dtype=np.float64)
+        error = replayed_time - logged_time
+        comparison[column.removesuffix("_time") + "_error_s"] = error
+        # Sampled periods have no replayed time, and are not held against the trial
+        matches &= np.isnan(replayed_time) | (np.abs(error) <= tolerance_s)
+    comparison["matches"] = matches
+    return comparison
+
+
+def summarize_replay(replayed: pd.DataFrame, comparison: pd.DataFrame) -> Dict[str, Any]:
+    """Summarizes the comparison of a session with its replay."""
+    errors = comparison.filter(like="_error_s").to_numpy(dtype=np.float64)
+    mismatches = int((~comparison["matches"]).sum())
+    return {
+        "replayed_trial_count": len(comparison),
+        "unreplayed_trial_count": int((~replayed["is_replayed"]).sum()),
+        "replay_mismatch_count": mismatches,
+        "replay_mismatch_rate": mismatches / len(comparison) if len(comparison) else np.nan,
+        "replay_max_timing_error_s": float(np.nanmax(np.abs(errors))) if np.isfinite(errors).any() else np.nan,
+    }
+
+
+def read_force(
+    session_path: os.PathLike, lookup_table: Optional[np.ndarray] = None, chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> ForceTrace:
+    """
+    Reads the load cells of a session and computes the force seen by the task, with the rig calibration
+    and the task operation control. The memory mapped load cells file is processed chunk by chunk, so only
+    the force is held in memory.
+
+    Args:
+        session_path (os.PathLike): The session directory.
+        lookup_table (Optional[np.ndarray]): The prepared look up table. Required in `SingleLookupTable` mode.
+        chunk_size (int): The number of samples processed at a time.
+
+    Raises:
+        FileNotFoundError: If the load cells, rig or task logic were not logged.
+
+    Returns:
+        ForceTrace: The force.
+    """
+    path = dataset.find_harp_register_file(session_path, LOAD_CELLS_DEVICE, LOAD_CELL_DATA_ADDRESS)
+    rig = dataset.read_rig(session_path)
+    task_logic = dataset.read_task_logic(session_path)
+    if path is None or rig is None or task_logic is None:
+        raise FileNotFoundError(f"Session {session_path} is missing the load cells data, rig or task logic.")
+    reader = HarpRegisterReader(path, LOAD_CELL_DATA_ADDRESS)
+    calibration = rig.harp_load_cells.calibration
+    calibration = calibration.output if calibration is not None else None
+    control = task_logic.task_parameters.operation_control.force
+    trace = ForceTrace(time=np.empty(len(reader)), left_force=np.empty(len(reader)), right_force=np.empty(len(reader)))
+    for start in range(0, len(reader), chunk_size):
+        messages = reader.read(start, start + chunk_size)
+        data = apply_load_cells_calibration(messages.payload.reshape(len(messages), -1), calibration)
+        force = parse_force(data, control, lookup_table)
+        stop = start + len(messages)
+        trace.time[start:stop] = messages.timestamp
+        trace.left_force[start:stop] = force.left_force
+        trace.right_force[start:stop] = force.right_force
+    return trace
+
+
+def replay_session(
+    session_path: os.PathLike, lookup_table: Optional[np.ndarray] = None, tolerance_s: float = DEFAULT_TOLERANCE_S
+) -> Dict[str, Any]:
+    """Replays every trial of a session and compares it with the logs. See `summarize_replay`."""
+    force = read_force(session_path, lookup_table)
+    try:
+        lick_time = licks.read_licks(session_path).onset
+    except FileNotFoundError:
+        lick_time = np.empty(0)
+    events = [e for name in TRIAL_EVENTS for e in dataset.read_software_events(session_path, name)]
+    logged = build_trial_table(events)
+    trial_events = sorted((e for e in events if e.name == TRIAL_EVENT and e.timestamp is not None), key=_timestamp)
+    trials: List[Trial] = [Trial.model_validate(e.data or {}, strict=False) for e in trial_events]
+    replayed = replay_trials(force, lick_time, trials, logged["start_time"].to_numpy(dtype=np.float64))
+    return summarize_replay(replayed, compare_replay(replayed, logged, tolerance_s))
+
+
+def _timestamp(event) -> float:
+    return event.timestamp
@@ -0,0 +1,128 @@
+"""Compact binary serialization of the task logic and rig models.
+
+JSON, via `model_dump_json`, remains the exchange format with the Bonsai data schema classes.
+This module adds an optional MessagePack encoding for the Python side, e.g. for large
+curricula and cached task logic snapshots. Every payload starts with a fixed header:
+
+    magic (4 bytes, b"AFFB") | format version (uint8) | codec (uint8) | schema fingerprint (16 bytes)
+
+The fingerprint is a hash of the JSON schema of the model, so a payload is only decoded by the
+exact schema that wrote it. Payloads written by an older schema raise `SchemaMismatchError`
+and should be re-encoded from their JSON source, upgraded with `migrations` if needed.
+
+Decoding is guaranteed to round-trip: `loads(dumps(model), type(model)) == model`, and the
+decoded model serializes to the same JSON as the original.
+"""
+
+import enum
+import functools
+import hashlib
+import json
+import os
+import struct
+from pathlib import Path
+from typing import Type, TypeVar
+
+from pydantic import BaseModel
+
+MAGIC = b"AFFB"
+FORMAT_VERSION = 1
+FINGERPRINT_SIZE = 16
+HEADER = struct.Struct(f"<4sBB{FINGERPRINT_SIZE}s")
+
+T = TypeVar("T", bound=BaseModel)
+
+
+class Codec(enum.IntEnum):
+    JSON = 0
+    MSGPACK = 1
+
+
+class SchemaMismatchError(ValueError):
+    pass
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError as e:
+        raise ImportError("MessagePack serialization requires the 'msgpack' package.") from e
+    return msgpack
+
+
+@functools.lru_cache(maxsize=None)
+def schema_fingerprint(model: Type[BaseModel]) -> bytes:
+    """Returns a hash of the JSON schema of a model. Computed once per model."""
+    schema = json.dumps(model.model_json_schema(), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(schema.encode("utf-8")).digest()[:FINGERPRINT_SIZE]
+
+
+def dumps(model: BaseModel, codec: Codec = Codec.MSGPACK) -> bytes:
+    """
+    Serializes a model, with the header.
+
+    Args:
+        model (BaseModel): The model, e.g. an `AindForceForagingTaskLogic` or `AindForceForagingRig`.
+        codec (Codec): The payload encoding. Defaults to MessagePack.
+
+    Returns:
+        bytes: The serialized model.
+    """
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, codec, schema_fingerprint(type(model)))
+    match codec:
+        case Codec.MSGPACK:
+            payload = _msgpack().packb(model.model_dump(mode="json"), use_bin_type=True)
+        case Codec.JSON:
+            payload = model.model_dump_json().encode("utf-8")
+        case _:
+            raise ValueError(f"Unknown codec {codec}.")
+    return header + payload
+
+
+def loads(data: bytes, model: Type[T]) -> T:
+    """
+    Deserializes a model written by `dumps`.
+
+    Args:
+        data (bytes): The serialized model.
+        model (Type[T]): The expected model.
+
+    Raises:
+        SchemaMismatchError: If the payload was written by a different schema of `model`.
+
+    Returns:
+        T: The validated model.
+    """
+    if len(data) < HEADER.size:
+        raise ValueError("Payload is shorter than the header.")
+    magic, format_version, codec, fingerprint = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"Not a serialized model. Unexpected magic {magic!r}.")
+    if format_version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported format version {format_version}. Expected {FORMAT_VERSION}.")
+    if fingerprint != schema_fingerprint(model):
+        raise SchemaMismatchError(
+            f"Payload was written by a different schema of {model.__name__}. Re-encode it from its JSON source."
+        )
+    payload = memoryview(data)[HEADER.size :]
+    match codec:
+        case Codec.MSGPACK:
+            # The payload was dumped in JSON mode, so enums and datetimes are strings. The models are
+            # strict, so validation is relaxed to coerce them back, as `model_validate_json` does.
+            return model.model_validate(_msgpack().unpackb(payload, raw=False), strict=False)
+        case Codec.JSON:
+            return model.model_validate_json(bytes(payload))
+        case _:
+            raise ValueError(f"Unknown codec {codec}.")
+
+
+def dump(model: BaseModel, path: os.PathLike, codec: Codec = Codec.MSGPACK) -> None:
+    """Writes a serialized model to a file, atomically."""
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_bytes(dumps(model, codec))
+    os.replace(tmp, path)
+
+
+def load(path: os.PathLike, model: Type[T]) -> T:
+    return loads(Path(path).read_bytes(), model)
@@ -0,0 +1,173 @@
+"""Launcher startup instrumentation and concurrent pre-flight checks.
+
+Startup phases are timed with `StartupProfiler`, and independent checks, which mostly wait on the
+network share, run concurrently with a deadline so that a slow share cannot stall startup.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional
+
+from aind_behavior_experiment_launcher import resource_monitor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECK_TIMEOUT_S = 10.0
+STARTUP_PROFILE_FILENAME = "startup_profile.json"
+
+
+class PhaseTiming(NamedTuple):
+    name: str
+    start_s: float
+    duration_s: float
+    depth: int
+    error: Optional[str] = None
+
+
+class StartupProfiler:
+    """Records the duration of named, possibly nested, phases."""
+
+    def __init__(self):
+        self.phases: List[PhaseTiming] = []
+        self._origin = time.perf_counter()
+        self._depth = 0
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        self._depth += 1
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self._depth -= 1
+            self.phases.append(
+                PhaseTiming(
+                    name=name,
+                    start_s=start - self._origin,
+                    duration_s=time.perf_counter() - start,
+                    depth=self._depth,
+                    error=error,
+                )
+            )
+
+    def record(self, name: str, duration_s: float, error: Optional[str] = None) -> None:
+        """Records a phase that was timed elsewhere, e.g. a concurrent check."""
+        self.phases.append(
+            PhaseTiming(
+                name=name,
+                start_s=time.perf_counter() - self._origin - duration_s,
+                duration_s=duration_s,
+                depth=self._depth,
+                error=error,
+            )
+        )
+
+    def report(self) -> str:
+        lines = ["Startup profile:"]
+        for p in sorted(self.phases, key=lambda p: (p.start_s, p.depth)):
+            status = f" [{p.error}]" if p.error else ""
+            lines.append(f"  {'  ' * p.depth}{p.name:<{40 - 2 * p.depth}} {p.duration_s * 1000:9.1f} ms{status}")
+        return "\n".join(lines)
+
+    def save(self, path: os.PathLike) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump([p._asdict() for p in self.phases], f, indent=2)
+
+
+class CheckResult(NamedTuple):
+    name: str
+    value: Any
+    duration_s: float
+    error: Optional[str] = None
+    timed_out: bool = False
+
+    @property
+    def ok(self) -> bool:
+        """Whether the check completed. The meaning of `value` is up to the caller."""
+        return self.error is None and not self.timed_out
+
+
+def run_checks(
+    checks: Dict[str, Callable[[], Any]], timeout_s: float = DEFAULT_CHECK_TIMEOUT_S
+) -> Dict[str, CheckResult]:
+    """
+    Runs independent checks concurrently, and waits for them up to a shared deadline.
+
+    Checks run on daemon threads, so a check blocked on an unresponsive share is abandoned
+    after the deadline and does not keep the process alive.
+
+    Args:
+        checks (Dict[str, Callable[[], Any]]): The checks, by name.
+        timeout_s (float): The deadline, in seconds, for all checks.
+
+    Returns:
+        Dict[str, CheckResult]: The results, in the order of `checks`.
+    """
+    results: Dict[str, CheckResult] = {}
+    lock = threading.Lock()
+
+    def run(name: str, check: Callable[[], Any]) -> None:
+        start = time.perf_counter()
+        try:
+            result = CheckResult(name, check(), time.perf_counter() - start)
+        except Exception as e:
+            result = CheckResult(name, None, time.perf_counter() - start, error=f"{type(e).__name__}: {e}")
+        with lock:
+            results[name] = result
+
+    threads = [
+        threading.Thread(target=run, args=(name, check), name=f"check-{name}", daemon=True)
+        for name, check in checks.items()
+    ]
+    deadline = time.perf_counter() + timeout_s
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.perf_counter()))
+    with lock:
+        return {name: results.get(name, CheckResult(name, None, timeout_s, timed_out=True)) for name in checks}
+
+
+class ConcurrentResourceMonitor(resource_monitor.ResourceMonitor):
+    """
+    Resource monitor that evaluates its constraints concurrently. A constraint that does not
+    complete within `timeout_s` fails. Unlike the base monitor, every failing constraint is logged.
+    """
+
+    def __init__(self, *args, timeout_s: float = DEFAULT_CHECK_TIMEOUT_S, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.timeout_s = timeout_s
+        self.last_results: Dict[str, CheckResult] = {}
+
+    def evaluate_constraints(self) -> bool:
+        counts = Counter(c.name for c in self.constraints)
+        names = [c.name if counts[c.name] == 1 else f"{c.name}[{i}]" for i, c in enumerate(self.constraints)]
+        self.last_results = run_checks(dict(zip(names, self.constraints)), self.timeout_s)
+        passed = True
+        for name, constraint in zip(names, self.constraints):
+            result = self.last_results[name]
+            if result.timed_out:
+                logger.error("Constraint %s timed out after %.1f s.", constraint.name, self.timeout_s)
+            elif result.error is not None:
+                logger.error("Constraint %s raised. %s", constraint.name, result.error)
+            elif not result.value:
+                logger.error(constraint.on_fail())
+            else:
+                continue
+            passed = False
+        return passed
+
+
+def list_directories(*paths: os.PathLike) -> Dict[str, List[str]]:
+    """Lists the entries of each directory. Used to check, and warm up, the config library."""
+    return {str(p): sorted(os.listdir(p)) for p in paths if Path(p).is_dir()}
@@ -0,0 +1,275 @@
+"""Disk footprint estimates for the resource monitor.
+
+The size of a session is dominated by the videos, so it is estimated from the camera settings of
+the rig (frame rate, region of interest, binning and video writer) and the expected session
+duration, plus the rate at which the Harp devices log. The estimates are intentionally
+conservative: running out of disk space mid-session loses data.
+"""
+
+import logging
+import os
+import re
+import shutil
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+import aind_behavior_experiment_launcher.launcher.behavior_launcher as behavior_launcher
+import aind_behavior_services.rig as rig
+from aind_behavior_experiment_launcher import resource_monitor
+
+from aind_behavior_force_foraging.compression import CompressionSettings, queued_sessions, uncompressed_harp_files
+from aind_behavior_force_foraging.rig import AindForceForagingRig
+from aind_behavior_force_foraging.startup import DEFAULT_CHECK_TIMEOUT_S, ConcurrentResourceMonitor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXPECTED_DURATION_S = 2 * 3600
+DEFAULT_SAFETY_FACTOR = 1.25
+DEFAULT_SENSOR_SHAPE = (1080, 1440)  # (height, width), used when the region of interest is not set
+DEFAULT_WEBCAM_SHAPE = (480, 640)
+
+# Encoded bytes per pixel at the reference quality of each writer. For FFMPEG, the estimate is
+# halved every 6 steps of -cq/-crf above the reference, the usual rule of thumb for h264/h265.
+_FFMPEG_REFERENCE_QUALITY = 12
+_FFMPEG_REFERENCE_BYTES_PER_PIXEL = 0.15
+_OPENCV_BYTES_PER_PIXEL = 0.25
+_FFMPEG_QUALITY_PATTERN = re.compile(r"-(?:cq|crf|qp)(?::v)?\s+(\d+(?:\.\d+)?)")
+
+# Approximate logging rate, in bytes per second, of each Harp device of the rig.
+HARP_BYTES_PER_SECOND: Dict[str, float] = {
+    "harp_behavior": 25e3,  # Analog data at 1 kHz, digital inputs and camera triggers
+    "harp_lickometer": 1e3,
+    "harp_load_cells": 30e3,  # 8 channels at 1 kHz
+    "harp_clock_generator": 0.5e3,
+    "harp_analog_input": 40e3,  # 12 channels at 1 kHz
+    "harp_environment_sensor": 0.5e3,
+    "manipulator": 2e3,
+}
+
+
+class SessionFootprint(NamedTuple):
+    """Estimated disk usage of a session, in bytes."""
+
+    videos: Dict[str, float]
+    harp: Dict[str, float]
+    duration_s: float
+
+    @property
+    def video_bytes(self) -> float:
+        return sum(self.videos.values())
+
+    @property
+    def harp_bytes(self) -> float:
+        return sum(self.harp.values())
+
+    @property
+    def total_bytes(self) -> float:
+        return self.video_bytes + self.harp_bytes
+
+
+def encoded_bytes_per_pixel(video_writer: Optional[rig.VideoWriter]) -> float:
+    """Estimates the encoded size of a pixel for a video writer. Returns 0 if no video is written."""
+    if video_writer is None:
+        return 0.0
+    if isinstance(video_writer, rig.VideoWriterFfmpeg):
+        match = _FFMPEG_QUALITY_PATTERN.search(video_writer.output_arguments)
+        quality = float(match.group(1)) if match else _FFMPEG_REFERENCE_QUALITY
+        return _FFMPEG_REFERENCE_BYTES_PER_PIXEL * 2 ** (-(quality - _FFMPEG_REFERENCE_QUALITY) / 6)
+    return _OPENCV_BYTES_PER_PIXEL
+
+
+def camera_shape(camera: rig.CameraTypes, sensor_shape: Tuple[int, int] = DEFAULT_SENSOR_SHAPE) -> Tuple[int, int]:
+    """Returns the (height, width) of the frames acquired by a camera, after binning."""
+    if isinstance(camera, rig.SpinnakerCamera):
+        roi = camera.region_of_interest
+        height = roi.height if roi.height > 0 else sensor_shape[0]
+        width = roi.width if roi.width > 0 else sensor_shape[1]
+        return height // camera.binning, width // camera.binning
+    return DEFAULT_WEBCAM_SHAPE
+
+
+def camera_bytes_per_second(
+    camera: rig.CameraTypes, frame_rate: Optional[float], sensor_shape: Tuple[int, int] = DEFAULT_SENSOR_SHAPE
+) -> float:
+    """
+    Estimates the rate at which a camera writes to disk.
+
+    Args:
+        camera (rig.CameraTypes): The camera.
+        frame_rate (Optional[float]): The acquisition frame rate. If None, the frame rate of the video writer is used.
+        sensor_shape (Tuple[int, int]): Sensor (height, width), used when the region of interest is not set.
+
+    Returns:
+        float: The estimated bytes per second.
+    """
+    if camera.video_writer is None:
+        return 0.0
+    frame_rate = frame_rate if frame_rate is not None else camera.video_writer.frame_rate
+    height, width = camera_shape(camera, sensor_shape)
+    return height * width * frame_rate * encoded_bytes_per_pixel(camera.video_writer)
+
+
+def estimate_session_footprint(
+    rig_schema: AindForceForagingRig,
+    duration_s: float = DEFAULT_EXPECTED_DURATION_S,
+    sensor_shape: Tuple[int, int] = DEFAULT_SENSOR_SHAPE,
+) -> SessionFootprint:
+    """
+    Estimates the disk usage of a session acquired with a rig.
+
+    Args:
+        rig_schema (AindForceForagingRig): The rig.
+        duration_s (float): The expected session duration, in seconds.
+        sensor_shape (Tuple[int, int]): Sensor (height, width), used when the region of interest is not set.
+
+    Returns:
+        SessionFootprint: The estimate, per camera and per Harp device.
+    """
+    videos: Dict[str, float] = {}
+    for controller in (rig_schema.triggered_camera_controller, rig_schema.monitoring_camera_controller):
+        if controller is None:
+            continue
+        # Webcams are not triggered, and run at the frame rate of their writer.
+        frame_rate = controller.frame_rate if controller is rig_schema.triggered_camera_controller else None
+        for name, camera in controller.cameras.items():
+            videos[name] = camera_bytes_per_second(camera, frame_rate, sensor_shape) * duration_s
+    harp = {name: rate * duration_s for name, rate in HARP_BYTES_PER_SECOND.items() if getattr(rig_schema, name, None)}
+    return SessionFootprint(videos=videos, harp=harp, duration_s=duration_s)
+
+
+def pending_post_session_bytes(data_dir: os.PathLike, max_workers: Optional[int] = None) -> int:
+    """
+    Returns the transient space that the post-session stage of queued sessions may still claim on the drive.
+
+    Only sessions queued for the post-session stage, and not released yet, are counted. Files already
+    on disk are accounted for by the free space of the drive, so only the headroom needed by the
+    compressed copies being written is added: the largest Harp log still to be compressed, once per worker.
+    Every queued session runs its own post-session process, so their headroom adds up.
+
+    Args:
+        data_dir (os.PathLike): The data directory.
+        max_workers (Optional[int]): Number of compression workers. Defaults to the number of processors.
+
+    Returns:
+        int: The headroom, in bytes.
+    """
+    workers = max_workers if max_workers is not None else os.cpu_count() or 1
+    pending = 0
+    for session in queued_sessions(data_dir):
+        pending += max((p.stat().st_size for p in uncompressed_harp_files(session)), default=0) * workers
+    return pending
+
+
+def _session_fits(
+    launcher: behavior_launcher.BehaviorLauncher,
+    data_dir: os.PathLike,
+    duration_s: float,
+    safety_factor: float,
+    sensor_shape: Tuple[int, int],
+    warn_only: bool,
+    compression_settings: Optional[CompressionSettings] = None,
+) -> bool:
+    try:
+        rig_schema = launcher.rig_schema
+    except ValueError:
+        logger.debug("Rig not selected yet. Skipping the predictive storage check.")
+        return True
+    footprint = estimate_session_footprint(rig_schema, duration_s, sensor_shape)
+    compression_workers = compression_settings.max_workers if compression_settings is not None else None
+    required = footprint.total_bytes * safety_factor + pending_post_session_bytes(data_dir, compression_workers)
+    free = shutil.disk_usage(_existing_parent(data_dir)).free
+    logger.info(
+        "Estimated session footprint: %.1f GB (videos %.1f GB, harp %.1f GB) for %.0f minutes. %.1f GB free.",
+        footprint.total_bytes / 1e9,
+        footprint.video_bytes / 1e9,
+        footprint.harp_bytes / 1e9,
+        duration_s / 60,
+        free / 1e9,
+    )
+    if free >= required:
+        return True
+    if warn_only:
+        logger.warning("Session may not fit on disk: %.1f GB required, %.1f GB free.", required / 1e9, free / 1e9)
+        return True
+    return False
+
+
+def _fail_message(
+    launcher: behavior_launcher.BehaviorLauncher, data_dir: os.PathLike, duration_s: float, **kwargs
+) -> str:
+    return (
+        f"Drive of {data_dir} does not have enough space for a {duration_s / 60:.0f} minutes session "
+        f"with the selected rig. Free some space, or transfer pending sessions."
+    )
+
+
+def _existing_parent(path: os.PathLike) -> Path:
+    path = Path(path).absolute()
+    return next(p for p in (path, *path.parents) if p.exists())
+
+
+def predictive_storage_constraint_factory(
+    launcher: behavior_launcher.BehaviorLauncher,
+    data_dir: os.PathLike,
+    duration_s: float = DEFAULT_EXPECTED_DURATION_S,
+    safety_factor: float = DEFAULT_SAFETY_FACTOR,
+    sensor_shape: Tuple[int, int] = DEFAULT_SENSOR_SHAPE,
+    warn_only: bool = False,
+    compression_settings: Optional[CompressionSettings] = None,
+) -> resource_monitor.Constraint:
+    """
+    Creates a constraint that passes if the drive of `data_dir` can hold the next session.
+
+    The footprint is estimated from the rig selected in the launcher, so the constraint always
+    passes until a rig is selected and must be evaluated again before the session starts.
+
+    Args:
+        launcher (BehaviorLauncher): The launcher the rig is read from.
+        data_dir (os.PathLike): The directory the session is written to.
+        duration_s (float): The expected session duration, in seconds.
+        safety_factor (float): Multiplier applied to the estimated footprint.
+        sensor_shape (Tuple[int, int]): Sensor (height, width), used when the region of interest is not set.
+        warn_only (bool): Log a warning instead of failing. Defaults to False.
+        compression_settings (Optional[CompressionSettings]): The settings of the post-session compression,
+            whose number of workers sets the headroom of queued sessions. See `pending_post_session_bytes`.
+
+    Returns:
+        Constraint: The constraint.
+    """
+    return resource_monitor.Constraint(
+        name="predictive_storage",
+        constraint=_session_fits,
+        kwargs={
+            "launcher": launcher,
+            "data_dir": data_dir,
+            "duration_s": duration_s,
+            "safety_factor": safety_factor,
+            "sensor_shape": sensor_shape,
+            "warn_only": warn_only,
+            "compression_settings": compression_settings,
+        },
+        fail_msg_handler=_fail_message,
+    )
+
+
+def resource_monitor_factory(
+    data_dir: os.PathLike,
+    remote_dir: Optional[os.PathLike] = None,
+    timeout_s: float = DEFAULT_CHECK_TIMEOUT_S,
+    **kwargs,
+) -> Callable[[behavior_launcher.BehaviorLauncher], ConcurrentResourceMonitor]:
+    return partial(_resource_monitor_factory, data_dir=data_dir, remote_dir=remote_dir, timeout_s=timeout_s, **kwargs)
+
+
+def _resource_monitor_factory(
+    launcher: behavior_launcher.BehaviorLauncher,
+    data_dir: os.PathLike,
+    remote_dir: Optional[os.PathLike] = None,
+    timeout_s: float = DEFAULT_CHECK_TIMEOUT_S,
+    **kwargs,
+) -> ConcurrentResourceMonitor:
+    constraints = [predictive_storage_constraint_factory(launcher, data_dir, **kwargs)]
+    if remote_dir is not None:
+        constraints.append(resource_monitor.remote_dir_exists_constraint_factory(Path(remote_dir)))
+    return ConcurrentResourceMonitor(constrains=constraints, timeout_s=timeout_s)
@@ -0,0 +1,261 @@
+"""Resource telemetry recorded while a session runs.
+
+A background thread samples CPU and memory usage, disk write throughput, free space on the data
+drive and the latency of the network share, and appends one fixed-size record per sample to a
+binary file in the session directory. Samples that cross a threshold raise an alert.
+
+CPU, memory and disk throughput require the optional `psutil` package. Without it, these columns
+are recorded as NaN.
+"""
+
+import logging
+import os
+import shutil
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+import aind_behavior_experiment_launcher.launcher.behavior_launcher as behavior_launcher
+import numpy as np
+
+from aind_behavior_force_foraging import dataset
+
+logger = logging.getLogger(__name__)
+
+TELEMETRY_MAGIC = b"FFTELMTY"
+TELEMETRY_VERSION = 1
+TELEMETRY_DTYPE = np.dtype(
+    [
+        ("time", "<f8"),
+        ("cpu_percent", "<f4"),
+        ("memory_percent", "<f4"),
+        ("disk_write_bytes_per_s", "<f4"),
+        ("free_bytes", "<f8"),
+        ("share_latency_s", "<f4"),
+    ]
+)
+METRICS = TELEMETRY_DTYPE.names[1:]
+
+_HEADER = struct.Struct("<8sHxxd")  # magic, version, interval_s
+_HEADER_SIZE = 64
+
+
+class Threshold(NamedTuple):
+    """Raises an alert when `metric` goes above `above`, or below `below`."""
+
+    metric: str
+    above: Optional[float] = None
+    below: Optional[float] = None
+
+    def is_crossed(self, value: float) -> bool:
+        if np.isnan(value):
+            return False
+        return (self.above is not None and value > self.above) or (self.below is not None and value < self.below)
+
+
+class Alert(NamedTuple):
+    time: float
+    threshold: Threshold
+    value: float
+
+
+DEFAULT_THRESHOLDS = (
+    Threshold("cpu_percent", above=90),
+    Threshold("memory_percent", above=90),
+    Threshold("free_bytes", below=2e10),
+    Threshold("share_latency_s", above=1.0),
+)
+
+
+def log_alert(alert: Alert) -> None:
+    logger.warning(
+        "Resource alert: %s = %.3g crossed threshold (above=%s, below=%s).",
+        alert.threshold.metric,
+        alert.value,
+        alert.threshold.above,
+        alert.threshold.below,
+    )
+
+
+class TelemetrySampler:
+    """
+    Samples resource usage in a background thread and appends it to a telemetry file.
+
+    Alerts are edge triggered: a threshold raises an alert when it is crossed, and again only
+    after the metric has returned within bounds.
+
+    Example:
+        with TelemetrySampler("session/Behavior/Logs/telemetry.bin", data_dir="C:/Data"):
+            run_session()
+    """
+
+    def __init__(
+        self,
+        path: os.PathLike,
+        data_dir: os.PathLike,
+        remote_dir: Optional[os.PathLike] = None,
+        interval_s: float = 1.0,
+        thresholds: Sequence[Threshold] = DEFAULT_THRESHOLDS,
+        on_alert: Callable[[Alert], None] = log_alert,
+    ):
+        for threshold in thresholds:
+            if threshold.metric not in METRICS:
+                raise ValueError(f"Unknown metric {threshold.metric}. Expected one of {METRICS}.")
+        self.path = Path(path)
+        self.data_dir = Path(data_dir)
+        self.remote_dir = Path(remote_dir) if remote_dir is not None else None
+        self.interval_s = interval_s
+        self.thresholds = list(thresholds)
+        self.on_alert = on_alert
+        self.alerts: List[Alert] = []
+        self._crossed = [False] * len(self.thresholds)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._latency_executor: Optional[ThreadPoolExecutor] = None
+        self._psutil = _try_import_psutil()
+        self._last_write_bytes: Optional[float] = None
+        self._last_time: Optional[float] = None
+
+    def __enter__(self) -> "TelemetrySampler":
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            raise RuntimeError("Telemetry sampler is already running.")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "wb") as f:
+            f.write(_HEADER.pack(TELEMETRY_MAGIC, TELEMETRY_VERSION, self.interval_s).ljust(_HEADER_SIZE, b"\x00"))
+        self._stop.clear()
+        if self._psutil is not None:
+            self._psutil.cpu_percent(interval=None)  # The first call only sets the reference.
+        self._thread = threading.Thread(target=self._run, name="TelemetrySampler", daemon=True)
+        self._thread.start()
+        logger.info("Recording resource telemetry to %s.", self.path)
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        if self._latency_executor is not None:
+            self._latency_executor.shutdown(wait=False, cancel_futures=True)
+            self._latency_executor = None
+
+    def _run(self) -> None:
+        with open(self.path, "ab") as f:
+            while True:
+                record = self.sample()
+                f.write(record.tobytes())
+                f.flush()
+                self._check_thresholds(record)
+                if self._stop.wait(self.interval_s):
+                    return
+
+    def sample(self) -> np.ndarray:
+        """Takes a single sample. Metrics that are not available are NaN."""
+        record = np.full(1, np.nan, dtype=TELEMETRY_DTYPE)
+        now = time.time()
+        record["time"] = now
+        if self._psutil is not None:
+            record["cpu_percent"] = self._psutil.cpu_percent(interval=None)
+            record["memory_percent"] = self._psutil.virtual_memory().percent
+            counters = self._psutil.disk_io_counters()
+            if counters is not None:
+                if self._last_write_bytes is not None and now > self._last_time:
+                    record["disk_write_bytes_per_s"] = (counters.write_bytes - self._last_write_bytes) / (
+                        now - self._last_time
+                    )
+                self._last_write_bytes = counters.write_bytes
+        self._last_time = now
+        try:
+            record["free_bytes"] = shutil.disk_usage(self.data_dir).free
+        except OSError as e:
+            logger.debug("Failed to read free space of %s. %s", self.data_dir, e)
+        if self.remote_dir is not None:
+            record["share_latency_s"] = self._share_latency()
+        return record
+
+    def _share_latency(self) -> float:
+        """Time to stat the network share. A share that does not answer within the interval is reported as inf."""
+        if self._latency_executor is None:
+            self._latency_executor = ThreadPoolExecutor(max_workers=1)
+        start = time.perf_counter()
+        future = self._latency_executor.submit(os.stat, self.remote_dir)
+        try:
+            future.result(timeout=self.interval_s)
+        except FutureTimeoutError:
+            logger.debug("Network share %s did not answer within %s s.", self.remote_dir, self.interval_s)
+            return np.inf
+        except OSError:
+            return np.nan
+        return time.perf_counter() - start
+
+    def _check_thresholds(self, record: np.ndarray) -> None:
+        for i, threshold in enumerate(self.thresholds):
+            value = float(record[threshold.metric][0])
+            crossed = threshold.is_crossed(value)
+            if crossed and not self._crossed[i]:
+                alert = Alert(time=float(record["time"][0]), threshold=threshold, value=value)
+                self.alerts.append(alert)
+                try:
+                    self.on_alert(alert)
+                except Exception as e:
+                    logger.error("Telemetry alert handler failed. %s", e)
+            self._crossed[i] = crossed
+
+
+def read_telemetry(path: os.PathLike) -> np.ndarray:
+    """Reads a telemetry file. A partially written last record is ignored."""
+    with open(path, "rb") as f:
+        magic, version, _ = _HEADER.unpack(f.read(_HEADER.size))
+    if magic != TELEMETRY_MAGIC:
+        raise ValueError(f"{path} is not a telemetry file.")
+    if version != TELEMETRY_VERSION:
+        raise ValueError(f"Unsupported telemetry version {version}. Expected {TELEMETRY_VERSION}.")
+    n_records = (Path(path).stat().st_size - _HEADER_SIZE) // TELEMETRY_DTYPE.itemsize
+    return np.fromfile(path, dtype=TELEMETRY_DTYPE, count=n_records, offset=_HEADER_SIZE)
+
+
+def telemetry_summary(telemetry: np.ndarray) -> Dict[str, float]:
+    """Returns the maximum of each metric, and the minimum free space, ignoring missing samples."""
+    summary: Dict[str, float] = {}
+    for metric in METRICS:
+        values = telemetry[metric].astype(np.float64)
+        reduce, prefix = (np.nanmin, "min") if metric == "free_bytes" else (np.nanmax, "max")
+        summary[f"{prefix}_{metric}"] = float(reduce(values)) if np.isfinite(values).any() else np.nan
+    return summary
+
+
+def _try_import_psutil():
+    try:
+        import psutil
+    except ImportError:
+        logger.warning("psutil is not installed. CPU, memory and disk throughput will not be recorded.")
+        return None
+    return psutil
+
+
+def telemetry_sampler_factory(
+    data_dir: os.PathLike, remote_dir: Optional[os.PathLike] = None, **kwargs
+) -> Callable[[behavior_launcher.BehaviorLauncher], TelemetrySampler]:
+    return partial(_telemetry_sampler_factory, data_dir=data_dir, remote_dir=remote_dir, **kwargs)
+
+
+def _telemetry_sampler_factory(
+    launcher: behavior_launcher.BehaviorLauncher,
+    data_dir: os.PathLike,
+    remote_dir: Optional[os.PathLike] = None,
+    **kwargs,
+) -> TelemetrySampler:
+    path = launcher.session_directory / dataset.BEHAVIOR_DIR / dataset.LOGS_DIR / dataset.TELEMETRY_FILE
+    return TelemetrySampler(path, data_dir=data_dir, remote_dir=remote_dir, **kwargs)
@@ -0,0 +1,146 @@
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+from aind_behavior_services.data_types import SoftwareEvent
+
+logger = logging.getLogger(__name__)
+
+TRIAL_EVENT = "Trial"
+QUIESCENCE_PERIOD_EVENT = "QuiescencePeriod"
+INITIATION_PERIOD_EVENT = "InitiationPeriod"
+RESPONSE_PERIOD_EVENT = "ResponsePeriod"
+HARVEST_ACTION_SELECTED_EVENT = "HarvestActionSelected"
+GIVE_REWARD_EVENT = "GiveReward"
+TRIAL_OUTCOME_EVENT = "TrialOutcome"
+
+TRIAL_EVENTS = (
+    TRIAL_EVENT,
+    QUIESCENCE_PERIOD_EVENT,
+    INITIATION_PERIOD_EVENT,
+    RESPONSE_PERIOD_EVENT,
+    HARVEST_ACTION_SELECTED_EVENT,
+    GIVE_REWARD_EVENT,
+    TRIAL_OUTCOME_EVENT,
+)
+
+_PERIOD_COLUMNS = {
+    QUIESCENCE_PERIOD_EVENT: "quiescence_period_start_time",
+    INITIATION_PERIOD_EVENT: "initiation_period_start_time",
+    RESPONSE_PERIOD_EVENT: "response_period_start_time",
+    HARVEST_ACTION_SELECTED_EVENT: "harvest_action_selected_time",
+    TRIAL_OUTCOME_EVENT: "outcome_time",
+}
+
+HARVEST_ACTION_FIELDS = (
+    "harvest_mode",
+    "probability",
+    "amount",
+    "delay",
+    "force_duration",
+    "upper_force_threshold",
+    "lower_force_threshold",
+    "is_operant",
+)
+
+TRIAL_TABLE_COLUMNS = (
+    ["start_time", *_PERIOD_COLUMNS.values(), "trial_number", "selected_action", "is_aborted", "reward"]
+    + ["reward_count", "reward_amount"]
+    + [f"{side}_{field}" for side in ("left", "right") for field in HARVEST_ACTION_FIELDS]
+)
+
+
+def build_trial_table(events: Iterable[SoftwareEvent]) -> pd.DataFrame:
+    """
+    Builds a table with one row per trial from the software events logged by the task.
+
+    Trials are delimited by consecutive `Trial` events. Every other trial event is assigned to
+    the trial that was active at its timestamp using a single sorted search.
+
+    Args:
+        events (Iterable[SoftwareEvent]): Software events. Events that are not trial events, or have no
+            timestamp, are ignored.
+
+    Returns:
+        pd.DataFrame: The trial table, indexed by trial.
+    """
+    names: List[str] = []
+    timestamps: List[float] = []
+    data: List[Any] = []
+    for event in events:
+        if event.name in TRIAL_EVENTS and event.timestamp is not None:
+            names.append(event.name)
+            timestamps.append(event.timestamp)
+            data.append(event.data)
+
+    _names = np.asarray(names, dtype=object)
+    _timestamps = np.asarray(timestamps, dtype=np.float64)
+    order = np.argsort(_timestamps, kind="stable")
+    _names, _timestamps = _names[order], _timestamps[order]
+    data = [data[i] for i in order]
+
+    is_trial = _names == TRIAL_EVENT
+    start_times = _timestamps[is_trial]
+    n_trials = len(start_times)
+    table = pd.DataFrame(index=pd.RangeIndex(n_trials, name="trial"), columns=TRIAL_TABLE_COLUMNS)
+    if n_trials == 0:
+        return table
+
+    trial_index = np.searchsorted(start_times, _timestamps, side="right") - 1
+    in_trial = trial_index >= 0
+    table["start_time"] = start_times
+
+    for name, column in _PERIOD_COLUMNS.items():
+        table[column] = _first_per_trial(_timestamps, trial_index, (_names == name) & in_trial, n_trials)
+
+    is_reward = (_names == GIVE_REWARD_EVENT) & in_trial
+    reward_amount = np.array([_to_float(data[i]) for i in np.flatnonzero(is_reward)], dtype=np.float64)
+    table["reward_count"] = np.bincount(trial_index[is_reward], minlength=n_trials)
+    table["reward_amount"] = np.bincount(
+        trial_index[is_reward], weights=np.nan_to_num(reward_amount), minlength=n_trials
+    )
+
+    outcomes = _last_data_per_trial(data, trial_index, (_names == TRIAL_OUTCOME_EVENT) & in_trial, n_trials)
+    selected = _last_data_per_trial(data, trial_index, (_names == HARVEST_ACTION_SELECTED_EVENT) & in_trial, n_trials)
+    table["trial_number"] = pd.array([_get(o, "TrialNumber") for o in outcomes], dtype="Int64")
+    table["is_aborted"] = pd.array([_get(o, "IsAborted") for o in outcomes], dtype="boolean")
+    table["reward"] = pd.array([_to_float(_get(o, "Reward")) for o in outcomes], dtype="Float64")
+    table["selected_action"] = [
+        _get(s, "action") if s is not None else _get(_get(o, "HarvestAction"), "action")
+        for s, o in zip(selected, outcomes)
+    ]
+
+    trials = [data[i] for i in np.flatnonzero(is_trial)]
+    for side in ("left", "right"):
+        harvest = [_get(t, f"{side}_harvest") for t in trials]
+        for field in HARVEST_ACTION_FIELDS:
+            table[f"{side}_{field}"] = [_get(h, field) for h in harvest]
+    return table
+
+
+def _first_per_trial(values: np.ndarray, trial_index: np.ndarray, mask: np.ndarray, n_trials: int) -> np.ndarray:
+    out = np.full(n_trials, np.nan)
+    trials, first = np.unique(trial_index[mask], return_index=True)
+    out[trials] = values[mask][first]
+    return out
+
+
+def _last_data_per_trial(data: List[Any], trial_index: np.ndarray, mask: np.ndarray, n_trials: int) -> List[Any]:
+    out: List[Any] = [None] * n_trials
+    for i in np.flatnonzero(mask):
+        out[trial_index[i]] = data[i]
+    return out
+
+
+def _get(value: Optional[Dict[str, Any]], key: str) -> Any:
+    if isinstance(value, dict):
+        return value.get(key, None)
+    return None
+
+
+def _to_float(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
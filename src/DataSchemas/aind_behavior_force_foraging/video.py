@@ -0,0 +1,345 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import av
+import numpy as np
+import pandas as pd
+
+from aind_behavior_force_foraging import dataset
+from aind_behavior_force_foraging.frame_index import FrameIndex, load_frame_index
+from aind_behavior_force_foraging.rig import AindForceForagingRig
+
+logger = logging.getLogger(__name__)
+
+VIDEO_INDEX_SUFFIX = ".keyframes.npz"
+DEFAULT_PIXEL_FORMAT = "rgb24"
+DEFAULT_CLIP_CODEC = "libx264"
+_WINDOWS_PER_TASK = 16
+
+
+class VideoIndex(NamedTuple):
+    """Presentation timestamps of every frame of a video stream and the frame numbers of its keyframes."""
+
+    pts: np.ndarray
+    keyframes: np.ndarray
+    time_base: Fraction
+
+    def keyframe_before(self, frame: int) -> int:
+        """Returns the last keyframe at, or before, `frame`."""
+        return int(self.keyframes[max(np.searchsorted(self.keyframes, frame, side="right") - 1, 0)])
+
+
+class Window(NamedTuple):
+    camera: str
+    start: float
+    stop: float
+
+
+def build_video_index(video_path: os.PathLike) -> VideoIndex:
+    """
+    Indexes the frames and keyframes of a video by demuxing its packets. No frame is decoded.
+
+    Args:
+        video_path (os.PathLike): The video file.
+
+    Returns:
+        VideoIndex: The index.
+    """
+    with av.open(str(video_path)) as container:
+        stream = container.streams.video[0]
+        pts: List[int] = []
+        is_keyframe: List[bool] = []
+        for packet in container.demux(stream):
+            if packet.pts is None:
+                continue
+            pts.append(packet.pts)
+            is_keyframe.append(packet.is_keyframe)
+        time_base = stream.time_base
+    _pts = np.asarray(pts, dtype=np.int64)
+    order = np.argsort(_pts, kind="stable")  # Decode order to presentation order
+    keyframes = np.flatnonzero(np.asarray(is_keyframe, dtype=bool)[order])
+    if len(keyframes) == 0 and len(_pts) > 0:
+        raise ValueError(f"Video {video_path} has no keyframes.")
+    return VideoIndex(pts=_pts[order], keyframes=keyframes, time_base=time_base)
+
+
+def video_index_file(video_path: os.PathLike) -> Path:
+    return Path(video_path).with_suffix(VIDEO_INDEX_SUFFIX)
+
+
+def load_video_index(video_path: os.PathLike, build_if_stale: bool = True) -> VideoIndex:
+    """
+    Loads the keyframe index of a video from its sidecar, (re)building it first if it is missing
+    or older than the video.
+    """
+    video_path = Path(video_path)
+    sidecar = video_index_file(video_path)
+    if not sidecar.exists() or sidecar.stat().st_mtime < video_path.stat().st_mtime:
+        if not build_if_stale:
+            raise FileNotFoundError(f"Video index {sidecar} is missing or out of date.")
+        index = build_video_index(video_path)
+        with open(sidecar, "wb") as f:
+            np.savez(
+                f,
+                pts=index.pts,
+                keyframes=index.keyframes,
+                time_base=np.array([index.time_base.numerator, index.time_base.denominator]),
+            )
+        return index
+    with np.load(sidecar) as data:
+        return VideoIndex(
+            pts=data["pts"], keyframes=data["keyframes"], time_base=Fraction(*(int(v) for v in data["time_base"]))
+        )
+
+
+class VideoReader:
+    """Random access reader that seeks to the closest preceding keyframe instead of decoding from the start."""
+
+    def __init__(
+        self, video_path: os.PathLike, index: Optional[VideoIndex] = None, pixel_format: str = DEFAULT_PIXEL_FORMAT
+    ):
+        self.video_path = Path(video_path)
+        self.index = index if index is not None else load_video_index(video_path)
+        self.pixel_format = pixel_format
+        self._container = av.open(str(self.video_path))
+        self._stream = self._container.streams.video[0]
+        self._stream.thread_type = "AUTO"
+
+    def __len__(self) -> int:
+        return len(self.index.pts)
+
+    def __enter__(self) -> "VideoReader":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._container.close()
+
+    @property
+    def frame_rate(self) -> Optional[Fraction]:
+        """The average frame rate of the stream, or, if the container does not set it, the median frame
+        interval of the index in units of the stream time base. None if neither is known."""
+        if self._stream.average_rate:
+            return self._stream.average_rate
+        if len(self.index.pts) < 2:
+            return None
+        return 1 / (self.index.time_base * int(np.median(np.diff(self.index.pts))))
+
+    def read(self, start: int, stop: int) -> np.ndarray:
+        """
+        Decodes the frames in [`start`, `stop`).
+
+        Args:
+            start (int): The first frame number.
+            stop (int): The frame number after the last frame.
+
+        Returns:
+            np.ndarray: The frames, with shape (n_frames, height, width[, channels]).
+        """
+        start, stop = max(start, 0), min(stop, len(self))
+        if start >= stop:
+            return self._empty()
+        first_pts, last_pts = int(self.index.pts[start]), int(self.index.pts[stop - 1])
+        keyframe_pts = int(self.index.pts[self.index.keyframe_before(start)])
+        self._container.seek(keyframe_pts, stream=self._stream, backward=True, any_frame=False)
+        frames = []
+        for frame in self._container.decode(self._stream):
+            if frame.pts is None or frame.pts < first_pts:
+                continue
+            if frame.pts > last_pts:
+                break
+            frames.append(frame.to_ndarray(format=self.pixel_format))
+        return np.stack(frames) if frames else self._empty()
+
+    def _empty(self) -> np.ndarray:
+        shape = (0, self._stream.height, self._stream.width)
+        return np.empty(shape + ((3,) if self.pixel_format == DEFAULT_PIXEL_FORMAT else ()), dtype=np.uint8)
+
+
+class SessionVideos:
+    """
+    Trial-aligned access to the triggered camera videos of a session. Harp times are mapped to video
+    frames through the camera frame index (see `frame_index`), and frames are decoded from the
+    closest preceding keyframe.
+    """
+
+    def __init__(
+        self,
+        session_path: os.PathLike,
+        rig: Optional[AindForceForagingRig] = None,
+        pixel_format: str = DEFAULT_PIXEL_FORMAT,
+    ):
+        self.session_path = Path(session_path)
+        self.rig = rig if rig is not None else dataset.read_rig(session_path)
+        if self.rig is None:
+            raise FileNotFoundError(f"No rig configuration found in {session_path}.")
+        self.pixel_format = pixel_format
+        self._frame_indices: Dict[str, FrameIndex] = {}
+        self._video_indices: Dict[str, VideoIndex] = {}
+
+    @property
+    def cameras(self) -> List[str]:
+        return list(self.rig.triggered_camera_controller.cameras.keys())
+
+    def video_path(self, camera: str) -> Path:
+        path = dataset.video_file(self.session_path, camera)
+        if path is None:
+            raise FileNotFoundError(f"No video found for camera {camera} in {self.session_path}.")
+        return path
+
+    def frame_index(self, camera: str) -> FrameIndex:
+        if camera not in self._frame_indices:
+            self._frame_indices[camera] = load_frame_index(self.session_path, camera)
+        return self._frame_indices[camera]
+
+    def video_index(self, camera: str) -> VideoIndex:
+        if camera not in self._video_indices:
+            self._video_indices[camera] = load_video_index(self.video_path(camera))
+        return self._video_indices[camera]
+
+    def frame_range(self, window: Window) -> Tuple[int, int]:
+        """Returns the [start, stop) video frame numbers acquired within the window."""
+        frames = self.frame_index(window.camera).frames_between(window.start, window.stop)
+        return frames.start, frames.stop
+
+    def frames(self, camera: str, start: float, stop: float) -> np.ndarray:
+        """Returns the frames of `camera` acquired between the Harp times `start` and `stop`."""
+        first, last = self.frame_range(Window(camera, start, stop))
+        with VideoReader(self.video_path(camera), self.video_index(camera), self.pixel_format) as reader:
+            return reader.read(first, last)
+
+    def extract(self, windows: Sequence[Window], max_workers: Optional[int] = None) -> List[np.ndarray]:
+        """
+        Decodes many windows in a thread pool. Windows are grouped by camera and sorted, so that each
+        task reads forward through a single open video.
+
+        Args:
+            windows (Sequence[Window]): The windows to extract.
+            max_workers (Optional[int]): Number of threads. Defaults to the `ThreadPoolExecutor` default.
+
+        Returns:
+            List[np.ndarray]: The frames of each window, in the order of `windows`.
+        """
+        tasks = self._plan(windows)
+        results: List[Optional[np.ndarray]] = [None] * len(windows)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for task, frames in zip(tasks, executor.map(self._read_task, tasks)):
+                for (i, _, _), value in zip(task[1], frames):
+                    results[i] = value
+        return results
+
+    def write_clips(
+        self,
+        windows: Sequence[Window],
+        output_dir: os.PathLike,
+        max_workers: Optional[int] = None,
+        codec: str = DEFAULT_CLIP_CODEC,
+        names: Optional[Sequence[str]] = None,
+    ) -> List[Optional[Path]]:
+        """
+        Writes each window as a video clip, at the frame rate of the source video. Windows without any
+        frame are not written.
+
+        Args:
+            windows (Sequence[Window]): The windows to extract.
+            output_dir (os.PathLike): The output directory.
+            max_workers (Optional[int]): Number of threads.
+            codec (str): The clip codec. Defaults to `libx264`.
+            names (Optional[Sequence[str]]): Optional file names, one per window. Defaults to
+                `{camera}_{index}.mp4`.
+
+        Returns:
+            List[Optional[Path]]: The clip paths, in the order of `windows`. None for windows without frames.
+        """
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        names = names if names is not None else [f"{w.camera}_{i:05d}.mp4" for i, w in enumerate(windows)]
+        if len(names) != len(windows):
+            raise ValueError("Names must have the same length as windows.")
+        paths = [output_dir / name for name in names]
+
+        def _write(args: Tuple[Window, Path]) -> Optional[Path]:
+            window, path = args
+            first, last = self.frame_range(window)
+            camera = window.camera
+            with VideoReader(self.video_path(camera), self.video_index(camera), self.pixel_format) as reader:
+                frames = reader.read(first, last)
+                frame_rate = reader.frame_rate or self.rig.triggered_camera_controller.frame_rate
+            if len(frames) == 0:
+                logger.warning("No frames of camera %s between %s and %s, no clip written.", camera, *window[1:])
+                return None
+            if not frame_rate:
+                raise ValueError(f"The frame rate of the video of camera {camera} is unknown.")
+            _write_clip(frames, path, frame_rate, codec)
+            return path
+
+        for camera in {w.camera for w in windows}:  # Load the indices once, before fanning out
+            self.frame_index(camera)
+            self.video_index(camera)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(_write, zip(windows, paths)))
+
+    def _plan(self, windows: Sequence[Window]) -> List[Tuple[str, List[Tuple[int, int, int]]]]:
+        by_camera: Dict[str, List[Tuple[int, int, int]]] = {}
+        for i, window in enumerate(windows):
+            start, stop = self.frame_range(window)
+            by_camera.setdefault(window.camera, []).append((i, start, stop))
+        tasks = []
+        for camera, items in by_camera.items():
+            self.video_index(camera)
+            items.sort(key=lambda item: item[1])
+            tasks.extend((camera, items[i : i + _WINDOWS_PER_TASK]) for i in range(0, len(items), _WINDOWS_PER_TASK))
+        return tasks
+
+    def _read_task(self, task: Tuple[str, List[Tuple[int, int, int]]]) -> List[np.ndarray]:
+        camera, items = task
+        with VideoReader(self.video_path(camera), self.video_index(camera), self.pixel_format) as reader:
+            return [reader.read(start, stop) for _, start, stop in items]
+
+
+def trial_windows(
+    trial_table: pd.DataFrame,
+    camera: str,
+    start_column: str = "response_period_start_time",
+    stop_column: str = "outcome_time",
+    pre: float = 0.0,
+    post: float = 0.0,
+) -> List[Window]:
+    """
+    Builds one window per trial from two columns of a trial table (see `trials.build_trial_table`).
+    Trials where either column is missing are skipped.
+
+    Args:
+        trial_table (pd.DataFrame): The trial table.
+        camera (str): The camera.
+        start_column (str): The column with the start of the window. Defaults to the response period start.
+        stop_column (str): The column with the end of the window. Defaults to the trial outcome.
+        pre (float): Seconds added before the start. Defaults to 0.
+        post (float): Seconds added after the end. Defaults to 0.
+
+    Returns:
+        List[Window]: The windows.
+    """
+    start = pd.to_numeric(trial_table[start_column], errors="coerce")
+    stop = pd.to_numeric(trial_table[stop_column], errors="coerce")
+    valid = start.notna() & stop.notna()
+    return [Window(camera, a - pre, b + post) for a, b in zip(start[valid], stop[valid])]
+
+
+def _write_clip(frames: np.ndarray, path: Path, frame_rate: float, codec: str) -> None:
+    if len(frames) == 0:
+        raise ValueError(f"Can not write the clip {path} without frames.")
+    with av.open(str(path), mode="w") as container:
+        stream = container.add_stream(codec, rate=Fraction(frame_rate).limit_denominator(1000))
+        stream.height, stream.width = frames.shape[1], frames.shape[2]
+        stream.pix_fmt = "yuv420p"
+        pixel_format = "gray" if frames.ndim == 3 else DEFAULT_PIXEL_FORMAT
+        for frame in frames:
+            container.mux(stream.encode(av.VideoFrame.from_ndarray(frame, format=pixel_format)))
+        container.mux(stream.encode())
@@ -0,0 +1,153 @@
+"""Water delivery accounting from the valve commands logged during a session.
+
+The task opens the water valve by writing its open time to the `PulseSupplyPort0` register of the
+Harp behavior board, followed by an `OutputSet` command for `SupplyPort0`. Both commands are logged
+under `HarpCommands/Behavior`. Every opening is paired with the last open time written before it, and
+its volume is read off the rig's water valve calibration curve,
+`Volume = Slope * time + Offset`, for all openings at once.
+"""
+
+import logging
+import os
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+from aind_behavior_experiment_launcher.records.subject import WaterLogResult
+from aind_behavior_services.calibration.water_valve import WaterValveCalibration
+
+from aind_behavior_force_foraging import dataset
+from aind_behavior_force_foraging.harp_io import MessageType, read_harp_messages
+
+logger = logging.getLogger(__name__)
+
+# Register addresses and bits of the Harp Behavior device.yml
+BEHAVIOR_DEVICE = "Behavior"
+OUTPUT_SET_ADDRESS = 34  # Behavior OutputSet
+PULSE_SUPPLY_PORT0_ADDRESS = 49  # Behavior PulseSupplyPort0, in milliseconds
+SUPPLY_PORT0 = 0x8  # Water valve bit of the Behavior DigitalOutputs
+
+
+class WaterDeliveries(NamedTuple):
+    """The water valve openings of a session."""
+
+    time: np.ndarray
+    open_time_s: np.ndarray
+    volume_ml: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    @property
+    def total_ml(self) -> float:
+        return float(np.nansum(self.volume_ml))
+
+
+def valve_openings(
+    pulse_time: np.ndarray, pulse_ms: np.ndarray, output_set_time: np.ndarray, output_set: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pairs every opening of the water valve with the open time in effect when it was commanded.
+
+    Args:
+        pulse_time (np.ndarray): The timestamps of the `PulseSupplyPort0` writes, in seconds.
+        pulse_ms (np.ndarray): The open times written to `PulseSupplyPort0`, in milliseconds.
+        output_set_time (np.ndarray): The timestamps of the `OutputSet` writes, in seconds.
+        output_set (np.ndarray): The `OutputSet` bitmasks.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The time and open time, in seconds, of every opening. Openings
+            commanded before any open time was written have a NaN open time.
+    """
+    order = np.argsort(pulse_time, kind="stable")
+    pulse_time, pulse_ms = np.asarray(pulse_time)[order], np.asarray(pulse_ms, dtype=np.float64)[order]
+    time = np.asarray(output_set_time, dtype=np.float64)[(np.asarray(output_set) & SUPPLY_PORT0) != 0]
+    pulse = np.searchsorted(pulse_time, time, side="right") - 1
+    open_time_s = np.append(pulse_ms * 1e-3, np.nan)[pulse]  # -1 selects the NaN
+    if (pulse < 0).any():
+        logger.warning("%d valve openings were commanded before any open time was set.", int((pulse < 0).sum()))
+    return time, open_time_s
+
+
+def delivered_volume(open_time_s: np.ndarray, calibration: WaterValveCalibration) -> np.ndarray:
+    """
+    Evaluates the calibration curve of the water valve at every open time.
+
+    Args:
+        open_time_s (np.ndarray): The valve open times, in seconds.
+        calibration (WaterValveCalibration): The water valve calibration of the rig.
+
+    Returns:
+        np.ndarray: The volume of every opening, in mL. Never negative.
+    """
+    output = calibration.output
+    open_time_s = np.asarray(open_time_s, dtype=np.float64)
+    if output.valid_domain:
+        outside = (open_time_s < min(output.valid_domain)) | (open_time_s > max(output.valid_domain))
+        if outside.any():
+            logger.warning(
+                "%d valve open times are outside the calibrated domain [%s, %s] s.",
+                int(outside.sum()),
+                min(output.valid_domain),
+                max(output.valid_domain),
+            )
+    return np.maximum(output.slope * open_time_s + output.offset, 0.0)
+
+
+def read_water_deliveries(session_path: os.PathLike, calibration: WaterValveCalibration) -> WaterDeliveries:
+    """
+    Reads the water valve commands of a session and computes the volume of every delivery.
+
+    Manual valve openings, e.g. from the valve GUI, are sent through the same commands and are counted.
+
+    Args:
+        session_path (os.PathLike): The session directory.
+        calibration (WaterValveCalibration): The water valve calibration of the rig.
+
+    Raises:
+        FileNotFoundError: If the `OutputSet` commands were not logged.
+        ValueError: If the valve was opened, but no open time was ever written before an opening.
+
+    Returns:
+        WaterDeliveries: The deliveries.
+    """
+    output_set_file = dataset.find_harp_command_file(session_path, BEHAVIOR_DEVICE, OUTPUT_SET_ADDRESS)
+    if output_set_file is None:
+        raise FileNotFoundError(f"No {BEHAVIOR_DEVICE} OutputSet commands found in session {session_path}.")
+    output_set_time, output_set = _read_writes(output_set_file)
+    pulse_file = dataset.find_harp_command_file(session_path, BEHAVIOR_DEVICE, PULSE_SUPPLY_PORT0_ADDRESS)
+    pulse_time, pulse_ms = _read_writes(pulse_file) if pulse_file is not None else (np.empty(0), np.empty(0))
+    time, open_time_s = valve_openings(pulse_time, pulse_ms, output_set_time, output_set)
+    if len(time) > 0 and np.isnan(open_time_s).all():
+        raise ValueError(f"The water valve was opened {len(time)} times, but no open time was set.")
+    return WaterDeliveries(time=time, open_time_s=open_time_s, volume_ml=delivered_volume(open_time_s, calibration))
+
+
+def water_log_result(
+    deliveries: WaterDeliveries, weight_g: Optional[float] = None, supplement_ml: Optional[float] = None
+) -> WaterLogResult:
+    """Builds the water log of a session, as consumed by `AindSessionDataMapper`, from its deliveries."""
+    earned = deliveries.total_ml
+    return WaterLogResult(
+        weight_g=weight_g,
+        water_earned_ml=earned,
+        water_supplement_delivered_ml=supplement_ml,
+        water_supplement_recommended_ml=None,
+        total_water_ml=earned + (supplement_ml or 0.0),
+    )
+
+
+def session_water_log(session_path: os.PathLike, calibration: WaterValveCalibration) -> Optional[WaterLogResult]:
+    """Computes the water log of a session. Returns None, instead of raising, if it can not be computed."""
+    try:
+        deliveries = read_water_deliveries(session_path, calibration)
+    except (FileNotFoundError, ValueError) as e:
+        logger.warning("Could not compute the water delivered in session %s. %s", session_path, e)
+        return None
+    logger.info("%d water deliveries, %.3f mL, in session %s.", len(deliveries), deliveries.total_ml, session_path)
+    return water_log_result(deliveries)
+
+
+def _read_writes(path: os.PathLike) -> Tuple[np.ndarray, np.ndarray]:
+    messages = read_harp_messages(path)
+    valid = (messages.message_type == MessageType.WRITE) & messages.checksum_ok
+    return messages.timestamp[valid], messages.payload[valid].reshape(-1)
@@ -3,6 +3,7 @@ import importlib.util
 import logging
 from pathlib import Path
 from types import ModuleType
+from typing import Optional, Tuple
 
 EXAMPLES_DIR = Path(__file__).parents[1] / "examples"
 JSON_ROOT = Path("./local").resolve()
@@ -25,3 +26,118 @@ def build_example(script_path: str) -> ModuleType:
 def build_examples(examples_dir: Path = EXAMPLES_DIR):
     for script_path in glob.glob(str(examples_dir / "*.py")):
         _ = build_example(script_path)
+
+
+def write_mock_session(
+    session_path: Path,
+    duration_s: float = 10.0,
+    n_trials: int = 5,
+    load_cells_rate: float = 100.0,
+    video_shape: Optional[Tuple[int, int]] = None,
+    subject: Optional[str] = None,
+) -> Path:
+    """Writes a small synthetic session, with the on-disk layout of an acquired session, to `session_path`."""
+    import sys
+
+    import numpy as np
+    import pandas as pd
+    from aind_behavior_force_foraging import dataset
+    from aind_behavior_force_foraging.harp_io import PayloadType, encode_harp_messages
+    from aind_behavior_services.data_types import SoftwareEvent
+
+    sys.path.append(str(EXAMPLES_DIR.parent))
+    from examples.example_roi_trial_type import mock_rig, mock_session, mock_task_logic
+
+    session_path = Path(session_path)
+    rig = mock_rig()
+    session = mock_session()
+    session.subject = subject if subject is not None else session.subject
+    session.session_name = session_path.name
+    logs = session_path / dataset.BEHAVIOR_DIR / dataset.LOGS_DIR
+    logs.mkdir(parents=True, exist_ok=True)
+    for filename, model in (
+        (dataset.RIG_INPUT, rig),
+        (dataset.SESSION_INPUT, session),
+        (dataset.TASK_LOGIC_INPUT, mock_task_logic()),
+    ):
+        (logs / filename).write_text(model.model_dump_json(indent=2), encoding="utf-8")
+
+    def write_register(device: str, address: int, content: bytes) -> None:
+        path = dataset.harp_register_file(session_path, device, address)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+
+    heartbeat = np.arange(0, duration_s, 1.0)
+    frame_rate = rig.triggered_camera_controller.frame_rate
+    triggers = np.arange(0, duration_s, 1.0 / frame_rate)
+    load_cells = np.arange(0, duration_s, 1.0 / load_cells_rate)
+    rng = np.random.default_rng(seed=0)
+    for device in ("Behavior", "LoadCells", "Lickometer"):
+        write_register(device, 8, encode_harp_messages(8, heartbeat.astype(np.uint32), PayloadType.U32, heartbeat))
+    write_register("Behavior", 92, encode_harp_messages(92, np.ones(len(triggers), np.uint8), PayloadType.U8, triggers))
+    write_register(
+        "LoadCells",
+        33,
+        encode_harp_messages(
+            33, rng.integers(-100, 100, (len(load_cells), 8)).astype(np.int16), PayloadType.S16, load_cells
+        ),
+    )
+
+    for camera in rig.triggered_camera_controller.cameras:
+        camera_dir = session_path / dataset.BEHAVIOR_VIDEOS_DIR / camera
+        camera_dir.mkdir(parents=True, exist_ok=True)
+        pd.DataFrame(
+            {"ReferenceTime": triggers, "CameraFrameNumber": np.arange(len(triggers)), "CameraFrameTime": triggers}
+        ).to_csv(camera_dir / "metadata.csv", index=False)
+        if video_shape is not None:
+            write_mock_video(camera_dir / "video.mp4", len(triggers), video_shape, frame_rate)
+
+    events = {}
+    trial_duration = duration_s / n_trials
+    for i in range(n_trials):
+        t = i * trial_duration
+        harvest = {
+            "action": "Right",
+            "amount": 1.5,
+            "harvest_mode": "RegionOfInterest",
+            "upper_force_threshold": 15000 + 2500 * i,
+        }
+        rewarded = i % 2 == 0
+        events.setdefault("Trial", []).append(SoftwareEvent(name="Trial", timestamp=t, data={"right_harvest": harvest}))
+        events.setdefault("ResponsePeriod", []).append(SoftwareEvent(name="ResponsePeriod", timestamp=t + 0.1))
+        if rewarded:
+            events.setdefault("GiveReward", []).append(SoftwareEvent(name="GiveReward", timestamp=t + 0.2, data=1.5))
+        events.setdefault("TrialOutcome", []).append(
+            SoftwareEvent(
+                name="TrialOutcome",
+                timestamp=t + 0.3,
+                data={"TrialNumber": i, "Reward": 1.5 if rewarded else None, "IsAborted": False},
+            )
+        )
+    events_dir = session_path / dataset.BEHAVIOR_DIR / dataset.SOFTWARE_EVENTS_DIR
+    events_dir.mkdir(parents=True, exist_ok=True)
+    for name, values in events.items():
+        with open(events_dir / f"{name}.json", "w", encoding="utf-8") as f:
+            f.writelines(event.model_dump_json(by_alias=True) + "\n" for event in values)
+    return session_path
+
+
+def mock_frame_value(frame: int) -> int:
+    """The gray level of frame `frame` in the videos written by `write_mock_video`."""
+    return 16 + (frame * 37) % 224
+
+
+def write_mock_video(path: Path, n_frames: int, shape: Tuple[int, int], frame_rate: int, gop_size: int = 12) -> Path:
+    """Writes a video where every frame is a flat gray level that identifies the frame number."""
+    import av
+    import numpy as np
+
+    with av.open(str(path), mode="w") as container:
+        stream = container.add_stream("libx264", rate=frame_rate, options={"crf": "10", "g": str(gop_size)})
+        stream.height, stream.width = shape
+        stream.pix_fmt = "yuv420p"
+        for i in range(n_frames):
+            image = np.full(shape, mock_frame_value(i), dtype=np.uint8)
+            container.mux(stream.encode(av.VideoFrame.from_ndarray(image, format="gray")))
+        container.mux(stream.encode())
+    return path
@@ -2,14 +2,18 @@ import sys
 import unittest
 from datetime import datetime
 from pathlib import Path
+from typing import Dict, List, Optional
 from unittest.mock import MagicMock, patch
 
 from aind_behavior_force_foraging.data_mappers import (
     AindRigDataMapper,
     AindSessionDataMapper,
+    coerce_many_to_aind_data_schema,
+    coerce_to_aind_data_schema,
 )
 from aind_data_schema.core.rig import Rig
 from git import Repo
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, computed_field, field_serializer
 
 sys.path.append(".")
 from examples.example_roi_trial_type import mock_rig, mock_session, mock_task_logic  # isort:skip # pylint: disable=wrong-import-position
@@ -68,5 +72,96 @@ class TestAindRigDataMapper(unittest.TestCase):
         self.assertIsInstance(result, Rig)
 
 
+class SourceAxis(BaseModel):
+    name: str
+    gain: float
+    unused: int = 0
+
+
+class SourceDevice(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    name: str
+    serial_number: Optional[str] = None
+    axes: List[SourceAxis] = []
+    primary_axis: Optional[SourceAxis] = None
+    settings: SourceAxis = SourceAxis(name="settings", gain=1)
+    secret: str = Field(default="secret", exclude=True)
+    source_only: int = 0
+
+    @computed_field
+    @property
+    def axis_count(self) -> int:
+        return len(self.axes)
+
+
+class TargetAxis(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    name: str
+    gain: float
+
+
+class TargetDevice(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    name: str
+    serial_number: Optional[str] = None
+    axes: List[TargetAxis] = []
+    primary_axis: Optional[TargetAxis] = None
+    settings: Dict[str, float | str] = {}
+    secret: Optional[str] = None
+    axis_count: int = 0
+    notes: Optional[str] = None
+
+
+class SerializedDevice(BaseModel):
+    name: str
+
+    @field_serializer("name")
+    def _upper(self, name: str) -> str:
+        return name.upper()
+
+
+def dump_filter_validate(value, target_type):
+    """The previous implementation: dump the source, filter the keys, validate the target."""
+    dumped = value.model_dump() if isinstance(value, BaseModel) else value
+    return target_type(**{k: v for k, v in dumped.items() if k in target_type.model_fields})
+
+
+class CoerceToAindDataSchemaTests(unittest.TestCase):
+    def setUp(self):
+        axes = [SourceAxis(name="x", gain=1.5, unused=3), SourceAxis(name="y", gain=2.0)]
+        self.source = SourceDevice(name="manipulator", axes=axes, primary_axis=axes[0], notes="extra field")
+
+    def test_matches_dump_filter_validate(self):
+        source = SourceDevice(name="manipulator", serial_number="123", notes="extra field")
+        target = coerce_to_aind_data_schema(source, TargetDevice)
+        self.assertEqual(target, dump_filter_validate(source, TargetDevice))
+
+    def test_nested_models(self):
+        with self.assertRaises(ValidationError):
+            dump_filter_validate(self.source, TargetDevice)  # Nested fields were not filtered
+        target = coerce_to_aind_data_schema(self.source, TargetDevice)
+        self.assertEqual(target.axes[1], TargetAxis(name="y", gain=2.0))
+        self.assertEqual(target.primary_axis, TargetAxis(name="x", gain=1.5))
+        self.assertEqual(target.settings, {"name": "settings", "gain": 1.0, "unused": 0})
+        self.assertIsNone(target.secret)
+        self.assertEqual(target.axis_count, 2)
+        self.assertEqual(target.notes, "extra field")
+
+    def test_dict_and_serializers(self):
+        source = SourceDevice(name="manipulator", notes="extra field").model_dump()
+        self.assertEqual(coerce_to_aind_data_schema(source, TargetDevice), dump_filter_validate(source, TargetDevice))
+        self.assertEqual(coerce_to_aind_data_schema(SerializedDevice(name="a"), TargetDevice).name, "A")
+        with self.assertRaises(ValueError):
+            coerce_to_aind_data_schema([self.source], TargetDevice)
+
+    def test_many(self):
+        sources = [self.source, self.source.model_copy(update={"name": "other"})]
+        targets = coerce_many_to_aind_data_schema(sources, TargetDevice)
+        self.assertEqual([t.name for t in targets], ["manipulator", "other"])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,45 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+from aind_behavior_force_foraging import audio, dataset
+from aind_behavior_force_foraging.harp_io import MessageType, PayloadType, encode_harp_messages
+from aind_behavior_force_foraging.water import BEHAVIOR_DEVICE
+
+# Addresses of the Harp Behavior device.yml, on purpose not taken from the module under test
+PULSE_DO2 = 58
+PWM_FREQUENCY_DO2 = 62
+PWM_START = 68
+
+
+def write_audio_commands(session_path: Path, frequencies_hz, durations_ms, times) -> None:
+    """Writes the commands of one audio cue per element of `frequencies_hz`, at `times`."""
+    times = np.asarray(times, dtype=np.float64)
+    for address, payload_type, values, timestamps in (
+        (PWM_FREQUENCY_DO2, PayloadType.U16, frequencies_hz, times - 0.002),
+        (PULSE_DO2, PayloadType.U16, durations_ms, times - 0.001),
+        # Followed by a PwmStart command of another output, that does not play the speaker
+        (PWM_START, PayloadType.U8, [audio.PWM_DO2] * len(times) + [0x1], [*times, times[-1] + 1.0]),
+    ):
+        path = dataset.harp_command_file(session_path, BEHAVIOR_DEVICE, address)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(
+            encode_harp_messages(address, values, payload_type, timestamps, message_type=MessageType.WRITE)
+        )
+
+
+class AudioTests(unittest.TestCase):
+    def test_read_audio_cues(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            session_path = Path(tmp)
+            self.assertEqual(len(audio.read_audio_cues(session_path)), 0)
+            write_audio_commands(session_path, [3000, 6000], [100, 250], [1.0, 2.0])
+            cues = audio.read_audio_cues(session_path)
+        np.testing.assert_array_equal(cues.time, [1.0, 2.0])
+        np.testing.assert_array_equal(cues.frequency_hz, [3000, 6000])
+        np.testing.assert_allclose(cues.duration_s, [0.1, 0.25])
+
+
+if __name__ == "__main__":
+    unittest.main()
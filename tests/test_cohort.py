@@ -0,0 +1,69 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from aind_behavior_force_foraging import dataset
+from aind_behavior_force_foraging.cohort import CohortStore
+
+from tests import write_mock_session
+
+
+class CohortStoreTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self._tmp.name)
+        for subject, session in (("mouse_a", "s0"), ("mouse_a", "s1"), ("mouse_b", "s0")):
+            write_mock_session(self.root / subject / session, duration_s=4.0, n_trials=4, subject=subject)
+        (self.root / "not_a_session").mkdir()
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_ingest_and_query(self):
+        with CohortStore(self.root) as store:
+            ingested = store.ingest(max_workers=2)
+            self.assertEqual(sorted(ingested), ["mouse_a/s0", "mouse_a/s1", "mouse_b/s0"])
+            sessions = store.sessions("mouse_a")
+            self.assertEqual(list(sessions["session_id"]), ["mouse_a/s0", "mouse_a/s1"])
+            self.assertTrue((sessions["trial_count"] == 4).all())
+            self.assertEqual(sessions["task_logic_version"].iloc[0], "0.1.0")
+
+            trials = store.trials(
+                subject="mouse_a",
+                where="right_harvest_mode = ? AND right_upper_force_threshold > ?",
+                params=("RegionOfInterest", 20000),
+            )
+            self.assertEqual(len(trials), 2)  # One trial per session, with a threshold of 22500
+            self.assertTrue((trials["right_upper_force_threshold"] == 22500).all())
+            self.assertEqual(store.query("SELECT SUM(reward_amount) AS total FROM trials")["total"][0], 9.0)
+
+    def test_incremental_ingest(self):
+        with CohortStore(self.root) as store:
+            self.assertEqual(len(store.ingest(max_workers=1)), 3)
+            self.assertEqual(store.ingest(), [])
+            write_mock_session(self.root / "mouse_b" / "s1", duration_s=4.0, n_trials=2, subject="mouse_b")
+            self.assertEqual(store.ingest(), ["mouse_b/s1"])
+
+        events = self.root / "mouse_a" / "s0" / dataset.BEHAVIOR_DIR / dataset.SOFTWARE_EVENTS_DIR / "Trial.json"
+        with open(events, "a", encoding="utf-8") as f:
+            f.write('{"name": "Trial", "timestamp": 100.0, "data": {}}\n')
+        with CohortStore(self.root) as store:  # The index persists across instances
+            self.assertEqual(store.pending(), [self.root / "mouse_a" / "s0"])
+            self.assertEqual(store.ingest(), ["mouse_a/s0"])
+            self.assertEqual(store.sessions("mouse_a")["trial_count"].tolist(), [5, 4])
+            self.assertEqual(len(store.trials()), 4 + 4 + 5 + 2)
+
+    def test_removed_sessions_are_pruned(self):
+        with CohortStore(self.root) as store:
+            store.ingest(max_workers=1)
+            shutil.rmtree(self.root / "mouse_a" / "s1")
+            self.assertEqual(store.stale(), ["mouse_a/s1"])
+            self.assertEqual(store.ingest(), [])
+            self.assertEqual(store.stale(), [])
+            self.assertEqual(store.sessions()["session_id"].tolist(), ["mouse_a/s0", "mouse_b/s0"])
+            self.assertEqual(len(store.trials()), 4 + 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
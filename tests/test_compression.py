@@ -0,0 +1,154 @@
+import importlib.util
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from aind_behavior_experiment_launcher.data_transfer import DataTransfer
+from aind_behavior_force_foraging import dataset, pyramid
+from aind_behavior_force_foraging.compression import (
+    MANIFEST_FILENAME,
+    CompressionManifest,
+    CompressionSettings,
+    HarpCodec,
+    PostSessionCompressionService,
+    compress_session,
+    decompress_session,
+    originals_directory,
+    queued_sessions,
+    run_post_session,
+)
+from aind_behavior_force_foraging.harp_io import read_harp_messages
+from aind_behavior_force_foraging.pyramid import Pyramid
+from aind_behavior_force_foraging.qc import qc_session
+from aind_behavior_force_foraging.telemetry import TelemetrySampler, read_telemetry
+from aind_behavior_force_foraging.video import load_video_index
+
+from tests import write_mock_session, write_mock_video
+
+
+class _CopyTransfer(DataTransfer):
+    def __init__(self, source: Path, destination: Path, drop: str = ""):
+        self.source = source
+        self.destination = destination
+        self.drop = drop
+
+    def transfer(self) -> None:
+        shutil.copytree(self.source, self.destination, ignore=shutil.ignore_patterns(self.drop) if self.drop else None)
+
+    def validate(self) -> bool:
+        return True
+
+
+class CompressionTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.session = write_mock_session(Path(self._tmp.name) / "session", duration_s=5.0, n_trials=3)
+        self.originals = {
+            p.relative_to(self.session).as_posix(): p.read_bytes()
+            for p in (self.session / dataset.BEHAVIOR_DIR).rglob("*.bin")
+        }
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def assert_round_trip(self, settings: CompressionSettings, suffix: str):
+        manifest = compress_session(self.session, settings)
+        self.assertEqual(len(manifest.entries), len(self.originals))
+        self.assertEqual(list((self.session / dataset.BEHAVIOR_DIR).rglob("*.bin")), [])
+        self.assertLess(manifest.compressed_size, manifest.original_size)
+        for entry in manifest.entries:
+            self.assertTrue(entry.compressed_path.endswith(suffix))
+            messages = read_harp_messages(self.session / entry.compressed_path)
+            self.assertTrue(messages.checksum_ok.all())
+            self.assertEqual(messages.trailing_bytes, 0)
+
+        decompress_session(self.session)
+        restored = {
+            p.relative_to(self.session).as_posix(): p.read_bytes()
+            for p in (self.session / dataset.BEHAVIOR_DIR).rglob("*.bin")
+        }
+        self.assertEqual(restored, self.originals)
+        self.assertEqual(list((self.session / dataset.BEHAVIOR_DIR).rglob(f"*{suffix}")), [])
+
+    def test_gzip_round_trip(self):
+        self.assert_round_trip(CompressionSettings(max_workers=2), ".gz")
+
+    @unittest.skipUnless(importlib.util.find_spec("zstandard"), "zstandard is not installed")
+    def test_zstd_round_trip(self):
+        self.assert_round_trip(CompressionSettings(harp_codec=HarpCodec.ZSTD, max_workers=2), ".zst")
+
+    def test_compressed_session_is_readable(self):
+        before = qc_session(self.session)
+        compress_session(self.session, CompressionSettings(max_workers=2))
+        after = qc_session(self.session)
+        self.assertIsNone(after["error"])
+        for key in ("harp_corrupted_messages", "camera_trigger_count", "camera_missing_triggers", "trial_count"):
+            self.assertEqual(after[key], before[key])
+
+    def test_manifest_is_incremental(self):
+        compress_session(self.session, CompressionSettings(max_workers=1))
+        manifest = compress_session(self.session, CompressionSettings(max_workers=1))
+        self.assertEqual(len(manifest.entries), len(self.originals))
+        saved = CompressionManifest.model_validate_json((self.session / MANIFEST_FILENAME).read_text("utf-8"))
+        self.assertEqual({e.path for e in saved.entries}, set(self.originals))
+
+    def test_only_harp_files_are_compressed(self):
+        telemetry_path = self.session / dataset.BEHAVIOR_DIR / dataset.LOGS_DIR / dataset.TELEMETRY_FILE
+        with TelemetrySampler(telemetry_path, data_dir=self._tmp.name, interval_s=10):
+            pass
+        pyramids = pyramid.build_session_pyramids(self.session, n_levels=2)
+        manifest = compress_session(self.session, CompressionSettings(max_workers=1))
+        self.assertEqual({e.path for e in manifest.entries}, set(self.originals))
+        self.assertEqual(len(read_telemetry(telemetry_path)), 1)
+        self.assertEqual(Pyramid(pyramids["load_cells"]).n_levels, 2)
+
+    @unittest.skipUnless(importlib.util.find_spec("av"), "av is not installed")
+    def test_reencode_videos(self):
+        session = Path(self._tmp.name) / "video_session"
+        (session / "BehaviorVideos" / "FaceCamera").mkdir(parents=True)
+        video = write_mock_video(session / "BehaviorVideos" / "FaceCamera" / "video.mp4", 30, (64, 48), 30)
+        before = load_video_index(video)
+        manifest = compress_session(session, CompressionSettings(reencode_videos=True, video_crf=40, max_workers=1))
+        (entry,) = manifest.entries
+        self.assertEqual(entry.path, "BehaviorVideos/FaceCamera/video.mp4")
+        self.assertEqual(entry.method, "libx264")
+        self.assertEqual(video.stat().st_size, entry.compressed_size)
+        after = load_video_index(video)
+        self.assertEqual(len(after.pts), 30)
+        self.assertEqual(list(after.pts * after.time_base), list(before.pts * before.time_base))
+
+    def test_originals_are_kept_until_transfer_is_verified(self):
+        originals = originals_directory(self.session)
+        destination = Path(self._tmp.name) / "remote" / "session"
+        run_post_session(self.session, CompressionSettings(max_workers=1), _CopyTransfer(self.session, destination))
+        self.assertFalse(originals.exists())
+        self.assertFalse(originals.parent.exists())
+        manifest = CompressionManifest.model_validate_json((destination / MANIFEST_FILENAME).read_text("utf-8"))
+        self.assertEqual({e.path for e in manifest.entries}, set(self.originals))
+
+    def test_originals_are_kept_if_transfer_is_incomplete(self):
+        originals = originals_directory(self.session)
+        destination = Path(self._tmp.name) / "remote" / "session"
+        with self.assertRaises(IOError):
+            run_post_session(
+                self.session,
+                CompressionSettings(max_workers=1),
+                _CopyTransfer(self.session, destination, drop="*.gz"),
+            )
+        self.assertEqual(queued_sessions(self.session.parents[1]), [self.session])
+        kept = {p.relative_to(originals).as_posix(): p.read_bytes() for p in originals.rglob("*.bin")}
+        self.assertEqual(kept, self.originals)
+        self.assertEqual(list((self.session / dataset.BEHAVIOR_DIR).rglob("*.bin")), [])
+
+    def test_foreground_service(self):
+        service = PostSessionCompressionService(self.session, background=False)
+        self.assertTrue(service.validate())
+        service.transfer()
+        self.assertTrue((self.session / MANIFEST_FILENAME).exists())
+        self.assertEqual(queued_sessions(self.session.parents[1]), [])
+        self.assertFalse(PostSessionCompressionService(self.session / "missing").validate())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from aind_behavior_force_foraging.config_library import (
+    STATE_FILENAME,
+    ConfigLibraryMirror,
+    mirrored_config_library,
+)
+
+
+class ConfigLibraryMirrorTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        root = Path(self._tmp.name)
+        self.remote = root / "share" / "AindForceForaging"
+        self.local = root / "local" / ".config_library"
+        for relative_path, content in {
+            "Rig/RIG-1/rig.json": '{"rig_name": "RIG-1"}',
+            "Subjects/subjects.json": "{}",
+            "TaskLogic/stage1.json": '{"stage_name": "stage1"}',
+            "AindDataSchemaRig/RIG-1/rig.json": "{}",
+            "Other/large.bin": "x",
+        }.items():
+            path = self.remote / relative_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(content, encoding="utf-8")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def local_files(self):
+        return sorted(p.relative_to(self.local).as_posix() for p in self.local.rglob("*") if p.is_file())
+
+    def test_incremental_sync(self):
+        mirror = ConfigLibraryMirror(self.remote, self.local)
+        result = mirror.sync()
+        self.assertEqual((result.copied, result.deleted, result.unchanged), (4, 0, 0))
+        self.assertEqual(
+            self.local_files(),
+            [
+                STATE_FILENAME,
+                "AindDataSchemaRig/RIG-1/rig.json",
+                "Rig/RIG-1/rig.json",
+                "Subjects/subjects.json",
+                "TaskLogic/stage1.json",
+            ],
+        )
+        self.assertFalse(mirror.status().is_stale)
+
+        rig = self.remote / "Rig" / "RIG-1" / "rig.json"
+        os.utime(rig, ns=(rig.stat().st_atime_ns, rig.stat().st_mtime_ns + 10**9))  # Touched, same content
+        (self.remote / "TaskLogic" / "stage1.json").write_text('{"stage_name": "stage2"}', encoding="utf-8")
+        (self.remote / "Subjects" / "subjects.json").unlink()
+        result = ConfigLibraryMirror(self.remote, self.local).sync()
+        self.assertEqual((result.copied, result.deleted, result.unchanged), (1, 1, 2))
+        self.assertEqual(
+            (self.local / "TaskLogic" / "stage1.json").read_text(encoding="utf-8"), '{"stage_name": "stage2"}'
+        )
+        self.assertFalse((self.local / "Subjects" / "subjects.json").exists())
+
+    def test_share_outage(self):
+        mirror = ConfigLibraryMirror(self.remote, self.local)
+        mirror.sync()
+        shutil.rmtree(self.remote)
+        result = mirror.sync()
+        self.assertIsNotNone(result.error)
+        self.assertTrue((self.local / "Rig" / "RIG-1" / "rig.json").exists())
+        status = ConfigLibraryMirror(self.remote, self.local).status()
+        self.assertIsNotNone(status.last_sync)
+        self.assertIn("not reachable", status.last_error)
+
+    def test_staleness(self):
+        mirror = ConfigLibraryMirror(self.remote, self.local, max_staleness_s=3600)
+        self.assertTrue(mirror.status().is_stale)
+        mirror.sync()
+        self.assertFalse(mirror.status().is_stale)
+        earlier = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=2)
+        mirror._state["last_sync"] = earlier.isoformat()
+        status = mirror.status()
+        self.assertTrue(status.is_stale)
+        self.assertGreater(status.age_s, 7000)
+
+    def test_mirrored_config_library(self):
+        self.assertEqual(mirrored_config_library(self.remote, self.local, background=False), self.local)
+        missing = Path(self._tmp.name) / "missing"
+        other_local = Path(self._tmp.name) / "other"
+        self.assertEqual(mirrored_config_library(missing, other_local, background=False), missing)
+
+
+if __name__ == "__main__":
+    unittest.main()
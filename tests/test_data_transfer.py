@@ -0,0 +1,149 @@
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from aind_behavior_force_foraging.data_transfer import (
+    MANIFEST_FILENAME,
+    PARTIAL_SUFFIX,
+    ResumableTransferService,
+    file_hash,
+)
+
+
+class ResumableTransferTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        root = Path(self._tmp.name)
+        self.source = root / "session"
+        self.destination = root / "share" / "subject" / "session"
+        (self.source / "Behavior" / "Logs").mkdir(parents=True)
+        (self.source / "BehaviorVideos" / "FaceCamera").mkdir(parents=True)
+        (self.source / "BehaviorVideos" / "FaceCamera" / "video.mp4").write_bytes(os.urandom(10_000))
+        (self.source / "Behavior" / "Logs" / "session_input.json").write_text("{}", encoding="utf-8")
+        (self.source / "Behavior" / "empty.bin").write_bytes(b"")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def assert_same_tree(self):
+        for src in self.source.rglob("*"):
+            if src.is_file():
+                dst = self.destination / src.relative_to(self.source)
+                self.assertEqual(src.read_bytes(), dst.read_bytes())
+        self.assertEqual(list(self.destination.rglob(f"*{PARTIAL_SUFFIX}")), [])
+
+    def test_transfer(self):
+        service = ResumableTransferService(self.source, self.destination, chunk_size=1024, max_workers=4)
+        self.assertTrue(service.validate())
+        service.transfer()
+        self.assert_same_tree()
+        self.assertFalse((self.destination / MANIFEST_FILENAME).exists())
+        entry = service.manifest.files["BehaviorVideos/FaceCamera/video.mp4"]
+        self.assertTrue(entry["complete"])
+        self.assertEqual(entry["hash"], file_hash(self.source / "BehaviorVideos" / "FaceCamera" / "video.mp4"))
+
+    def test_resume_after_interruption(self):
+        service = ResumableTransferService(self.source, self.destination, chunk_size=1024, max_workers=1)
+        copy_chunk = service._copy_chunk
+        calls = []
+
+        def flaky_copy_chunk(relative_path, src, chunk):
+            calls.append((relative_path, chunk))
+            if len(calls) == 4:
+                raise IOError("Network share went away")
+            copy_chunk(relative_path, src, chunk)
+
+        with mock.patch.object(service, "_copy_chunk", side_effect=flaky_copy_chunk):
+            with self.assertRaises(IOError):
+                service.transfer()
+        self.assertFalse((self.destination / "BehaviorVideos" / "FaceCamera" / "video.mp4").exists())
+
+        service = ResumableTransferService(self.source, self.destination, chunk_size=1024, max_workers=2)
+        with mock.patch.object(service, "_copy_chunk", wraps=service._copy_chunk) as resumed:
+            service.transfer()
+        self.assert_same_tree()
+        copied = {(c.args[0], c.args[2]) for c in resumed.call_args_list}
+        self.assertTrue(copied.isdisjoint(calls[:3]))
+
+    def test_source_modified_during_transfer(self):
+        video = self.source / "BehaviorVideos" / "FaceCamera" / "video.mp4"
+        service = ResumableTransferService(self.source, self.destination, chunk_size=1024, max_workers=1)
+        copy_chunk = service._copy_chunk
+
+        def modifying_copy_chunk(relative_path, src, chunk):
+            if relative_path == "BehaviorVideos/FaceCamera/video.mp4" and chunk == 3:
+                with open(video, "r+b") as f:
+                    f.seek(3 * 1024)
+                    f.write(os.urandom(8))
+            copy_chunk(relative_path, src, chunk)
+
+        with mock.patch.object(service, "_copy_chunk", side_effect=modifying_copy_chunk):
+            with self.assertRaises(IOError):
+                service.transfer()
+        self.assertFalse((self.destination / "BehaviorVideos" / "FaceCamera" / "video.mp4").exists())
+        self.assertNotIn("3", service.manifest.files["BehaviorVideos/FaceCamera/video.mp4"]["chunks_done"])
+
+        ResumableTransferService(self.source, self.destination, chunk_size=1024).transfer()
+        self.assert_same_tree()
+
+    def test_orphaned_partial_files(self):
+        service = ResumableTransferService(self.source, self.destination, chunk_size=1024, max_workers=1)
+        with mock.patch.object(service, "_copy_chunk", side_effect=IOError("Network share went away")):
+            with self.assertRaises(IOError):
+                service.transfer()
+        partial_file = self.destination / "BehaviorVideos" / "FaceCamera" / f"video.mp4{PARTIAL_SUFFIX}"
+        self.assertTrue(partial_file.exists())
+
+        (self.source / "BehaviorVideos" / "FaceCamera" / "video.mp4").unlink()
+        service = ResumableTransferService(self.source, self.destination, chunk_size=1024)
+        service.transfer()
+        self.assertFalse(partial_file.exists())
+        self.assertNotIn("BehaviorVideos/FaceCamera/video.mp4", service.manifest.files)
+        self.assert_same_tree()
+
+    def test_recheck_completed_files(self):
+        service = ResumableTransferService(self.source, self.destination, chunk_size=1024)
+        finalize = service._finalize
+        video = "BehaviorVideos/FaceCamera/video.mp4"
+
+        def failing_finalize(relative_path, src):
+            return relative_path != video and finalize(relative_path, src)
+
+        with mock.patch.object(service, "_finalize", side_effect=failing_finalize):
+            with self.assertRaises(IOError):
+                service.transfer()
+        manifest = json.loads((self.destination / MANIFEST_FILENAME).read_text(encoding="utf-8"))
+        self.assertTrue(manifest["files"]["Behavior/Logs/session_input.json"]["complete"])
+
+        # Modified at the destination after it was verified, with the same size
+        tampered = self.destination / "Behavior" / "Logs" / "session_input.json"
+        tampered.write_text("[]", encoding="utf-8")
+        os.utime(tampered, ns=(0, 0))
+        service = ResumableTransferService(self.source, self.destination, chunk_size=1024)
+        with mock.patch.object(service, "_copy_chunk", wraps=service._copy_chunk) as copied:
+            service.transfer()
+        # The chunks of the video were all copied, only its verification failed
+        self.assertEqual({c.args[0] for c in copied.call_args_list}, {"Behavior/Logs/session_input.json"})
+        self.assert_same_tree()
+        self.assertFalse((self.destination / MANIFEST_FILENAME).exists())
+
+    def test_skip_files_with_same_hash(self):
+        ResumableTransferService(self.source, self.destination, chunk_size=4096).transfer()
+        (self.destination / "Behavior" / "Logs" / "session_input.json").write_text("{ }", encoding="utf-8")
+
+        service = ResumableTransferService(self.source, self.destination, chunk_size=4096)
+        with mock.patch.object(service, "_copy_chunk", wraps=service._copy_chunk) as copied:
+            service.transfer()
+        self.assertEqual({c.args[0] for c in copied.call_args_list}, {"Behavior/Logs/session_input.json"})
+        self.assert_same_tree()
+
+    def test_validate(self):
+        self.assertFalse(ResumableTransferService(self.source / "missing", self.destination).validate())
+        self.assertFalse(ResumableTransferService(self.source, self.destination, hash_algorithm="nope").validate())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+import itertools
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+import numpy as np
+from aind_behavior_force_foraging import emulator, licks, replay, water
+from aind_behavior_force_foraging.emulator import Agent, emulate_session, sample_distribution
+from aind_behavior_force_foraging.harp_io import parse_harp_messages, split_harp_stream
+from aind_behavior_force_foraging.load_cells_calibration import LOAD_CELL_DATA_ADDRESS
+from aind_behavior_force_foraging.task_logic import (
+    Block,
+    BlockGenerator,
+    Environment,
+    HarvestMode,
+    InitiationPeriod,
+    LeftHarvestAction,
+    PressMode,
+    QuiescencePeriod,
+    ResponsePeriod,
+    RightHarvestAction,
+    Trial,
+    scalar_value,
+    uniform_distribution_value,
+)
+from aind_behavior_services.task_logic.distributions import ScalingParameters, TruncationParameters
+
+from tests import EXAMPLES_DIR
+
+sys.path.append(str(EXAMPLES_DIR.parent))
+from examples.example_roi_trial_type import mock_rig, mock_task_logic  # isort:skip # pylint: disable=wrong-import-position
+
+
+def task_logic(press_mode: PressMode = PressMode.SINGLE_AVERAGE):
+    """The example task logic, with two actions and a response period long enough to press."""
+    logic = mock_task_logic()
+    logic.task_parameters.operation_control.force.press_mode = press_mode
+    logic.task_parameters.environment = Environment(
+        block_statistics=[
+            Block(
+                trials=[
+                    Trial(
+                        inter_trial_interval=uniform_distribution_value(0.5, 1.0),
+                        quiescence_period=QuiescencePeriod(duration=scalar_value(0.2), force_threshold=500),
+                        initiation_period=InitiationPeriod(duration=scalar_value(0.3)),
+                        response_period=ResponsePeriod(duration=scalar_value(2.0)),
+                        left_harvest=LeftHarvestAction(
+                            harvest_mode=HarvestMode.ACCUMULATION,
+                            lower_force_threshold=0,
+                            upper_force_threshold=2000,
+                            force_duration=0.2,
+                            delay=0.1,
+                            time_to_collect=scalar_value(1.0),
+                        ),
+                        right_harvest=RightHarvestAction(
+                            harvest_mode=HarvestMode.ROI,
+                            lower_force_threshold=5000,
+                            upper_force_threshold=8000,
+                            force_duration=0.3,
+                            probability=0.5,
+                            is_operant=False,
+                        ),
+                    )
+                ],
+                repeat_count=None,
+            )
+        ]
+    )
+    return logic
+
+
+class EmulatorTests(unittest.TestCase):
+    def test_sample_distribution(self):
+        rng = np.random.default_rng(0)
+        self.assertEqual(sample_distribution(scalar_value(2.5), rng), 2.5)
+        uniform = uniform_distribution_value(0, 10)
+        uniform.truncation_parameters = TruncationParameters(is_truncated=True, min=4, max=5)
+        uniform.scaling_parameters = ScalingParameters(scale=2.0, offset=1.0)
+        samples = [sample_distribution(uniform, rng) for _ in range(100)]
+        self.assertTrue(all(4 <= s <= 5 for s in samples))
+
+    def test_iter_trials(self):
+        rng = np.random.default_rng(0)
+        a, b = Trial(inter_trial_interval=scalar_value(1)), Trial(inter_trial_interval=scalar_value(2))
+        environment = Environment(
+            block_statistics=[
+                Block(trials=[a, b], repeat_count=1),
+                BlockGenerator(block_size=scalar_value(3), trial_statistics=b),
+            ],
+        )
+        trials = list(emulator.iter_trials(environment, rng))
+        self.assertEqual(trials, [a, b, a, b, b, b, b])
+        environment.repeat_count = None
+        self.assertEqual(len(list(itertools.islice(emulator.iter_trials(environment, rng), 20))), 20)
+        self.assertEqual(list(emulator.iter_trials(Environment(block_statistics=[], repeat_count=None), rng)), [])
+
+    def test_write_session(self):
+        rig = mock_rig()
+        for press_mode in (PressMode.SINGLE_AVERAGE, PressMode.DOUBLE):
+            logic = task_logic(press_mode)
+            emulated = emulate_session(logic, rig, 60.0, Agent(press_probability=0.8, noise_sd=20), 2.0, seed=1)
+            with tempfile.TemporaryDirectory() as tmp:
+                session = emulator.write_session(emulated, Path(tmp) / "session", [rig, logic])
+                force = replay.read_force(session)
+                lick_onsets = licks.read_licks(session).onset
+                deliveries = water.read_water_deliveries(session, rig.calibration.water_valve)
+            trials = emulated.trials[emulated.trials["is_replayed"]]
+            self.assertGreater(len(trials), 20)
+            self.assertEqual(set(trials["selected_action"]), {"Left", "Right", "None"})
+            self.assertEqual(len(force), 120_000)
+            self.assertGreater(len(lick_onsets), 0)
+            rewards = [e for e in emulated.events if e.name == "GiveReward" and not np.isnan(e.data)]
+            self.assertEqual(len(deliveries), len(rewards))
+
+    def test_lookup_table_not_supported(self):
+        logic = mock_task_logic()
+        logic.task_parameters.operation_control.force.press_mode = PressMode.SINGLE_LOOKUP_TABLE
+        with self.assertRaises(ValueError):
+            emulate_session(logic, mock_rig(), 1.0)
+
+    @unittest.skipUnless(hasattr(os, "openpty"), "Requires a pty")
+    def test_stream_to_pty(self):
+        emulated = emulate_session(task_logic(), mock_rig(), 5.0, rate_multiplier=10, seed=0)
+        stream = emulator.device_stream(emulated, replay.LOAD_CELLS_DEVICE)
+        controller, port, name = emulator.open_pty()
+        received = bytearray()
+
+        def read() -> None:
+            fd = os.open(name, os.O_RDONLY | os.O_NOCTTY)
+            while len(received) < stream.offset[-1]:
+                received.extend(os.read(fd, 1 << 16))
+            os.close(fd)
+
+        reader = threading.Thread(target=read, daemon=True)
+        reader.start()
+        try:
+            statistics = emulator.stream_device(stream, emulator.fd_writer(controller), speed=np.inf)
+            reader.join(10)
+        finally:
+            os.close(controller)
+            os.close(port)
+        self.assertEqual(statistics.message_count, len(stream))
+        self.assertEqual(bytes(received), stream.data.tobytes())
+        registers, trailing_bytes = split_harp_stream(received)
+        self.assertEqual(trailing_bytes, 0)
+        messages = parse_harp_messages(registers[LOAD_CELL_DATA_ADDRESS])
+        self.assertEqual(len(messages), 50_000)
+        self.assertTrue((np.diff(messages.timestamp) > 0).all())
+        self.assertEqual(parse_harp_messages(registers[0]).payload[0, 0], mock_rig().harp_load_cells.who_am_i)
+
+    def test_stream_schedule(self):
+        stream = emulator.device_stream(emulate_session(task_logic(), mock_rig(), 2.0, seed=0), "Lickometer")
+        now = [0.0]
+        writes = []
+        statistics = emulator.stream_device(
+            stream,
+            lambda data: writes.append((now[0], len(data))),
+            speed=2.0,
+            chunk_s=0.5,
+            clock=lambda: now[0],
+            sleep=lambda s: now.__setitem__(0, now[0] + s),
+        )
+        self.assertEqual(sum(n for _, n in writes), statistics.byte_count)
+        self.assertAlmostEqual(writes[-1][0], (stream.timestamp[-1] - stream.timestamp[0]) / 2.0)
+        self.assertEqual(statistics.max_lag_s, 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
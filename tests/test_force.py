@@ -0,0 +1,71 @@
+import unittest
+
+import aind_behavior_services.calibration.load_cells as lcc
+import numpy as np
+from aind_behavior_force_foraging import task_logic
+from aind_behavior_force_foraging.force import (
+    apply_load_cells_calibration,
+    lookup_table_force,
+    parse_force,
+    prepare_lookup_table,
+)
+
+
+class ForceTests(unittest.TestCase):
+    def setUp(self):
+        self.data = np.array([[100, 200, 0], [300, 50, 0]], dtype=np.int16)
+
+    def test_apply_load_cells_calibration(self):
+        calibration = lcc.LoadCellsCalibrationOutput(
+            channels=[
+                lcc.LoadCellCalibrationOutput(channel=0, baseline=10.7, slope=2),
+                lcc.LoadCellCalibrationOutput(channel=1),
+            ]
+        )
+        calibrated = apply_load_cells_calibration(self.data, calibration)
+        np.testing.assert_allclose(calibrated[:, 0], [180, 580])
+        np.testing.assert_allclose(calibrated[:, 1:], self.data[:, 1:])
+        np.testing.assert_allclose(apply_load_cells_calibration(self.data, None), self.data)
+
+    def test_press_modes(self):
+        expected = {
+            task_logic.PressMode.DOUBLE: ([100, 300], [200, 50]),
+            task_logic.PressMode.SINGLE_LEFT: ([100, 300], [100, 300]),
+            task_logic.PressMode.SINGLE_RIGHT: ([200, 50], [200, 50]),
+            task_logic.PressMode.SINGLE_AVERAGE: ([150, 175], [150, 175]),
+            task_logic.PressMode.SINGLE_MAX: ([200, 300], [200, 300]),
+            task_logic.PressMode.SINGLE_MIN: ([100, 50], [100, 50]),
+        }
+        for press_mode, (left, right) in expected.items():
+            with self.subTest(press_mode=press_mode):
+                control = task_logic.ForceOperationControl(press_mode=press_mode, left_index=0, right_index=1)
+                force = parse_force(self.data, control)
+                np.testing.assert_allclose(force.left_force, left)
+                np.testing.assert_allclose(force.right_force, right)
+
+    def test_lookup_table_force(self):
+        settings = task_logic.ForceLookUpTable(path="lut.png", left_min=0, left_max=4, right_min=0, right_max=4)
+        # LUT[l, r] = l + 10 * r, which is exactly recovered by bilinear interpolation
+        image = np.add.outer(np.arange(4), 10 * np.arange(4))
+        lut = prepare_lookup_table(image, settings)
+        force = lookup_table_force(np.array([0, 1.5, -5]), np.array([0, 2.25, 1]), settings, lut)
+        np.testing.assert_allclose(force.left_force, [0, 1.5 + 22.5, 10])
+        np.testing.assert_allclose(force.diagnosis.lookup_index_left_force, [0, 1.5, 0])
+        np.testing.assert_allclose(force.left_force, force.right_force)
+
+        scaled = prepare_lookup_table(image, settings.model_copy(update={"scale": 2, "offset": 1}))
+        np.testing.assert_allclose(scaled, image * 2 + 1)
+
+    def test_lookup_table_mode_requires_table(self):
+        control = task_logic.ForceOperationControl(
+            press_mode=task_logic.PressMode.SINGLE_LOOKUP_TABLE,
+            force_lookup_table=task_logic.ForceLookUpTable(
+                path="lut.png", left_min=0, left_max=1, right_min=0, right_max=1
+            ),
+        )
+        with self.assertRaises(ValueError):
+            parse_force(self.data, control)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from aind_behavior_force_foraging import dataset
+from aind_behavior_force_foraging.frame_index import (
+    FrameFlags,
+    FrameIndex,
+    build_frame_index,
+    build_session_frame_indices,
+    load_frame_index,
+)
+
+from tests import write_mock_session
+
+
+class FrameIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.triggers = np.arange(10) * 0.1 + 5.0
+        # Frame 3 is dropped, frame 6 is written twice
+        camera_frames = np.array([0, 1, 2, 4, 5, 6, 6, 7, 8, 9])
+        self.metadata = pd.DataFrame(
+            {"ReferenceTime": self.triggers[camera_frames] + 0.001, "CameraFrameNumber": camera_frames + 100}
+        )
+
+    def test_build_frame_index(self):
+        index = build_frame_index(self.metadata, self.triggers, frame_rate=10)
+        self.assertEqual(len(index), 10)
+        np.testing.assert_array_equal(index.frames["trigger_index"], [0, 1, 2, 4, 5, 6, 6, 7, 8, 9])
+        self.assertEqual(index.frames["flags"][3], FrameFlags.DROPPED_BEFORE)
+        self.assertEqual(index.frames["flags"][6], FrameFlags.DUPLICATE)
+        self.assertEqual(index.dropped_frame_count, 1)
+        self.assertEqual(index.duplicate_frame_count, 1)
+        np.testing.assert_array_equal(index.trigger_frame, [0, 1, 2, -1, 3, 4, 5, 7, 8, 9])
+        self.assertEqual(index.frames_between(5.2, 5.5), slice(2, 4))
+        self.assertEqual(index.frame_at(5.45), 3)
+        self.assertEqual(index.frame_at(0), -1)
+
+    def test_no_trigger(self):
+        index = build_frame_index(self.metadata, self.triggers[:5], frame_rate=10)
+        self.assertTrue(np.all(index.frames["flags"][5:] & FrameFlags.NO_TRIGGER))
+        self.assertTrue(np.all(index.frames["trigger_index"][5:] == -1))
+
+    def test_save_load(self):
+        index = build_frame_index(self.metadata, self.triggers, frame_rate=10)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "video.frame_index.bin"
+            index.save(path)
+            for mmap in (True, False):
+                loaded = FrameIndex.load(path, mmap=mmap)
+                np.testing.assert_array_equal(loaded.frames, index.frames)
+                np.testing.assert_array_equal(loaded.trigger_frame, index.trigger_frame)
+                self.assertEqual(loaded.frame_rate, 10)
+                del loaded
+
+    def test_session(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            session = write_mock_session(Path(tmp) / "session", duration_s=2.0)
+            sidecars = build_session_frame_indices(session)
+            self.assertEqual(set(sidecars), {"FaceCamera", "SideCamera"})
+            self.assertEqual(sidecars["FaceCamera"].parent, dataset.video_metadata_file(session, "FaceCamera").parent)
+            index = load_frame_index(session, "FaceCamera")
+            self.assertEqual(len(index), 240)
+            self.assertEqual(index.dropped_frame_count, 0)
+            self.assertEqual(index.frames_between(1.0, 1.5), slice(120, 180))
+            del index
+
+            metadata = dataset.video_metadata_file(session, "FaceCamera")
+            pd.read_csv(metadata).iloc[:100].to_csv(metadata, index=False)
+            os.utime(sidecars["FaceCamera"], (0, 0))
+            index = load_frame_index(session, "FaceCamera")
+            self.assertEqual(len(index), 100)
+            self.assertEqual(index.dropped_frame_count, 140)
+            del index
+
+
+if __name__ == "__main__":
+    unittest.main()
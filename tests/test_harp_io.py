@@ -0,0 +1,89 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import harp.io
+import numpy as np
+from aind_behavior_force_foraging.harp_io import (
+    HarpRegisterReader,
+    MessageType,
+    PayloadType,
+    encode_harp_messages,
+    parse_harp_messages,
+    split_harp_stream,
+)
+
+
+class HarpIoTests(unittest.TestCase):
+    def test_round_trip(self):
+        timestamps = np.array([1.0, 1.5, 2.000032, 3.25])
+        payload = np.arange(4 * 8, dtype=np.int16).reshape(4, 8) - 10
+        buffer = encode_harp_messages(33, payload, PayloadType.S16, timestamps)
+        messages = parse_harp_messages(buffer)
+        self.assertEqual(len(messages), 4)
+        self.assertTrue(messages.checksum_ok.all())
+        self.assertTrue(messages.is_event.all())
+        self.assertEqual(messages.trailing_bytes, 0)
+        np.testing.assert_array_equal(messages.address, 33)
+        np.testing.assert_array_equal(messages.payload, payload)
+        np.testing.assert_allclose(messages.timestamp, timestamps, atol=32e-6)
+
+    def test_matches_harp_reader(self):
+        timestamps = np.linspace(0, 10, 50)
+        payload = np.linspace(-1, 1, 50, dtype=np.float32)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "Device_40.bin"
+            path.write_bytes(encode_harp_messages(40, payload, PayloadType.FLOAT, timestamps, MessageType.WRITE))
+            reference = harp.io.read(path, address=40, keep_type=True)
+            messages = parse_harp_messages(path.read_bytes())
+        np.testing.assert_allclose(reference.index.values, messages.timestamp)
+        np.testing.assert_array_equal(reference[0].values, messages.payload[:, 0])
+        self.assertTrue((reference["MessageType"] == "WRITE").all())
+
+    def test_corruption(self):
+        buffer = bytearray(encode_harp_messages(8, np.arange(5, dtype=np.uint32), PayloadType.U32, np.arange(5.0)))
+        buffer[7] ^= 0xFF
+        messages = parse_harp_messages(bytes(buffer) + b"\x03\x0b")
+        self.assertEqual(messages.trailing_bytes, 2)
+        np.testing.assert_array_equal(messages.checksum_ok, [False, True, True, True, True])
+
+    def test_truncated(self):
+        buffer = encode_harp_messages(8, np.arange(2, dtype=np.uint32), PayloadType.U32, [0.0, 1.0])
+        for size in range(5):
+            messages = parse_harp_messages(buffer[:size])
+            self.assertEqual(len(messages.timestamp), 0)
+            self.assertEqual(messages.trailing_bytes, size)
+
+    def test_split_stream(self):
+        heartbeat = encode_harp_messages(8, np.arange(2, dtype=np.uint32), PayloadType.U32, [0.0, 1.0])
+        data = encode_harp_messages(33, np.ones((3, 8), dtype=np.int16), PayloadType.S16, [0.2, 0.5, 1.5])
+        stream = heartbeat[:16] + data[: 2 * 28] + heartbeat[16:] + data[2 * 28 :]
+        registers, trailing_bytes = split_harp_stream(stream + data[:10])
+        self.assertEqual(registers, {8: heartbeat, 33: data})
+        self.assertEqual(trailing_bytes, 10)
+
+    def test_register_reader(self):
+        timestamps = np.arange(10) * 0.5
+        payload = np.arange(10 * 8, dtype=np.int16).reshape(10, 8)
+        buffer = bytearray(encode_harp_messages(33, payload, PayloadType.S16, timestamps))
+        buffer[3 * 28 + 5] ^= 0xFF  # Corrupts the checksum of message 3
+        buffer[7 * 28 + 2] = 34  # Another register, with a valid checksum
+        buffer[7 * 28 + 27] = (buffer[7 * 28 + 27] + 1) & 0xFF
+        valid = np.array([0, 1, 2, 4, 5, 6, 8, 9])
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "LoadCells_33.bin"
+            path.write_bytes(bytes(buffer))
+            reader = HarpRegisterReader(path, address=33, chunk_size=3)
+            self.assertEqual(len(reader), len(valid))
+            messages = reader.read(2, 6)
+            np.testing.assert_allclose(messages.timestamp, timestamps[valid[2:6]])
+            np.testing.assert_array_equal(messages.payload, payload[valid[2:6]])
+            self.assertEqual(len(reader.read(8)), 0)
+            self.assertEqual(len(HarpRegisterReader(path)), 9)
+            del reader, messages  # Releases the memory map
+            path.write_bytes(b"")
+            self.assertEqual(len(HarpRegisterReader(path)), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+from aind_behavior_force_foraging import dataset, licks
+from aind_behavior_force_foraging.harp_io import PayloadType, encode_harp_messages
+from aind_behavior_force_foraging.licks import Licks, build_collection_table, collection_by_trial, segment_bouts
+from aind_behavior_force_foraging.qc import qc_session
+from aind_behavior_services.data_types import SoftwareEvent
+
+from tests import write_mock_session
+
+
+def _harvest(is_operant: bool = True, time_to_collect=None, delay: float = 0.0, action: str = "Left") -> dict:
+    return {
+        "action": action,
+        "harvest_mode": "RegionOfInterest",
+        "delay": delay,
+        "is_operant": is_operant,
+        "time_to_collect": time_to_collect,
+    }
+
+
+def _scalar(value: float) -> dict:
+    return {"family": "Scalar", "distribution_parameters": {"family": "Scalar", "value": value}}
+
+
+class LickTests(unittest.TestCase):
+    def test_lick_edges(self):
+        timestamp = np.arange(8, dtype=float)
+        state = np.array([0, 1, 1, 0, 2, 3, 0, 1], dtype=np.uint8)
+        left = licks.lick_edges(timestamp, state, channel=0)
+        np.testing.assert_array_equal(left.onset, [1.0, 5.0, 7.0])
+        np.testing.assert_array_equal(left.offset, [3.0, 6.0, np.nan])
+        right = licks.lick_edges(timestamp, state, channel=1)
+        np.testing.assert_array_equal(right.onset, [4.0])
+        np.testing.assert_array_equal(right.offset, [6.0])
+
+    def test_segment_bouts(self):
+        onset = np.array([0.0, 0.1, 0.2, 2.0, 2.1, 5.0])
+        bouts = segment_bouts(Licks(onset, onset + 0.05), max_inter_lick_interval=0.5)
+        np.testing.assert_array_equal(bouts.start, [0.0, 2.0, 5.0])
+        np.testing.assert_allclose(bouts.end, [0.25, 2.15, 5.05])
+        np.testing.assert_array_equal(bouts.first_lick, [0, 3, 5])
+        np.testing.assert_array_equal(bouts.lick_count, [3, 2, 1])
+        self.assertEqual(len(segment_bouts(Licks(np.empty(0), np.empty(0)))), 0)
+
+    def test_collection_table(self):
+        # Events in the order the workflow logs them: operant rewards are given at the collecting lick
+        events = [
+            SoftwareEvent(name="Trial", timestamp=0.0, data={}),
+            SoftwareEvent(
+                name="HarvestActionSelected", timestamp=1.0, data=_harvest(time_to_collect=_scalar(1.0), delay=0.5)
+            ),
+            SoftwareEvent(name="GiveReward", timestamp=2.0, data=1.0),  # Available at 1.5, collected at 2.0
+            SoftwareEvent(name="Trial", timestamp=10.0, data={}),
+            SoftwareEvent(name="HarvestActionSelected", timestamp=11.0, data=_harvest(time_to_collect=_scalar(1.0))),
+            # First lick at 12.5, too late, so no reward is given
+            SoftwareEvent(name="Trial", timestamp=20.0, data={}),
+            SoftwareEvent(name="HarvestActionSelected", timestamp=21.0, data=_harvest(is_operant=False, delay=1.0)),
+            SoftwareEvent(name="GiveReward", timestamp=22.0, data=1.0),  # Not operant, never licked
+            SoftwareEvent(name="Trial", timestamp=30.0, data={}),
+            SoftwareEvent(name="HarvestActionSelected", timestamp=31.0, data=_harvest()),
+            SoftwareEvent(name="GiveReward", timestamp=35.0, data=1.0),  # No deadline, collected at 35
+            SoftwareEvent(name="Trial", timestamp=40.0, data={}),
+            SoftwareEvent(name="HarvestActionSelected", timestamp=41.0, data=_harvest(action="None")),  # Timeout
+        ]
+        onset = np.array([0.5, 1.2, 2.0, 2.1, 12.5, 35.0])
+        lick_data = Licks(onset, onset + 0.05)
+        bouts = segment_bouts(lick_data)
+        table = build_collection_table(events[::-1], lick_data, bouts)
+        self.assertEqual(list(table.columns), list(licks.COLLECTION_TABLE_COLUMNS))
+        np.testing.assert_array_equal(table["trial"], [0, 1, 2, 3])
+        np.testing.assert_allclose(table["available_time"], [1.5, 11.0, 22.0, 31.0])
+        np.testing.assert_allclose(table["reward_time"], [2.0, np.nan, 22.0, 35.0])
+        np.testing.assert_array_equal(table["is_collected"], [True, False, False, True])
+        np.testing.assert_array_equal(table["is_missed"], [False, True, False, False])
+        np.testing.assert_allclose(table["collection_latency"], [0.5, np.nan, np.nan, 4.0])
+        np.testing.assert_allclose(table["collection_deadline"], [2.5, 12.0, 30.0, 40.0])
+        self.assertEqual(table["collection_bout"].fillna(-1).tolist(), [2, -1, -1, 4])
+
+        per_trial = collection_by_trial(table, n_trials=5)
+        np.testing.assert_array_equal(per_trial["selection_count"], [1, 1, 1, 1, 0])
+        np.testing.assert_array_equal(per_trial["reward_count"], [1, 0, 1, 1, 0])
+        np.testing.assert_array_equal(per_trial["missed_count"], [0, 1, 0, 0, 0])
+        np.testing.assert_allclose(per_trial["collection_latency"], [0.5, np.nan, np.nan, 4.0, np.nan])
+
+        summary = licks.summarize_collection(lick_data, bouts, table)
+        self.assertEqual(summary["lick_count"], 6)
+        self.assertEqual(summary["operant_selection_count"], 3)
+        self.assertAlmostEqual(summary["missed_collection_rate"], 1 / 3)
+        self.assertAlmostEqual(summary["median_collection_latency_s"], 2.25)
+
+    def test_session(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            session = write_mock_session(Path(tmp) / "session", duration_s=10.0, n_trials=5)
+            self.assertNotIn("lick_count", qc_session(session, with_licks=True))
+            # Operant selections at 0.15, 4.15 and 8.15 s, available 0.1 s later. The second one is missed.
+            events_dir = session / dataset.BEHAVIOR_DIR / dataset.SOFTWARE_EVENTS_DIR
+            selections = [
+                SoftwareEvent(
+                    name="HarvestActionSelected",
+                    timestamp=t + 0.15,
+                    data=_harvest(time_to_collect=_scalar(1.0), delay=0.1, action="Right" if t % 4 == 0 else "None"),
+                )
+                for t in (0.0, 2.0, 4.0, 6.0, 8.0)
+            ]
+            rewards = [SoftwareEvent(name="GiveReward", timestamp=t, data=1.5) for t in (0.5, 8.4)]
+            for name, values in (("HarvestActionSelected", selections), ("GiveReward", rewards)):
+                with open(events_dir / f"{name}.json", "w", encoding="utf-8") as f:
+                    f.writelines(event.model_dump_json(by_alias=True) + "\n" for event in values)
+            timestamp = np.array([0.5, 0.6, 0.7, 0.8, 8.4, 8.5])
+            state = np.array([1, 0, 1, 0, 1, 0], dtype=np.uint8)
+            path = dataset.harp_register_file(
+                session, licks.LICKOMETER_DEVICE, licks.LICK_STATE_ADDRESS, licks.LICKOMETER_HARP_DEVICE
+            )
+            path.write_bytes(encode_harp_messages(licks.LICK_STATE_ADDRESS, state, PayloadType.U8, timestamp))
+            self.assertNotIn("lick_count", qc_session(session))
+            row = qc_session(session, with_licks=True)
+        self.assertEqual(row["lick_count"], 3)
+        self.assertEqual(row["lick_bout_count"], 2)
+        self.assertEqual(row["operant_selection_count"], 3)
+        self.assertEqual(row["missed_collection_count"], 1)
+        self.assertAlmostEqual(row["missed_collection_rate"], 1 / 3)
+        self.assertAlmostEqual(row["median_collection_latency_s"], 0.2)
+
+
+if __name__ == "__main__":
+    unittest.main()
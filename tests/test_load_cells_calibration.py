@@ -0,0 +1,89 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+import aind_behavior_services.calibration.load_cells as lcc
+import numpy as np
+import pandas as pd
+from aind_behavior_force_foraging import load_cells_calibration as calibration
+from aind_behavior_force_foraging.force import apply_load_cells_calibration
+from aind_behavior_force_foraging.harp_io import PayloadType, encode_harp_messages
+
+BASELINE = np.array([120.0, -340.0, 15.0, 0.0])
+ADC_PER_GRAM = np.array([50.0, 42.0, 61.0, 55.0])
+
+
+def readings(weight_g: np.ndarray) -> np.ndarray:
+    return BASELINE + weight_g * ADC_PER_GRAM
+
+
+class FitTests(unittest.TestCase):
+    def test_fit_with_outlier(self):
+        rng = np.random.default_rng(0)
+        weight_g = np.repeat(np.array([0.0, 1.0, 2.0, 5.0, 10.0, 20.0])[:, None], 4, axis=1)
+        reading = readings(weight_g) + rng.normal(0, 0.5, weight_g.shape)
+        reading[3, 2] += 400  # A weight that was knocked while recording
+        weight_g[0, 3] = np.nan  # Channel 3 was not recorded at zero
+        fit = calibration.fit_load_cells(weight_g, reading)
+        np.testing.assert_allclose(fit.baseline, BASELINE, atol=2.0)
+        np.testing.assert_allclose(fit.slope, 1 / ADC_PER_GRAM, rtol=5e-3)
+        self.assertGreater(fit.residual_g[3, 2], 5.0)
+        self.assertLess(fit.robust_weight[3, 2], 0.1)
+        self.assertEqual(fit.robust_weight[0, 3], 0.0)
+
+        # The fit follows ApplyLoadCellsCalibration.cs
+        output = calibration.to_calibration_output(fit)
+        force = apply_load_cells_calibration(readings(np.full((1, 4), 7.0)), output)
+        np.testing.assert_allclose(force, 7.0, atol=0.1)
+
+    def test_report(self):
+        weight_g = np.repeat(np.array([0.0, 10.0, 20.0])[:, None], 4, axis=1)
+        fit = calibration.fit_load_cells(weight_g, readings(weight_g), channel=[0, 1, 2, 3])
+        previous = lcc.LoadCellsCalibrationOutput(
+            channels=[
+                lcc.LoadCellCalibrationOutput(channel=0, offset=12, baseline=100.0, slope=0.02),
+                lcc.LoadCellCalibrationOutput(channel=7, offset=-3, baseline=5.0, slope=0.01),
+            ]
+        )
+        report = calibration.calibration_report(fit, previous).set_index("channel")
+        self.assertAlmostEqual(report.loc[0, "baseline_drift"], 20.0)
+        self.assertAlmostEqual(report.loc[0, "slope_drift"], 0.0)
+        self.assertTrue(np.isnan(report.loc[1, "baseline_drift"]))
+        self.assertTrue((report["rmse_g"] < 1e-6).all())
+        output = calibration.to_calibration_output(fit, previous)
+        self.assertEqual([c.channel for c in output.channels], [0, 1, 2, 3, 7])
+        self.assertEqual(output.channels[0].offset, 12)
+        self.assertEqual(len(output.channels[0].weight_lookup), 3)
+
+    def test_not_enough_weights(self):
+        with self.assertRaises(ValueError):
+            calibration.fit_load_cells(np.array([[1.0, 0.0], [1.0, 1.0]]), np.array([[1.0, 0.0], [2.0, 1.0]]))
+
+    def test_main(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            rows = []
+            for i, (weight, channel) in enumerate([(0.0, None), (10.0, 0), (20.0, 0), (10.0, 1), (20.0, 1)]):
+                applied = np.zeros(8)
+                applied[slice(None) if channel is None else channel] = weight
+                raw = np.round(np.concatenate([readings(applied[:4]), readings(applied[4:])]))
+                data = np.repeat(raw[None, :], 50, axis=0).astype(np.int16)
+                path = root / f"recording_{i}.bin"
+                path.write_bytes(
+                    encode_harp_messages(
+                        calibration.LOAD_CELL_DATA_ADDRESS, data, PayloadType.S16, np.arange(50) * 1e-3
+                    )
+                )
+                rows.append({"path": path.name, "weight_g": weight, "channel": channel})
+            pd.DataFrame(rows).to_csv(root / "manifest.csv", index=False)
+            output = root / "calibration.json"
+            self.assertEqual(calibration.main([str(root / "manifest.csv"), "--output", str(output)]), 0)
+            fitted = lcc.LoadCellsCalibrationOutput.model_validate(json.loads(output.read_text(encoding="utf-8")))
+        self.assertEqual([c.channel for c in fitted.channels], [0, 1])
+        self.assertAlmostEqual(fitted.channels[1].baseline, -340.0, places=3)
+        self.assertAlmostEqual(fitted.channels[1].slope, 1 / 42.0, places=6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+import json
+import multiprocessing
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from aind_behavior_force_foraging import dataset, migrations
+from aind_behavior_force_foraging.migrations import MigrationError, MigrationRegistry, migrate_file, migrate_tree
+from aind_behavior_force_foraging.rig import AindForceForagingRig
+from aind_behavior_force_foraging.task_logic import AindForceForagingTaskLogic
+
+sys.path.append(".")
+from examples.example_roi_trial_type import (  # isort:skip # pylint: disable=wrong-import-position
+    mock_rig,
+    mock_task_logic,
+)
+
+
+def _rename_environment(document):
+    parameters = document["task_parameters"]
+    parameters["environment"] = parameters.pop("patches")
+    return document
+
+
+def _drop_legacy_field(document):
+    document["task_parameters"].pop("legacy", None)
+    return document
+
+
+def task_logic_registry() -> MigrationRegistry:
+    """A task logic registry with two past versions. In 0.0.1, the environment was named `patches`."""
+    registry = MigrationRegistry("task_logic", "0.1.0", AindForceForagingTaskLogic)
+    registry.register("0.0.1", "0.0.2")(_rename_environment)
+    registry.register("0.0.2", "0.1.0")(_drop_legacy_field)
+    return registry
+
+
+def legacy_task_logic() -> dict:
+    document = json.loads(mock_task_logic().model_dump_json())
+    document["version"] = "0.0.1"
+    document["task_parameters"]["patches"] = document["task_parameters"].pop("environment")
+    document["task_parameters"]["legacy"] = True
+    return document
+
+
+class MigrationRegistryTests(unittest.TestCase):
+    def test_migrate(self):
+        registry = task_logic_registry()
+        document = legacy_task_logic()
+        self.assertEqual([m.to_version for m in registry.path("0.0.1")], ["0.0.2", "0.1.0"])
+        self.assertEqual(registry.path("0.1.0"), [])
+        model = registry.migrate_and_validate(document)
+        self.assertEqual(model, mock_task_logic())
+        self.assertEqual(document["version"], "0.0.1")  # The input is not modified
+
+    def test_invalid_paths(self):
+        registry = task_logic_registry()
+        with self.assertRaises(MigrationError):
+            registry.path("0.0.0")
+        with self.assertRaises(MigrationError):
+            registry.path("0.2.0")
+        with self.assertRaises(MigrationError):
+            registry.register("0.0.2", "0.0.1")
+        with self.assertRaises(MigrationError):
+            registry.register("0.1.0", "0.2.0")
+        with self.assertRaises(MigrationError):
+            registry.register("0.0.1", "0.1.0")(lambda d: d)
+        with self.assertRaises(MigrationError):
+            registry.migrate({})
+
+    def test_rig_defaults(self):
+        registry = MigrationRegistry(
+            "rig", "0.2.0", AindForceForagingRig, defaults={"aind_behavior_services_pkg_version": "0.9.0"}
+        )
+        registry.register("0.1.0", "0.2.0")(lambda d: d)
+        expected = mock_rig()
+        document = json.loads(expected.model_dump_json())
+        document.update(version="0.1.0", aind_behavior_services_pkg_version="0.8.0")
+        self.assertEqual(registry.migrate_and_validate(document), expected)
+
+
+class MigrateTreeTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self._tmp.name) / "Data"
+        self.registries = mock.patch.dict(migrations.REGISTRIES, {"task_logic": task_logic_registry()})
+        self.registries.start()
+        for session, task_logic in (
+            ("old", legacy_task_logic()),
+            ("new", json.loads(mock_task_logic().model_dump_json())),
+        ):
+            logs = self.root / "mouse" / session / "Behavior" / "Logs"
+            logs.mkdir(parents=True)
+            (logs / dataset.TASK_LOGIC_INPUT).write_text(json.dumps(task_logic), encoding="utf-8")
+            (logs / dataset.RIG_INPUT).write_text(mock_rig().model_dump_json(), encoding="utf-8")
+            # Software events are logged as JSON lines, and are never opened
+            events = logs.parent / dataset.SOFTWARE_EVENTS_DIR
+            events.mkdir()
+            (events / "Trial.json").write_text("{}\n{}\n", encoding="utf-8")
+        # A config library, whose documents are not named after their schema
+        self.library = self.root / "Library"
+        (self.library / "TaskLogic").mkdir(parents=True)
+        (self.library / "Rig" / "computer").mkdir(parents=True)
+        (self.library / "TaskLogic" / "stage.json").write_text(json.dumps(legacy_task_logic()), encoding="utf-8")
+        (self.library / "Rig" / "computer" / "other.json").write_text("{}", encoding="utf-8")
+        broken = legacy_task_logic()
+        broken["version"] = "0.0.0"
+        (self.library / "TaskLogic" / "broken.json").write_text(json.dumps(broken), encoding="utf-8")
+
+    def tearDown(self):
+        self.registries.stop()
+        self._tmp.cleanup()
+
+    def test_in_place(self):
+        # Spawned workers, the default on Windows, only see the registries passed to the pool
+        report = migrate_tree(self.root, in_place=True, max_workers=2, mp_context=multiprocessing.get_context("spawn"))
+        self.assertEqual(len(report), 7)
+        report = report.set_index("path")
+        logs = self.root / "mouse" / "old" / "Behavior" / "Logs"
+        old = str(logs / dataset.TASK_LOGIC_INPUT)
+        broken = str(self.library / "TaskLogic" / "broken.json")
+        self.assertEqual(report.loc[old, "status"], "migrated")
+        self.assertEqual(report.loc[str(logs / dataset.RIG_INPUT), "status"], "current")
+        self.assertEqual(report.loc[str(self.library / "TaskLogic" / "stage.json"), "status"], "migrated")
+        self.assertEqual(report.loc[str(self.library / "Rig" / "computer" / "other.json"), "status"], "skipped")
+        self.assertEqual(report.loc[broken, "status"], "failed")
+        self.assertIn("No task_logic migration", report.loc[broken, "error"])
+        self.assertEqual(dataset.read_task_logic(logs.parent.parent), mock_task_logic())
+        self.assertTrue((logs / f"{dataset.TASK_LOGIC_INPUT}.0.0.1.bak").exists())
+
+        report = migrate_tree(self.root, in_place=True, max_workers=1)
+        self.assertNotIn("migrated", set(report["status"]))
+
+    def test_acquired_data_is_not_modified_by_default(self):
+        logs = self.root / "mouse" / "old" / "Behavior" / "Logs"
+        before = (logs / dataset.TASK_LOGIC_INPUT).read_text(encoding="utf-8")
+        report = migrate_tree(self.root, max_workers=1).set_index("path")
+        self.assertEqual(report.loc[str(logs / dataset.TASK_LOGIC_INPUT), "status"], "skipped")
+        self.assertEqual(report.loc[str(self.library / "TaskLogic" / "stage.json"), "status"], "migrated")
+        self.assertEqual((logs / dataset.TASK_LOGIC_INPUT).read_text(encoding="utf-8"), before)
+        self.assertEqual(list(logs.glob(f"*{migrations.BACKUP_SUFFIX}")), [])
+
+    def test_output_dir(self):
+        output = Path(self._tmp.name) / "Migrated"
+        report = migrate_tree(self.root, output_dir=output, max_workers=1)
+        self.assertEqual(set(report["status"]), {"migrated", "current", "skipped", "failed"})
+        self.assertTrue((output / migrations.MIGRATION_REPORT).exists())
+        original = self.root / "mouse" / "old" / "Behavior" / "Logs" / dataset.TASK_LOGIC_INPUT
+        self.assertEqual(json.loads(original.read_text(encoding="utf-8"))["version"], "0.0.1")
+        for session in ("old", "new"):
+            self.assertEqual(dataset.read_task_logic(output / "mouse" / session), mock_task_logic())
+
+    def test_dry_run(self):
+        path = self.root / "mouse" / "old" / "Behavior" / "Logs" / dataset.TASK_LOGIC_INPUT
+        before = path.read_text(encoding="utf-8")
+        result = migrate_file(path, dry_run=True)
+        self.assertEqual((result.status, result.from_version, result.to_version), ("migrated", "0.0.1", "0.1.0"))
+        self.assertEqual(path.read_text(encoding="utf-8"), before)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import datetime
+import importlib.util
+import tempfile
+import unittest
+import uuid
+from pathlib import Path
+
+import numpy as np
+from aind_behavior_force_foraging import dataset
+from aind_behavior_services.calibration.load_cells import LoadCellCalibrationOutput
+
+from tests import write_mock_session
+from tests.test_audio import write_audio_commands
+from tests.test_water import write_valve_commands
+
+HAS_PYNWB = importlib.util.find_spec("pynwb") is not None
+if HAS_PYNWB:
+    from aind_behavior_force_foraging import nwb
+    from pynwb import NWBHDF5IO, NWBFile
+
+
+@unittest.skipUnless(HAS_PYNWB, "pynwb is not installed")
+class NwbTests(unittest.TestCase):
+    def test_export_session(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            session = write_mock_session(Path(tmp) / "session", duration_s=10.0, n_trials=5, video_shape=(16, 16))
+            write_valve_commands(session, [30, 50], [1.0, 4.0])
+            write_audio_commands(session, [3000], [100], [2.0])
+            output = nwb.export_session(session, Path(tmp) / "nwb" / "session.nwb", chunk_size=300)
+            with NWBHDF5IO(output, mode="r") as io:
+                nwbfile = io.read()
+                load_cells = nwbfile.acquisition["load_cells"]
+                self.assertEqual(load_cells.data.shape, (1000, 8))
+                self.assertEqual(load_cells.data.chunks, (300, 8))
+                self.assertEqual(load_cells.data.compression, "gzip")
+                self.assertEqual(load_cells.unit, "ADC counts")  # The mock rig has no calibrated channel
+                np.testing.assert_allclose(load_cells.timestamps[:], np.arange(1000) / 100.0, atol=1e-4)
+
+                trials = nwbfile.trials.to_dataframe()
+                np.testing.assert_allclose(trials["start_time"], [0, 2, 4, 6, 8])
+                np.testing.assert_allclose(trials["stop_time"], [2, 4, 6, 8, 8.3])
+                self.assertEqual(trials["right_upper_force_threshold"].tolist(), [15000, 17500, 20000, 22500, 25000])
+                self.assertIn('"harvest_mode": "RegionOfInterest"', trials["right_harvest_action"].iloc[0])
+
+                np.testing.assert_allclose(nwbfile.intervals["water_valve"]["stop_time"][:], [1.03, 4.05])
+                self.assertEqual(nwbfile.intervals["audio_cues"]["frequency_hz"][:].tolist(), [3000])
+                for camera in ("FaceCamera", "SideCamera"):
+                    video = Path(output.parent, nwbfile.acquisition[camera].external_file[0])
+                    self.assertEqual(video.resolve(), dataset.video_file(session, camera).resolve())
+                    self.assertEqual(len(nwbfile.acquisition[camera].timestamps), 1200)
+                self.assertEqual(nwbfile.subject.subject_id, "test")
+                self.assertEqual(uuid.UUID(nwbfile.identifier).version, 4)
+                self.assertIn("force_lookup_table", nwbfile.protocol)
+
+    def test_calibrated_load_cells(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            session = write_mock_session(Path(tmp) / "session", duration_s=1.0, n_trials=1)
+            rig = dataset.read_rig(session)
+            rig.harp_load_cells.calibration.output.channels = [
+                LoadCellCalibrationOutput(channel=1, baseline=10, slope=0.5)
+            ]
+            nwbfile = NWBFile("session", "session", datetime.datetime.now(datetime.timezone.utc))
+            nwb.add_load_cells(nwbfile, session, rig)
+            load_cells = nwbfile.acquisition["load_cells"]
+            self.assertEqual(load_cells.unit, "a.u.")
+            self.assertIn("Channels [1] are calibrated", load_cells.description)
+            rig.harp_load_cells.calibration = None
+            nwbfile = NWBFile("session", "session", datetime.datetime.now(datetime.timezone.utc))
+            nwb.add_load_cells(nwbfile, session, rig)
+            self.assertEqual(nwbfile.acquisition["load_cells"].unit, "ADC counts")
+
+    def test_export_sessions(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            session = write_mock_session(Path(tmp) / "a", duration_s=2.0, n_trials=2)
+            summary = nwb.export_sessions([session, Path(tmp) / "missing"], Path(tmp) / "nwb", max_workers=2)
+            self.assertEqual(Path(summary["output"][0]), Path(tmp) / "nwb" / "test_a.nwb")
+            self.assertTrue(Path(summary["output"][0]).exists())
+        self.assertEqual(summary["error"].notna().tolist(), [False, True])
+
+
+if __name__ == "__main__":
+    unittest.main()
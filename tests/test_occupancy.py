@@ -0,0 +1,73 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+from aind_behavior_force_foraging import occupancy
+from aind_behavior_force_foraging.occupancy import OccupancyAccumulator, cohort_occupancy, session_occupancy
+from aind_behavior_force_foraging.task_logic import ForceLookUpTable
+
+from tests import write_mock_session
+
+LUT = ForceLookUpTable(path="lut.png", left_min=0, left_max=100, right_min=-50, right_max=50)
+
+
+class OccupancyTests(unittest.TestCase):
+    def test_cells(self):
+        accumulator = OccupancyAccumulator(LUT, lut_shape=(10, 20), bins=(5, 4))
+        cells, clipped = accumulator.cells(np.array([0, 19.9, 100, 150, -1]), np.array([-50, 0, 50, 0, 0]))
+        # Left force indexes rows of 20 force units, right force columns of 25
+        np.testing.assert_array_equal(cells, [0 * 4 + 0, 0 * 4 + 2, 4 * 4 + 3, 4 * 4 + 2, 0 * 4 + 2])
+        np.testing.assert_array_equal(clipped, [False, False, False, True, True])
+
+    def test_chunks(self):
+        rng = np.random.default_rng(0)
+        time = np.cumsum(rng.uniform(0.0005, 0.0015, 10_000))
+        time[5000:] += 1.0  # A gap in the log
+        left, right = rng.uniform(-10, 110, len(time)), rng.normal(0, 20, len(time))
+        starts = np.array([time[1000], time[4000], time[9000]])
+
+        whole = OccupancyAccumulator(LUT, (64, 64), (8, 8), starts)
+        whole.append(time, left, right)
+        whole = whole.result()
+        chunked = OccupancyAccumulator(LUT, (64, 64), (8, 8), starts)
+        for i in range(0, len(time), 777):
+            chunked.append(time[i : i + 777], left[i : i + 777], right[i : i + 777])
+        chunked = chunked.result()
+
+        np.testing.assert_array_equal(whole.session.sample_count, chunked.session.sample_count)
+        np.testing.assert_allclose(whole.session.dwell_s, chunked.session.dwell_s)
+        self.assertEqual(whole.session.sample_count.sum(), len(time))
+        intervals = np.minimum(np.diff(time), occupancy.DEFAULT_MAX_DWELL_S)
+        self.assertAlmostEqual(whole.session.dwell_s.sum(), intervals.sum())
+        self.assertEqual(whole.session.clipped_count, ((left < 0) | (left > 100) | (right < -50) | (right > 50)).sum())
+
+        self.assertEqual(whole.trials.groupby("trial")["sample_count"].sum().tolist(), [3000, 5000, 1000])
+        self.assertEqual(whole.trials.to_dict("list"), chunked.trials.to_dict("list"))
+        trial = whole.trial_map(2)
+        self.assertEqual(trial.sample_count.sum(), 1000)
+        self.assertAlmostEqual(trial.dwell_s.sum(), intervals[9000:].sum())
+
+    def test_session_and_cohort(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            sessions = [write_mock_session(Path(tmp) / name, duration_s=10.0, n_trials=5) for name in "ab"]
+            result = session_occupancy(sessions[0], lut_shape=(32, 32), force_lookup_table=LUT, chunk_size=300)
+            with self.assertRaises(ValueError):  # The mock task logic has no look up table
+                session_occupancy(sessions[0], lut_shape=(32, 32))
+            cohort, summary = cohort_occupancy(
+                sessions + [Path(tmp) / "missing"], max_workers=1, lut_shape=(32, 32), force_lookup_table=LUT
+            )
+            occupancy.save_occupancy(Path(tmp) / "cohort.npz", cohort)
+            loaded = occupancy.load_occupancy(Path(tmp) / "cohort.npz")
+
+        self.assertEqual(result.session.sample_count.sum(), 1000)
+        self.assertEqual(set(result.trials["trial"]), set(range(5)))
+        np.testing.assert_array_equal(cohort.sample_count, 2 * result.session.sample_count)
+        self.assertEqual(summary["sample_count"].tolist(), [1000, 1000, 0])
+        self.assertEqual(summary["error"].notna().tolist(), [False, False, True])
+        np.testing.assert_array_equal(loaded.sample_count, cohort.sample_count)
+        self.assertEqual(loaded.clipped_count, cohort.clipped_count)
+
+
+if __name__ == "__main__":
+    unittest.main()
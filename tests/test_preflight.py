@@ -0,0 +1,140 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from typing import List, Optional
+from unittest import mock
+
+import aind_behavior_experiment_launcher.launcher.behavior_launcher as behavior_launcher
+import aind_behavior_services.rig as rig
+from aind_behavior_force_foraging import emulator, preflight
+from aind_behavior_force_foraging.harp_io import (
+    TIMESTAMP_SECONDS_ADDRESS,
+    MessageType,
+    PayloadType,
+    encode_harp_messages,
+)
+from aind_behavior_force_foraging.launcher import ForceForagingLauncher
+from aind_behavior_force_foraging.preflight import DeviceIdentity, probe_rig, read_identity
+from aind_behavior_force_foraging.startup import StartupProfiler
+
+from tests import EXAMPLES_DIR
+
+sys.path.append(str(EXAMPLES_DIR.parent))
+from examples.example_roi_trial_type import mock_rig, mock_task_logic  # isort:skip # pylint: disable=wrong-import-position
+
+
+class FakePort:
+    """Replies with `chunks`, one per read."""
+
+    def __init__(self, chunks: List[bytes]) -> None:
+        self.chunks = chunks
+        self.written = b""
+
+    def write(self, data: bytes) -> None:
+        self.written += data
+
+    def read(self, timeout_s: float) -> bytes:
+        return self.chunks.pop(0) if self.chunks else b""
+
+
+class PreflightTests(unittest.TestCase):
+    def test_read_identity(self):
+        heartbeat = encode_harp_messages(TIMESTAMP_SECONDS_ADDRESS, [1, 2], PayloadType.U32, [1.0, 2.0])
+        replies = b"".join(
+            encode_harp_messages(address, [value], payload_type, [0.0], MessageType.READ)
+            for address, payload_type, value in (
+                (0, PayloadType.U16, 1232),
+                (6, PayloadType.U8, 2),
+                (7, PayloadType.U8, 3),
+            )
+        )
+        stream = heartbeat[:10] + heartbeat[10:] + replies
+        port = FakePort([stream[:7], stream[7:20], stream[20:]])
+        self.assertEqual(read_identity(port), DeviceIdentity(who_am_i=1232, firmware_version=(2, 3)))
+        self.assertEqual(
+            port.written, b"".join(preflight.read_request(a, t) for a, t in preflight.IDENTITY_REGISTERS.items())
+        )
+
+        with self.assertRaises(TimeoutError):
+            read_identity(FakePort([replies[:8]]), timeout_s=0.05)
+
+    @unittest.skipUnless(hasattr(os, "openpty"), "Requires a pty")
+    def test_probe_rig(self):
+        emulated = emulator.emulate_session(mock_task_logic(), mock_rig(), 1.0, seed=0)
+        stop = threading.Event()
+        descriptors: List[int] = []
+        threads: List[threading.Thread] = []
+
+        def pty(device: Optional[str] = None) -> str:
+            controller, port, name = emulator.open_pty()
+            descriptors.extend([controller, port])
+            if device is not None:
+                target = emulator.serve_read_requests
+                threads.append(threading.Thread(target=target, args=(emulated, device, controller, stop), daemon=True))
+                threads[-1].start()
+            return name
+
+        rig_model = mock_rig()
+        rig_model.harp_behavior.port_name = "/nonexistent/tty"
+        rig_model.harp_lickometer.port_name = pty("Lickometer")
+        rig_model.harp_load_cells.port_name = pty("LoadCells")
+        rig_model.harp_clock_generator.port_name = pty("LoadCells")  # Answers with the WhoAmI of the load cells
+        rig_model.manipulator.port_name = pty()
+        rig_model.harp_analog_input = rig.HarpAnalogInput(port_name=pty())
+        try:
+            start = time.perf_counter()
+            probes = probe_rig(rig_model, timeout_s=0.5)
+            elapsed = time.perf_counter() - start
+            with self.assertRaises(RuntimeError):
+                preflight.validate_rig_hardware(rig_model, timeout_s=0.1)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join(1)
+            for fd in descriptors:
+                os.close(fd)
+
+        self.assertEqual(
+            set(probes),
+            {
+                "harp_behavior",
+                "harp_lickometer",
+                "harp_load_cells",
+                "harp_clock_generator",
+                "manipulator",
+                "harp_analog_input",
+            },
+        )
+        self.assertLess(elapsed, 1.0)  # The two silent devices time out concurrently
+        self.assertIn("FileNotFoundError", probes["harp_behavior"].error)
+        self.assertTrue(probes["harp_lickometer"].ok)
+        self.assertEqual(probes["harp_load_cells"].identity, DeviceIdentity(1232, emulator.DEFAULT_FIRMWARE_VERSION))
+        self.assertTrue(probes["harp_load_cells"].ok)
+        self.assertFalse(probes["harp_clock_generator"].ok)
+        self.assertIsNone(probes["harp_clock_generator"].error)
+        for name in ("manipulator", "harp_analog_input"):
+            self.assertIn("TimeoutError", probes[name].error)
+
+    def test_pre_run_hook_without_serial_backend(self):
+        launcher = object.__new__(ForceForagingLauncher)
+        launcher.skip_hardware_validation = False
+        launcher.hardware_probe_timeout_s = preflight.DEFAULT_PROBE_TIMEOUT_S
+        launcher.startup_profiler = StartupProfiler()
+        launcher._rig_schema = mock_rig()
+        launcher._services_factory_manager = SimpleNamespace(resource_monitor=None)
+        launcher._exit = mock.Mock(side_effect=SystemExit)
+        with (
+            mock.patch.object(behavior_launcher.BehaviorLauncher, "_pre_run_hook"),
+            mock.patch.object(preflight, "has_serial_backend", return_value=False),
+            mock.patch.object(preflight, "probe_rig") as probe,
+        ):
+            launcher._pre_run_hook()
+        probe.assert_not_called()
+        launcher._exit.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+from aind_behavior_force_foraging import dataset
+from aind_behavior_force_foraging.prepare import launch_arguments, prepare_sessions
+from aind_behavior_force_foraging.rig import AindForceForagingRig
+from aind_behavior_force_foraging.task_logic import AindForceForagingTaskLogic
+from aind_behavior_services.session import AindBehaviorSessionModel
+from aind_behavior_services.utils import model_from_json_file
+
+sys.path.append(".")
+from examples.example_roi_trial_type import (  # isort:skip # pylint: disable=wrong-import-position
+    mock_rig,
+    mock_subject_database,
+    mock_task_logic,
+)
+
+
+class PrepareSessionsTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        root = Path(self._tmp.name)
+        self.library = root / "AindForceForaging"
+        self.output = root / "prepared"
+        self.data_dir = root / "Data"
+        for directory in ("Rig/RIG-1", "Subjects", "TaskLogic"):
+            (self.library / directory).mkdir(parents=True)
+        (self.library / "Rig" / "RIG-1" / "rig.json").write_text(mock_rig().model_dump_json(), encoding="utf-8")
+        (self.library / "TaskLogic" / "preward_intercept_stageA.json").write_text(
+            mock_task_logic().model_dump_json(), encoding="utf-8"
+        )
+        database = mock_subject_database()
+        database.add_subject("test3", None)
+        (self.library / "Subjects" / "batch.json").write_text(database.model_dump_json(), encoding="utf-8")
+        self.rig_path = self.library / "Rig" / "RIG-1" / "rig.json"
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_prepare_sessions(self):
+        summary = prepare_sessions(
+            self.library, "batch.json", self.output, self.data_dir, rig_path=self.rig_path, max_workers=2
+        )
+        self.assertEqual(list(summary["subject"]), ["test", "test2", "test3"])
+        self.assertIsNone(summary["error"][0])
+        self.assertIn("not found", summary["error"][1])
+        self.assertIn("no task logic target", summary["error"][2])
+        self.assertTrue((self.output / "prepared_sessions.csv").exists())
+
+        directory = self.output / "test"
+        model_from_json_file(directory / dataset.RIG_INPUT, AindForceForagingRig)
+        task_logic = model_from_json_file(directory / dataset.TASK_LOGIC_INPUT, AindForceForagingTaskLogic)
+        session = model_from_json_file(directory / dataset.SESSION_INPUT, AindBehaviorSessionModel)
+        self.assertEqual(session.subject, "test")
+        self.assertEqual(session.experiment, task_logic.name)
+        self.assertEqual(Path(session.root_path), self.data_dir.resolve() / "test")
+        self.assertFalse((self.output / "test2").exists())
+
+        arguments = launch_arguments(next(summary.itertuples(index=False)))
+        self.assertEqual(arguments[:2], ["--subject", "test"])
+        self.assertEqual(Path(arguments[3]), directory / dataset.RIG_INPUT)
+
+    def test_scheduled_subjects(self):
+        summary = prepare_sessions(
+            self.library, "batch.json", self.output, self.data_dir, subjects=["test"], rig_path=self.rig_path
+        )
+        self.assertEqual(list(summary["subject"]), ["test"])
+        with self.assertRaises(ValueError):
+            prepare_sessions(self.library, "batch.json", self.output, self.data_dir, subjects=["unknown"])
+
+    def test_rig_resolution(self):
+        with self.assertRaises(ValueError):
+            prepare_sessions(self.library, "batch.json", self.output, self.data_dir, subjects=["test"])
+        (self.library / "Rig" / os.environ["COMPUTERNAME"]).mkdir()
+        shutil.copy(self.rig_path, self.library / "Rig" / os.environ["COMPUTERNAME"] / "rig.json")
+        summary = prepare_sessions(self.library, "batch.json", self.output, self.data_dir, subjects=["test"])
+        self.assertIsNone(summary["error"][0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+from aind_behavior_force_foraging import pyramid
+from aind_behavior_force_foraging.pyramid import Pyramid, PyramidBuilder
+
+from tests import write_mock_session
+
+
+def reference_level(timestamp: np.ndarray, data: np.ndarray, t0: float, bin_s: float, n_bins: int):
+    index = np.floor((timestamp - t0) / bin_s).astype(int)
+    vmin = np.full((n_bins, data.shape[1]), np.nan)
+    vmax = np.full((n_bins, data.shape[1]), np.nan)
+    mean = np.full((n_bins, data.shape[1]), np.nan)
+    for k in np.unique(index):
+        vmin[k], vmax[k], mean[k] = data[index == k].min(0), data[index == k].max(0), data[index == k].mean(0)
+    return vmin, vmax, mean
+
+
+class PyramidTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self._tmp.name)
+        rng = np.random.default_rng(0)
+        self.timestamp = 10.0 + np.cumsum(rng.uniform(0.0005, 0.0015, 20_000))
+        self.timestamp = self.timestamp[(self.timestamp < 15.0) | (self.timestamp > 16.0)]  # A gap in the data
+        self.data = rng.normal(size=(len(self.timestamp), 3)).astype(np.float32).astype(np.float64)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def build(self, name: str, chunks: int) -> Pyramid:
+        with PyramidBuilder(self.root / name, 3, t0=10.0, bin_s=0.01, factor=4, n_levels=5) as builder:
+            for timestamp, data in zip(np.array_split(self.timestamp, chunks), np.array_split(self.data, chunks)):
+                builder.append(timestamp, data)
+        return Pyramid(self.root / name)
+
+    def test_levels(self):
+        levels = self.build("one", chunks=1)
+        for level in range(levels.n_levels):
+            records = levels.level(level)
+            vmin, vmax, mean = reference_level(self.timestamp, self.data, 10.0, levels.bin_s_of(level), len(records))
+            np.testing.assert_allclose(records["min"], vmin, rtol=1e-6)
+            np.testing.assert_allclose(records["max"], vmax, rtol=1e-6)
+            np.testing.assert_allclose(records["mean"], mean, rtol=1e-4, atol=1e-6)
+            self.assertEqual(int(records["count"].sum()), len(self.timestamp))
+        self.assertTrue(np.isnan(levels.level(0)["mean"][550]).all())  # In the gap
+
+        # Appending chunk by chunk builds the same pyramid
+        chunked = self.build("chunked", chunks=37)
+        for level in range(levels.n_levels):
+            np.testing.assert_array_equal(chunked.level(level).tobytes(), levels.level(level).tobytes())
+
+    def test_query(self):
+        levels = self.build("one", chunks=1)
+        window = levels.query(11.0, 12.0, width=1000)
+        self.assertEqual(window.level, 0)
+        self.assertEqual(len(window.time), 100)
+        self.assertAlmostEqual(window.time[0], 11.0)
+        window = levels.query(10.0, 30.0, width=200)
+        self.assertEqual(window.level, 2)  # 0.16 s bins
+        self.assertLessEqual(len(window.time), 200)
+        np.testing.assert_allclose(np.nanmax(window.max, axis=0), self.data.max(0), rtol=1e-6)
+        self.assertEqual(len(levels.query(100.0, 200.0, width=10).time), 0)
+
+    def test_incremental_read(self):
+        builder = PyramidBuilder(self.root / "live", 3, t0=10.0, bin_s=0.01, factor=4, n_levels=3)
+        reader = None
+        for timestamp, data in zip(np.array_split(self.timestamp, 4), np.array_split(self.data, 4)):
+            builder.append(timestamp, data)
+            reader = reader or Pyramid(self.root / "live")
+            window = reader.query(10.0, timestamp[-1], width=100_000)
+            self.assertLessEqual(window.time[-1], timestamp[-1])
+            self.assertEqual(int(window.count.sum()), int((self.timestamp < window.time[-1] + 0.01).sum()))
+        builder.close()
+
+    def test_session(self):
+        session = write_mock_session(self.root / "session", duration_s=10.0, n_trials=5)
+        pyramids = pyramid.build_session_pyramids(session, chunk_size=300, n_levels=4)
+        self.assertEqual(list(pyramids), ["load_cells"])
+        levels = Pyramid(pyramids["load_cells"])
+        self.assertEqual(levels.n_channels, 8)
+        self.assertEqual(int(levels.level(3)["count"].sum()), 1000)
+
+
+if __name__ == "__main__":
+    unittest.main()
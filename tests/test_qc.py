@@ -0,0 +1,72 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+from aind_behavior_force_foraging import dataset
+from aind_behavior_force_foraging.harp_io import PayloadType, encode_harp_messages
+from aind_behavior_force_foraging.qc import check_harp_file, qc_session, run_qc
+
+from tests import write_mock_session
+
+
+class QcTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self._tmp.name)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_clean_session(self):
+        session = write_mock_session(self.root / "session", duration_s=10.0, n_trials=5)
+        self.assertNotIn("replayed_trial_count", qc_session(session))
+        row = qc_session(session, with_replay=True)
+        self.assertIsNone(row["error"])
+        self.assertEqual(row["harp_corrupted_messages"], 0)
+        self.assertEqual(row["harp_dropped_heartbeats"], 0)
+        self.assertEqual(row["harp_clock_discontinuities"], 0)
+        self.assertEqual(row["camera_trigger_count"], 1200)
+        self.assertEqual(row["camera_missing_triggers"], 0)
+        self.assertEqual(row["FaceCamera_missing_frames"], 0)
+        self.assertEqual(row["trial_count"], 5)
+        self.assertEqual(row["reward_count"], 3)
+        self.assertAlmostEqual(row["total_reward"], 4.5)
+        self.assertEqual(row["replayed_trial_count"], 5)
+
+    def test_harp_integrity(self):
+        timestamps = np.array([0.0, 1.0, 2.0, 5.0, 4.5, 6.0])
+        buffer = bytearray(encode_harp_messages(8, np.zeros(6, np.uint32), PayloadType.U32, timestamps))
+        buffer[-1] ^= 0xFF
+        path = self.root / "Behavior_8.bin"
+        path.write_bytes(bytes(buffer))
+        qc = check_harp_file(path, "Behavior", 8)
+        self.assertEqual(qc.message_count, 6)
+        self.assertEqual(qc.corrupted_count, 1)
+        self.assertEqual(qc.clock_discontinuities, 1)
+        self.assertEqual(qc.dropped_heartbeats, 2)
+        self.assertEqual(qc.max_gap_s, 3.0)
+
+    def test_truncated_harp_file(self):
+        session = write_mock_session(self.root / "session", duration_s=4.0, n_trials=2)
+        dataset.harp_register_file(session, "Behavior", 8).write_bytes(b"\x03\x0b\x08")
+        row = qc_session(session)
+        self.assertIsNone(row["error"])
+        self.assertEqual(row["harp_corrupted_messages"], 0)
+
+    def test_run_qc(self):
+        sessions = [write_mock_session(self.root / f"session{i}", duration_s=4.0, n_trials=2) for i in range(2)]
+        dataset.harp_register_file(sessions[1], "Behavior", 92).unlink()
+        summary = run_qc([*sessions, self.root / "missing"], max_workers=2)
+        self.assertEqual(len(summary), 3)
+        self.assertEqual(list(summary["session"]), [str(s) for s in [*sessions, self.root / "missing"]])
+        self.assertEqual(summary.columns[-1], "error")
+        self.assertEqual(summary.loc[0, "camera_trigger_count"], 480)
+        self.assertTrue(np.isnan(summary.loc[1, "camera_trigger_count"]))
+        self.assertTrue(summary["error"].iloc[:2].isna().all())
+        self.assertIn("FileNotFoundError", summary.loc[2, "error"])
+        self.assertEqual(list(run_qc([]).columns), ["session", "error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
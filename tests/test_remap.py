@@ -0,0 +1,122 @@
+import datetime
+import json
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+from aind_behavior_force_foraging import dataset
+from aind_behavior_force_foraging.remap import EnvironmentSnapshot, RepositorySnapshot, remap_session, remap_sessions
+from aind_data_schema.components.devices import Disc, Speaker
+from aind_data_schema.core.rig import Rig
+from aind_data_schema.core.session import Session
+from aind_data_schema_models.modalities import Modality
+from aind_data_schema_models.organizations import Organization
+
+from tests.test_water import write_valve_commands
+
+sys.path.append(".")
+from examples.example_roi_trial_type import (  # isort:skip # pylint: disable=wrong-import-position
+    mock_rig,
+    mock_session,
+    mock_task_logic,
+)
+
+REPOSITORY = RepositorySnapshot(
+    url="https://github.com/AllenNeuralDynamics/Aind.Behavior.ForceForaging",
+    sha="0" * 40,
+    working_dir=str(Path(".").resolve()),
+)
+
+
+def mock_aind_rig(rig_id: str) -> Rig:
+    return Rig(
+        rig_id=rig_id,
+        modification_date=datetime.date(2024, 1, 1),
+        mouse_platform=Disc(name="disc", radius=1),
+        calibrations=[],
+        modalities={Modality.BEHAVIOR},
+        stimulus_devices=[Speaker(name="speaker", manufacturer=Organization.OTHER, notes="Speaker")],
+    )
+
+
+class RemapTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self._tmp.name) / "Data"
+        self.library = Path(self._tmp.name) / "AindForceForaging"
+        rig = mock_rig()
+        self.sessions = []
+        for name in ("session_1", "session_2"):
+            logs = self.root / "mouse" / name / dataset.BEHAVIOR_DIR / dataset.LOGS_DIR
+            logs.mkdir(parents=True)
+            for filename, model in (
+                (dataset.SESSION_INPUT, mock_session()),
+                (dataset.RIG_INPUT, rig),
+                (dataset.TASK_LOGIC_INPUT, mock_task_logic()),
+            ):
+                (logs / filename).write_text(model.model_dump_json(), encoding="utf-8")
+            self.sessions.append(logs.parents[1])
+        aind_rig_dir = self.library / "AindDataSchemaRig" / rig.computer_name
+        aind_rig_dir.mkdir(parents=True)
+        mock_aind_rig("428_RIG-1_20240101").write_standard_file(aind_rig_dir)
+        (aind_rig_dir / "rig.json").rename(aind_rig_dir / f"{rig.rig_name}.json")
+        self.environment = EnvironmentSnapshot(python={"numpy": "2.0"}, bonsai={"Bonsai": "2.8"})
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_remap_session(self):
+        session_path = self.sessions[0]
+        result = remap_session(session_path, REPOSITORY, self.library, environment=self.environment)
+        self.assertIsNone(result.error)
+        self.assertIn("Could not compute the water", result.warning)  # No valve commands
+        self.assertEqual(result.rig_id, "428_RIG-1_20240101")
+        session = Session.model_validate_json((session_path / "session.json").read_text(encoding="utf-8"))
+        self.assertEqual(session.rig_id, "428_RIG-1_20240101")
+        self.assertEqual(session.subject_id, mock_session().subject)
+        self.assertEqual(session.stimulus_epochs[0].software[0].parameters.model_dump(), self.environment.bonsai)
+        self.assertTrue((session_path / "rig.json").exists())
+
+        # Fields that can not be rebuilt from the inputs are carried over
+        document = json.loads((session_path / "session.json").read_text(encoding="utf-8"))
+        document["animal_weight_post"] = 21.5
+        document["stimulus_epochs"][0]["software"][1]["parameters"] = {"numpy": "1.26"}
+        (session_path / "session.json").write_text(json.dumps(document), encoding="utf-8")
+        remap_session(session_path, REPOSITORY, None, environment=self.environment)
+        session = Session.model_validate_json((session_path / "session.json").read_text(encoding="utf-8"))
+        self.assertEqual(session.animal_weight_post, 21.5)
+        self.assertEqual(session.stimulus_epochs[0].software[1].parameters.model_dump(), {"numpy": "1.26"})
+        self.assertEqual(session.session_end_time, datetime.datetime.fromisoformat(document["session_end_time"]))
+
+    def test_session_rig_is_preferred(self):
+        session_path = self.sessions[0]
+        mock_aind_rig("428_RIG-1_20230101").write_standard_file(session_path)
+        result = remap_session(session_path, REPOSITORY, self.library, environment=self.environment)
+        self.assertIsNone(result.error)
+        self.assertEqual(result.rig_id, "428_RIG-1_20230101")
+
+    def test_water_from_valve_commands(self):
+        session_path = self.sessions[0]
+        write_valve_commands(session_path, [100, 200], [1.0, 2.0])  # The mock calibration has a unit slope
+        result = remap_session(session_path, REPOSITORY, self.library, environment=self.environment)
+        self.assertIsNone(result.warning)
+        session = Session.model_validate_json((session_path / "session.json").read_text(encoding="utf-8"))
+        self.assertAlmostEqual(float(session.reward_consumed_total), 0.3)
+        self.assertAlmostEqual(float(session.stimulus_epochs[0].reward_consumed_during_epoch), 0.3)
+
+    def test_remap_sessions(self):
+        (self.sessions[1] / dataset.BEHAVIOR_DIR / dataset.LOGS_DIR / dataset.RIG_INPUT).unlink()
+        output = Path(self._tmp.name) / "Metadata"
+        report = remap_sessions(
+            dataset.discover_sessions(self.root), self.library, REPOSITORY, output_root=output, max_workers=2
+        ).set_index("session")
+        self.assertIsNone(report.loc[str(self.sessions[0]), "error"])
+        self.assertIn("Missing input files", report.loc[str(self.sessions[1]), "error"])
+        self.assertTrue((output / "mouse" / "session_1" / "session.json").exists())
+        self.assertFalse((self.sessions[0] / "session.json").exists())
+        self.assertTrue((output / "remap_report.csv").exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
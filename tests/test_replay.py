@@ -0,0 +1,188 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+from aind_behavior_force_foraging import dataset, replay
+from aind_behavior_force_foraging.replay import ForceTrace, first_held, replay_trial, replay_trials
+from aind_behavior_force_foraging.task_logic import (
+    HarvestMode,
+    InitiationPeriod,
+    LeftHarvestAction,
+    QuiescencePeriod,
+    ResponsePeriod,
+    RightHarvestAction,
+    Trial,
+    scalar_value,
+    uniform_distribution_value,
+)
+from aind_behavior_force_foraging.trials import build_trial_table
+
+from tests import write_mock_session
+
+RATE = 1000.0
+
+
+def force_trace(duration_s: float, presses=()) -> ForceTrace:
+    """A flat force, with `(start, stop, side, value)` presses."""
+    time = np.arange(0, duration_s, 1.0 / RATE)
+    force = {"Left": np.zeros_like(time), "Right": np.zeros_like(time)}
+    for start, stop, side, value in presses:
+        force[side][(time >= start) & (time < stop)] = value
+    return ForceTrace(time=time, left_force=force["Left"], right_force=force["Right"])
+
+
+def roi_trial(**kwargs) -> Trial:
+    return Trial(
+        inter_trial_interval=scalar_value(0.5),
+        initiation_period=InitiationPeriod(duration=scalar_value(0.5)),
+        response_period=ResponsePeriod(duration=scalar_value(2.0)),
+        left_harvest=LeftHarvestAction(
+            harvest_mode=HarvestMode.ROI,
+            lower_force_threshold=100,
+            upper_force_threshold=200,
+            force_duration=0.2,
+            is_operant=False,
+        ),
+        right_harvest=RightHarvestAction(
+            harvest_mode=HarvestMode.ROI,
+            lower_force_threshold=100,
+            upper_force_threshold=200,
+            force_duration=0.2,
+            is_operant=False,
+        ),
+        **kwargs,
+    )
+
+
+class ReplayTests(unittest.TestCase):
+    def test_first_held(self):
+        time = np.arange(10, dtype=float)
+        state = np.array([0, 1, 1, 0, 1, 1, 1, 1, 0, 0], dtype=bool)
+        self.assertEqual(first_held(time, state, True, 2.0, 0.0, 10.0), 3.0)
+        self.assertEqual(first_held(time, state, True, 2.0, 5.0, 10.0), 7.0)  # The timer starts with the observation
+        self.assertEqual(first_held(time, state, False, 1.5, 0.0, 10.0), 9.5)
+        self.assertEqual(first_held(time, state, True, 2.5, 0.0, 10.0), 6.5)
+        self.assertTrue(np.isnan(first_held(time, state, True, 5.0, 0.0, 10.0)))
+
+    def test_accumulated_force(self):
+        rng = np.random.default_rng(0)
+        time = np.cumsum(rng.uniform(0.001, 0.002, 1000))
+        force = rng.normal(0, 100, 1000)
+        expected, total = [], 50.0
+        for i in range(1, len(time)):
+            total = max(total + 0.5 * (force[i] + force[i - 1]) * (time[i] - time[i - 1]), 50.0)
+            expected.append(total)
+        np.testing.assert_allclose(replay.accumulated_force(time, force, 50.0), expected)
+
+    def test_harvest(self):
+        force = force_trace(4.0, [(0.8, 1.2, "Right", 300), (1.3, 1.6, "Right", 150), (1.4, 1.7, "Left", 150)])
+        trial = replay_trial(force, np.empty(0), roi_trial(), start=0.0)
+        self.assertTrue(trial.is_replayed)
+        self.assertEqual(trial.initiation_period_start_time, 0.0)
+        self.assertEqual(trial.response_period_start_time, 0.5)
+        self.assertAlmostEqual(trial.harvest_action_selected_time, 1.5)
+        self.assertEqual(trial.selected_action, "Right")
+        self.assertFalse(trial.is_aborted)
+        self.assertAlmostEqual(trial.reward_time, 1.5)  # Open loop, without delay
+        self.assertAlmostEqual(trial.outcome_time, 2.0)
+
+        timeout = replay_trial(force_trace(4.0), np.empty(0), roi_trial(), start=0.0)
+        self.assertEqual(timeout.selected_action, "None")
+        self.assertTrue(timeout.is_aborted)
+        self.assertAlmostEqual(timeout.harvest_action_selected_time, 2.5)
+
+        # The next trial starts before the response period ends
+        self.assertFalse(replay_trial(force_trace(4.0), np.empty(0), roi_trial(), start=0.0, stop=2.0).is_replayed)
+
+    def test_quiescence_and_abort(self):
+        trial = roi_trial(
+            quiescence_period=QuiescencePeriod(duration=scalar_value(0.5), force_threshold=50),
+        )
+        trial.initiation_period.abort_on_force = True
+        trial.initiation_period.abort_on_force_threshold = 50
+        force = force_trace(4.0, [(0.0, 0.4, "Left", 100), (0.6, 0.7, "Left", 100), (1.5, 1.6, "Right", 100)])
+        replayed = replay_trial(force, np.empty(0), trial, start=0.0)
+        self.assertAlmostEqual(replayed.initiation_period_start_time, 1.2)
+        self.assertTrue(replayed.is_aborted)
+        self.assertAlmostEqual(replayed.end_time, 1.5)
+        self.assertTrue(np.isnan(replayed.response_period_start_time))
+
+    def test_accumulation(self):
+        trial = Trial(
+            initiation_period=InitiationPeriod(duration=scalar_value(0.0)),
+            response_period=ResponsePeriod(duration=scalar_value(5.0)),
+            left_harvest=LeftHarvestAction(
+                harvest_mode=HarvestMode.ACCUMULATION, lower_force_threshold=0, upper_force_threshold=100, delay=0.1
+            ),
+        )
+        replayed = replay_trial(force_trace(6.0, [(1.0, 3.0, "Left", 100)]), np.array([1.0, 3.0]), trial, start=0.0)
+        self.assertEqual(replayed.selected_action, "Left")
+        self.assertAlmostEqual(replayed.harvest_action_selected_time, 2.5, places=2)  # 1 s to accumulate, held 0.5 s
+        self.assertEqual(replayed.reward_time, 3.0)  # Operant, at the first lick after the delay
+
+    def test_time_to_collect(self):
+        trial = roi_trial()
+        trial.right_harvest.is_operant = True
+        trial.right_harvest.time_to_collect = scalar_value(1.0)
+        force = force_trace(10.0, [(1.0, 1.3, "Right", 150), (5.0, 5.3, "Right", 150)])
+        replayed = replay_trials(force, np.array([2.0, 7.0]), [trial, trial], [0.0, 4.0])
+        np.testing.assert_allclose(replayed["reward_time"], [2.0, np.nan])
+        np.testing.assert_allclose(replayed["end_time"], [2.0, 6.2])
+
+        # The sampled time to collect is not logged
+        trial.right_harvest.time_to_collect = uniform_distribution_value(0.5, 1.5)
+        self.assertFalse(replay_trial(force, np.empty(0), trial, start=4.0).is_replayed)
+
+    def test_compare(self):
+        force = force_trace(8.0, [(0.8, 1.3, "Right", 150)])
+        trials = [roi_trial(), roi_trial()]
+        replayed = replay_trials(force, np.empty(0), trials, [0.0, 3.0])
+        events = []
+        for start, response, harvest, action, rewarded in (
+            (0.0, 0.5, 1.0, "Right", True),
+            (3.0, 3.5, 5.5, "Left", True),
+        ):
+            events += [
+                _event("Trial", start, {}),
+                _event("InitiationPeriod", start, {}),
+                _event("ResponsePeriod", response, {}),
+                _event("HarvestActionSelected", harvest, {"action": action}),
+                _event("TrialOutcome", harvest + 0.5, {"IsAborted": False}),
+            ]
+            if rewarded:
+                events.append(_event("GiveReward", harvest, 1.0))
+        comparison = replay.compare_replay(replayed, build_trial_table(events))
+        self.assertEqual(list(comparison["matches"]), [True, False])
+        self.assertEqual(list(comparison["action_matches"]), [True, False])
+        self.assertAlmostEqual(comparison.loc[1, "harvest_action_selected_error_s"], 0.0)
+        summary = replay.summarize_replay(replayed, comparison)
+        self.assertEqual(summary["replay_mismatch_count"], 1)
+        self.assertAlmostEqual(summary["replay_max_timing_error_s"], 0.0)
+
+    def test_session(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            session = write_mock_session(Path(tmp) / "session", duration_s=10.0, n_trials=5)
+            force = replay.read_force(session)
+            chunked = replay.read_force(session, chunk_size=300)
+            summary = replay.replay_session(session)
+            (dataset.harp_register_file(session, "LoadCells", 33)).unlink()
+            with self.assertRaises(FileNotFoundError):
+                replay.read_force(session)
+        self.assertEqual(len(force), 1000)
+        for expected, actual in zip(force, chunked):
+            np.testing.assert_array_equal(actual, expected)
+        self.assertEqual(summary["replayed_trial_count"], 5)
+        # The mock session logs a response, but no timeout, in every trial
+        self.assertEqual(summary["replay_mismatch_count"], 5)
+
+
+def _event(name: str, timestamp: float, data):
+    from aind_behavior_services.data_types import SoftwareEvent
+
+    return SoftwareEvent(name=name, timestamp=timestamp, data=json.loads(json.dumps(data)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import importlib.util
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+from aind_behavior_force_foraging import serialization
+from aind_behavior_force_foraging.rig import AindForceForagingRig
+from aind_behavior_force_foraging.serialization import Codec, SchemaMismatchError
+from aind_behavior_force_foraging.task_logic import AindForceForagingTaskLogic
+
+sys.path.append(".")
+from examples.example_roi_trial_type import (  # isort:skip # pylint: disable=wrong-import-position
+    mock_rig,
+    mock_task_logic,
+)
+
+CODECS = [Codec.JSON] + ([Codec.MSGPACK] if importlib.util.find_spec("msgpack") else [])
+
+
+class SerializationTests(unittest.TestCase):
+    def test_round_trip(self):
+        for codec in CODECS:
+            for model in (mock_task_logic(), mock_rig()):
+                with self.subTest(codec=codec.name, model=type(model).__name__):
+                    decoded = serialization.loads(serialization.dumps(model, codec), type(model))
+                    self.assertEqual(decoded, model)
+                    self.assertEqual(decoded.model_dump_json(), model.model_dump_json())
+
+    @unittest.skipUnless(importlib.util.find_spec("msgpack"), "msgpack is not installed")
+    def test_msgpack_is_smaller(self):
+        model = mock_rig()
+        self.assertLess(len(serialization.dumps(model)), len(model.model_dump_json().encode("utf-8")))
+
+    def test_header(self):
+        payload = serialization.dumps(mock_task_logic(), Codec.JSON)
+        self.assertEqual(payload[:4], serialization.MAGIC)
+        self.assertEqual(
+            payload[6 : serialization.HEADER.size], serialization.schema_fingerprint(AindForceForagingTaskLogic)
+        )
+        with self.assertRaises(SchemaMismatchError):
+            serialization.loads(payload, AindForceForagingRig)
+        with self.assertRaises(ValueError):
+            serialization.loads(b"{}" + payload, AindForceForagingTaskLogic)
+        with self.assertRaises(ValueError):
+            serialization.loads(payload[:8], AindForceForagingTaskLogic)
+        self.assertNotEqual(
+            serialization.schema_fingerprint(AindForceForagingTaskLogic),
+            serialization.schema_fingerprint(AindForceForagingRig),
+        )
+
+    def test_file(self):
+        model = mock_task_logic()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "tasklogic_input.bin"
+            serialization.dump(model, path, CODECS[-1])
+            self.assertEqual(serialization.load(path, AindForceForagingTaskLogic), model)
+
+
+if __name__ == "__main__":
+    unittest.main()
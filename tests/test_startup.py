@@ -0,0 +1,127 @@
+import json
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import aind_behavior_experiment_launcher.launcher.behavior_launcher as behavior_launcher
+from aind_behavior_experiment_launcher.resource_monitor import Constraint
+from aind_behavior_force_foraging import launcher as force_foraging_launcher
+from aind_behavior_force_foraging.startup import (
+    ConcurrentResourceMonitor,
+    StartupProfiler,
+    list_directories,
+    run_checks,
+)
+
+
+class RunChecksTests(unittest.TestCase):
+    def test_checks_run_concurrently(self):
+        barrier = threading.Barrier(3, timeout=2)
+        start = time.perf_counter()
+        results = run_checks({name: barrier.wait for name in "abc"}, timeout_s=5)
+        self.assertLess(time.perf_counter() - start, 2)
+        self.assertTrue(all(r.ok for r in results.values()))
+        self.assertEqual(list(results), ["a", "b", "c"])
+
+    def test_timeout_and_errors(self):
+        release = threading.Event()
+
+        def fail():
+            raise OSError("share went away")
+
+        start = time.perf_counter()
+        results = run_checks({"hung": release.wait, "fail": fail, "fast": lambda: 42}, timeout_s=0.2)
+        release.set()
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertTrue(results["hung"].timed_out)
+        self.assertIn("share went away", results["fail"].error)
+        self.assertFalse(results["fail"].ok)
+        self.assertEqual(results["fast"].value, 42)
+
+    def test_concurrent_resource_monitor(self):
+        release = threading.Event()
+        constraints = [
+            Constraint(name="ok", constraint=lambda: True),
+            Constraint(name="slow_share", constraint=release.wait),
+        ]
+        monitor = ConcurrentResourceMonitor(constrains=constraints, timeout_s=0.2)
+        self.assertFalse(monitor.validate())
+        self.assertTrue(monitor.last_results["slow_share"].timed_out)
+        release.set()
+        self.assertTrue(monitor.evaluate_constraints())
+        monitor.add_constraint(Constraint(name="ok", constraint=lambda: False))
+        self.assertFalse(monitor.evaluate_constraints())
+        self.assertEqual(set(monitor.last_results), {"ok[0]", "slow_share", "ok[2]"})
+
+
+class StartupProfilerTests(unittest.TestCase):
+    def test_phases(self):
+        profiler = StartupProfiler()
+        with profiler.phase("init"):
+            with profiler.phase("validate"):
+                time.sleep(0.01)
+            profiler.record("check:remote", 0.005)
+        with self.assertRaises(ValueError):
+            with profiler.phase("broken"):
+                raise ValueError()
+        phases = {p.name: p for p in profiler.phases}
+        self.assertGreaterEqual(phases["init"].duration_s, phases["validate"].duration_s)
+        self.assertGreaterEqual(phases["validate"].duration_s, 0.01)
+        self.assertEqual((phases["init"].depth, phases["validate"].depth, phases["check:remote"].depth), (0, 1, 1))
+        self.assertEqual(phases["broken"].error, "ValueError")
+        report = profiler.report()
+        self.assertLess(report.index("init"), report.index("validate"))
+        with tempfile.TemporaryDirectory() as tmp:
+            profiler.save(Path(tmp) / "profile.json")
+            saved = json.loads((Path(tmp) / "profile.json").read_text(encoding="utf-8"))
+        self.assertEqual(len(saved), 4)
+
+    def test_list_directories(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            (Path(tmp) / "Rig").mkdir()
+            (Path(tmp) / "Rig" / "rig.json").write_text("{}", encoding="utf-8")
+            listing = list_directories(Path(tmp) / "Rig", Path(tmp) / "Missing")
+        self.assertEqual(listing, {str(Path(tmp) / "Rig"): ["rig.json"]})
+
+
+class LauncherValidateTests(unittest.TestCase):
+    def _launcher(self, config_library_dir: Path):
+        launcher = object.__new__(force_foraging_launcher.ForceForagingLauncher)
+        launcher.startup_profiler = StartupProfiler()
+        launcher.startup_check_timeout_s = 0.2
+        launcher._rig_dir = config_library_dir / "Rig"
+        launcher._subject_dir = config_library_dir / "Subjects"
+        launcher._task_logic_dir = config_library_dir / "TaskLogic"
+        launcher._exit = mock.Mock()
+        return launcher
+
+    def test_validate(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            launcher = self._launcher(Path(tmp))
+            with mock.patch.object(behavior_launcher.BehaviorLauncher, "validate") as base:
+                launcher.validate()
+        base.assert_called_once()
+        names = {p.name for p in launcher.startup_profiler.phases}
+        self.assertLessEqual({"validate", "base_checks", "check:config_listing:rig"}, names)
+        launcher._exit.assert_not_called()
+
+    def test_validate_unresponsive_share(self):
+        release = threading.Event()
+        with tempfile.TemporaryDirectory() as tmp:
+            launcher = self._launcher(Path(tmp))
+            with (
+                mock.patch.object(behavior_launcher.BehaviorLauncher, "validate") as base,
+                mock.patch.object(force_foraging_launcher, "list_directories", side_effect=lambda _: release.wait()),
+            ):
+                with self.assertRaises(TimeoutError):
+                    launcher.validate()
+            release.set()
+        base.assert_not_called()
+        launcher._exit.assert_called_once_with(-1)
+
+
+if __name__ == "__main__":
+    unittest.main()
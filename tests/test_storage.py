@@ -0,0 +1,112 @@
+import os
+import sys
+import tempfile
+import unittest
+from collections import namedtuple
+from pathlib import Path
+from unittest import mock
+
+import aind_behavior_services.rig as rig
+from aind_behavior_force_foraging import storage
+from aind_behavior_force_foraging.compression import CompressionSettings, originals_directory
+
+sys.path.append(".")
+from examples.example_roi_trial_type import mock_rig  # isort:skip # pylint: disable=wrong-import-position
+
+_DiskUsage = namedtuple("_DiskUsage", ["total", "used", "free"])
+
+
+class _Launcher:
+    def __init__(self, rig_schema=None):
+        self._rig_schema = rig_schema
+
+    @property
+    def rig_schema(self):
+        if self._rig_schema is None:
+            raise ValueError("Rig schema instance not set.")
+        return self._rig_schema
+
+
+class StorageTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.data_dir = Path(self._tmp.name)
+        self.rig = mock_rig()
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_camera_estimate(self):
+        writer = rig.VideoWriterFfmpeg(frame_rate=60, output_arguments="-c:v h264_nvenc -cq 18")
+        camera = rig.SpinnakerCamera(serial_number="0", binning=2, video_writer=writer)
+        camera.region_of_interest = rig.Rect(x=0, y=0, width=800, height=600)
+        self.assertEqual(storage.camera_shape(camera), (300, 400))
+        self.assertAlmostEqual(storage.camera_bytes_per_second(camera, 100), 300 * 400 * 100 * 0.075)
+        self.assertAlmostEqual(storage.camera_bytes_per_second(camera, None), 300 * 400 * 60 * 0.075)
+        camera.video_writer = None
+        self.assertEqual(storage.camera_bytes_per_second(camera, 100), 0)
+
+    def test_session_footprint(self):
+        footprint = storage.estimate_session_footprint(self.rig, duration_s=3600)
+        self.assertEqual(set(footprint.videos), {"FaceCamera", "SideCamera", "WebCam0"})
+        self.assertEqual(footprint.videos["WebCam0"], 0)  # No video writer
+        self.assertAlmostEqual(footprint.videos["FaceCamera"], 1080 * 1440 * 120 * 0.15 * 3600)
+        self.assertNotIn("harp_analog_input", footprint.harp)
+        self.assertIn("harp_load_cells", footprint.harp)
+        longer = storage.estimate_session_footprint(self.rig, duration_s=7200)
+        self.assertAlmostEqual(longer.total_bytes, 2 * footprint.total_bytes)
+
+    def test_pending_post_session_bytes(self):
+        for name, queued in (("a", True), ("b", False), ("c", True)):
+            behavior = self.data_dir / "subject" / name / "Behavior" / "Behavior.harp"
+            behavior.mkdir(parents=True)
+            (behavior / "Behavior_32.bin").write_bytes(os.urandom(1000))
+            (behavior / "Behavior_44.bin").write_bytes(os.urandom(100 if queued else 5000))
+            (behavior.parent / "telemetry.bin").write_bytes(os.urandom(10000))
+            if queued:
+                originals_directory(behavior.parents[1]).mkdir(parents=True)
+        self.assertEqual(storage.pending_post_session_bytes(self.data_dir, max_workers=2), 4000)
+        (self.data_dir / "subject" / "a" / "Behavior" / "Behavior.harp" / "Behavior_32.bin").unlink()
+        self.assertEqual(storage.pending_post_session_bytes(self.data_dir, max_workers=2), 2200)
+        originals_directory(self.data_dir / "subject" / "c").rmdir()
+        self.assertEqual(storage.pending_post_session_bytes(self.data_dir, max_workers=2), 200)
+        originals_directory(self.data_dir / "subject" / "a").rmdir()
+        self.assertEqual(storage.pending_post_session_bytes(self.data_dir, max_workers=2), 0)
+
+    def test_constraint_compression_workers(self):
+        behavior = self.data_dir / "subject" / "a" / "Behavior" / "Behavior.harp"
+        behavior.mkdir(parents=True)
+        (behavior / "Behavior_32.bin").write_bytes(os.urandom(1000))
+        originals_directory(behavior.parents[1]).mkdir(parents=True)
+        required = storage.estimate_session_footprint(self.rig, duration_s=3600).total_bytes * 1.25
+        constraint = storage.predictive_storage_constraint_factory(
+            _Launcher(self.rig),
+            self.data_dir,
+            duration_s=3600,
+            compression_settings=CompressionSettings(max_workers=4),
+        )
+        with mock.patch("shutil.disk_usage", return_value=_DiskUsage(0, 0, required + 4000)):
+            self.assertTrue(constraint())
+        with mock.patch("shutil.disk_usage", return_value=_DiskUsage(0, 0, required + 3999)):
+            self.assertFalse(constraint())
+
+    def test_constraint(self):
+        required = storage.estimate_session_footprint(self.rig, duration_s=3600).total_bytes * 1.25
+        constraint = storage.predictive_storage_constraint_factory(_Launcher(), self.data_dir, duration_s=3600)
+        with mock.patch("shutil.disk_usage", return_value=_DiskUsage(0, 0, 0)):
+            self.assertTrue(constraint())  # Rig not selected yet
+        launcher = _Launcher(self.rig)
+        constraint = storage.predictive_storage_constraint_factory(launcher, self.data_dir, duration_s=3600)
+        with mock.patch("shutil.disk_usage", return_value=_DiskUsage(0, 0, required * 1.01)):
+            self.assertTrue(constraint())
+        with mock.patch("shutil.disk_usage", return_value=_DiskUsage(0, 0, required * 0.99)):
+            self.assertFalse(constraint())
+            self.assertIn("does not have enough space", constraint.on_fail())
+            warn_only = storage.predictive_storage_constraint_factory(
+                launcher, self.data_dir, duration_s=3600, warn_only=True
+            )
+            self.assertTrue(warn_only())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+from aind_behavior_force_foraging.telemetry import (
+    TELEMETRY_DTYPE,
+    TelemetrySampler,
+    Threshold,
+    read_telemetry,
+    telemetry_summary,
+)
+
+
+class _FakePsutil:
+    def __init__(self):
+        self.write_bytes = 0
+
+    def cpu_percent(self, interval=None):
+        return 50.0
+
+    def virtual_memory(self):
+        return SimpleNamespace(percent=40.0)
+
+    def disk_io_counters(self):
+        self.write_bytes += 1000
+        return SimpleNamespace(write_bytes=self.write_bytes)
+
+
+class TelemetryTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self._tmp.name)
+        self.path = self.root / "session" / "Behavior" / "Logs" / "telemetry.bin"
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_record(self):
+        sampler = TelemetrySampler(self.path, data_dir=self.root, remote_dir=self.root, interval_s=0.02)
+        sampler._psutil = _FakePsutil()
+        with sampler:
+            time.sleep(0.2)
+        telemetry = read_telemetry(self.path)
+        self.assertGreater(len(telemetry), 2)
+        self.assertTrue(np.all(np.diff(telemetry["time"]) > 0))
+        self.assertTrue(np.all(telemetry["cpu_percent"] == 50))
+        self.assertTrue(np.isnan(telemetry["disk_write_bytes_per_s"][0]))
+        self.assertTrue(np.all(telemetry["disk_write_bytes_per_s"][1:] > 0))
+        self.assertTrue(np.all(telemetry["free_bytes"] > 0))
+        self.assertTrue(np.all(np.isfinite(telemetry["share_latency_s"])))
+        summary = telemetry_summary(telemetry)
+        self.assertEqual(summary["max_memory_percent"], 40)
+        self.assertGreater(summary["min_free_bytes"], 0)
+
+    def test_partial_record_is_ignored(self):
+        with TelemetrySampler(self.path, data_dir=self.root, interval_s=10):
+            pass
+        with open(self.path, "ab") as f:
+            f.write(b"\x00" * (TELEMETRY_DTYPE.itemsize // 2))
+        telemetry = read_telemetry(self.path)
+        self.assertEqual(len(telemetry), 1)
+        self.assertTrue(np.isnan(telemetry["share_latency_s"][0]))
+
+    def test_alerts_are_edge_triggered(self):
+        alerts = []
+        sampler = TelemetrySampler(
+            self.path,
+            data_dir=self.root,
+            thresholds=[Threshold("cpu_percent", above=80), Threshold("free_bytes", below=100)],
+            on_alert=alerts.append,
+        )
+        record = np.zeros(1, dtype=TELEMETRY_DTYPE)
+        record["free_bytes"] = 1000
+        for cpu in (10, 90, 95, 10, 85, np.nan):
+            record["cpu_percent"] = cpu
+            sampler._check_thresholds(record)
+        self.assertEqual([a.value for a in alerts], [90, 85])
+        self.assertEqual(sampler.alerts, alerts)
+
+    def test_unknown_metric(self):
+        with self.assertRaises(ValueError):
+            TelemetrySampler(self.path, data_dir=self.root, thresholds=[Threshold("gpu_percent", above=1)])
+
+
+if __name__ == "__main__":
+    unittest.main()
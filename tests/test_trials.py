@@ -0,0 +1,63 @@
+import unittest
+
+import numpy as np
+from aind_behavior_force_foraging.trials import build_trial_table
+from aind_behavior_services.data_types import SoftwareEvent
+
+
+def _harvest(action: str, amount: float = 1.0) -> dict:
+    return {"action": action, "harvest_mode": "RegionOfInterest", "amount": amount, "upper_force_threshold": 20000}
+
+
+class TrialTableTests(unittest.TestCase):
+    def setUp(self):
+        trial = {"left_harvest": _harvest("Left"), "right_harvest": _harvest("Right", 2.0)}
+        self.events = [
+            SoftwareEvent(name="Trial", timestamp=10.0, data=trial),
+            SoftwareEvent(name="QuiescencePeriod", timestamp=10.5, data={}),
+            SoftwareEvent(name="ResponsePeriod", timestamp=11.0, data={}),
+            SoftwareEvent(name="HarvestActionSelected", timestamp=11.5, data=_harvest("Right", 2.0)),
+            SoftwareEvent(name="GiveReward", timestamp=12.0, data=2.0),
+            SoftwareEvent(
+                name="TrialOutcome",
+                timestamp=12.5,
+                data={"HarvestAction": _harvest("Right"), "TrialNumber": 0, "Reward": 2.0, "IsAborted": False},
+            ),
+            SoftwareEvent(name="Trial", timestamp=20.0, data={"left_harvest": None, "right_harvest": None}),
+            SoftwareEvent(
+                name="TrialOutcome",
+                timestamp=21.0,
+                data={"HarvestAction": None, "TrialNumber": 1, "Reward": None, "IsAborted": True},
+            ),
+            SoftwareEvent(name="GiveReward", timestamp=5.0, data=1.0),  # Before the first trial
+            SoftwareEvent(name="Annotations", timestamp=11.0, data="ignored"),
+        ]
+
+    def test_build_trial_table(self):
+        table = build_trial_table(self.events)
+        self.assertEqual(len(table), 2)
+        np.testing.assert_allclose(table["start_time"], [10.0, 20.0])
+        self.assertEqual(table.loc[0, "quiescence_period_start_time"], 10.5)
+        self.assertTrue(np.isnan(table.loc[0, "initiation_period_start_time"]))
+        self.assertEqual(table.loc[0, "selected_action"], "Right")
+        self.assertEqual(list(table["reward_count"]), [1, 0])
+        self.assertEqual(list(table["reward_amount"]), [2.0, 0.0])
+        self.assertEqual(list(table["is_aborted"]), [False, True])
+        self.assertEqual(list(table["trial_number"]), [0, 1])
+        self.assertEqual(table.loc[0, "right_amount"], 2.0)
+        self.assertEqual(table.loc[0, "left_harvest_mode"], "RegionOfInterest")
+        self.assertIsNone(table.loc[1, "left_harvest_mode"])
+
+    def test_event_order_does_not_matter(self):
+        table = build_trial_table(self.events)
+        shuffled = build_trial_table(reversed(self.events))
+        self.assertTrue(table.equals(shuffled))
+
+    def test_empty(self):
+        table = build_trial_table([])
+        self.assertEqual(len(table), 0)
+        self.assertIn("start_time", table.columns)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import av
+import numpy as np
+from aind_behavior_force_foraging import dataset
+from aind_behavior_force_foraging.trials import build_trial_table
+from aind_behavior_force_foraging.video import (
+    SessionVideos,
+    VideoReader,
+    Window,
+    load_video_index,
+    trial_windows,
+)
+
+from tests import mock_frame_value, write_mock_session
+
+
+class VideoTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls._tmp = tempfile.TemporaryDirectory()
+        cls.session = write_mock_session(Path(cls._tmp.name) / "session", duration_s=2.0, video_shape=(32, 48))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._tmp.cleanup()
+
+    def assert_frames(self, frames: np.ndarray, start: int, stop: int):
+        self.assertEqual(len(frames), stop - start)
+        if len(frames) == 0:
+            return
+        expected = np.array([mock_frame_value(i) for i in range(start, stop)])
+        np.testing.assert_allclose(frames.reshape(len(frames), -1).mean(axis=1), expected, atol=3)
+
+    def test_video_index(self):
+        path = dataset.video_file(self.session, "FaceCamera")
+        index = load_video_index(path)
+        self.assertEqual(len(index.pts), 240)
+        self.assertGreater(len(index.keyframes), 1)
+        self.assertEqual(index.keyframe_before(0), 0)
+        cached = load_video_index(path, build_if_stale=False)
+        np.testing.assert_array_equal(cached.pts, index.pts)
+        self.assertEqual(cached.time_base, index.time_base)
+
+    def test_random_access(self):
+        with VideoReader(dataset.video_file(self.session, "FaceCamera"), pixel_format="gray") as reader:
+            for start, stop in ((100, 110), (5, 7), (0, 3), (230, 240), (50, 40)):
+                self.assert_frames(reader.read(start, stop), start, max(start, stop))
+            self.assertEqual(reader.frame_rate, 120)
+        index = load_video_index(dataset.video_file(self.session, "FaceCamera"))
+        beyond = index._replace(pts=index.pts + index.pts[-1] + 1)  # An index out of sync, past the end of the file
+        with VideoReader(dataset.video_file(self.session, "FaceCamera"), beyond, pixel_format="gray") as reader:
+            self.assertEqual(reader.read(230, 240).shape, (0, 32, 48))
+
+    def test_trial_windows(self):
+        videos = SessionVideos(self.session, pixel_format="gray")
+        trials = build_trial_table(dataset.read_software_events(self.session))
+        windows = trial_windows(trials, "SideCamera", start_column="start_time", stop_column="outcome_time")
+        self.assertEqual(len(windows), 5)
+        windows = [*windows, Window("FaceCamera", 1.0, 1.25)] * 3
+        results = videos.extract(windows, max_workers=4)
+        for window, frames in zip(windows, results):
+            start, stop = videos.frame_range(window)
+            self.assert_frames(frames, start, stop)
+        self.assert_frames(videos.frames("FaceCamera", 1.0, 1.25), 120, 150)
+
+    def test_write_clips(self):
+        videos = SessionVideos(self.session)
+        with tempfile.TemporaryDirectory() as tmp:
+            windows = [Window("FaceCamera", 0.5, 0.75), Window("SideCamera", 1.0, 1.1), Window("FaceCamera", 50, 60)]
+            paths = videos.write_clips(windows, tmp)
+            self.assertEqual([p.name for p in paths[:2]], ["FaceCamera_00000.mp4", "SideCamera_00001.mp4"])
+            self.assertIsNone(paths[2])
+            self.assertFalse((Path(tmp) / "FaceCamera_00002.mp4").exists())
+            with av.open(str(paths[0])) as container:
+                self.assertEqual(container.streams.video[0].average_rate, 120)
+                self.assertEqual(sum(1 for _ in container.decode(video=0)), 30)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import tempfile
+import unittest
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from aind_behavior_force_foraging import dataset, water
+from aind_behavior_force_foraging.harp_io import MessageType, PayloadType, encode_harp_messages
+from aind_behavior_services.calibration.water_valve import (
+    WaterValveCalibration,
+    WaterValveCalibrationInput,
+    WaterValveCalibrationOutput,
+)
+
+# Addresses of the Harp Behavior device.yml, on purpose not taken from the module under test
+PULSE_SUPPLY_PORT0 = 49
+OUTPUT_SET = 34
+
+
+def write_valve_commands(session_path: Path, open_times_ms: Optional[list], times) -> None:
+    """
+    Writes the commands of one valve opening per element of `times`, with the open times `open_times_ms`.
+    If `open_times_ms` is None, no open time is written.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    output_set = dataset.harp_command_file(session_path, water.BEHAVIOR_DEVICE, OUTPUT_SET)
+    output_set.parent.mkdir(parents=True, exist_ok=True)
+    if open_times_ms is not None:
+        dataset.harp_command_file(session_path, water.BEHAVIOR_DEVICE, PULSE_SUPPLY_PORT0).write_bytes(
+            encode_harp_messages(
+                PULSE_SUPPLY_PORT0,
+                np.asarray(open_times_ms, dtype=np.uint16),
+                PayloadType.U16,
+                times - 0.001,
+                message_type=MessageType.WRITE,
+            )
+        )
+    # Followed by an OutputSet command of another output, that does not open the valve
+    masks = np.full(len(times), water.SUPPLY_PORT0, dtype=np.uint16)
+    output_set.write_bytes(
+        encode_harp_messages(
+            OUTPUT_SET,
+            np.append(masks, 0x4),
+            PayloadType.U16,
+            np.append(times, times[-1] + 1.0),
+            message_type=MessageType.WRITE,
+        )
+    )
+
+
+def calibration(slope: float = 0.1, offset: float = -0.0005, valid_domain=None) -> WaterValveCalibration:
+    return WaterValveCalibration(
+        input=WaterValveCalibrationInput(measurements=[]),
+        output=WaterValveCalibrationOutput(slope=slope, offset=offset, valid_domain=valid_domain),
+        device_name="Valve",
+    )
+
+
+class WaterTests(unittest.TestCase):
+    def test_valve_openings(self):
+        time, open_time_s = water.valve_openings(
+            pulse_time=np.array([1.0, 5.0]),
+            pulse_ms=np.array([30, 50], dtype=np.uint16),
+            output_set_time=np.array([0.5, 2.0, 3.0, 5.0, 6.0]),
+            output_set=np.array([water.SUPPLY_PORT0, water.SUPPLY_PORT0, 0x1, water.SUPPLY_PORT0 | 0x1, 0x1]),
+        )
+        np.testing.assert_array_equal(time, [0.5, 2.0, 5.0])
+        np.testing.assert_allclose(open_time_s, [np.nan, 0.03, 0.05])
+
+    def test_delivered_volume(self):
+        volume = water.delivered_volume(np.array([0.001, 0.03, np.nan]), calibration(valid_domain=[0.01, 0.1]))
+        np.testing.assert_allclose(volume, [0.0, 0.0025, np.nan])
+
+    def test_session(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            session = Path(tmp)
+            self.assertIsNone(water.session_water_log(session, calibration()))
+            write_valve_commands(session, [30, 30, 50], [1.0, 2.0, 3.0])
+            deliveries = water.read_water_deliveries(session, calibration())
+            log = water.session_water_log(session, calibration())
+        self.assertEqual(len(deliveries), 3)
+        np.testing.assert_allclose(deliveries.volume_ml, [0.0025, 0.0025, 0.0045])
+        self.assertAlmostEqual(log.water_earned_ml, 0.0095)
+        self.assertAlmostEqual(log.total_water_ml, 0.0095)
+        self.assertAlmostEqual(water.water_log_result(deliveries, supplement_ml=0.5).total_water_ml, 0.5095)
+
+    def test_openings_without_open_time(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            session = Path(tmp)
+            write_valve_commands(session, None, [1.0, 2.0])
+            with self.assertRaises(ValueError):
+                water.read_water_deliveries(session, calibration())
+            self.assertIsNone(water.session_water_log(session, calibration()))
+
+
+if __name__ == "__main__":
+    unittest.main()